@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Time and peak memory of expanding and compressing hostlists of 100k hosts.
+
+Usage: hostlist_100k.py [--hosts <n>] [--repeat <n>]
+
+Builds hostlists of --hosts hosts in the forms Slurm reports for burst nodes: one padded
+range, EC2 private names of two bracket groups rounded up to whole rows of 256, and a list
+of single hosts with every seventh host missing. For each, measures HostList length,
+membership and indexing from the ranges, iterating the hosts lazily, expanding them into a
+list, and compressing the list back into an expression, which has to give the same hosts.
+scontrol show hostnames is measured as well when it is on the PATH. Prints the milliseconds
+and peak megabytes of each as JSON lines.
+'''
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import hostlist  # noqa: E402
+
+
+def expressions(hosts):
+    rows = (hosts + 255) // 256
+    gaps = [x for x in range(hosts + hosts // 6 + 7) if x % 7 != 3][:hosts]
+    return [
+        ('padded', 'burst-[000001-{:06d}]'.format(hosts)),
+        ('ec2', 'ip-10-248-[0-{}]-[0-255]'.format(rows - 1)),
+        ('gaps', hostlist.compress('node{}'.format(x) for x in gaps)),
+    ]
+
+
+def measure(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.time()
+        result = function()
+        seconds.append(time.time() - started)
+    # traced apart from the timed runs, tracing slows down the allocations
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {'ms': round(min(seconds) * 1000, 2), 'peak_mb': round(peak / 1024.0 / 1024.0, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Expanding and compressing hostlists of many hosts.')
+    parser.add_argument('--hosts', type=int, default=100000, help='hosts per hostlist (default %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per operation (default %(default)s)')
+    options = parser.parse_args()
+    for form, expression in expressions(options.hosts):
+        hosts = hostlist.HostList(expression)
+        last = hosts[-1]
+
+        def iterate():
+            count = 0
+            for _ in hostlist.expand(expression):
+                count += 1
+            return count
+        operations = [
+            ('len', lambda: len(hostlist.HostList(expression))),
+            ('in', lambda: last in hostlist.HostList(expression)),
+            ('index', lambda: hostlist.HostList(expression)[len(hosts) // 2]),
+            ('iterate', iterate),
+            ('expand', lambda: list(hostlist.expand(expression))),
+        ]
+        expanded = None
+        for name, function in operations:
+            result, stats = measure(function, options.repeat)
+            if name == 'expand':
+                expanded = result
+            stats.update(form=form, operation=name, hosts=len(hosts), expression_bytes=len(expression))
+            print(json.dumps(stats, sort_keys=True))
+            sys.stdout.flush()
+        compressed, stats = measure(lambda: hostlist.compress(expanded), options.repeat)
+        assert list(hostlist.expand(compressed)) == expanded, form
+        stats.update(form=form, operation='compress', hosts=len(hosts), expression_bytes=len(compressed))
+        print(json.dumps(stats, sort_keys=True))
+        if shutil.which('scontrol'):
+            started = time.time()
+            output = subprocess.check_output(['scontrol', 'show', 'hostnames', expression], universal_newlines=True)
+            print(json.dumps({'form': form, 'operation': 'scontrol', 'hosts': len(output.split()),
+                              'ms': round((time.time() - started) * 1000, 2)}, sort_keys=True))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
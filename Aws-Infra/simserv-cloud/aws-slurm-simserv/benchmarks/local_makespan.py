@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Makespan of a burst of cpu bound jobs on the local subprocess backend, queued by cores
+against launching every job at once.
+
+Usage: local_makespan.py [--jobs <n>] [--work <iterations>] [--cores <n>]
+
+Submits --jobs single threaded jobs counting to --work through ProcessSiteCluster, once
+admitted by --cores, the cores of this host by default, and once with as many cores as
+jobs, which starts all of them right away as the backend did before it queued jobs. The
+jobs are polled with status until all completed. Prints the makespan, the jobs per second
+and the milliseconds per status call of each run as JSON lines.
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+import slurmsim  # noqa: E402
+
+
+def run(jobs, work, cores):
+    directory = tempfile.mkdtemp(prefix='local-makespan.')
+    environ = dict(os.environ)
+    cwd = os.getcwd()
+    try:
+        os.chdir(directory)
+        os.environ.update(SITE_CLUSTER_CACHE_DIR=directory, SITE_CLUSTER_LOCAL_CORES=str(cores), SITE_CLUSTER_LOCAL_AFFINITY='0')
+        cluster = sitecluster.ProcessSiteCluster(use_argv=False)
+        options = cluster.submitParser().parse_args(['--threads', '1'])
+        started = time.time()
+        jobIds = [cluster.submitJob(options, [sys.executable, '-c', 'for _ in range({}): pass'.format(work)]) for _ in range(jobs)]
+        statusCalls = []
+        while True:
+            called = time.time()
+            statuses = cluster.getJobStatuses(jobIds, addStatus=True)
+            statusCalls.append((time.time() - called) * 1000)
+            if all(x.startswith('COMPLETED') for x in statuses):
+                break
+            time.sleep(0.05)
+        makespan = time.time() - started
+        failed = len([x for x in statuses if x != 'COMPLETED 0'])
+        return {'makespan_seconds': round(makespan, 2), 'jobs_per_second': round(jobs / makespan, 2), 'failed': failed,
+                'status_ms': slurmsim.percentiles(statusCalls)}
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Makespan of queued against immediately launched local jobs.')
+    parser.add_argument('--jobs', type=int, default=50, help='jobs per run (default %(default)s)')
+    parser.add_argument('--work', type=int, default=20000000, help='loop iterations of each job (default %(default)s)')
+    parser.add_argument('--cores', type=int, default=len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count(),
+                        help='cores jobs are admitted by (default %(default)s)')
+    options = parser.parse_args()
+    for mode, cores in [('queued', options.cores), ('launch-all', options.jobs)]:
+        result = run(options.jobs, options.work, cores)
+        result.update(mode=mode, jobs=options.jobs, cores=cores)
+        print(json.dumps(result, sort_keys=True))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Status of many LSF jobs through batched bjobs -json and the bhist result cache, against
+one lookup per job.
+
+Usage: lsf_status.py [--jobs <n>] [--latency <seconds>] [--exited <fraction>]
+
+Writes a bjobs -json listing of --jobs jobs in the format recorded from LSF 10.1, of which
+an --exited fraction exited without exit code and need bhist, and fake bjobs and bhist
+commands answering from it after --latency seconds each. Measures LSFSiteCluster status of
+all jobs in one call without and with cached results, and one call per job as before the
+batching. Prints the seconds and the bjobs and bhist calls of each run as JSON lines.
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+FAKE_BJOBS = '''#!/bin/sh
+sleep {latency}
+echo x >> {directory}/bjobs.log
+cat {directory}/bjobs.json
+'''
+
+FAKE_BHIST = '''#!/bin/sh
+sleep {latency}
+echo x >> {directory}/bhist.log
+echo "Job <$2>, User <user>, Project <default>, Command <sim>"
+echo "Sun Oct 18 10:01:00: Exited with exit code 137. The CPU time used is 1.0 seconds;"
+'''
+
+
+def listing(jobs, exited):
+    records = []
+    for x in range(jobs):
+        if x < jobs * exited:
+            record = {'STAT': 'EXIT', 'EXIT_CODE': ''}
+        else:
+            record = [{'STAT': 'RUN', 'EXIT_CODE': ''}, {'STAT': 'DONE', 'EXIT_CODE': ''}, {'STAT': 'EXIT', 'EXIT_CODE': '3'}][x % 3]
+        records.append(dict(record, JOBID=str(1000 + x), JOBINDEX='0'))
+    return json.dumps({'COMMAND': 'bjobs', 'JOBS': jobs, 'RECORDS': records}, indent=2)
+
+
+def calls(directory):
+    counts = {}
+    for name in ['bjobs', 'bhist']:
+        path = os.path.join(directory, name + '.log')
+        with open(path, 'a+') as f:
+            f.seek(0)
+            counts[name] = len(f.readlines())
+        os.unlink(path)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batched and cached LSF status against one lookup per job.')
+    parser.add_argument('--jobs', type=int, default=500, help='jobs (default %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per bjobs and bhist call (default %(default)s)')
+    parser.add_argument('--exited', type=float, default=0.1, help='fraction of jobs needing bhist (default %(default)s)')
+    options = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='lsf-status.')
+    environ = dict(os.environ)
+    try:
+        with open(os.path.join(directory, 'bjobs.json'), 'w') as f:
+            f.write(listing(options.jobs, options.exited))
+        for name, script in [('bjobs', FAKE_BJOBS), ('bhist', FAKE_BHIST)]:
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(script.format(latency=options.latency, directory=directory))
+            os.chmod(os.path.join(directory, name), 0o755)
+        os.environ.update(PATH=directory + os.pathsep + os.environ['PATH'], SITE_CLUSTER_CACHE_DIR=directory)
+        cluster = sitecluster.LSFSiteCluster(use_argv=False)
+        jobIds = [str(1000 + x) for x in range(options.jobs)]
+        results = os.path.join(directory, 'LSFSiteCluster-results.json')
+
+        def forget():
+            if os.path.exists(results):
+                os.unlink(results)
+
+        def batched():
+            cluster.getJobStatuses(jobIds, addStatus=True)
+
+        def perJob():
+            for jobId in jobIds:
+                forget()
+                cluster.getJobStatuses([jobId], addStatus=True)
+        # one lookup per job without cached results, as before the batching
+        for name, run, clean in [('per-job', perJob, True), ('batched', batched, True), ('batched-cached', batched, False)]:
+            if clean:
+                forget()
+            calls(directory)
+            started = time.time()
+            run()
+            seconds = time.time() - started
+            result = dict(calls(directory), mode=name, jobs=options.jobs, seconds=round(seconds, 2))
+            print(json.dumps(result, sort_keys=True))
+            sys.stdout.flush()
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
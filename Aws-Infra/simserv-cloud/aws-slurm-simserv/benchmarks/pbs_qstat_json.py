@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Time and peak memory of decoding a qstat -f -F json listing of many jobs.
+
+Usage: pbs_qstat_json.py [--jobs <n>] [--repeat <n>]
+
+Writes a listing of --jobs finished jobs with the attributes of PBS Professional 19.1 and
+decodes it --repeat times with the streamed iterJsonMembers and with json.load of the whole
+document. Then answers the status of all jobs through PBSSiteCluster and a fake qstat
+printing the listing. Prints the milliseconds and peak megabytes of each as JSON lines.
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+FAKE_QSTAT = '''#!/bin/sh
+cat {listing}
+'''
+
+
+def listing(jobs):
+    attributes = {
+        'Job_Name': 'sim', 'Job_Owner': 'user@headnode', 'job_state': 'F', 'queue': 'workq',
+        'Resource_List': {'ncpus': 4, 'mem': '4gb', 'nodect': 1, 'select': '1:ncpus=4:mem=4gb'},
+        'resources_used': {'cpupercent': 398, 'cput': '01:02:03', 'mem': '3854212kb', 'walltime': '00:15:42'},
+        'Variable_List': 'PBS_O_HOME=/home/user,PBS_O_PATH=/usr/bin:/bin,PBS_O_WORKDIR=/home/user/sim',
+        'comment': 'Job run at Sun Oct 18 at 10:00 on (node1:ncpus=4:mem=4194304kb) and finished',
+    }
+    return json.dumps({'timestamp': 1603015200, 'pbs_version': '19.1.3', 'pbs_server': 'headnode',
+                       'Jobs': dict(('{}.headnode'.format(x), dict(attributes, Exit_status=x % 7)) for x in range(jobs))}, indent=4)
+
+
+def measure(decode, repeat):
+    seconds = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        started = time.time()
+        decode()
+        seconds.append(time.time() - started)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'ms': round(min(seconds) * 1000, 1), 'peak_mb': round(peak / 1024.0 / 1024.0, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decoding a qstat -F json listing of many jobs.')
+    parser.add_argument('--jobs', type=int, default=10000, help='jobs of the listing (default %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='decodes per parser (default %(default)s)')
+    options = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='pbs-qstat-json.')
+    environ = dict(os.environ)
+    try:
+        path = os.path.join(directory, 'qstat.json')
+        with open(path, 'w') as f:
+            f.write(listing(options.jobs))
+
+        def streamed():
+            with open(path) as f:
+                for _ in sitecluster.iterJsonMembers(f, 'Jobs'):
+                    pass
+
+        def whole():
+            with open(path) as f:
+                json.load(f)['Jobs']
+        for name, decode in [('iterJsonMembers', streamed), ('json.load', whole)]:
+            result = measure(decode, options.repeat)
+            result.update(parser=name, jobs=options.jobs, bytes=os.path.getsize(path))
+            print(json.dumps(result, sort_keys=True))
+
+        with open(os.path.join(directory, 'qstat'), 'w') as f:
+            f.write(FAKE_QSTAT.format(listing=path))
+        os.chmod(os.path.join(directory, 'qstat'), 0o755)
+        os.environ.update(PATH=directory + os.pathsep + os.environ['PATH'], SITE_CLUSTER_CACHE_DIR=directory)
+        cluster = sitecluster.PBSSiteCluster(use_argv=False)
+        jobIds = ['{}.headnode'.format(x) for x in range(options.jobs)]
+        statuses = []
+        result = measure(lambda: statuses.append(cluster.getJobStatuses(jobIds, addStatus=True)), options.repeat)
+        assert statuses[-1][:2] == ['COMPLETED 0', 'COMPLETED 1'], statuses[-1][:2]
+        result.update(parser='getJobStatuses', jobs=options.jobs)
+        print(json.dumps(result, sort_keys=True))
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
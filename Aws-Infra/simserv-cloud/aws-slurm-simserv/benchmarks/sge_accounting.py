@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Cost of the SGE accounting index on a large accounting file against scanning the file for
+each job as qacct -j does.
+
+Usage: sge_accounting.py [--size-mb <n>] [--lookups <n>] [--appended <n>] [--directory <path>]
+
+Writes an accounting file of --size-mb megabytes with records in the format of Son of Grid
+Engine 8.1.9, every tenth job an array of 4 tasks, into --directory, the temporary directory
+by default. Measures building the index from scratch, adding --appended records written
+afterwards, and looking up --lookups jobs through the index. The lookup of one job by a full
+scan of the file stands for qacct -j. Prints the seconds and the megabytes per second of each
+as JSON lines.
+'''
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+# qname:hostname:group:owner:job_name:job_number:account:priority:submission_time:start_time:end_time:failed:exit_status:...
+RECORD = ('all.q:node{node}.cluster:users:user{user}:sim_{job}:{job}:sge:0:1600000000:1600000100:{end}:{failed}:{exit}:'
+          '3600:3540.5:58.3:0:0:0:0:123456:0:0:0:0:0:0:1024:2048:0:0:NONE:defaultdepartment:mpi:{slots}:{task}:'
+          '3598.8:912.4:0.0:-l h_vmem=4G,h_rt=7200 -pe mpi 4:0.000000:NONE:4194304000.0:0:0\n')
+
+
+def records(first, count):
+    lines = []
+    job = first
+    while len(lines) < count:
+        tasks = 4 if job % 10 == 0 else 0
+        for task in range(1, tasks + 1) if tasks else [0]:
+            lines.append(RECORD.format(node=job % 64, user=job % 16, job=job, end=1600003600 + job, task=task,
+                                       failed=100 if job % 97 == 0 else 0, exit=job % 5 if job % 7 == 0 else 0,
+                                       slots=4))
+        job += 1
+    return lines, job
+
+
+def scan(path, jobId):
+    '''
+    Last record of jobId found by reading the whole file, as qacct -j does.
+    '''
+    found = None
+    prefix = ':{}:'.format(jobId).encode('ascii')
+    with open(path, 'rb') as f:
+        for line in f:
+            if prefix in line:
+                fields = line.decode('utf-8', 'replace').split(':')
+                if fields[5] == str(jobId):
+                    found = (fields[12], fields[11], fields[10])
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SGE accounting index against scanning the accounting file.')
+    parser.add_argument('--size-mb', type=int, default=2048, help='size of the accounting file (default %(default)s)')
+    parser.add_argument('--lookups', type=int, default=1000, help='jobs looked up through the index (default %(default)s)')
+    parser.add_argument('--appended', type=int, default=10000, help='records appended after the index was built (default %(default)s)')
+    parser.add_argument('--directory', help='directory of the accounting file and the index (default a temporary one)')
+    options = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='sge-accounting.', dir=options.directory)
+    environ = dict(os.environ)
+    try:
+        path = os.path.join(directory, 'accounting')
+        os.environ.update(SITE_CLUSTER_CACHE_DIR=directory, SITE_CLUSTER_SGE_ACCOUNTING=path)
+        started = time.time()
+        job = 1
+        with open(path, 'w') as f:
+            f.write('# Version: 8.1.9\n')
+            while f.tell() < options.size_mb * 1024 * 1024:
+                lines, job = records(job, 10000)
+                f.write(''.join(lines))
+        size = os.path.getsize(path) / 1024.0 / 1024.0
+        print(json.dumps({'step': 'generate', 'jobs': job - 1, 'mb': round(size, 1), 'seconds': round(time.time() - started, 2)}, sort_keys=True))
+        sys.stdout.flush()
+
+        index = sitecluster.SGEAccountingIndex()
+        started = time.time()
+        index.lookup([])
+        seconds = time.time() - started
+        print(json.dumps({'step': 'build', 'seconds': round(seconds, 2), 'mb_per_second': round(size / seconds, 1),
+                          'db_mb': round(os.path.getsize(index.dbPath) / 1024.0 / 1024.0, 1)}, sort_keys=True))
+        sys.stdout.flush()
+
+        lines, last = records(job, options.appended)
+        with open(path, 'a') as f:
+            f.write(''.join(lines))
+        started = time.time()
+        index.lookup([])
+        print(json.dumps({'step': 'update', 'records': len(lines), 'seconds': round(time.time() - started, 3)}, sort_keys=True))
+
+        jobIds = [str(random.randint(1, last - 1)) for _ in range(options.lookups)]
+        started = time.time()
+        found = index.lookup(jobIds)
+        seconds = time.time() - started
+        print(json.dumps({'step': 'lookup', 'jobs': len(jobIds), 'found': len(found), 'seconds': round(seconds, 3)}, sort_keys=True))
+
+        started = time.time()
+        scan(path, jobIds[0])
+        seconds = time.time() - started
+        print(json.dumps({'step': 'scan', 'jobs': 1, 'seconds': round(seconds, 2), 'mb_per_second': round(size / seconds, 1)}, sort_keys=True))
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
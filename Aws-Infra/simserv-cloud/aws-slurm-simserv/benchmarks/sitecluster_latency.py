@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Latency of sitecluster calls run per call and forwarded to a sitecluster serve daemon.
+
+Usage: sitecluster_latency.py [--calls <n>] [--command <command>]
+
+Runs the command --calls times with the local subprocess backend: as the sitecluster.py
+script, as sitecluster_client.py running the compiled sitecluster module in-process, which
+the sitecluster wrapper does without a daemon, and as sitecluster_client.py forwarding to a
+daemon on a temporary socket. Prints the milliseconds per call of each path as JSON lines.
+Run python3 -m compileall on the directory first, as the installation does.
+'''
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import slurmsim  # noqa: E402
+
+
+def measure(argv, env, calls):
+    seconds = []
+    for _ in range(calls):
+        started = time.time()
+        subprocess.check_call(argv, env=env, stdout=subprocess.DEVNULL)
+        seconds.append(time.time() - started)
+    return slurmsim.percentiles([x * 1000 for x in seconds])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of sitecluster calls with and without the serve daemon.')
+    parser.add_argument('--calls', type=int, default=20, help='calls per path (default %(default)s)')
+    parser.add_argument('--command', default='api', help='sitecluster command (default %(default)s)')
+    options = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='sitecluster-latency.')
+    env = dict(os.environ, SITE_CLUSTER_USE_SUBPROCESS='1', SITE_CLUSTER_CACHE_DIR=directory)
+    env.pop('SITE_CLUSTER_SOCKET', None)
+    command = shlex.split(options.command)
+    results = [('script', measure([sys.executable, os.path.join(DIRECTORY, 'sitecluster.py')] + command, env, options.calls)),
+               ('in-process', measure([sys.executable, os.path.join(DIRECTORY, 'sitecluster_client.py')] + command, env, options.calls))]
+    socketPath = os.path.join(directory, 'serve.sock')
+    daemon = subprocess.Popen([sys.executable, os.path.join(DIRECTORY, 'sitecluster.py'), 'serve', '--socket', socketPath], env=env)
+    try:
+        deadline = time.time() + 30
+        while not os.path.exists(socketPath) and time.time() < deadline:
+            time.sleep(0.05)
+        env['SITE_CLUSTER_SOCKET'] = socketPath
+        results.append(('daemon', measure([sys.executable, os.path.join(DIRECTORY, 'sitecluster_client.py')] + command, env, options.calls)))
+    finally:
+        daemon.terminate()
+        daemon.wait()
+    for path, milliseconds in results:
+        print(json.dumps({'path': path, 'command': options.command, 'milliseconds': milliseconds}, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Throughput of the Slurm CLI backend against the slurmrestd backend.
+
+Usage: slurmrest_throughput.py [--jobs <n>] [--polls <n>]
+
+Submits --jobs jobs and polls the status of all of them --polls times, once through
+SlurmSiteCluster with fake sbatch, squeue and sacct scripts and once through
+SlurmRestSiteCluster with the local slurmrestd stub of the tests, and prints the calls per
+second of each as JSON lines. The fake commands answer at once, a real slurmctld adds a
+munge authenticated RPC to every fork of the CLI backend.
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+sys.path.insert(0, os.path.join(DIRECTORY, 'tests'))
+
+import sitecluster  # noqa: E402
+from slurmrestd_stub import SlurmRestStub  # noqa: E402
+
+FAKE_COMMANDS = {
+    'sbatch': '#!/bin/sh\necho "Submitted batch job $$"\n',
+    # every job is running
+    'squeue': '#!/bin/sh\nwhile [ $# -gt 0 ]; do [ "$1" = -j ] && ids=$2; shift; done\n'
+              'for id in $(echo "$ids" | tr , " "); do echo "$id R"; done\n',
+    'sacct': '#!/bin/sh\nexit 0\n',
+}
+
+
+def measure(cluster, jobs, polls):
+    options = cluster.submitParser().parse_args(['--threads', '2', '--memory', '2G', '--', 'true'])
+    started = time.time()
+    jobIds = [cluster.submitJob(options, ['true']) for _ in range(jobs)]
+    submitSeconds = time.time() - started
+    started = time.time()
+    for _ in range(polls):
+        statuses = cluster.getJobStatuses(jobIds)
+    pollSeconds = time.time() - started
+    assert statuses == ['RUNNING'] * jobs, statuses
+    return {'submits_per_second': round(jobs / submitSeconds, 1), 'polls_per_second': round(polls / pollSeconds, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of the Slurm CLI and slurmrestd backends.')
+    parser.add_argument('--jobs', type=int, default=200, help='jobs to submit (default %(default)s)')
+    parser.add_argument('--polls', type=int, default=200, help='status polls of all jobs (default %(default)s)')
+    options = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='slurmrest-throughput.')
+    environ = dict(os.environ)
+    try:
+        os.environ['SITE_CLUSTER_CACHE_DIR'] = directory
+        os.environ['PATH'] = directory + os.pathsep + os.environ['PATH']
+        for name, script in FAKE_COMMANDS.items():
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(script)
+            os.chmod(os.path.join(directory, name), 0o755)
+        os.chdir(directory)
+        cli = sitecluster.SlurmSiteCluster(use_argv=False)
+        cli.ignore_user = True
+        result = measure(cli, options.jobs, options.polls)
+        result['backend'] = 'cli'
+        print(json.dumps(result, sort_keys=True))
+        with SlurmRestStub() as stub:
+            os.environ['SLURM_RESTD_URL'] = stub.url
+            result = measure(sitecluster.SlurmRestSiteCluster(use_argv=False), options.jobs, options.polls)
+            result['backend'] = 'slurmrestd'
+            result['connections'] = stub.connections
+            print(json.dumps(result, sort_keys=True))
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
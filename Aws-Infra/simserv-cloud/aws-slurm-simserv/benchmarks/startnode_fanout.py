@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Wall time of starting a command on every node of an allocation through the startnode
+launcher tree, against one startnode per node.
+
+Usage: startnode_fanout.py [--nodes <n>] [--latency <seconds>] [--fanout <k> ...]
+
+Runs the PBS backend in an allocation of --nodes nodes with a fake pbsdsh, which takes
+--latency seconds to reach a node and then runs the command on this host. The command is
+started on all nodes by startnode --all with each --fanout, and by one startnode call per
+node in turn as callers did before the tree. Node agents are disabled, so every start goes
+through the launcher. All nodes of the tree are sitecluster processes on this host, so
+their interpreter starts share its cores unlike on a real allocation. Prints the seconds
+and the launches of each run as JSON lines.
+'''
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# reaches the node after the latency, then runs the command here
+PBSDSH = '''#!/bin/sh
+sleep {latency}
+echo "$2" >> "$SITE_CLUSTER_CACHE_DIR/pbsdsh.log"
+shift 2
+exec "$@"
+'''
+
+
+def launches(directory):
+    path = os.path.join(directory, 'pbsdsh.log')
+    with open(path, 'a+') as f:
+        f.seek(0)
+        count = len(f.readlines())
+    os.unlink(path)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='startnode launcher tree against one startnode per node.')
+    parser.add_argument('--nodes', type=int, default=64, help='nodes of the allocation (default %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds of the launcher to reach a node (default %(default)s)')
+    parser.add_argument('--fanout', type=int, nargs='+', default=[2, 8, 32], help='fanouts of the tree (default %(default)s)')
+    options = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='startnode-fanout.')
+    try:
+        env = dict(os.environ, SITE_CLUSTER_USE_PBS='1', SITE_CLUSTER_PBS_FLAVOUR='torque', SITE_CLUSTER_CACHE_DIR=directory,
+                   PBS_JOBID='1.headnode', PBS_NODEFILE=os.path.join(directory, 'nodes'), TMPDIR=directory, SITE_CLUSTER_AGENT='0',
+                   PATH=directory + os.pathsep + os.environ['PATH'])
+        for name in [x for x in env if x.startswith('SITE_CLUSTER_USE_') and x != 'SITE_CLUSTER_USE_PBS']:
+            del env[name]
+        for name in ['SITE_CLUSTER_NODE', 'SITE_CLUSTER_SOCKET']:
+            env.pop(name, None)
+        with open(env['PBS_NODEFILE'], 'w') as f:
+            f.write(''.join('node{}\n'.format(x) for x in range(options.nodes)))
+        with open(os.path.join(directory, 'pbsdsh'), 'w') as f:
+            f.write(PBSDSH.format(latency=options.latency))
+        os.chmod(os.path.join(directory, 'pbsdsh'), 0o755)
+        sitecluster = [sys.executable, os.path.join(DIRECTORY, 'sitecluster.py'), 'startnode']
+        command = ['true']
+
+        def perNode():
+            for node in range(options.nodes):
+                subprocess.check_call(sitecluster + [str(node)] + command, env=env, cwd=directory, stdout=subprocess.DEVNULL)
+        runs = [('per-node', None, perNode)]
+        for fanout in options.fanout:
+            runs.append(('tree', fanout, lambda fanout=fanout: subprocess.check_call(
+                sitecluster + ['--all', '--fanout', str(fanout), '--'] + command, env=env, cwd=directory, stdout=subprocess.DEVNULL)))
+        for mode, fanout, run in runs:
+            started = time.time()
+            run()
+            seconds = time.time() - started
+            print(json.dumps({'mode': mode, 'fanout': fanout, 'nodes': options.nodes, 'latency': options.latency,
+                              'seconds': round(seconds, 2), 'launches': launches(directory)}, sort_keys=True))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Submissions per second of the SubmissionEngine against a fake sbatch.
+
+Usage: submission_throughput.py [--jobs <n>] [--latency <seconds>] [--busy <fraction>]
+                                [--concurrency <n>,...] [--rate <per second>]
+
+Submits --jobs single jobs through SlurmSiteCluster and a fake sbatch which takes --latency
+seconds and answers a --busy fraction of the submissions with "Socket timed out", at each
+concurrency level, and prints the submissions per second and the retries as JSON lines.
+The rate limit is SITE_CLUSTER_SUBMIT_RATE, --rate or the default of the engine.
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+FAKE_SBATCH = '''#!/bin/bash
+sleep {latency}
+echo x >> {log}
+if [ $((RANDOM % 1000)) -lt {busy} ]; then
+    echo "sbatch: error: Batch job submission failed: Socket timed out on send/recv operation" >&2
+    exit 1
+fi
+echo "Submitted batch job $$"
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Submissions per second of the SubmissionEngine.')
+    parser.add_argument('--jobs', type=int, default=64, help='jobs per run (default %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds per sbatch call (default %(default)s)')
+    parser.add_argument('--busy', type=float, default=0.0, help='fraction of busy answers (default %(default)s)')
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='concurrency levels (default %(default)s)')
+    parser.add_argument('--rate', type=float, help='submissions per second of the token bucket')
+    options = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix='submission-throughput.')
+    environ = dict(os.environ)
+    try:
+        os.environ['PATH'] = directory + os.pathsep + os.environ['PATH']
+        if options.rate:
+            os.environ['SITE_CLUSTER_SUBMIT_RATE'] = str(options.rate)
+        log = os.path.join(directory, 'sbatch.log')
+        with open(os.path.join(directory, 'sbatch'), 'w') as f:
+            f.write(FAKE_SBATCH.format(latency=options.latency, log=log, busy=int(options.busy * 1000)))
+        os.chmod(os.path.join(directory, 'sbatch'), 0o755)
+        cluster = sitecluster.SlurmSiteCluster(use_argv=False)
+        cluster.ignore_user = True
+        for concurrency in [int(x) for x in options.concurrency.split(',')]:
+            # a fresh token bucket per run
+            sitecluster._submitBuckets.clear()
+            if os.path.exists(log):
+                os.unlink(log)
+            jobOptions = [cluster.submitParser().parse_args(['--', 'sim', str(x)]) for x in range(options.jobs)]
+            submissions = [lambda x=x: cluster.submitJob(x, x.cmdargs[1:]) for x in jobOptions]
+            results = []
+            started = time.time()
+            sitecluster.SubmissionEngine(cluster, concurrency).run(submissions, lambda index, result, error: results.append(error))
+            seconds = time.time() - started
+            with open(log) as f:
+                calls = len(f.readlines())
+            print(json.dumps({'concurrency': concurrency, 'jobs': options.jobs, 'failed': len([x for x in results if x]),
+                              'retries': calls - options.jobs, 'submissions_per_second': round(options.jobs / seconds, 1),
+                              'rate_limit': sitecluster._submitBuckets['SlurmSiteCluster'].maxRate}, sort_keys=True))
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
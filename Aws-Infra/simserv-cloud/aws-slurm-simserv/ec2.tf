@@ -95,6 +95,26 @@ resource "aws_instance" "simserv" {
     type        = "ssh"
     user        = "centos"
     private_key = file("Slurm-key-2020.pem")
+  }
+    source      = "sitecluster_client.py"
+    destination = "/tmp/sitecluster_client.py"
+  }
+    provisioner "file" {
+    connection {
+    host        = coalesce(self.public_ip, self.private_ip)
+    type        = "ssh"
+    user        = "centos"
+    private_key = file("Slurm-key-2020.pem")
+  }
+    source      = "hostlist.py"
+    destination = "/home/centos/hostlist.py"
+  }
+    provisioner "file" {
+    connection {
+    host        = coalesce(self.public_ip, self.private_ip)
+    type        = "ssh"
+    user        = "centos"
+    private_key = file("Slurm-key-2020.pem")
   }
     source      = "slurm-17.11.8.tar.bz2"
     destination = "/home/centos/slurm-17.11.8.tar.bz2"
@@ -145,6 +165,26 @@ resource "aws_instance" "simserv" {
     type        = "ssh"
     user        = "centos"
     private_key = file("Slurm-key-2020.pem")
+  }
+    source      = "slurm-aws-resume.py"
+    destination = "/home/centos/slurm-aws-resume.py"
+  }
+    provisioner "file" {
+    connection {
+    host        = coalesce(self.public_ip, self.private_ip)
+    type        = "ssh"
+    user        = "centos"
+    private_key = file("Slurm-key-2020.pem")
+  }
+    source      = "slurmaws.py"
+    destination = "/home/centos/slurmaws.py"
+  }
+    provisioner "file" {
+    connection {
+    host        = coalesce(self.public_ip, self.private_ip)
+    type        = "ssh"
+    user        = "centos"
+    private_key = file("Slurm-key-2020.pem")
   }
     source      = "gres.conf"
     destination = "/home/centos/gres.conf"
@@ -175,6 +215,46 @@ resource "aws_instance" "simserv" {
     type        = "ssh"
     user        = "centos"
     private_key = file("Slurm-key-2020.pem")
+  }
+    source      = "slurm-aws-suspend.py"
+    destination = "/home/centos/slurm-aws-suspend.py"
+  }
+    provisioner "file" {
+    connection {
+    host        = coalesce(self.public_ip, self.private_ip)
+    type        = "ssh"
+    user        = "centos"
+    private_key = file("Slurm-key-2020.pem")
+  }
+    source      = "slurm-aws-scaler.py"
+    destination = "/home/centos/slurm-aws-scaler.py"
+  }
+    provisioner "file" {
+    connection {
+    host        = coalesce(self.public_ip, self.private_ip)
+    type        = "ssh"
+    user        = "centos"
+    private_key = file("Slurm-key-2020.pem")
+  }
+    source      = "slurm-aws-planner.py"
+    destination = "/home/centos/slurm-aws-planner.py"
+  }
+    provisioner "file" {
+    connection {
+    host        = coalesce(self.public_ip, self.private_ip)
+    type        = "ssh"
+    user        = "centos"
+    private_key = file("Slurm-key-2020.pem")
+  }
+    source      = "slurmsim.py"
+    destination = "/home/centos/slurmsim.py"
+  }
+    provisioner "file" {
+    connection {
+    host        = coalesce(self.public_ip, self.private_ip)
+    type        = "ssh"
+    user        = "centos"
+    private_key = file("Slurm-key-2020.pem")
   }
     source      = "config"
     destination = "/tmp/config"
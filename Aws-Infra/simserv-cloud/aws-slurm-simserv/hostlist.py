@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# Copyright 1983-2020 Keysight Technologies
+'''
+Slurm hostlist expressions like ip-10-248-156-[4-9,12],ip-10-248-157-[1-200].
+
+HostList answers the length, membership and indexing of an expression from its ranges
+and yields the hosts one at a time, the hosts are never stored. compress turns a host
+sequence back into an expression while reading it.
+
+Usage: hostlist.py {expand|compress|count} <expression|host> [...]
+'''
+from __future__ import print_function
+import re
+import sys
+
+
+class _HostPattern(object):
+    '''
+    One comma separated item of a hostlist: texts around bracket groups of ranges.
+    The hosts are the product of the groups, the last group varying fastest.
+    '''
+    def __init__(self, item):
+        parts = re.split(r'\[([^\[\]]*)\]', item)
+        if '[' in ''.join(parts[::2]) or ']' in ''.join(parts[::2]):
+            raise ValueError('unbalanced brackets in {}'.format(item))
+        self.texts = parts[::2]
+        self.groups = [self.__parseGroup(x, item) for x in parts[1::2]]
+        self.sizes = [sum(high - low + 1 for low, high, _ in group) for group in self.groups]
+        self.count = 1
+        for size in self.sizes:
+            self.count *= size
+        self.regex = re.compile('^' + r'(\d+)'.join(re.escape(x) for x in self.texts) + '$')
+
+    @staticmethod
+    def __parseGroup(group, item):
+        ranges = []
+        for entry in group.split(','):
+            match = re.match(r'^(\d+)(?:-(\d+))?$', entry.strip())
+            if not match or int(match.group(2) or match.group(1)) < int(match.group(1)):
+                raise ValueError('invalid range {} in {}'.format(entry, item))
+            # the width of the lower bound pads all numbers of the range, as in [001-100]
+            ranges.append((int(match.group(1)), int(match.group(2) or match.group(1)), len(match.group(1))))
+        return ranges
+
+    def __format(self, numbers):
+        host = self.texts[0]
+        for (number, width), text in zip(numbers, self.texts[1:]):
+            host += '%0*d' % (width, number) + text
+        return host
+
+    def __iter__(self):
+        def numbers(groups):
+            if not groups:
+                yield []
+                return
+            for rest in numbers(groups[:-1]):
+                for low, high, width in groups[-1]:
+                    for number in range(low, high + 1):
+                        yield rest + [(number, width)]
+        for entry in numbers(self.groups):
+            yield self.__format(entry)
+
+    def __len__(self):
+        return self.count
+
+    def host(self, index):
+        numbers = []
+        for group, size in reversed(list(zip(self.groups, self.sizes))):
+            index, offset = divmod(index, size)
+            for low, high, width in group:
+                if offset <= high - low:
+                    numbers.append((low + offset, width))
+                    break
+                offset -= high - low + 1
+        return self.__format(list(reversed(numbers)))
+
+    def __contains__(self, host):
+        match = self.regex.match(host)
+        if not match:
+            return False
+        for digits, group in zip(match.groups(), self.groups):
+            number = int(digits)
+            if not any(low <= number <= high and '%0*d' % (width, number) == digits for low, high, width in group):
+                return False
+        return True
+
+
+class HostList(object):
+    '''
+    Hosts of a hostlist expression in the order of the expression.
+
+    Iterating yields the hosts lazily, len, in and indexing are computed from the ranges.
+    A slice returns the list of the selected hosts only.
+    '''
+    def __init__(self, expression):
+        self.patterns = [_HostPattern(x) for x in splitExpression(expression)]
+
+    def __iter__(self):
+        for pattern in self.patterns:
+            for host in pattern:
+                yield host
+
+    def __len__(self):
+        return sum(len(x) for x in self.patterns)
+
+    def __contains__(self, host):
+        return any(host in x for x in self.patterns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[x] for x in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            for pattern in self.patterns:
+                if index < len(pattern):
+                    return pattern.host(index)
+                index -= len(pattern)
+        raise IndexError('hostlist index out of range')
+
+
+def splitExpression(expression):
+    '''
+    Yields the comma separated items of expression, ignoring the commas within brackets.
+    '''
+    depth, start = 0, 0
+    for position, char in enumerate(expression):
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            if expression[start:position].strip():
+                yield expression[start:position].strip()
+            start = position + 1
+    if expression[start:].strip():
+        yield expression[start:].strip()
+
+
+def expand(expression):
+    '''
+    Yields the hosts of the hostlist expression.
+    '''
+    return iter(HostList(expression))
+
+
+def compress(hosts):
+    '''
+    Returns the hostlist expression of the hosts in their order. Consecutive hosts differing
+    only in the last number of their name share one bracket group, numbers following each
+    other form a range.
+    '''
+    items = []
+    current = None  # prefix, width, suffix, ranges of the open group
+    for host in hosts:
+        match = re.match(r'^(.*?)(\d+)(\D*)$', host)
+        if not match:
+            current = None
+            items.append(host)
+            continue
+        prefix, digits, suffix = match.groups()
+        # padded numbers only join groups of the same width
+        width = len(digits) if digits.startswith('0') and len(digits) > 1 else 0
+        number = int(digits)
+        if current and current[1] and len(digits) == current[1]:
+            # numbers of the padded width without leading zero continue a padded group, as 100 in [001-100]
+            width = current[1]
+        if current and current[:3] == (prefix, width, suffix):
+            ranges = current[3]
+            if number == ranges[-1][1] + 1:
+                ranges[-1][1] = number
+            else:
+                ranges.append([number, number])
+        else:
+            current = (prefix, width, suffix, [[number, number]])
+            items.append(current)
+    expressions = []
+    for item in items:
+        if not isinstance(item, tuple):
+            expressions.append(item)
+            continue
+        prefix, width, suffix, ranges = item
+        entries = ['%0*d' % (width, low) + ('-%0*d' % (width, high) if high != low else '') for low, high in ranges]
+        if len(entries) == 1 and '-' not in entries[0]:
+            expressions.append(prefix + entries[0] + suffix)
+        else:
+            expressions.append('{}[{}]{}'.format(prefix, ','.join(entries), suffix))
+    return ','.join(expressions)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('expand', 'compress', 'count'):
+        print(__doc__.strip().splitlines()[-1], file=sys.stderr)
+        sys.exit(2)
+    try:
+        if sys.argv[1] == 'compress':
+            # hosts as arguments or one per line on stdin
+            print(compress(sys.argv[2:] or (x.strip() for x in sys.stdin if x.strip())))
+        elif sys.argv[1] == 'count':
+            print(sum(len(HostList(x)) for x in sys.argv[2:]))
+        else:
+            for expression in sys.argv[2:]:
+                for host in expand(expression):
+                    print(host)
+    except ValueError as e:
+        print('ERROR: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
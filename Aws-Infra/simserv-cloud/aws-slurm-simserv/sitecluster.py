@@ -2,15 +2,43 @@
 # Copyright 1983-2020 Keysight Technologies
 from __future__ import print_function
 import argparse
+import base64
+import binascii
+import bisect
+import fcntl
+import io
 import json
 import os
+import random
 import re
+import select
 import shlex
 import signal
+import socket
 import stat
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+try:
+    from shlex import quote
+except ImportError:  # pragma: no cover
+    from pipes import quote
+
+try:
+    import socketserver
+except ImportError:  # pragma: no cover
+    import SocketServer as socketserver
+
+from sitecluster_client import SERVE_COMMANDS, runClient
 
 
 try:
@@ -62,11 +90,10 @@ class SiteCluster(object):
         '''
         Constructor
         '''
+        self.ignore_user = ignore_user
         if not use_argv:
             return
 
-        self.ignore_user = ignore_user
-
         parser = argparse.ArgumentParser(
             description='site cluster',
             usage='''sitecluster <command> [<args>]
@@ -90,19 +117,103 @@ The supported sitecluster commands are:
             [--project=<projectname>]   add a project/account name on submit when available (Optional).
             [--group=<groupname>]       add a group name for submit when available (Optional).
             [--customargs=<customargs>] Custom submit arguments for the job. Repeated occurences append customargs content. (Optional)
-    status  ['-e','--add-exit-status'] <JobId>            Returns the status of the job with identifier <JobId> on the cluster,
+            [--pool=<name>]             Runs the job right away in a warm allocation of the pool <name>, with the options of
+                                        the pool instead of the other submit options (Optional).
+    submit-batch [--concurrency=<n>] [--stream] [<file>]  Submits the jobs of a JSON lines file or stdin, one job spec
+                                        {"cmdargs": [...], <option>: ...} per line with the submit options as keys. Jobs which
+                                        differ only in the arguments of the command are submitted as one native job array.
+                                        Prints one job id per input line, <arrayid>_<index> for array tasks. Up to <n>
+                                        submissions run concurrently, rate limited per backend. With --stream a JSON line
+                                        {"line", "id", "error"} is printed as each job is submitted. With --pack the jobs with
+                                        the same options run as tasks <allocid>+<n> of one allocation of <nodes> nodes.
+    run-pack <dir>                      Runs the tasks of a pack, started by submit-batch --pack within the allocation.
+    pool {start,status,stop} <name> [--nodes=<n>] [--size=<n>] [--idle=<seconds>] [<submit options>]
+                                        Manages a pool of up to <size> allocations of <nodes> nodes which run the jobs
+                                        submitted with --pool=<name> without waiting for the scheduler. Allocations end
+                                        after <idle> seconds without jobs. status reports the members and the hit rate.
+                                        A started pool keeps its settings until it is stopped.
+    status  ['-e','--add-exit-status'] <JobId> [<JobId> ...]  Returns the status of the jobs with identifiers <JobId> on the cluster,
+                                        one line per job in the given order. The identifiers are read from stdin when omitted or '-'.
                                         supported states are 'PENDING', 'RUNNING', 'SUSPENDED', 'COMPLETED' and UNKNOWNID.
                                         Optional options -e and --exit adds an optional exit status as provided by the cluster system
+    watch [--interval=<seconds>] [<JobId> ...]  Streams a JSON line {"job", "state", "exit", "ts"} whenever the state of a job changes.
+                                        Further job identifiers are read line by line from stdin, the command ends when
+                                        stdin is closed and all watched jobs are COMPLETED or UNKNOWNID.
     kill <JobId> [<JobId> ...]          Kills the jobs with the specied <JobId>s.
     nodecount                           Returns the total number of nodes allocated to the job. Only usable within a job's environment.
-    startnode <num> <cmd> <args>        Starts the command <cmd> with arguments <args> on node <num>.
+    hosts [<num> ...]                   Returns the hosts allocated to the job with their number of nodes, one host per line,
+                                        or the host of each node <num>. Only usable within a job's environment.
+    startnode <num> <cmd> <args>        Starts the command <cmd> with arguments <args> on node <num>. The first call for a node
+                                        starts an agent there through the scheduler launcher, later calls run their
+                                        command through the agent. SITE_CLUSTER_AGENT=0 always uses the launcher.
+                                        The pid of a command run by the agent is written to SITE_CLUSTER_PID_FILE when set.
+    startnode {--all|--range=<a>-<b>} [--fanout=<k>] <cmd> <args>  Starts the command on all nodes or the nodes <a> to <b>
+                                        through a tree in which every node launches it on up to <k> further nodes. Output
+                                        lines are prefixed with the node number, the first failing node stops the others.
+    agent --token-file=<path>           Runs the node agent of startnode, started by startnode within the allocation.
+    supervise <JobId> <fd>              Runs the supervisor of a local job, started by submit with SITE_CLUSTER_USE_SUBPROCESS.
     behavior                            Returns default behavior specifications.
+    cachestats                          Returns the hit and miss counters of the shared job state cache as JSON.
+    serve [--socket=<path>]             Serves the api, queues, status, kill, behavior and cachestats commands over a Unix domain socket.
+                                        Clients use it when SITE_CLUSTER_SOCKET points to the socket.
 ''')
-        parser.add_argument('command', choices=['api', 'queues', 'submit', 'status', 'kill', 'nodecount', 'startnode', 'behavior'],
+        parser.add_argument('command', choices=['api', 'queues', 'submit', 'submit-batch', 'run-pack', 'pool', 'status', 'watch', 'kill', 'nodecount', 'hosts', 'startnode', 'agent', 'supervise', 'behavior', 'cachestats', 'serve'],
                             help='Subcommand to run')
-        args = parser.parse_args(sys.argv[1:2])
+        self.parser = parser
+        self.dispatch()
+
+    @property
+    def argv(self):
+        '''
+        Command line of the current request in serve mode, sys.argv otherwise.
+        '''
+        return getattr(_requestContext, 'argv', None) or sys.argv
+
+    @property
+    def stdin(self):
+        '''
+        Standard input of the current request in serve mode, sys.stdin otherwise.
+        '''
+        return getattr(_requestContext, 'stdin', None) or sys.stdin
+
+    def dispatch(self):
+        args = self.parser.parse_args(self.argv[1:2])
         # use dispatch pattern to invoke method with same name
-        getattr(self, args.command)()
+        getattr(self, args.command.replace('-', '_'))()
+
+    def execute(self, argv, stdin=None):
+        '''
+        Runs the sitecluster command argv as if invoked from the command line.
+        Returns the exit code and the captured stdout and stderr.
+        '''
+        _requestContext.argv = [sys.argv[0]] + list(argv)
+        _requestContext.stdin = io.StringIO(stdin or u'')
+        _requestContext.stdout = io.StringIO()
+        _requestContext.stderr = io.StringIO()
+        returncode = 0
+        try:
+            if argv[:1] and argv[0] not in SERVE_COMMANDS:
+                print('ERROR: command {} is not served, run it directly'.format(argv[0]), file=sys.stderr)
+                returncode = 2
+            else:
+                self.dispatch()
+        except SystemExit as e:
+            if e.code is None:
+                returncode = 0
+            elif isinstance(e.code, int):
+                returncode = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            returncode = 1
+        finally:
+            stdout = _requestContext.stdout.getvalue()
+            stderr = _requestContext.stderr.getvalue()
+            _requestContext.argv = _requestContext.stdin = None
+            _requestContext.stdout = _requestContext.stderr = None
+        return (returncode, stdout, stderr)
 
     def api(self):
         '''
@@ -119,9 +230,9 @@ The supported sitecluster commands are:
         for queue in queues:
             print(queue)
 
-    def submit(self):
+    def submitParser(self):
         '''
-        Submits a job to the cluster.
+        Returns the parser of the submit options.
         '''
         parser = argparse.ArgumentParser(description='submit', usage='%(prog)s submit [options] -- cmdargs')
         parser.add_argument('--queue', help='Queue on which the job should run (Optional).')
@@ -138,32 +249,378 @@ The supported sitecluster commands are:
         parser.add_argument('--customargs', action='append', help='Custom submit arguments for the job. (Optional).')
         parser.add_argument('--startnode', type=int, metavar='<n>', help='Number of node to run sub process within a job just as with startnode command. (Optional).')
         parser.add_argument('--user', help='Defines the user name under which the job is to run on the execution system if allowed by workload system (Optional).')
+        parser.add_argument('--pool', help='Name of a pool started with sitecluster pool start to run the job in right away (Optional).')
         parser.add_argument('cmdargs', nargs=argparse.REMAINDER)
-        if not sys.argv[2:]:
+        return parser
+
+    def submit(self):
+        '''
+        Submits a job to the cluster.
+        '''
+        parser = self.submitParser()
+        if not self.argv[2:]:
             parser.print_help()
-        args = parser.parse_args(sys.argv[2:])
+        args = parser.parse_args(self.argv[2:])
         cmdargs = None
         if len(args.cmdargs) > 1 and args.cmdargs[0] == '--':
             cmdargs = args.cmdargs[1:]
         if not hasattr(self, 'submitJob'):
             parser.print_help()
+        elif args.pool:
+            # the jobs of a pool run with the options the pool was started with
+            defaults = vars(parser.parse_args([]))
+            given = sorted(x for x, value in vars(args).items() if x not in ['pool', 'cmdargs'] and value != defaults[x])
+            if given:
+                parser.error('{} cannot be used with --pool, give the options to pool start instead'.format(', '.join('--' + x for x in given)))
+            try:
+                print(AllocationPool(self, args.pool).submit(cmdargs, os.getcwd()))
+            except KeyError as e:
+                print(e.args[0], file=sys.stderr)
+                sys.exit(1)
         else:
             print(self.submitJob(args, cmdargs))
 
+    def submit_batch(self):
+        '''
+        Submits many jobs at once, grouping jobs which differ only in their arguments into job arrays.
+        '''
+        parser = argparse.ArgumentParser(description='submit-batch', usage='%(prog)s submit-batch [--concurrency=<n>] [--stream] [--pack=<nodes>] [<file>]')
+        parser.add_argument('--concurrency', type=int, metavar='<n>', default=int(os.environ.get('SITE_CLUSTER_SUBMIT_CONCURRENCY') or 4),
+                            help='Number of submissions in flight at the same time (Optional).')
+        parser.add_argument('--stream', action='store_true',
+                            help='Print a JSON line {"line", "id", "error"} as soon as each job is submitted instead of the ids in input order (Optional).')
+        parser.add_argument('--pack', type=int, metavar='<nodes>',
+                            help='Run jobs with the same options as tasks of one allocation of <nodes> nodes (Optional).')
+        parser.add_argument('file', nargs='?', default='-', help="JSON lines file of job specs, read from stdin when omitted or '-'")
+        args = parser.parse_args(self.argv[2:])
+        if not hasattr(self, 'submitJob'):
+            parser.print_help()
+            return
+        if args.file == '-':
+            lines = self.stdin.read().splitlines()
+        else:
+            with open(args.file) as f:
+                lines = f.read().splitlines()
+
+        defaults = vars(self.submitParser().parse_args([]))
+        jobs = []
+        lineNumbers = {}
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            spec = json.loads(line)
+            options = argparse.Namespace(**defaults)
+            for name, value in spec.items():
+                if name not in defaults:
+                    parser.error('line {}: unknown submit option {}'.format(number, name))
+                if name == 'pool':
+                    parser.error('line {}: pool is not supported by submit-batch, use submit --pool'.format(number))
+                setattr(options, name, value)
+            if not options.cmdargs:
+                parser.error('line {}: no cmdargs given'.format(number))
+            options.cmdargs = [str(x) for x in options.cmdargs]
+            jobs.append(options)
+            lineNumbers[id(options)] = number
+
+        # jobs with the same options and command form one array, jobs with the same options one pack
+        groups = {}
+        for options in jobs:
+            key = json.dumps([None if args.pack else options.cmdargs[0], dict((k, v) for k, v in vars(options).items() if k != 'cmdargs')], sort_keys=True)
+            groups.setdefault(key, []).append(options)
+        # every pack, array and single job is one submission with the format of the ids of its jobs
+        submissions = []
+        for group in groups.values():
+            if args.pack and not group[0].startnode:
+                submissions.append((group, lambda group=group: self.submitPack(group, args.pack), '{}+{}'))
+            elif len(group) > 1 and self.ARRAY_INDEX_VARIABLE and not group[0].startnode:
+                submissions.append((group, lambda group=group: self.submitArray(group), '{}_{}'))
+            else:
+                for options in group:
+                    submissions.append(([options], lambda options=options: self.submitJob(options, options.cmdargs), '{}'))
+
+        jobIds = {}
+        failed = []
+
+        def submitted(index, result, error):
+            group, _, idFormat = submissions[index]
+            if error is not None:
+                failed.append(error)
+                print('ERROR: submission of line {} failed: {}'.format(
+                    ','.join(str(lineNumbers[id(x)]) for x in group), str(error).strip()), file=sys.stderr)
+            for position, options in enumerate(group, 1):
+                jobId = None
+                if error is None:
+                    jobId = idFormat.format(result, position)
+                jobIds[id(options)] = jobId
+            if args.stream:
+                try:
+                    for options in group:
+                        print(json.dumps({'line': lineNumbers[id(options)], 'id': jobIds[id(options)], 'error': str(error).strip() if error else None}))
+                    sys.stdout.flush()
+                except IOError:
+                    # the reader of the stream went away, the remaining jobs are still submitted
+                    pass
+
+        SubmissionEngine(self, args.concurrency).run([x[1] for x in submissions], submitted)
+        if not args.stream:
+            # an empty line keeps the ids of the other jobs on their lines
+            for options in jobs:
+                print(jobIds[id(options)] or '')
+        if failed:
+            sys.exit(1)
+
+    # environment variable with the index of the running array task, None if the backend has no job arrays
+    ARRAY_INDEX_VARIABLE = None
+
+    def submitArray(self, group):
+        '''
+        Submits the jobs of group as one array with indices 1 to len(group) and returns the array job id.
+        The tasks run a wrapper script in the working directory which selects the command by the task index.
+        '''
+        lines = ['#!/bin/bash', '# task table of a sitecluster submit-batch job array', 'case "${}" in'.format(self.ARRAY_INDEX_VARIABLE)]
+        for index, options in enumerate(group, 1):
+            lines.append('{}) exec {} ;;'.format(index, ' '.join(quote(x) for x in options.cmdargs)))
+        lines.append('*) echo "sitecluster: no task ${0} in $0" >&2; exit 1 ;;'.format(self.ARRAY_INDEX_VARIABLE))
+        lines.append('esac')
+        fd, script = tempfile.mkstemp(dir=os.getcwd(), prefix='sitecluster-array.', suffix='.sh')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.chmod(script, stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH)
+        options = argparse.Namespace(**vars(group[0]))
+        options.array = len(group)
+        return self.submitJob(options, [script])
+
+    def submitPack(self, group, nodes):
+        '''
+        Submits one allocation of nodes running the jobs of group as its tasks and returns the allocation id.
+        The tasks are numbered from 1 and kept with their state in a pack directory in the working directory.
+        '''
+        pack = Pack.make(os.getcwd(), group[0].threads)
+        for options in group:
+            pack.addTask(options.cmdargs, os.getcwd())
+        pack.seal()
+        return self.submitPackAllocation(pack, group[0], nodes)
+
+    def submitPackAllocation(self, pack, options, nodes):
+        '''
+        Submits the allocation running the runner of pack and returns its id.
+        '''
+        allocId = self.submitJob(self.getPackOptions(options, nodes), [pack.writeRunner()])
+        Pack.register(allocId, pack.directory)
+        return allocId
+
+    def getPackOptions(self, options, nodes):
+        '''
+        Returns the submit options of an allocation of nodes for tasks submitted with options.
+        '''
+        options = argparse.Namespace(**vars(options))
+        options.nodes = nodes
+        options.jobname = options.jobname or 'sitecluster-pack'
+        return options
+
+    def getPackSlots(self, threads):
+        '''
+        Returns the number of tasks of threads threads a pack runs at the same time within the allocation.
+        '''
+        return int(self.getNodeCount())
+
+    def getPackTaskCommand(self, slot, threads, cmdargs):
+        '''
+        Returns the command running cmdargs as a task on the given slot of the allocation.
+        '''
+        return ['/usr/bin/env', 'python3', os.path.abspath(__file__), 'startnode', str(slot)] + cmdargs
+
+    def pool(self):
+        '''
+        Starts, stops or reports a pool of warm allocations for submit --pool.
+        '''
+        parser = argparse.ArgumentParser(description='pool', usage='%(prog)s pool {start,status,stop} <name> [options]')
+        parser.add_argument('action', choices=['start', 'status', 'stop'])
+        parser.add_argument('name', help='Name of the pool')
+        parser.add_argument('--nodes', type=int, default=1, metavar='<n>', help='Number of nodes of each allocation (Optional).')
+        parser.add_argument('--size', type=int, default=1, metavar='<n>', help='Maximum number of allocations the pool grows to (Optional).')
+        parser.add_argument('--idle', type=float, default=600, metavar='<seconds>', help='Time an allocation without jobs is kept (Optional).')
+        for name in ['queue', 'memory', 'jobname', 'project', 'group']:
+            parser.add_argument('--' + name, help='Submit option of the allocations (Optional).')
+        parser.add_argument('--threads', type=int, metavar='<n>', help='Number of threads of each job run in the pool (Optional).')
+        parser.add_argument('--customargs', action='append', help='Custom submit arguments of the allocations (Optional).')
+        if not self.argv[2:]:
+            parser.print_help()
+        args = parser.parse_args(self.argv[2:])
+        pool = AllocationPool(self, args.name)
+        try:
+            if args.action == 'start':
+                options = vars(self.submitParser().parse_args([]))
+                for name in ['queue', 'memory', 'jobname', 'project', 'group', 'threads', 'customargs']:
+                    options[name] = getattr(args, name)
+                options['jobname'] = options['jobname'] or 'sitecluster-pool-{}'.format(args.name)
+                pool.start({'nodes': args.nodes, 'size': max(1, args.size), 'idle': args.idle, 'options': options, 'directory': os.getcwd()})
+            elif args.action == 'stop':
+                pool.stop()
+            else:
+                print(json.dumps(pool.getStatus(), sort_keys=True))
+        except KeyError as e:
+            print(e.args[0], file=sys.stderr)
+            sys.exit(1)
+
+    def run_pack(self):
+        '''
+        Runs the tasks of a pack, called by the runner script within the pack allocation.
+        '''
+        parser = argparse.ArgumentParser(description='run-pack', usage='%(prog)s run-pack <dir>')
+        parser.add_argument('dir', help='Pack directory created by submit-batch --pack')
+        args = parser.parse_args(self.argv[2:])
+        Pack(args.dir).run(self)
+
+    def getPackedJobStatuses(self, idsOnCluster, addStatus=False):
+        '''
+        Returns the status of jobs including <allocid>+<task> jobs of packs, querying the scheduler once
+        for the other jobs and the allocations.
+        '''
+        queried = []
+        for idOnCluster in idsOnCluster:
+            queryId = idOnCluster.split('+')[0]
+            if queryId not in queried:
+                queried.append(queryId)
+        states = dict(zip(queried, self._lookupJobStatuses(queried, True)))
+        packDirs = Pack.getRegistry()
+
+        jobStatuses = []
+        for idOnCluster in idsOnCluster:
+            allocId, packed, task = idOnCluster.partition('+')
+            jobStatus = states[allocId]
+            if packed:
+                if allocId not in packDirs or not task.isdigit():
+                    jobStatus = 'UNKNOWNID'
+                else:
+                    jobStatus = Pack(packDirs[allocId][0]).getTaskStatus(int(task), jobStatus.partition(' ')[0])
+            if not addStatus:
+                jobStatus = jobStatus.partition(' ')[0]
+            jobStatuses.append(jobStatus)
+        return jobStatuses
+
+    def nativeJobId(self, idOnCluster):
+        '''
+        Returns the scheduler's own id of a job, translating the <arrayid>_<index> ids of array tasks.
+        '''
+        idOnCluster = str(idOnCluster)
+        reMatch = re.match(r'(.+)_(\d+)$', idOnCluster)
+        if reMatch and self.ARRAY_INDEX_VARIABLE:
+            return self.arrayTaskId(reMatch.group(1), reMatch.group(2))
+        return idOnCluster
+
+    def arrayTaskId(self, arrayId, index):
+        return '{}_{}'.format(arrayId, index)
+
     def status(self):
         '''
-        Returns the status of a job.
+        Returns the status of one or more jobs, one line per job.
         '''
-        parser = argparse.ArgumentParser(description='status', usage='%(prog)s status [options] jobId')
+        parser = argparse.ArgumentParser(description='status', usage='%(prog)s status [options] jobId [jobId ...]')
         parser.add_argument('-e', '--add-exit-status', dest='addStatus', action='store_true', help='Return the job exit status when available after COMPLETED')
-        parser.add_argument('jobId')
-        if not sys.argv[2:]:
+        parser.add_argument('jobId', nargs='*', help="Job identifiers, read from stdin when omitted or '-'")
+        if not self.argv[2:] and self.stdin.isatty():
             parser.print_help()
-        args = parser.parse_args(sys.argv[2:])
+        args = parser.parse_args(self.argv[2:])
+        jobIds = args.jobId
+        if not jobIds or jobIds == ['-']:
+            if self.stdin.isatty():
+                parser.error('the following arguments are required: jobId')
+            jobIds = self.stdin.read().split()
         if not hasattr(self, 'getJobStatus'):
             parser.print_help()
         else:
-            print(self.getJobStatus(args.jobId, args.addStatus))
+            for jobStatus in self.lookupJobStatuses([self.nativeJobId(x) for x in jobIds], args.addStatus):
+                print(jobStatus)
+
+    def lookupJobStatuses(self, idsOnCluster, addStatus=False):
+        '''
+        Returns the status of each job through the shared job state cache
+        when SITE_CLUSTER_CACHE_TTL is set and the backend supports it.
+        '''
+        idsOnCluster = [str(x) for x in idsOnCluster]
+        if [x for x in idsOnCluster if '+' in x]:
+            return self.getPackedJobStatuses(idsOnCluster, addStatus)
+        return self._lookupJobStatuses(idsOnCluster, addStatus)
+
+    def _lookupJobStatuses(self, idsOnCluster, addStatus=False):
+        ttl = float(os.environ.get('SITE_CLUSTER_CACHE_TTL') or 0)
+        if ttl > 0 and hasattr(self, 'getActiveJobStates'):
+            return JobStateCache(self, ttl).getJobStatuses(idsOnCluster, addStatus)
+        return self.getJobStatuses(idsOnCluster, addStatus)
+
+    def getJobStatuses(self, idsOnCluster, addStatus=False):
+        '''
+        Returns the status of each job in idsOnCluster, in the same order.
+        Backends override this to answer all jobs with a single scheduler query.
+        '''
+        return [self.getJobStatus(idOnCluster, addStatus) for idOnCluster in idsOnCluster]
+
+    def watch(self):
+        '''
+        Streams job state transitions as JSON lines, polling all watched jobs together.
+        '''
+        parser = argparse.ArgumentParser(description='watch', usage='%(prog)s watch [--interval=<seconds>] [jobId ...]')
+        parser.add_argument('--interval', type=float, default=float(os.environ.get('SITE_CLUSTER_WATCH_INTERVAL') or 5),
+                            help='Seconds between two scheduler polls (Optional).')
+        parser.add_argument('jobId', nargs='*', help="Job identifiers, more are read from stdin when not a terminal or '-'")
+        args = parser.parse_args(self.argv[2:])
+        jobIds = [x for x in args.jobId if x != '-']
+        if not hasattr(self, 'getJobStatus'):
+            parser.print_help()
+            return
+
+        # job identifiers arriving on stdin wake up the poll loop, None marks the end of stdin
+        newJobIds = queue.Queue()
+        if args.jobId in ([], ['-']) or not self.stdin.isatty():
+            def readJobIds():
+                for line in iter(self.stdin.readline, ''):
+                    for jobId in line.split():
+                        newJobIds.put(jobId)
+                newJobIds.put(None)
+            reader = threading.Thread(target=readJobIds)
+            reader.daemon = True
+            reader.start()
+        else:
+            newJobIds.put(None)
+
+        lastStatus = {}
+        stdinOpen = True
+        while jobIds or stdinOpen:
+            if jobIds:
+                for jobId, jobStatus in zip(list(jobIds), self.lookupJobStatuses([self.nativeJobId(x) for x in jobIds], True)):
+                    if lastStatus.get(jobId) == jobStatus:
+                        continue
+                    lastStatus[jobId] = jobStatus
+                    state, _, exitStatus = jobStatus.partition(' ')
+                    event = {'job': jobId, 'state': state, 'exit': int(exitStatus) if exitStatus.lstrip('-').isdigit() else None, 'ts': time.time()}
+                    print(json.dumps(event))
+                    if state in ['COMPLETED', 'UNKNOWNID']:
+                        jobIds.remove(jobId)
+                try:
+                    sys.stdout.flush()
+                except IOError:
+                    # the reader of the stream went away
+                    return
+            # sleep for one poll interval unless new jobs arrive
+            deadline = time.time() + args.interval
+            added = False
+            while stdinOpen:
+                try:
+                    if added:
+                        jobId = newJobIds.get_nowait()
+                    else:
+                        jobId = newJobIds.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if jobId is None:
+                    stdinOpen = False
+                elif jobId not in jobIds:
+                    jobIds.append(jobId)
+                    lastStatus.pop(jobId, None)
+                    added = True
+            if not added and jobIds:
+                time.sleep(max(0, deadline - time.time()))
 
     def kill(self):
         '''
@@ -171,19 +628,255 @@ The supported sitecluster commands are:
         '''
         parser = argparse.ArgumentParser(description='kill', usage='%(prog)s kill jobId [jobId ...]')
         parser.add_argument('jobId', nargs='+', help='Kills the jobs with the specied <JobId>s')
-        if not sys.argv[2:]:
+        if not self.argv[2:]:
             parser.print_help()
-        args = parser.parse_args(sys.argv[2:])
+        args = parser.parse_args(self.argv[2:])
         if not hasattr(self, 'killJob'):
             parser.print_help()
-        else:
-            print(self.killJob(args.jobId))
+            return
+        # tasks of packs are cancelled by their runner
+        packDirs = Pack.getRegistry()
+        for jobId in [x for x in args.jobId if '+' in x]:
+            allocId, _, task = jobId.partition('+')
+            if allocId in packDirs and task.isdigit():
+                Pack(packDirs[allocId][0]).cancelTask(int(task))
+        jobIds = [self.nativeJobId(x) for x in args.jobId if '+' not in x]
+        print(self.killJob(jobIds) if jobIds else 0)
+
+    def cachestats(self):
+        '''
+        Prints the counters of the shared job state cache.
+        '''
+        print(json.dumps(JobStateCache(self).getStats(), sort_keys=True))
+
+    def serve(self):
+        '''
+        Serves sitecluster commands over a Unix domain socket until interrupted.
+        '''
+        parser = argparse.ArgumentParser(description='serve', usage='%(prog)s serve [--socket=<path>]')
+        parser.add_argument('--socket', default=defaultSocketPath(), help='Path of the Unix domain socket (Optional).')
+        args = parser.parse_args(self.argv[2:])
+        if os.path.exists(args.socket):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(args.socket)
+                print('ERROR: a sitecluster daemon is already serving {}'.format(args.socket), file=sys.stderr)
+                sys.exit(1)
+            except socket.error:
+                # a left over socket of a previous daemon
+                os.unlink(args.socket)
+            finally:
+                probe.close()
+        sys.stdout = _RequestStream('stdout', sys.stdout)
+        sys.stderr = _RequestStream('stderr', sys.stderr)
+        # only the owner may submit commands through the socket, from the moment it is bound
+        umask = os.umask(0o077)
+        try:
+            server = _SiteClusterServer(args.socket, self)
+        finally:
+            os.umask(umask)
+        # terminate through the finally clause below so the socket is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(args.socket)
 
     def nodecount(self):
         print(self.getNodeCount())
 
+    def agent(self):
+        '''
+        Runs the node agent which starts the commands of startnode on this node.
+        '''
+        parser = argparse.ArgumentParser(description='agent', usage='%(prog)s agent --token-file=<path>')
+        parser.add_argument('--token-file', required=True, help='File with the token clients authenticate with.')
+        args = parser.parse_args(self.argv[2:])
+        with open(args.token_file) as f:
+            token = f.read().strip()
+        server = _NodeAgentServer(token)
+        # the launcher relays the address to the startnode which started the agent
+        print('{} {} {}'.format(NODE_AGENT_BANNER, socket.gethostname(), server.server_address[1]))
+        sys.stdout.flush()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    # environment variables describing the allocation of the current job, read by readAllocation
+    ALLOCATION_VARIABLES = ()
+
+    def getTopology(self):
+        if not hasattr(self, '_topology'):
+            self._topology = AllocationTopology.load(self)
+        return self._topology
+
+    def getNodeCount(self):
+        return len(self.getTopology())
+
+    def getNodeHost(self, num):
+        '''
+        Host of node num of the allocation, the node index itself when the host is not known.
+        '''
+        if not self.ALLOCATION_VARIABLES:
+            return str(int(num))
+        return self.getTopology().host(int(num))
+
+    def hosts(self):
+        '''
+        Prints the hosts of the allocation with their number of nodes, or the host of each given node.
+        '''
+        parser = argparse.ArgumentParser(description='hosts', usage='%(prog)s hosts [<num> ...]')
+        parser.add_argument('num', nargs='*', type=int, help='Prints the hosts of the nodes <num> (Optional).')
+        args = parser.parse_args(self.argv[2:])
+        topology = self.getTopology()
+        try:
+            for num in args.num:
+                print(topology.host(num))
+        except IndexError:
+            print('ERROR: node {} is not part of the allocation'.format(num), file=sys.stderr)
+            sys.exit(1)
+        if not args.num:
+            for host, count in zip(topology.hosts, topology.counts):
+                print(host, count)
+
+    def getAgentLaunchCommand(self, num, cmdargs):
+        return self.getLaunchCommand(num, cmdargs)
+
     def startnode(self):
-        self.startNode(sys.argv[2], sys.argv[3:])
+        if self.argv[2:3] and self.argv[2].startswith('--'):
+            self.startnodes()
+            return
+        # commands go through the node agent once the launcher started it on the node
+        if hasattr(self, 'getLaunchCommand') and os.environ.get('SITE_CLUSTER_AGENT', '1') != '0':
+            pidFile = os.environ.get('SITE_CLUSTER_PID_FILE')
+
+            def started(pid):
+                with open(pidFile, 'w') as f:
+                    f.write('{}\n'.format(pid))
+            returncode = NodeAgentClient(self).run(self.argv[2], self.argv[3:], started if pidFile else None)
+            if returncode is not None:
+                sys.exit(returncode)
+        try:
+            self.startNode(self.argv[2], self.argv[3:])
+        except CalledProcessError as e:
+            # pass on the exit status of the command
+            sys.exit(e.returncode)
+
+    def startnodes(self):
+        '''
+        Starts a command on all nodes or a range of nodes through a tree of launchers.
+        '''
+        parser = argparse.ArgumentParser(description='startnode',
+                                         usage='%(prog)s startnode {--all|--range=<a>-<b>} [--fanout=<k>] <cmd> <args>')
+        nodes = parser.add_mutually_exclusive_group(required=True)
+        nodes.add_argument('--all', action='store_true', help='Starts the command on every node of the allocation.')
+        nodes.add_argument('--range', help='Starts the command on the nodes <a> to <b>.')
+        parser.add_argument('--fanout', type=int, default=int(os.environ.get('SITE_CLUSTER_FANOUT', 8)),
+                            help='Number of nodes each node launches the command on (Optional).')
+        # set on the nodes of the tree, which run the command on the first node of their range
+        parser.add_argument('--local', action='store_true', help=argparse.SUPPRESS)
+        parser.add_argument('cmdargs', nargs=argparse.REMAINDER)
+        args = parser.parse_args(self.argv[2:])
+        cmdargs = args.cmdargs[1:] if args.cmdargs[:1] == ['--'] else args.cmdargs
+        if not cmdargs or args.fanout < 1:
+            parser.error('a command and a fanout of at least 1 are required')
+        if not hasattr(self, 'getLaunchCommand'):
+            parser.error('starting commands on other nodes is not supported by this cluster')
+        if args.all:
+            first, last = 0, int(self.getNodeCount()) - 1
+        else:
+            match = re.match(r'^(\d+)-(\d+)$', args.range)
+            if not match or int(match.group(1)) > int(match.group(2)):
+                parser.error('invalid node range {}'.format(args.range))
+            first, last = int(match.group(1)), int(match.group(2))
+        sys.exit(self.startNodes(first, last, cmdargs, args.fanout, args.local))
+
+    def startNodes(self, first, last, cmdargs, fanout, local=False):
+        '''
+        Runs cmdargs on the nodes first to last and returns the first non zero exit status, 0 if all succeeded.
+
+        The range is split into up to fanout contiguous subranges, each launched on its first node,
+        which runs the command itself and launches the rest of its subrange in the same way. With local
+        set this process is the first node of the range. Output lines are prefixed with their node number,
+        the first failure terminates the other branches of the tree.
+        '''
+        outputLock = threading.Lock()
+        finished = queue.Queue()
+        branches = []
+
+        def start(label, cmd, prefix, env=None):
+            try:
+                with open(os.devnull) as devnull:
+                    proc = subprocess.Popen(cmd, stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                            env=env, preexec_fn=os.setpgrp, close_fds=True)
+            except OSError as e:
+                print('ERROR: node {} failed to start: {}'.format(label, e), file=sys.stderr)
+                finished.put((label, 127))
+                return
+            branches.append(proc)
+            relays = [threading.Thread(target=relayLines, args=(stream, out, prefix, outputLock))
+                      for stream, out in ((proc.stdout, sys.stdout), (proc.stderr, sys.stderr))]
+            for relay in relays:
+                relay.daemon = True
+                relay.start()
+
+            def wait():
+                for relay in relays:
+                    relay.join()
+                finished.put((label, proc.wait()))
+            waiter = threading.Thread(target=wait)
+            waiter.daemon = True
+            waiter.start()
+
+        def terminate():
+            for proc in branches:
+                if proc.poll() is None:
+                    try:
+                        os.killpg(proc.pid, signal.SIGTERM)
+                    except OSError:
+                        pass
+
+        def terminated(signum, frame):
+            terminate()
+            sys.exit(128 + signum)
+        # a failure elsewhere in the tree terminates this branch through its launcher
+        signal.signal(signal.SIGTERM, terminated)
+
+        count = 0
+        if local:
+            env = dict(os.environ, SITE_CLUSTER_NODE=str(first))
+            start(str(first), cmdargs, '{}: '.format(first).encode('utf-8'), env)
+            first += 1
+            count += 1
+        remaining = last - first + 1
+        for branch in range(min(fanout, max(remaining, 0))):
+            # contiguous subranges of nearly equal size
+            size = remaining // fanout + (1 if branch < remaining % fanout else 0)
+            subrange = '{}-{}'.format(first, first + size - 1)
+            forward = ['/usr/bin/env', 'python3', os.path.abspath(__file__), 'startnode', '--range', subrange,
+                       '--fanout', str(fanout), '--local', '--'] + cmdargs
+            # the nodes of the subrange prefix their own output
+            start(subrange if size > 1 else str(first), self.getLaunchCommand(first, forward), b'')
+            first += size
+            count += 1
+        returncode = 0
+        for _ in range(count):
+            label, status = finished.get()
+            if status != 0 and returncode == 0:
+                returncode = status if status > 0 else 128 - status
+                print('ERROR: node {} failed with exit status {}'.format(label, returncode), file=sys.stderr)
+                terminate()
+        return returncode
 
     def behavior(self):
         behavior = {}
@@ -216,11 +909,1050 @@ The supported sitecluster commands are:
 
         print(json.dumps(behavior))
 
+# per thread request state of the serve mode
+_requestContext = threading.local()
+
+
+def defaultSocketPath():
+    if 'SITE_CLUSTER_SOCKET' in os.environ:
+        return os.environ['SITE_CLUSTER_SOCKET']
+    return os.path.join(tempfile.gettempdir(), 'sitecluster-{}.sock'.format(os.getuid()))
+
+
+class _RequestStream(object):
+    '''
+    Routes the output of a serve mode request thread into its own buffer.
+    '''
+    def __init__(self, name, stream):
+        self.name = name
+        self.stream = stream
+
+    def __getattr__(self, attr):
+        return getattr(getattr(_requestContext, self.name, None) or self.stream, attr)
+
+
+class _SiteClusterRequestHandler(socketserver.StreamRequestHandler):
+    '''
+    Handles newline delimited JSON requests {"argv": [...], "stdin": ...} on one connection
+    and answers each with {"rc": ..., "stdout": ..., "stderr": ...}.
+    '''
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                returncode, stdout, stderr = self.server.siteCluster.execute(request.get('argv', []), request.get('stdin'))
+            except ValueError as e:
+                returncode, stdout, stderr = (2, '', 'ERROR: invalid request: {}\n'.format(e))
+            response = {'rc': returncode, 'stdout': stdout, 'stderr': stderr}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class _SiteClusterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, siteCluster):
+        self.siteCluster = siteCluster
+        socketserver.UnixStreamServer.__init__(self, path, _SiteClusterRequestHandler)
+
+
+def relayLines(stream, out, prefix, lock):
+    '''
+    Copies the lines of the binary stream to the text stream out, each line prefixed with prefix.
+    '''
+    out = getattr(out, 'buffer', out)
+    for line in iter(stream.readline, b''):
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        with lock:
+            out.write(prefix + line)
+            out.flush()
+    stream.close()
+
+
+# first line the node agent prints, followed by its host and port
+NODE_AGENT_BANNER = 'SITECLUSTER-AGENT'
+
+# environment variables holding the id of the allocation startnode runs in
+ALLOCATION_ID_VARIABLES = ('SLURM_JOB_ID', 'PBS_JOBID', 'LSB_JOBID', 'JOB_ID')
+
+
+def allocationId():
+    return next((os.environ[x] for x in ALLOCATION_ID_VARIABLES if os.environ.get(x)), 'local')
+
+
+class AllocationTopology(object):
+    '''
+    Slot table of the allocation of the current job: the hosts in allocation order with their
+    number of slots. Slots, the node numbers of nodecount and startnode, are numbered from 0
+    across the hosts and map to their host by a binary search in the running slot totals, so the
+    table stays one entry per host however many slots the hosts have.
+
+    The backend parses the scheduler's description of the allocation once per job, the table
+    is cached in the job's temporary directory together with the environment it was read from.
+    '''
+    def __init__(self, hosts, counts):
+        self.hosts = hosts
+        self.counts = counts
+        # slot after the last slot of each host
+        self.ends = []
+        for count in counts:
+            self.ends.append((self.ends[-1] if self.ends else 0) + count)
+
+    @classmethod
+    def load(cls, siteCluster):
+        source = [os.environ.get(x) for x in siteCluster.ALLOCATION_VARIABLES]
+        directory = os.environ.get('TMPDIR')
+        state = StateFile('sitecluster-topology-{}.json'.format(allocationId()).replace(os.sep, '_'),
+                          directory if directory and os.path.isdir(directory) else None)
+        cached = state.read()
+        if cached.get('source') == source:
+            return cls(cached['hosts'], cached['counts'])
+        hosts, counts = [], []
+        for host, count in siteCluster.readAllocation():
+            # consecutive entries of a host, one line per slot in PBS_NODEFILE
+            if hosts and hosts[-1] == host:
+                counts[-1] += count
+            else:
+                hosts.append(host)
+                counts.append(count)
+        try:
+            state.write({'source': source, 'hosts': hosts, 'counts': counts})
+        except (IOError, OSError):
+            pass
+        return cls(hosts, counts)
+
+    def __len__(self):
+        return self.ends[-1] if self.ends else 0
+
+    def host(self, slot):
+        if slot < 0 or slot >= len(self):
+            raise IndexError(slot)
+        return self.hosts[bisect.bisect_right(self.ends, slot)]
+
+
+class _NodeAgentHandler(socketserver.StreamRequestHandler):
+    '''
+    Runs the command of one request {"token", "cmdargs", "cwd"} and answers with {"pid": ...},
+    the output of the command as {"fd": 1|2, "data": <base64>} and finally {"exit": ...}.
+    The command is killed when the client disconnects before it ended. The agent always runs
+    on python3, whose start_new_session avoids the cost of a preexec_fn in every launch.
+    '''
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError:
+            return
+        if not isinstance(request, dict) or request.get('token') != self.server.token:
+            self.send({'error': 'invalid token'})
+            return
+        self.sendLock = threading.Lock()
+        try:
+            with open(os.devnull) as devnull:
+                proc = subprocess.Popen(request['cmdargs'], cwd=request.get('cwd') or None, stdin=devnull,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        start_new_session=True, close_fds=True)
+        except (OSError, KeyError, TypeError) as e:
+            self.send({'error': str(e), 'exit': 127})
+            return
+        self.send({'pid': proc.pid})
+        pumps = [threading.Thread(target=self.pump, args=(fd, stream)) for fd, stream in ((1, proc.stdout), (2, proc.stderr))]
+        hangup = threading.Thread(target=self.watchClient, args=(proc,))
+        hangup.daemon = True
+        for thread in pumps + [hangup]:
+            thread.start()
+        returncode = proc.wait()
+        for thread in pumps:
+            thread.join()
+        self.send({'exit': 128 - returncode if returncode < 0 else returncode})
+
+    def send(self, message):
+        try:
+            with getattr(self, 'sendLock', threading.Lock()):
+                self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+                self.wfile.flush()
+        except (IOError, OSError, socket.error):
+            pass
+
+    def pump(self, fd, stream):
+        while True:
+            data = os.read(stream.fileno(), 65536)
+            if not data:
+                break
+            self.send({'fd': fd, 'data': base64.b64encode(data).decode('ascii')})
+        stream.close()
+
+    def watchClient(self, proc):
+        try:
+            self.rfile.read()
+        except (IOError, OSError, socket.error, ValueError):
+            pass
+        if proc.poll() is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+
+class _NodeAgentServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, token):
+        self.token = token
+        socketserver.TCPServer.__init__(self, ('', 0), _NodeAgentHandler)
+
+
+class NodeAgentClient(object):
+    '''
+    Runs startnode commands through the agent on the node, starting the agent through
+    the launcher of the scheduler on first use.
+
+    The address and token of the agent of each node are kept in a state file of the
+    allocation in the cache directory. The token is handed to a new agent through a
+    file in the working directory readable only by the user, which is removed once
+    the agent reported its address. Nodes whose agent could not be started use the
+    launcher for every command.
+    '''
+    def __init__(self, siteCluster):
+        self.siteCluster = siteCluster
+        self.allocation = allocationId()
+        self.timeout = float(os.environ.get('SITE_CLUSTER_AGENT_TIMEOUT', 30))
+
+    def run(self, num, cmdargs, started=None):
+        '''
+        Runs cmdargs on node num and writes its output. started is called with the pid of the
+        command on the node as soon as the agent started it, the pid is kept as self.pid.
+        Returns the exit code of the command or None when no agent is available on the node.
+        '''
+        self.pid = None
+        self.started = started
+        host = self.siteCluster.getNodeHost(num)
+        state = StateFile('agent-{}-{}.json'.format(self.allocation, host).replace(os.sep, '_'))
+        agent = state.read()
+        if 'port' in agent:
+            connection = self.connect(agent)
+            returncode = self.request(connection, agent, cmdargs) if connection else None
+            if returncode is not None:
+                return returncode
+        elif agent:
+            return None
+        with state.lock():
+            # another startnode may have started the agent meanwhile
+            current = state.read()
+            if current and current != agent:
+                agent = current
+            else:
+                agent = self.start(num) or {'failed': time.time()}
+                state.write(agent)
+        connection = self.connect(agent) if 'port' in agent else None
+        return self.request(connection, agent, cmdargs) if connection else None
+
+    def start(self, num):
+        '''
+        Starts the agent on node num and returns its {"host", "port", "token"}, None if it did not start.
+        '''
+        token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        fd, tokenPath = tempfile.mkstemp(dir=os.getcwd(), prefix='.sitecluster-agent.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(token)
+            cmdargs = ['/usr/bin/env', 'python3', os.path.abspath(__file__), 'agent', '--token-file', tokenPath]
+            with open(os.devnull, 'r+') as devnull:
+                # the launcher keeps running with the agent after startnode returned
+                launcher = subprocess.Popen(self.siteCluster.getAgentLaunchCommand(num, cmdargs), stdin=devnull,
+                                            stdout=subprocess.PIPE, stderr=devnull, preexec_fn=os.setsid, close_fds=True)
+            deadline = time.time() + self.timeout
+            while time.time() < deadline and select.select([launcher.stdout], [], [], deadline - time.time())[0]:
+                line = launcher.stdout.readline().decode('utf-8', 'replace').split()
+                if not line:
+                    break
+                if len(line) == 3 and line[0] == NODE_AGENT_BANNER and line[2].isdigit():
+                    launcher.stdout.close()
+                    return {'host': line[1], 'port': int(line[2]), 'token': token}
+        except OSError:
+            return None
+        finally:
+            os.remove(tokenPath)
+        try:
+            os.killpg(launcher.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        launcher.wait()
+        return None
+
+    def connect(self, agent):
+        try:
+            connection = socket.create_connection((agent['host'], agent['port']), timeout=self.timeout)
+        except socket.error:
+            return None
+        connection.settimeout(None)
+        return connection
+
+    def request(self, connection, agent, cmdargs):
+        streams = {1: getattr(sys.stdout, 'buffer', sys.stdout), 2: getattr(sys.stderr, 'buffer', sys.stderr)}
+        try:
+            connection.sendall((json.dumps({'token': agent['token'], 'cmdargs': cmdargs, 'cwd': os.getcwd()}) + '\n').encode('utf-8'))
+            for line in connection.makefile('rb'):
+                message = json.loads(line.decode('utf-8'))
+                if 'pid' in message:
+                    self.pid = message['pid']
+                    if self.started:
+                        self.started(self.pid)
+                if 'data' in message:
+                    streams[message['fd']].write(base64.b64decode(message['data']))
+                    streams[message['fd']].flush()
+                if 'exit' in message:
+                    if 'error' in message:
+                        print('ERROR: {}'.format(message['error']), file=sys.stderr)
+                    return message['exit']
+                if 'error' in message:
+                    # not an agent of this allocation anymore, the launcher runs the command
+                    return None
+        except (IOError, OSError, socket.error, ValueError):
+            pass
+        finally:
+            connection.close()
+        print('ERROR: lost the connection to the node agent on {}'.format(agent['host']), file=sys.stderr)
+        return 255
+
+
+def cacheDirectory():
+    '''
+    Directory of the state shared between sitecluster invocations of the current user.
+    '''
+    directory = os.environ.get('SITE_CLUSTER_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'sitecluster-{}'.format(os.getuid()))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError:
+            # created concurrently by another invocation
+            if not os.path.isdir(directory):
+                raise
+    return directory
+
+
+class StateFile(object):
+    '''
+    JSON document shared between concurrent sitecluster processes. Readers always
+    see a complete document, writers are serialized through a lock file.
+    '''
+    def __init__(self, name, directory=None):
+        self.path = os.path.join(directory or cacheDirectory(), name)
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def write(self, data):
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmpPath, self.path)
+
+    def lock(self, blocking=True):
+        '''
+        Returns an open lock file holding the exclusive lock, or None if not blocking and already locked.
+        '''
+        lockFile = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lockFile, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            lockFile.close()
+            if blocking:
+                raise
+            return None
+        return lockFile
+
+    def update(self, modify):
+        '''
+        Applies modify to the document under the lock and returns the written document.
+        '''
+        with self.lock():
+            data = self.read()
+            modify(data)
+            self.write(data)
+        return data
+
+    def merge(self, entries, maxAge=7 * 24 * 3600):
+        '''
+        Adds entries whose values end with their creation time, dropping entries older than maxAge seconds.
+        '''
+        def mergeEntries(data):
+            expired = time.time() - maxAge
+            for key in [x for x in data if data[x][-1] < expired]:
+                del data[key]
+            data.update(entries)
+        return self.update(mergeEntries)
+
+
+class JobStateCache(object):
+    '''
+    Table of the states of all active jobs shared between sitecluster invocations.
+
+    The table is refreshed with a single scheduler query once it is older than
+    the TTL. The first invocation finding it expired starts the refresh in the
+    background and answers from the stale table like every other invocation
+    until the refresh is written, for up to SITE_CLUSTER_CACHE_MAX_STALE seconds
+    past the TTL. Older tables are refreshed before answering. Jobs missing from
+    the table are not active anymore and are resolved by the backend directly.
+
+    The counters of each invocation are appended to a log, which the refresh
+    adds to the counters file, so answering takes no lock.
+    '''
+    COUNTERS = ('hits', 'misses', 'refreshes', 'stale')
+
+    def __init__(self, siteCluster, ttl=0):
+        self.siteCluster = siteCluster
+        self.ttl = ttl
+        self.maxStale = float(os.environ.get('SITE_CLUSTER_CACHE_MAX_STALE') or 30)
+        name = type(siteCluster).__name__
+        self.table = StateFile('{}-jobs.json'.format(name))
+        self.stats = StateFile('{}-jobs-stats.json'.format(name))
+        self.statsLog = self.stats.path + '.log'
+
+    def getJobStatuses(self, idsOnCluster, addStatus=False):
+        idsOnCluster = [str(x) for x in idsOnCluster]
+        table = self.table.read()
+        age = time.time() - table.get('time', 0)
+        counters = dict.fromkeys(self.COUNTERS, 0)
+        if age >= self.ttl + self.maxStale:
+            # too old to be served, wait for the refresh
+            table = self.refresh()
+            counters['refreshes'] += 1
+        elif age >= self.ttl:
+            lockFile = self.table.lock(blocking=False)
+            if lockFile is not None:
+                self.refreshInBackground(lockFile)
+                counters['refreshes'] += 1
+            counters['stale'] += 1
+
+        jobs = table.get('jobs', {})
+        jobStatuses = {}
+        misses = []
+        for idOnCluster in idsOnCluster:
+            jobStatus = jobs.get(idOnCluster) or jobs.get(idOnCluster.split('.')[0])
+            if jobStatus:
+                jobStatuses[idOnCluster] = jobStatus
+            else:
+                misses.append(idOnCluster)
+        counters['hits'] = len(idsOnCluster) - len(misses)
+        counters['misses'] = len(misses)
+        if misses:
+            jobStatuses.update(zip(misses, self.siteCluster.getJobStatuses(misses, addStatus)))
+        self.recordStats(counters)
+        return [jobStatuses[idOnCluster] for idOnCluster in idsOnCluster]
+
+    def refresh(self, blocking=True):
+        '''
+        Reloads the table from the scheduler, returns None if another invocation is refreshing it.
+        '''
+        lockFile = self.table.lock(blocking)
+        if lockFile is None:
+            return None
+        with lockFile:
+            return self._refresh()
+
+    def _refresh(self):
+        table = self.table.read()
+        # refreshed by another invocation while waiting for the lock
+        if time.time() - table.get('time', 0) < self.ttl:
+            return table
+        table = {'time': time.time(), 'jobs': self.siteCluster.getActiveJobStates()}
+        self.table.write(table)
+        self.foldStats()
+        return table
+
+    def refreshInBackground(self, lockFile):
+        '''
+        Refreshes the table holding lockFile without waiting for the scheduler. The daemon
+        refreshes in a thread, a command in a child process which outlives it.
+        '''
+        def refreshTable():
+            try:
+                with lockFile:
+                    self._refresh()
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+
+        if getattr(_requestContext, 'argv', None):
+            threading.Thread(target=refreshTable).start()
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # the child inherits the lock with the open lock file
+        if os.fork() != 0:
+            lockFile.close()
+            return
+        # detach from the streams of this command so its caller sees them closed
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(devnull, fd)
+        os.setsid()
+        refreshTable()
+        os._exit(0)
+
+    def recordStats(self, counters):
+        '''
+        Appends counters to the log, under a shared lock so no append is lost while it is folded.
+        '''
+        if not any(counters.values()):
+            return
+        fd = os.open(self.statsLog, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            os.write(fd, (json.dumps(counters, sort_keys=True) + '\n').encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def foldStats(self):
+        '''
+        Adds the counters of the log to the counters file and empties the log.
+        '''
+        try:
+            fd = os.open(self.statsLog, os.O_RDWR)
+        except OSError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            totals = self._readStatsLog(fd)
+            if any(totals.values()):
+                self.stats.update(lambda stats: stats.update((k, stats.get(k, 0) + v) for k, v in totals.items()))
+            os.ftruncate(fd, 0)
+        finally:
+            os.close(fd)
+
+    def _readStatsLog(self, fd):
+        totals = dict.fromkeys(self.COUNTERS, 0)
+        with os.fdopen(os.dup(fd), 'rb') as f:
+            f.seek(0)
+            for line in f:
+                try:
+                    counters = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # cut off by a crash
+                    continue
+                for name in self.COUNTERS:
+                    totals[name] += counters.get(name, 0)
+        return totals
+
+    def getStats(self):
+        stats = dict.fromkeys(self.COUNTERS, 0)
+        stats.update(self.stats.read())
+        try:
+            fd = os.open(self.statsLog, os.O_RDONLY)
+        except OSError:
+            pass
+        else:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                for name, value in self._readStatsLog(fd).items():
+                    stats[name] += value
+            finally:
+                os.close(fd)
+        stats['ttl'] = float(os.environ.get('SITE_CLUSTER_CACHE_TTL') or 0)
+        return stats
+
+
+def checkSubmitOutput(submitCmd):
+    '''
+    Runs a submit command and returns its output. The error output is passed on
+    as a whole and is part of the CalledProcessError raised on failure, so busy
+    answers of the scheduler can be told apart from other failures.
+    '''
+    proc = subprocess.Popen(submitCmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    output, errors = proc.communicate()
+    if errors:
+        sys.stderr.write(errors)
+    if proc.returncode:
+        raise CalledProcessError(proc.returncode, submitCmd, output=output + errors)
+    return output
+
+
+# answers of schedulers which are overloaded but will accept the request later
+SCHEDULER_BUSY_PATTERN = re.compile(r'timed out|server busy|try again|temporarily unavailable|unable to contact qmaster', re.IGNORECASE)
+
+
+class TokenBucket(object):
+    '''
+    Limits the rate of requests to a scheduler. The rate is halved whenever the
+    scheduler reports to be busy, down to 1/16 of the maximum, and recovers by 1/16
+    of the maximum with each success.
+    '''
+    def __init__(self, rate, burst=None):
+        self.maxRate = rate
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.time = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+                self.time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slowDown(self):
+        with self._lock:
+            self.rate = max(self.maxRate / 16, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def speedUp(self):
+        with self._lock:
+            self.rate = min(self.maxRate, self.rate + self.maxRate / 16)
+
+
+# one token bucket per backend shared by all engines of the process
+_submitBuckets = {}
+_submitBucketsLock = threading.Lock()
+
+
+class SubmissionEngine(object):
+    '''
+    Submits jobs through a bounded pool of threads.
+
+    All submissions to a backend draw from one token bucket of SITE_CLUSTER_SUBMIT_RATE
+    requests per second (default 10) with bursts of SITE_CLUSTER_SUBMIT_BURST. A submission
+    the scheduler rejects as busy is retried up to SITE_CLUSTER_SUBMIT_RETRIES times
+    (default 5) with exponential backoff, other failures are reported right away.
+    '''
+    def __init__(self, siteCluster, concurrency=4):
+        self.siteCluster = siteCluster
+        self.concurrency = max(1, concurrency)
+        self.retries = int(os.environ.get('SITE_CLUSTER_SUBMIT_RETRIES') or 5)
+        name = type(siteCluster).__name__
+        with _submitBucketsLock:
+            if name not in _submitBuckets:
+                rate = float(os.environ.get('SITE_CLUSTER_SUBMIT_RATE') or 10)
+                burst = float(os.environ.get('SITE_CLUSTER_SUBMIT_BURST') or 0)
+                _submitBuckets[name] = TokenBucket(rate, burst)
+            self.bucket = _submitBuckets[name]
+
+    def submit(self, submission):
+        '''
+        Calls submission() within the rate limit, retrying while the scheduler is busy.
+        '''
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                result = submission()
+            except Exception as e:
+                text = str(e) + str(getattr(e, 'output', '') or '')
+                if attempt == self.retries or not SCHEDULER_BUSY_PATTERN.search(text):
+                    raise
+                self.bucket.slowDown()
+                time.sleep(min(60, 0.5 * 2 ** attempt) * (0.5 + random.random()))
+                continue
+            self.bucket.speedUp()
+            return result
+
+    def run(self, submissions, callback):
+        '''
+        Runs the submission callables concurrently and calls callback(index, result, error)
+        for each as soon as it finished, serialized across threads.
+        '''
+        pending = queue.Queue()
+        for index, submission in enumerate(submissions):
+            pending.put((index, submission))
+        callbackLock = threading.Lock()
+
+        def work():
+            while True:
+                try:
+                    index, submission = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    result, error = (self.submit(submission), None)
+                except Exception as e:
+                    result, error = (None, e)
+                with callbackLock:
+                    callback(index, result, error)
+
+        workers = [threading.Thread(target=work) for _ in range(min(self.concurrency, len(submissions)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+
+class Pack(object):
+    '''
+    Directory of tasks run within one allocation by a runner started in it.
+
+    tasks/<n>.json holds the command of task n, numbered from 1, state/<n>.json its
+    state as written by the runner and cancel/<n> marks a task to be killed. The
+    output of a task goes to stdout.<n>.txt and stderr.<n>.txt. The runner ends once
+    the sealed marker exists and all tasks ended, or after the idle timeout without
+    tasks. It then marks the pack as closed so no further tasks are added.
+    '''
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.settings = StateFile('pack.json', self.directory)
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    @staticmethod
+    def make(parent, threads=None, idleTimeout=None):
+        '''
+        Creates a new pack directory below parent.
+        '''
+        directory = tempfile.mkdtemp(dir=parent, prefix='sitecluster-pack.')
+        os.chmod(directory, stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH)
+        pack = Pack(directory)
+        pack.create(threads, idleTimeout)
+        return pack
+
+    def create(self, threads=None, idleTimeout=None):
+        for name in ['tasks', 'state', 'cancel']:
+            os.mkdir(self.path(name))
+        self.settings.write({'threads': threads or 1, 'tasks': 0, 'completed': 0, 'idle_timeout': idleTimeout})
+
+    def addTask(self, cmdargs, cwd):
+        '''
+        Adds a task and returns its number, or None if the runner ended already.
+        '''
+        def addTask(data):
+            if not data.get('closed'):
+                data['tasks'] += 1
+        settings = self.settings.update(addTask)
+        if settings.get('closed'):
+            return None
+        task = settings['tasks']
+        StateFile('{}.json'.format(task), self.path('tasks')).write({'cmdargs': cmdargs, 'cwd': cwd})
+        return task
+
+    def seal(self):
+        open(self.path('sealed'), 'w').close()
+
+    def writeRunner(self):
+        '''
+        Writes the script started as the allocation job and returns its path.
+        '''
+        runner = self.path('runner.sh')
+        with open(runner, 'w') as f:
+            f.write('#!/bin/bash\nexec /usr/bin/env python3 {} run-pack {}\n'.format(quote(os.path.abspath(__file__)), quote(self.directory)))
+        os.chmod(runner, stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH)
+        return runner
+
+    @staticmethod
+    def register(allocId, directory):
+        '''
+        Remembers the pack directory of an allocation for status and kill.
+        '''
+        StateFile('packs.json').merge({str(allocId): [os.path.abspath(directory), time.time()]})
+
+    @staticmethod
+    def getRegistry():
+        return StateFile('packs.json').read()
+
+    def taskState(self, task):
+        return StateFile('{}.json'.format(task), self.path('state'))
+
+    def cancelTask(self, task):
+        open(self.path('cancel', str(task)), 'w').close()
+
+    def getTaskStatus(self, task, allocStatus):
+        '''
+        Returns the status of a task given the status of the allocation.
+        '''
+        state = self.taskState(task).read()
+        if state.get('state') == 'COMPLETED':
+            return 'COMPLETED {}'.format(state['exit'])
+        if not os.path.exists(self.path('tasks', '{}.json'.format(task))):
+            return 'UNKNOWNID'
+        if not state and os.path.exists(self.path('cancel', str(task))):
+            return 'COMPLETED {}'.format(128 + signal.SIGKILL)
+        if allocStatus in ['RUNNING', 'SUSPENDED']:
+            return allocStatus if state else 'PENDING'
+        if allocStatus == 'PENDING':
+            return 'PENDING'
+        # the allocation ended before the task, killing it or before it started
+        return 'COMPLETED {}'.format(128 + signal.SIGKILL if state else 1)
+
+    def run(self, siteCluster, interval=0.2, killDelay=10):
+        '''
+        Runs the tasks on the free slots of the allocation until the pack is complete.
+        '''
+        settings = self.settings.read()
+        threads = settings.get('threads') or 1
+        idleTimeout = settings.get('idle_timeout')
+        slots = max(1, siteCluster.getPackSlots(threads))
+        freeSlots = list(range(slots))
+        running = {}
+        nextTask = 1
+        completed = 0
+        lastActive = heartbeat = 0
+        while True:
+            if time.time() - heartbeat >= 5:
+                # lets submitters tell a live runner from a lost allocation
+                heartbeat = time.time()
+                self.settings.update(lambda data: data.update(slots=slots, heartbeat=heartbeat, completed=completed,
+                                                              started=data.get('started') or heartbeat))
+            for task in list(running):
+                proc, slot, cancelled = running[task]
+                returncode = proc.poll()
+                if returncode is None:
+                    if cancelled is None and os.path.exists(self.path('cancel', str(task))):
+                        os.killpg(proc.pid, signal.SIGTERM)
+                        running[task] = (proc, slot, time.time())
+                    elif cancelled is not None and time.time() - cancelled > killDelay:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    continue
+                self.taskState(task).write({'state': 'COMPLETED', 'exit': 128 - returncode if returncode < 0 else returncode})
+                freeSlots.append(slot)
+                del running[task]
+                completed += 1
+                heartbeat = 0
+
+            while freeSlots and os.path.exists(self.path('tasks', '{}.json'.format(nextTask))):
+                task = nextTask
+                nextTask += 1
+                if os.path.exists(self.path('cancel', str(task))):
+                    self.taskState(task).write({'state': 'COMPLETED', 'exit': 128 + signal.SIGKILL})
+                    continue
+                spec = StateFile('{}.json'.format(task), self.path('tasks')).read()
+                slot = freeSlots.pop(0)
+                cmd = siteCluster.getPackTaskCommand(slot, threads, spec['cmdargs'])
+                try:
+                    with open(self.path('stdout.{}.txt'.format(task)), 'wb') as out, open(self.path('stderr.{}.txt'.format(task)), 'wb') as err:
+                        proc = subprocess.Popen(cmd, stdout=out, stderr=err, cwd=spec['cwd'], preexec_fn=os.setpgrp, close_fds=True)
+                except OSError as e:
+                    print('ERROR: task {} failed to start: {}'.format(task, e), file=sys.stderr)
+                    self.taskState(task).write({'state': 'COMPLETED', 'exit': 127})
+                    freeSlots.append(slot)
+                    continue
+                self.taskState(task).write({'state': 'RUNNING', 'slot': slot})
+                running[task] = (proc, slot, None)
+
+            if running:
+                lastActive = time.time()
+            elif not os.path.exists(self.path('tasks', '{}.json'.format(nextTask))):
+                # all tasks are written before the pack is sealed
+                sealed = os.path.exists(self.path('sealed'))
+                if sealed or idleTimeout is not None and time.time() - (lastActive or heartbeat) >= idleTimeout:
+                    if self.close(nextTask - 1, completed):
+                        return
+            time.sleep(interval)
+
+    def close(self, tasks, completed):
+        '''
+        Marks the pack as closed unless more than tasks tasks were added meanwhile.
+        '''
+        def close(data):
+            if data['tasks'] <= tasks:
+                data.update(closed=time.time(), completed=completed)
+        return bool(self.settings.update(close).get('closed'))
+
+
+class AllocationPool(object):
+    '''
+    Named set of long lived pack allocations which run submitted jobs as tasks right away.
+
+    Each member is a pack without the sealed marker whose runner ends after the idle
+    timeout. A job goes to the live member with the fewest queued tasks, counting
+    as a hit if that member has a free slot. The pool grows by one allocation, up to
+    its size, whenever no live member has a free slot, and shrinks as idle members end.
+    The pools are kept in pools.json of the cache directory. A new member is reserved
+    under the lock of pools.json and its allocation submitted after releasing it, so a
+    slow scheduler never blocks the submissions to the other members.
+    '''
+    # seconds a reserved member may wait for the id of its allocation
+    RESERVE_TIMEOUT = 300
+
+    def __init__(self, siteCluster, name):
+        self.siteCluster = siteCluster
+        self.name = name
+        self.pools = StateFile('pools.json')
+
+    def start(self, settings):
+        '''
+        Creates the pool and submits its first allocation.
+        '''
+        with self.pools.lock():
+            data = self.pools.read()
+            if self.name in data:
+                raise KeyError('ERROR: pool {} exists already, stop it first to start it with other settings'.format(self.name))
+            pool = data[self.name] = dict(settings, members=[], hits=0, misses=0)
+            pack = self._reserve(pool)[1]
+            self.pools.write(data)
+        try:
+            self._launch(pool, pack)
+        except BaseException:
+            # the pool can be started again
+            self.pools.update(lambda data: data.pop(self.name, None))
+            raise
+
+    def stop(self):
+        '''
+        Lets the members end once their tasks ended and forgets the pool.
+        '''
+        with self.pools.lock():
+            data = self.pools.read()
+            pool = data.pop(self.name, None)
+            if pool is None:
+                raise KeyError('ERROR: no pool named {}'.format(self.name))
+            for allocId, directory in pool['members']:
+                Pack(directory).seal()
+            self.pools.write(data)
+
+    def _members(self, pool):
+        '''
+        Returns the (allocId, pack, settings, live) of the members, dropping ended ones.
+        The allocId is None while the allocation of the member is being submitted.
+        '''
+        members = []
+        for allocId, directory in pool['members']:
+            pack = Pack(directory)
+            settings = pack.settings.read()
+            allocId = allocId or settings.get('alloc_id')
+            live = time.time() - settings.get('heartbeat', 0) < 60
+            if settings.get('closed') or settings.get('started') and not live:
+                continue
+            if allocId is None and time.time() - settings.get('reserved', 0) > self.RESERVE_TIMEOUT:
+                # the submitting process ended before the allocation was submitted
+                continue
+            members.append((allocId, pack, settings, live))
+        pool['members'] = [[x[0], x[1].directory] for x in members]
+        return members
+
+    def _reserve(self, pool):
+        '''
+        Adds a member whose allocation is submitted by _launch, called with the lock held.
+        '''
+        pack = Pack.make(pool['directory'], pool['options']['threads'], pool['idle'])
+        settings = pack.settings.update(lambda data: data.update(reserved=time.time()))
+        pool['members'].append([None, pack.directory])
+        return (None, pack, settings, False)
+
+    def _launch(self, pool, pack):
+        '''
+        Submits the allocation of a reserved member, called without the lock held.
+        '''
+        try:
+            allocId = self.siteCluster.submitPackAllocation(pack, argparse.Namespace(**pool['options']), pool['nodes'])
+        except BaseException:
+            # the tasks added meanwhile are submitted again to other members
+            pack.settings.update(lambda data: data.update(closed=time.time()))
+            raise
+        pack.settings.update(lambda data: data.update(alloc_id=allocId))
+        return allocId
+
+    def _waitForAllocation(self, pack, interval=0.1):
+        '''
+        Returns the id of the allocation of a reserved member once submitted, None if its submission failed.
+        '''
+        while True:
+            settings = pack.settings.read()
+            if settings.get('alloc_id') is not None:
+                return settings['alloc_id']
+            if settings.get('closed') or time.time() - settings.get('reserved', 0) > self.RESERVE_TIMEOUT:
+                return None
+            time.sleep(interval)
+
+    def submit(self, cmdargs, cwd):
+        '''
+        Adds the job to a member of the pool and returns its <allocid>+<task> id.
+        '''
+        while True:
+            reserved = None
+            with self.pools.lock():
+                data = self.pools.read()
+                if self.name not in data:
+                    raise KeyError('ERROR: no pool named {}, start it with sitecluster pool start {}'.format(self.name, self.name))
+                pool = data[self.name]
+                while True:
+                    members = self._members(pool)
+                    live = sorted([x for x in members if x[3]], key=lambda x: x[2]['tasks'] - x[2].get('completed', 0))
+                    waiting = [x for x in members if not x[3]]
+                    hit = bool(live) and live[0][2]['tasks'] - live[0][2].get('completed', 0) < live[0][2].get('slots', 1)
+                    if not hit and len(members) < pool['size'] and not waiting and reserved is None:
+                        reserved = self._reserve(pool)
+                        waiting.append(reserved)
+                    # a busy live member still starts the job before a new allocation would
+                    allocId, pack = (live or waiting)[0][:2]
+                    task = pack.addTask(cmdargs, cwd)
+                    if task is not None:
+                        break
+                pool['hits' if hit else 'misses'] += 1
+                self.pools.write(data)
+            if reserved is not None:
+                self._launch(pool, reserved[1])
+            if allocId is None:
+                allocId = self._waitForAllocation(pack)
+            if allocId is not None:
+                return '{}+{}'.format(allocId, task)
+
+    def getStatus(self):
+        with self.pools.lock():
+            data = self.pools.read()
+            if self.name not in data:
+                raise KeyError('ERROR: no pool named {}'.format(self.name))
+            pool = data[self.name]
+            members = self._members(pool)
+            self.pools.write(data)
+        requests = pool['hits'] + pool['misses']
+        return {
+            'name': self.name,
+            'members': [{'id': x[0], 'live': x[3], 'slots': x[2].get('slots'), 'queued': x[2]['tasks'] - x[2].get('completed', 0)} for x in members],
+            'size': pool['size'],
+            'hits': pool['hits'],
+            'misses': pool['misses'],
+            'hit_rate': float(pool['hits']) / requests if requests else None,
+        }
+
+
 class PBSSiteCluster(SiteCluster):
 
     def __init__(self, use_argv=True, ignore_user=True):
         SiteCluster.__init__(self, use_argv=use_argv, ignore_user=ignore_user)
 
+    def getFlavour(self):
+        '''
+        Returns 'pro' for PBS Professional and OpenPBS or 'torque' for Torque, which differ in their job
+        arrays. SITE_CLUSTER_PBS_FLAVOUR overrides the detection through qstat --version.
+        '''
+        flavour = os.environ.get('SITE_CLUSTER_PBS_FLAVOUR')
+        if flavour:
+            return flavour
+        features = StateFile('PBSSiteCluster-features.json')
+        flavour = features.read().get('flavour')
+        if flavour is None:
+            try:
+                output = subprocess.check_output(['qstat', '--version'], stderr=subprocess.STDOUT, universal_newlines=True)
+            except CalledProcessError as e:
+                output = e.output or ''
+            # PBS Professional prints "pbs_version = 19.1.3", Torque "Version: 6.1.2"
+            flavour = 'pro' if 'pbs_version' in output else 'torque'
+            features.update(lambda data: data.update({'flavour': flavour}))
+        return flavour
+
+    @property
+    def ARRAY_INDEX_VARIABLE(self):
+        return 'PBS_ARRAY_INDEX' if self.getFlavour() == 'pro' else 'PBS_ARRAYID'
+
+    def readJobId(self):
+        '''
+        Returns the sitecluster id of the running job from PBS_JOBID, which is <num>.<server>
+        or <num>[<index>].<server> within an array task.
+        '''
+        reMatch = re.match(r'(\d+)(?:\[(\d+)\])?(.*)$', os.environ['PBS_JOBID'])
+        if reMatch and reMatch.group(2):
+            return '{}{}_{}'.format(reMatch.group(1), reMatch.group(3), reMatch.group(2))
+        return os.environ['PBS_JOBID']
+
     def getQueues(self):
         cmd = ['qstat', '-Q']
         reAnsw = r'([a-zA-Z0-9_\.-]+)[ ]*([0-9]+).*'
@@ -235,7 +1967,7 @@ class PBSSiteCluster(SiteCluster):
         #  sub job start within job
         if options.startnode:
             self.startNode(options.startnode, cmdargs)
-            return str(int(os.environ['PBS_JOBID']))
+            return self.readJobId()
 
         submitCmd = ['qsub', '-V', '-W', 'umask=022']
         # destination  queue of the job
@@ -284,6 +2016,9 @@ class PBSSiteCluster(SiteCluster):
             submitCmd += ['-A', options.project]
         if options.group:
             submitCmd += ['-W', 'group_list=%s'% options.group]
+        # job array of submit-batch
+        if getattr(options, 'array', None):
+            submitCmd += ['-J' if self.getFlavour() == 'pro' else '-t', '1-%d' % options.array]
         # custom arguments is an array need to decide how to process
         # TODO need to decide how to process arguments if duplicates are not allowed
         if options.customargs:
@@ -296,32 +2031,149 @@ class PBSSiteCluster(SiteCluster):
         submitCmd += cmdargs
         # perform the job submission
         res = ''
-        reAnsw = r'(^\d+\.[\w\.\-]+).*'
-        for s in [s for s in subprocess.check_output(submitCmd, universal_newlines=True).splitlines()]:
+        # job arrays are reported as <num>[].<server>
+        reAnsw = r'(^\d+)(?:\[\])?(\.[\w\.\-]+).*'
+        for s in [s for s in checkSubmitOutput(submitCmd).splitlines()]:
             reMatch = re.match(reAnsw, s)
             if reMatch:
-                res = str(reMatch.group(1))
+                res = str(reMatch.group(1) + reMatch.group(2))
         return res
 
+    def arrayTaskId(self, arrayId, index):
+        num, dot, server = arrayId.partition('.')
+        return '{}[{}]{}{}'.format(num, index, dot, server)
+
     def getJobStatus(self, idOnCluster, addStatus=False):
-        cmd = ['qstat', '-f', idOnCluster]
+        return self.getJobStatuses([idOnCluster], addStatus)[0]
+
+    def getJobStatuses(self, idsOnCluster, addStatus=False):
+        idsOnCluster = [str(x) for x in idsOnCluster]
+        records = None
+        features = StateFile('PBSSiteCluster-features.json')
+        if features.read().get('json', True):
+            records = self.__getJsonRecords(idsOnCluster, features)
+        if records is None:
+            records = self.__getTextRecords(idsOnCluster)
+        jobs, unknown = records
+
+        jobStatuses = []
+        for idOnCluster in idsOnCluster:
+            # the server may name itself differently than the id, as 123.headnode for 123.headnode.domain
+            job = jobs.get(idOnCluster) or jobs.get(idOnCluster.split('.')[0])
+            if job is None:
+                # reported unknown or not listed at all, no evidence the job succeeded
+                jobStatuses.append('UNKNOWNID')
+                continue
+            jobStatuses.append(self._pbsJobStatus(job['state'], job['exit'], addStatus))
+        return jobStatuses
+
+    def __getJsonRecords(self, idsOnCluster, features):
+        '''
+        Returns the (job_state, exit_status) records of the jobs including finished ones and the set
+        of unknown job ids, or None if no JSON output is available. The output is decoded one job at
+        a time, keeping memory flat for listings of many jobs.
+        '''
+        cmd = ['qstat', '-f', '-F', 'json', '-x'] + idsOnCluster
+        with tempfile.TemporaryFile(mode='w+') as err:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err, universal_newlines=True)
+            jobs = {}
+            try:
+                for jobId, attributes in iterJsonMembers(proc.stdout, 'Jobs'):
+                    job = {'state': attributes.get('job_state', ''), 'exit': str(attributes.get('Exit_status', 0))}
+                    jobs[jobId] = job
+                    # allow lookups by the short numeric id as well
+                    jobs.setdefault(jobId.split('.')[0], job)
+            except ValueError:
+                # no or malformed JSON output
+                jobs = None
+            finally:
+                proc.stdout.close()
+                proc.wait()
+            err.seek(0)
+            errors = err.read()
+
+        unknown = set()
+        for reMatch in re.finditer(r'Unknown Job Id\s+(\S+)', errors):
+            unknown.add(reMatch.group(1))
+            unknown.add(reMatch.group(1).split('.')[0])
+        if jobs is None and unknown and 'option' not in errors and 'usage' not in errors.lower():
+            # qstat prints no JSON at all when every job is unknown
+            jobs = {}
+        if jobs is None:
+            if 'option' in errors or 'usage' in errors.lower():
+                # remember servers without -F json or -x to not try it on every call
+                features.update(lambda data: data.update({'json': False}))
+            return None
+        if proc.returncode and not unknown:
+            print(errors, file=sys.stderr)
+            raise CalledProcessError(proc.returncode, cmd, output=errors)
+        return (jobs, unknown)
+
+    def __getTextRecords(self, idsOnCluster):
+        '''
+        Returns the (job_state, exit_status) records of the jobs and the set of unknown job ids.
+        '''
+        cmd = ['qstat', '-f'] + idsOnCluster
         try:
             # stderr=subprocess.STDOUT redirection is needed for getting the "Unknown Job Id" in err.output
             output = [s for s in subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True).splitlines()]
         except CalledProcessError as err:
             print(err.output, file=sys.stderr)
             # PBS error code PBSE_UNKJOBID = 15001; PBSE_UNKJOBID mod 256 = 153
+            # known jobs are still listed when only some of the ids are unknown
             if err.returncode == 153 or "Unknown Job Id" in err.output:
-                return "UNKNOWNID"
-            raise
+                output = err.output.splitlines()
+            else:
+                raise
 
-        reAnsw = r'\s+job_state\s+=\s+([BEHQRSTUWX])'
-        rstate = ''
+        # split the full listing into one (job_state, exit_status) entry per job
+        reJobId = r'Job Id:\s+(\S+)'
+        reState = r'\s+job_state\s+=\s+([BEFHQRSTUWX])'
+        reExit = r'\s+[Ee]xit_status\s+=\s+(-?[0-9]+)'
+        reUnknown = r'.*Unknown Job Id\s+(\S+)'
+        jobs = {}
+        unknown = set()
+        job = None
         for s in output:
+            reMatch = re.match(reJobId, s)
+            if reMatch:
+                job = jobs.setdefault(reMatch.group(1), {'state': '', 'exit': '0'})
+                # allow lookups by the short numeric id as well
+                jobs.setdefault(reMatch.group(1).split('.')[0], job)
+                continue
+            reMatch = re.match(reUnknown, s)
+            if reMatch:
+                unknown.add(reMatch.group(1))
+                unknown.add(reMatch.group(1).split('.')[0])
+                continue
+            if job is None:
+                continue
+            reMatch = re.match(reState, s)
+            if reMatch:
+                job['state'] = reMatch.group(1)
+                continue
+            reMatch = re.match(reExit, s)
+            if reMatch:
+                job['exit'] = reMatch.group(1)
+        return (jobs, unknown)
+
+    def getActiveJobStates(self):
+        '''
+        Returns the status of all jobs which did not finish yet, keyed by the numeric job id.
+        '''
+        # the plain listing truncates long server names, only the numeric part is reliable
+        cmd = ['qstat']
+        reAnsw = r'(\d+)(\.\S*)?\s+\S+\s+\S+\s+\S+\s+([BEHQRSTUWX])\s+\S+'
+        jobStatuses = {}
+        for s in [s.strip() for s in subprocess.check_output(cmd, universal_newlines=True).splitlines()]:
             reMatch = re.match(reAnsw, s)
             if reMatch:
-                rstate = reMatch.group(1)
-                break
+                jobStatus = self._pbsJobStatus(reMatch.group(3), '0', False)
+                if jobStatus != 'COMPLETED':
+                    jobStatuses[reMatch.group(1)] = jobStatus
+        return jobStatuses
+
+    def _pbsJobStatus(self, rstate, exitStatus, addStatus):
         jobStatus = 'COMPLETED'
         if rstate == '':
             jobStatus = 'COMPLETED'
@@ -335,13 +2187,6 @@ class PBSSiteCluster(SiteCluster):
             jobStatus = 'COMPLETED'
 
         if addStatus and jobStatus == 'COMPLETED':
-            exitStatus = '0'
-            reAnsw = r'\s+exit_status\s+=\s+([0-9]+)'
-            for s in output:
-                reMatch = re.match(reAnsw, s)
-                if reMatch:
-                    exitStatus = reMatch.group(1)
-                    break
             jobStatus += ' ' + exitStatus
         return jobStatus
 
@@ -358,7 +2203,7 @@ class PBSSiteCluster(SiteCluster):
                         res = l
                 if not res:
                     continue
-                reAnsw = r'Request invalid for state of job.*COMPLETE\s+{}'.format(jobId)
+                reAnsw = r'Request invalid for state of job.*COMPLETE\s+{}'.format(re.escape(str(jobId)))
                 reMatch = re.search(reAnsw, res)
                 if reMatch:
                     continue
@@ -369,17 +2214,36 @@ class PBSSiteCluster(SiteCluster):
                 return 1
         return 0
 
-    def getNodeCount(self):
-        return str(int(os.environ['PBS_NUM_NODES']))
+    ALLOCATION_VARIABLES = ('PBS_NODEFILE',)
+
+    def readAllocation(self):
+        # the node file lists the host of each node index of pbsdsh
+        with open(os.environ['PBS_NODEFILE']) as f:
+            return [(x.strip(), 1) for x in f if x.strip()]
+
+    def getLaunchCommand(self, num, cmdargs):
+        return ['pbsdsh', '-n', str(int(num))] + cmdargs
 
     def startNode(self, num, cmdargs):
-        subprocess.check_call(['pbsdsh', '-n', str(int(num))] + cmdargs)
+        subprocess.check_call(self.getLaunchCommand(num, cmdargs))
 
 class LSFSiteCluster(SiteCluster):
 
+    ARRAY_INDEX_VARIABLE = 'LSB_JOBINDEX'
+
     def __init__(self, use_argv=True):
         SiteCluster.__init__(self, use_argv=use_argv)
 
+    def readJobId(self):
+        '''
+        Returns the sitecluster id of the running job from LSB_JOBID, and LSB_JOBINDEX within an
+        array task, which is 0 outside of arrays.
+        '''
+        index = os.environ.get('LSB_JOBINDEX', '0')
+        if index not in ('0', ''):
+            return '{}_{}'.format(os.environ['LSB_JOBID'], index)
+        return os.environ['LSB_JOBID']
+
     def getQueues(self):
         cmd = ['bqueues', '-w']
         reAnsw = r'([a-zA-Z0-9_-]+)[ ]*([0-9]+).*'
@@ -394,14 +2258,16 @@ class LSFSiteCluster(SiteCluster):
         #  sub job start within job
         if options.startnode:
             self.startNode(options.startnode, cmdargs)
-            return str(int(os.environ['PBS_JOBID']))
+            return self.readJobId()
 
         submitCmd = ['bsub']
         # destination  queue of the job
         if options.queue:
             submitCmd += ['-q', options.queue]
-        # name of the job
-        if options.jobname:
+        # name of the job, job arrays of submit-batch are declared through the name
+        if getattr(options, 'array', None):
+            submitCmd += ['-J', '%s[1-%d]' % (options.jobname or 'sitecluster', options.array)]
+        elif options.jobname:
             submitCmd += ['-J', options.jobname]
         # resources
         if options.nodes:
@@ -456,67 +2322,139 @@ class LSFSiteCluster(SiteCluster):
         # perform the job submission
         res = ''
         reAnsw = r'Job\s+<([0-9]+)>.*'
-        for s in [s for s in subprocess.check_output(submitCmd, universal_newlines=True).splitlines()]:
+        for s in [s for s in checkSubmitOutput(submitCmd).splitlines()]:
             reMatch = re.match(reAnsw, s)
             if reMatch:
                 res = str(reMatch.group(1))
         return res
 
-    def getJobStatus(self, idOnCluster, addStatus=False):
-        cmd = ['bjobs', '-a', idOnCluster]
-        reAnsw = r'\s*{}\s+\S+\s+(\w+)\s+.*'.format(idOnCluster)
-        reAnswUnk = r'Job\s*<{}>\s*is not found'.format(idOnCluster)
-        rstate = ''
-        reMatchUnk = None
-        for s in [s for s in subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True).splitlines()]:
+    def __getBhistStatus(self, idOnCluster):
+        '''
+        Returns the (status, exit status, final) of a job from bhist, final if bhist recorded how the job ended.
+        '''
+        cmdhist = ['bhist', '-la', idOnCluster]
+        reAnsw = r'.*: Exited with exit code\s*(\d+).*'
+        answSucces = 'Done successfully'
+        answUnk = 'No matching job found'
+        try:
+            output = [s for s in subprocess.check_output(cmdhist, stderr=subprocess.STDOUT, universal_newlines=True).splitlines()]
+        except CalledProcessError as err:
+            # LSF error code is always 255 so just look for string
+            if answUnk in err.output:
+                return ('UNKNOWNID', 0, False)
+            raise
+
+        jobStatus = 'COMPLETED'
+        exitStatus = 0
+        final = False
+        for s in output:
+            if answSucces in s:
+                exitStatus = 0
+                final = True
+                break
+            if answUnk in s:
+                jobStatus = 'UNKNOWNID'
+                break
             reMatch = re.match(reAnsw, s)
             if reMatch:
-                rstate = reMatch.group(1)
+                exitStatus = reMatch.group(1)
+                final = True
                 break
-            reMatchUnk = re.match(reAnswUnk, s)
-            if reMatchUnk:
-                break
-        jobStatus = 'COMPLETED'
-        if rstate == 'EXIT' or reMatchUnk:
-            jobStatus = 'COMPLETED'
-            exitStatus = 0
-            cmdhist = ['bhist', '-la', idOnCluster]
-            reAnsw = r'.*: Exited with exit code\s*(\d+).*'
-            answSucces = 'Done successfully'
-            answUnk = 'No matching job found'
-            try:
-                output = [s for s in subprocess.check_output(cmdhist, stderr=subprocess.STDOUT, universal_newlines=True).splitlines()]
-            except CalledProcessError as err:
-                # LSF error code is always 255 so just look for string
-                if answUnk in err.output:
-                    return "UNKNOWNID"
-                raise
+        return (jobStatus, exitStatus, final)
 
-            for s in output:
-                if answSucces in s:
-                    exitStatus = 0
-                    break
-                if answUnk in s:
-                    jobStatus = 'UNKNOWNID'
-                    break
-                reMatch = re.match(reAnsw, s)
-                if reMatch:
-                    exitStatus = reMatch.group(1)
-                    break
-            if addStatus:
-                jobStatus += ' ' + str(exitStatus)
-        elif rstate == 'PEND':
-            jobStatus = 'PENDING'
-        elif rstate == 'RUN':
-            jobStatus = 'RUNNING'
-        elif rstate == 'SUSP':
-            jobStatus = 'SUSPENDED'
-        elif rstate == 'DONE':
-            if addStatus:
-                jobStatus = 'COMPLETED 0'
+    def arrayTaskId(self, arrayId, index):
+        return '{}[{}]'.format(arrayId, index)
+
+    def getJobStatus(self, idOnCluster, addStatus=False):
+        return self.getJobStatuses([idOnCluster], addStatus)[0]
+
+    def __getBjobsRecords(self, idsOnCluster):
+        '''
+        Returns (state, exit code) of the jobs known to bjobs, keyed by job id.
+        '''
+        if not idsOnCluster:
+            return {}
+        cmd = ['bjobs', '-a', '-o', 'jobid jobindex stat exit_code', '-json'] + idsOnCluster
+        try:
+            output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True)
+        except CalledProcessError as err:
+            # bjobs fails when some of the jobs are not found, the others are still listed
+            output = err.output
+        try:
+            records = {}
+            for record in json.loads(output).get('RECORDS', []):
+                if 'ERROR' not in record:
+                    jobId = record['JOBID']
+                    # array tasks are listed with the id of their array
+                    if record.get('JOBINDEX', '0') not in ['0', '']:
+                        jobId = self.arrayTaskId(jobId, record['JOBINDEX'])
+                    records[jobId] = (record.get('STAT', ''), record.get('EXIT_CODE', ''))
+            return records
+        except ValueError:
+            # LSF before 10.1 has no JSON output
+            pass
+
+        cmd = ['bjobs', '-a'] + idsOnCluster
+        try:
+            output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True).splitlines()
+        except CalledProcessError as err:
+            output = err.output.splitlines()
+
+        reAnsw = r'\s*(\S+)\s+\S+\s+(\w+)\s+.*'
+        reAnswUnk = r'Job\s*<(\S+)>\s*is not found'
+        # array tasks carry their index in the job name
+        reAnswIndex = r'.*\S\[(\d+)\]\s'
+        records = {}
+        for s in output:
+            if re.match(reAnswUnk, s):
+                continue
+            reMatch = re.match(reAnsw, s)
+            if reMatch:
+                jobId = reMatch.group(1)
+                reMatchIndex = re.match(reAnswIndex, s)
+                if reMatchIndex:
+                    jobId = self.arrayTaskId(jobId, reMatchIndex.group(1))
+                records.setdefault(jobId, (reMatch.group(2), ''))
+        return records
+
+    def getJobStatuses(self, idsOnCluster, addStatus=False):
+        idsOnCluster = [str(x) for x in idsOnCluster]
+        # results of finished jobs never change, so no job needs bhist twice
+        resultCache = StateFile('LSFSiteCluster-results.json')
+        cached = resultCache.read()
+        records = self.__getBjobsRecords([x for x in idsOnCluster if x not in cached])
+
+        terminal = {}
+        jobStatuses = []
+        for idOnCluster in idsOnCluster:
+            if idOnCluster in cached:
+                jobStatus, exitStatus = cached[idOnCluster][:2]
             else:
+                rstate, exitStatus = records.get(idOnCluster, ('', ''))
                 jobStatus = 'COMPLETED'
-        return jobStatus
+                # only the results of DONE and EXIT records are final, a job bhist does not know yet may still appear
+                final = rstate == 'DONE' or rstate == 'EXIT' and exitStatus != ''
+                if rstate == 'DONE':
+                    exitStatus = 0
+                elif rstate == 'EXIT' and exitStatus:
+                    pass
+                elif rstate in ['EXIT', '']:
+                    # only jobs which exited without exit code or are not known anymore need the slow bhist lookup
+                    jobStatus, exitStatus, final = self.__getBhistStatus(idOnCluster)
+                elif rstate == 'PEND':
+                    jobStatus = 'PENDING'
+                elif rstate == 'RUN':
+                    jobStatus = 'RUNNING'
+                elif rstate in ['SUSP', 'PSUSP', 'USUSP', 'SSUSP']:
+                    jobStatus = 'SUSPENDED'
+                if final:
+                    terminal[idOnCluster] = [jobStatus, str(exitStatus), time.time()]
+            if addStatus and jobStatus == 'COMPLETED':
+                jobStatus += ' ' + str(exitStatus)
+            jobStatuses.append(jobStatus)
+        if terminal:
+            resultCache.merge(terminal)
+        return jobStatuses
 
     def killJob(self, idsOnCluster):
         cmd = ['bkill'] + [str(x) for x in idsOnCluster]
@@ -532,7 +2470,7 @@ class LSFSiteCluster(SiteCluster):
                     break
             if not res:
                 continue
-            reAnsw = r'Job\s+<{}>\s+is being terminated'.format(jobId)
+            reAnsw = r'Job\s+<{}>\s+is being terminated'.format(re.escape(str(jobId)))
             reMatch = re.search(reAnsw, res)
             if reMatch:
                 continue
@@ -544,29 +2482,147 @@ class LSFSiteCluster(SiteCluster):
             return 1
         return 0
 
-    def __getLSBHosts(self):
+    ALLOCATION_VARIABLES = ('LSB_MCPU_HOSTS', 'LSB_HOSTS')
+
+    def readAllocation(self):
         if 'LSB_MCPU_HOSTS' in os.environ:
             # host, slot number pairs
-            return (True, os.environ['LSB_MCPU_HOSTS'].split(' '))
-        else:
-            # list with host names
-            return (False, os.environ['LSB_HOSTS'].split(' '))
+            slots = os.environ['LSB_MCPU_HOSTS'].split()
+            return [(slots[x], int(slots[x + 1])) for x in range(0, len(slots) - 1, 2)]
+        # list with host names
+        return [(x, 1) for x in os.environ['LSB_HOSTS'].split()]
 
-    def getNodeCount(self):
-        isShortHostnameSlotFormat, slots = self.__getLSBHosts()
-        if isShortHostnameSlotFormat:
-            return sum([int(y) for x, y in enumerate(slots) if x%2])
-        else:
-            return len(slots)
+    def getLaunchCommand(self, num, cmdargs):
+        return ['blaunch', self.getNodeHost(num)] + cmdargs
 
     def startNode(self, num, cmdargs):
-        isShortHostnameSlotFormat, slots = self.__getLSBHosts()
-        if isShortHostnameSlotFormat:
-            slots = sum([[slots[x]]*int(slots[x+1]) for x, _ in enumerate(slots) if x%2 != 1], [])
-        subprocess.check_call(['blaunch', slots[int(num)]] + cmdargs)
+        subprocess.check_call(self.getLaunchCommand(num, cmdargs))
+
+class SGEAccountingIndex(object):
+    '''
+    Index job id -> (exit_status, failed, end_time) of the SGE accounting file.
+
+    The accounting file is only read from the offset reached by the previous update,
+    starting over when the file was rotated. The index is an SQLite database in the
+    sitecluster cache directory, array tasks are indexed as <job>.<task>. <job> of an array
+    has the record of its worst task: a task SGE failed before one which exited, and the
+    highest exit status among those, so a failing task is not hidden by the tasks after it.
+    '''
+    def __init__(self, accountingPath=None):
+        self.accountingPath = accountingPath or os.environ.get('SITE_CLUSTER_SGE_ACCOUNTING') or os.path.join(
+            os.environ.get('SGE_ROOT', '/opt/sge'), os.environ.get('SGE_CELL', 'default'), 'common', 'accounting')
+        self.dbPath = os.path.join(cacheDirectory(), 'SunGridEngineSiteCluster-acct.db')
+
+    def available(self):
+        return os.access(self.accountingPath, os.R_OK)
+
+    def _connect(self):
+        import sqlite3
+        db = sqlite3.connect(self.dbPath, timeout=60, isolation_level=None)
+        db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, exit_status TEXT, failed TEXT, end_time TEXT) WITHOUT ROWID')
+        db.execute('CREATE TABLE IF NOT EXISTS position (inode INTEGER, offset INTEGER)')
+        return db
+
+    def update(self, db):
+        '''
+        Adds the records appended to the accounting file since the last update.
+        '''
+        st = os.stat(self.accountingPath)
+        # serializes concurrent updates, readers are not blocked
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            position = db.execute('SELECT inode, offset FROM position').fetchone() or (None, 0)
+            offset = position[1]
+            if position[0] != st.st_ino or st.st_size < offset:
+                # rotated, the records of the old file stay in the index
+                offset = 0
+            if st.st_size > offset:
+                offset = self._index(db, offset)
+                db.execute('DELETE FROM position')
+                db.execute('INSERT INTO position VALUES (?, ?)', (st.st_ino, offset))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    # orders records of the tasks of an array, the worst one is kept for the array
+    SEVERITY = "(CASE WHEN failed IN ('0', '') THEN 0 ELSE 1000000 END + CAST(exit_status AS INTEGER))"
+
+    @staticmethod
+    def severity(exitStatus, failed):
+        try:
+            exitStatus = int(exitStatus)
+        except ValueError:
+            exitStatus = 0
+        return (0 if failed in ('0', '') else 1000000) + exitStatus
+
+    def _index(self, db, offset):
+        records = []
+        arrays = {}
+        with open(self.accountingPath, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # record still being written
+                    break
+                offset += len(line)
+                if line.startswith(b'#'):
+                    continue
+                fields = line.decode('utf-8', 'replace').split(':')
+                if len(fields) < 13:
+                    continue
+                # job_number, exit_status, failed and end_time
+                record = (fields[5], fields[12], fields[11], fields[10])
+                if len(fields) > 35 and fields[35] not in ('0', ''):
+                    records.append((fields[5] + '.' + fields[35],) + record[1:])
+                    worst = arrays.get(fields[5])
+                    if worst is None or self.severity(record[1], record[2]) > self.severity(worst[1], worst[2]):
+                        arrays[fields[5]] = record
+                else:
+                    records.append(record)
+                if len(records) >= 10000:
+                    self._store(db, records, arrays)
+                    records = []
+                    arrays = {}
+        self._store(db, records, arrays)
+        return offset
+
+    def _store(self, db, records, arrays):
+        db.executemany('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)', records)
+        # the worst task of an array so far may be in the index already
+        arrays = list(arrays.values())
+        db.executemany('INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?)', arrays)
+        db.executemany('UPDATE jobs SET exit_status = ?, failed = ?, end_time = ? WHERE id = ? AND {} < ?'.format(self.SEVERITY),
+                       [(x[1], x[2], x[3], x[0], self.severity(x[1], x[2])) for x in arrays])
+
+    def lookup(self, idsOnCluster):
+        '''
+        Returns (exit_status, failed, end_time) of the jobs found in the accounting, keyed by job id.
+        '''
+        db = self._connect()
+        try:
+            self.update(db)
+            records = {}
+            for idOnCluster in idsOnCluster:
+                record = db.execute('SELECT exit_status, failed, end_time FROM jobs WHERE id = ?', (idOnCluster,)).fetchone()
+                if record:
+                    records[idOnCluster] = record
+        finally:
+            db.close()
+        return records
+
+    def getExitStatuses(self, idsOnCluster):
+        '''
+        Returns the exit status of each job as qacct reports it, UNKNOWNID for jobs not in the accounting.
+        '''
+        records = self.lookup(idsOnCluster)
+        return dict((x, records[x][0] if x in records else 'UNKNOWNID') for x in idsOnCluster)
+
 
 class SunGridEngineSiteCluster(SiteCluster):
 
+    ARRAY_INDEX_VARIABLE = 'SGE_TASK_ID'
+
     def __init__(self, use_argv=True):
         SiteCluster.__init__(self, use_argv=use_argv)
 
@@ -629,6 +2685,9 @@ class SunGridEngineSiteCluster(SiteCluster):
         # group option for submit doesn't exist in SGE
         if options.group:
             submitCmd += ['-A', options.group]
+        # job array of submit-batch
+        if getattr(options, 'array', None):
+            submitCmd += ['-t', '1-%d' % options.array]
         # custom arguments is an array 
         # TODO need to decide how to process arguments if duplicates are not allowed
         if options.customargs:
@@ -641,16 +2700,32 @@ class SunGridEngineSiteCluster(SiteCluster):
         submitCmd += cmdargs
         # perform the job submission
         res = ''
-        reAnsw = r'[Yy]our job[ ]+([0-9]+).*'
-        for s in [s for s in subprocess.check_output(submitCmd, universal_newlines=True).splitlines()]:
+        reAnsw = r'[Yy]our job(?:-array)?[ ]+([0-9]+).*'
+        for s in [s for s in checkSubmitOutput(submitCmd).splitlines()]:
             reMatch = re.match(reAnsw, s)
             if reMatch:
                 res = str(reMatch.group(1))
         return res
 
+    def arrayTaskId(self, arrayId, index):
+        return '{}.{}'.format(arrayId, index)
+
+    def __parseTaskList(self, taskList):
+        '''
+        Returns the task ids of an SGE task list like 1-10:2,12.
+        '''
+        taskIds = []
+        for part in [x for x in taskList.split(',') if x]:
+            reMatch = re.match(r'(\d+)(?:-(\d+)(?::(\d+))?)?$', part)
+            if reMatch:
+                first = int(reMatch.group(1))
+                taskIds.extend(range(first, int(reMatch.group(2) or first) + 1, int(reMatch.group(3) or 1)))
+        return taskIds
+
     def __getQacctStatus(self, idOnCluster):
-        cmdhist = ['qacct', '-j', idOnCluster]
-        answUnk = "job id %s not found" % idOnCluster
+        jobId, _, taskId = idOnCluster.partition('.')
+        cmdhist = ['qacct', '-j', jobId] + (['-t', taskId] if taskId else [])
+        answUnk = "job id %s not found" % jobId
         try:
             output = [s for s in subprocess.check_output(cmdhist, stderr=subprocess.STDOUT, universal_newlines=True).splitlines()]
         except CalledProcessError as err:
@@ -665,33 +2740,58 @@ class SunGridEngineSiteCluster(SiteCluster):
         return "UNKNOWNID" # not found
 
     def getJobStatus(self, idOnCluster, addStatus=False):
+        return self.getJobStatuses([idOnCluster], addStatus)[0]
+
+    def getJobStatuses(self, idsOnCluster, addStatus=False):
+        # one qstat listing answers all jobs still known to the scheduler
         cmd = ['qstat']
-        reAnsw = r'\s+{}\s+[\d\.]+\s+\S+\s+\S+\s+(\S+)\s+.*'.format(idOnCluster)
-        rstate = ''
+        reAnsw = r'\s*(\d+)\s+[\d\.]+\s+\S+\s+\S+\s+(\S+)\s+.*'
+        states = {}
         for s in [s for s in subprocess.check_output(cmd, universal_newlines=True).splitlines()]:
             reMatch = re.match(reAnsw, s)
             if reMatch:
-                rstate = reMatch.group(1)
-                break
-        jobStatus = 'PENDING'
-        if rstate == '':
-            jobStatus = 'RUNNING'
-            qacct_code = self.__getQacctStatus(str(idOnCluster))
-            if qacct_code == "UNKNOWNID":
-                return qacct_code
-            if qacct_code == '0':
-                if addStatus:
-                    jobStatus = 'COMPLETED 0'
-                else:
-                    jobStatus = 'COMPLETED'
+                states.setdefault(reMatch.group(1), reMatch.group(2))
+                # array jobs end with the ja-task-ID column after queue and slots, pending jobs have no queue
+                columns = s.split()[7:]
+                if columns and not columns[0].isdigit():
+                    columns = columns[1:]
+                for taskId in self.__parseTaskList(columns[1] if len(columns) > 1 else ''):
+                    states.setdefault('{}.{}'.format(reMatch.group(1), taskId), reMatch.group(2))
+
+        idsOnCluster = [str(x) for x in idsOnCluster]
+        finished = [x for x in idsOnCluster if x not in states]
+        accounting = {}
+        if finished:
+            index = SGEAccountingIndex()
+            if index.available():
+                accounting = index.getExitStatuses(finished)
             else:
-                if addStatus:
-                    jobStatus = 'COMPLETED ' + qacct_code # non-zero exit status
+                accounting = dict((x, self.__getQacctStatus(x)) for x in finished)
+
+        jobStatuses = []
+        for idOnCluster in idsOnCluster:
+            rstate = states.get(idOnCluster, '')
+            jobStatus = 'PENDING'
+            if rstate == '':
+                jobStatus = 'RUNNING'
+                qacct_code = accounting[idOnCluster]
+                if qacct_code == "UNKNOWNID":
+                    jobStatuses.append(qacct_code)
+                    continue
+                if qacct_code == '0':
+                    if addStatus:
+                        jobStatus = 'COMPLETED 0'
+                    else:
+                        jobStatus = 'COMPLETED'
                 else:
-                    jobStatus = 'COMPLETED'
-        elif rstate == 'r':
-            jobStatus = 'RUNNING'
-        return jobStatus
+                    if addStatus:
+                        jobStatus = 'COMPLETED ' + qacct_code # non-zero exit status
+                    else:
+                        jobStatus = 'COMPLETED'
+            elif rstate == 'r':
+                jobStatus = 'RUNNING'
+            jobStatuses.append(jobStatus)
+        return jobStatuses
 
     def killJob(self, idsOnCluster):
         cmd = ['qdel'] + [ str(x) for x in idsOnCluster ]
@@ -707,7 +2807,7 @@ class SunGridEngineSiteCluster(SiteCluster):
                     break
             if not res:
                 continue
-            reAnsw = r'(has registered the job\s+{}\s+for deletion)'.format(jobId)
+            reAnsw = r'(has registered the job(?:-array task)?\s+{}\s+for deletion)'.format(re.escape(str(jobId)))
             reMatch = re.search(reAnsw, res)
             if reMatch:
                 # job was already killed
@@ -720,29 +2820,51 @@ class SunGridEngineSiteCluster(SiteCluster):
             return 1
         return 0
 
-    def __getPEHosts(self):
-        if 'PE_HOSTFILE' in os.environ:
-            # host, slot number pairs
-            return os.environ['PE_HOSTFILE'].split(' ')
-        return None
+    ALLOCATION_VARIABLES = ('PE_HOSTFILE',)
 
-    def getNodeCount(self):
-        slots = self.__getPEHosts()
-        if slots:
-            return sum([int(y) for x, y in enumerate(slots) if x%2])
-        return 0
+    def readAllocation(self):
+        if 'PE_HOSTFILE' not in os.environ:
+            return []
+        # lines <host> <slots> <queue> <processor range>
+        with open(os.environ['PE_HOSTFILE']) as f:
+            return [(x.split()[0], int(x.split()[1])) for x in f if len(x.split()) > 1]
+
+    def getLaunchCommand(self, num, cmdargs):
+        return ['qrsh', '-inherit', self.getNodeHost(num)] + cmdargs
 
     def startNode(self, num, cmdargs):
-        slots = self.__getPEHosts()
-        if slots:
-            slots = sum([[slots[x]]*int(slots[x+1]) for x, _ in enumerate(slots) if x%2 != 1], [])
-        subprocess.check_call(['qrsh', '-inherit', slots[int(num)]] + cmdargs)
+        subprocess.check_call(self.getLaunchCommand(num, cmdargs))
+
+
+# compact squeue state codes of the state names reported by sacct
+SLURM_STATE_CODES = {
+    'BOOT_FAIL': 'BF', 'CANCELLED': 'CA', 'COMPLETED': 'CD', 'CONFIGURING': 'CF', 'COMPLETING': 'CG',
+    'DEADLINE': 'DL', 'FAILED': 'F', 'NODE_FAIL': 'NF', 'OUT_OF_MEMORY': 'OOM', 'PENDING': 'PD',
+    'PREEMPTED': 'PR', 'RUNNING': 'R', 'RESV_DEL_HOLD': 'RD', 'REQUEUE_FED': 'RF', 'REQUEUE_HOLD': 'RH',
+    'REQUEUED': 'RQ', 'RESIZING': 'RS', 'REVOKED': 'RV', 'SIGNALING': 'SI', 'SPECIAL_EXIT': 'SE',
+    'STAGE_OUT': 'SO', 'STOPPED': 'ST', 'SUSPENDED': 'S', 'TIMEOUT': 'TO',
+}
+
+# states in which a job stays forever
+SLURM_TERMINAL_STATES = ('BOOT_FAIL', 'CANCELLED', 'COMPLETED', 'DEADLINE', 'FAILED', 'NODE_FAIL',
+                         'OUT_OF_MEMORY', 'PREEMPTED', 'REVOKED', 'TIMEOUT')
 
 
 class SlurmSiteCluster(SiteCluster):
+
+    ARRAY_INDEX_VARIABLE = 'SLURM_ARRAY_TASK_ID'
     def __init__(self, use_argv=True, ignore_user=True):
         SiteCluster.__init__(self, use_argv=use_argv, ignore_user=ignore_user)
 
+    def readJobId(self):
+        '''
+        Returns the sitecluster id of the running job from SLURM_JOB_ID, or <arrayid>_<index>
+        from SLURM_ARRAY_JOB_ID and SLURM_ARRAY_TASK_ID within an array task.
+        '''
+        if os.environ.get('SLURM_ARRAY_JOB_ID') and os.environ.get('SLURM_ARRAY_TASK_ID'):
+            return '{}_{}'.format(os.environ['SLURM_ARRAY_JOB_ID'], os.environ['SLURM_ARRAY_TASK_ID'])
+        return os.environ['SLURM_JOB_ID']
+
     def getQueues(self):
         cmd = ['sinfo', '-s', '--noheader']
         reAnsw = r'\s*([a-zA-Z0-9_\.-]+)\*?'
@@ -757,7 +2879,7 @@ class SlurmSiteCluster(SiteCluster):
         #  sub job start within job
         if hasattr(options, 'startnode') and options.startnode:
             self.startNode(options.startnode, cmdargs)
-            return str(int(os.environ['PBS_JOBID']))
+            return self.readJobId()
 
         submitCmd = ['sbatch', '-v'] #, '-W', 'umask=022']
         # destination  queue of the job
@@ -802,6 +2924,9 @@ class SlurmSiteCluster(SiteCluster):
         # submit as specific user (typically only allowed for administrators)
         if not self.ignore_user and options.user:
             submitCmd += ['--uid', options.user]
+        # job array of submit-batch
+        if getattr(options, 'array', None):
+            submitCmd += ['--array=1-%d' % options.array]
 
         # custom arguments
         if options.customargs:
@@ -813,49 +2938,171 @@ class SlurmSiteCluster(SiteCluster):
             submitCmd += cmdargs
 
         # perform the job submission
-        for line in subprocess.check_output(submitCmd, universal_newlines=True).splitlines():
+        for line in checkSubmitOutput(submitCmd).splitlines():
             reMatch = re.match(r'Submitted batch job\s+([0-9]+).*', line.strip())
             if reMatch:
                 return reMatch.group(1)
         return ''
 
+    def getPackOptions(self, options, nodes):
+        # whole nodes, the tasks request their cpus as job steps
+        options = SiteCluster.getPackOptions(self, options, nodes)
+        options.threads = None
+        options.customargs = (options.customargs or []) + ['--exclusive']
+        return options
+
+    def getPackSlots(self, threads):
+        cpus = int(os.environ.get('SLURM_CPUS_ON_NODE') or 1)
+        return int(os.environ.get('SLURM_JOB_NUM_NODES') or 1) * max(1, cpus // threads)
+
+    def getPackTaskCommand(self, slot, threads, cmdargs):
+        # the controller places each step on free cpus of the allocation
+        return ['srun', '--exclusive', '--nodes=1', '--ntasks=1', '--cpus-per-task={}'.format(threads)] + cmdargs
+
     def getJobStatus(self, idOnCluster, addStatus=False):
-        import re, subprocess
-        cmd = ['squeue',  '--noheader', '-j', idOnCluster, '--Format=statecompact', ]
+        return self.getJobStatuses([idOnCluster], addStatus)[0]
+
+    def getJobStatuses(self, idsOnCluster, addStatus=False):
+        idsOnCluster = [str(x) for x in idsOnCluster]
+        # jobs with a cached terminal state do not need to be queried again
+        cached = StateFile('SlurmSiteCluster-acct.json').read()
+        jobStatuses = {}
+        for idOnCluster in idsOnCluster:
+            if idOnCluster in cached:
+                state, exitStatus = cached[idOnCluster][:2]
+                jobStatuses[idOnCluster] = self._slurmJobStatus(SLURM_STATE_CODES.get(state, ''), addStatus, exitStatus)
+        queried = [x for x in idsOnCluster if x not in jobStatuses]
+        if not queried:
+            return [jobStatuses[idOnCluster] for idOnCluster in idsOnCluster]
+
+        # --array lists pending array tasks one per line instead of as a range
+        cmd = ['squeue', '--noheader', '--array', '--states=all', '-j', ','.join(queried), '-o', '%i %t']
         try:
-            # stderr=subprocess.STDOUT redirection is needed for getting the "Unknown Job Id" in err.output
+            # stderr=subprocess.STDOUT redirection is needed for getting the "Invalid job id" in err.output
             output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True).splitlines()
         except CalledProcessError as err:
-            print(err.output, file=sys.stderr)
-            # TODO PBS CODES need to be updated for Slurm
-            if err.returncode == 153 or "Unknown Job Id" in err.output:
-                return "UNKNOWNID"
-            raise
+            # none of the jobs is known to the controller anymore
+            if "Invalid job id" in err.output:
+                output = []
+            else:
+                print(err.output, file=sys.stderr)
+                raise
 
-        reAnsw = r'\s*statecompact\s*:\s*([ABCDEFGHILMNOPQRSTV]+)'
-        rstate = ''
+        reAnsw = r'\s*(\S+)\s+([ABCDEFGHILMNOPQRSTV]+)'
+        states = {}
         for s in output:
             reMatch = re.match(reAnsw, s)
             if reMatch:
-                rstate = reMatch.group(1)
-                break
+                states[reMatch.group(1)] = reMatch.group(2)
+
+        finished = []
+        for idOnCluster in queried:
+            rstate = states.get(idOnCluster, '')
+            if rstate == '' or self._slurmJobStatus(rstate) == 'COMPLETED':
+                finished.append(idOnCluster)
+            else:
+                jobStatuses[idOnCluster] = self._slurmJobStatus(rstate, addStatus)
+
+        # finished jobs get their real exit status from the accounting
+        accounting = self.getAccountingStatuses(finished) if finished else {}
+        for idOnCluster in finished:
+            if accounting.get(idOnCluster):
+                state, exitStatus = accounting[idOnCluster]
+                jobStatuses[idOnCluster] = self._slurmJobStatus(SLURM_STATE_CODES.get(state, ''), addStatus, exitStatus)
+            elif idOnCluster in accounting or idOnCluster in states:
+                # no accounting available (yet), fall back to the queue state
+                jobStatuses[idOnCluster] = self._slurmJobStatus(states.get(idOnCluster, ''), addStatus)
+            else:
+                jobStatuses[idOnCluster] = 'UNKNOWNID'
+        return [jobStatuses[idOnCluster] for idOnCluster in idsOnCluster]
+
+    def getAccountingStatuses(self, idsOnCluster):
+        '''
+        Returns (state, exit status) of the jobs known to the Slurm accounting, keyed by job id.
+        Jobs are mapped to None when the accounting is not available. Terminal states never
+        change and are kept in an on-disk cache so every job is looked up with sacct only once.
+        '''
+        acctCache = StateFile('SlurmSiteCluster-acct.json')
+        cached = acctCache.read()
+        accounting = dict((x, tuple(cached[x][:2])) for x in idsOnCluster if x in cached)
+        missing = [x for x in idsOnCluster if x not in accounting]
+        if not missing:
+            return accounting
+
+        cmd = ['sacct', '--noheader', '--parsable2', '--allocations', '-j', ','.join(missing), '--format=JobID,State,ExitCode']
+        try:
+            output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True).splitlines()
+        except (CalledProcessError, OSError):
+            # e.g. "Slurm accounting storage is disabled" or sacct not installed
+            accounting.update((x, None) for x in missing)
+            return accounting
+
+        terminal = {}
+        for s in output:
+            fields = s.strip().split('|')
+            if len(fields) != 3 or fields[0] not in missing:
+                continue
+            # e.g. "CANCELLED by 1000"
+            state = fields[1].split()[0] if fields[1] else ''
+            exitStatus = self._slurmExitStatus(state, fields[2])
+            accounting[fields[0]] = (state, exitStatus)
+            if state in SLURM_TERMINAL_STATES:
+                terminal[fields[0]] = [state, exitStatus, time.time()]
+
+        if terminal:
+            acctCache.merge(terminal)
+        return accounting
+
+    def _slurmExitStatus(self, state, exitCode):
+        '''
+        Derives the exit status from the sacct ExitCode "<code>:<signal>" of a job.
+        '''
+        code, _, sig = exitCode.partition(':')
+        code = int(code) if code.isdigit() else 0
+        sig = int(sig) if sig.isdigit() else 0
+        if code:
+            return str(code)
+        if sig:
+            # same convention as the shell for processes terminated by a signal
+            return str(128 + sig)
+        if state in SLURM_TERMINAL_STATES and state != 'COMPLETED':
+            # e.g. cancelled before it started
+            return '1'
+        return '0'
+
+    def getActiveJobStates(self):
+        '''
+        Returns the status of all jobs which did not finish yet, keyed by job id.
+        '''
+        cmd = ['squeue', '--noheader', '--array', '-o', '%i %t']
+        reAnsw = r'\s*(\S+)\s+([ABCDEFGHILMNOPQRSTV]+)'
+        jobStatuses = {}
+        for s in subprocess.check_output(cmd, universal_newlines=True).splitlines():
+            reMatch = re.match(reAnsw, s)
+            if reMatch:
+                jobStatus = self._slurmJobStatus(reMatch.group(2))
+                if jobStatus != 'COMPLETED':
+                    jobStatuses[reMatch.group(1)] = jobStatus
+        return jobStatuses
+
+    def _slurmJobStatus(self, rstate, addStatus=False, exitStatus=None):
         jobStatus = 'COMPLETED'
-        exitStatus = '0'
         if rstate == '':
             jobStatus = 'COMPLETED'
         elif rstate in ['PD']:
             jobStatus = 'PENDING'
         elif rstate in ['R', 'SO', 'RS', 'CF', 'CG', 'SI', 'RQ'] :
             jobStatus = 'RUNNING'
-        elif rstate in ['RH', 'RF', 'S', 'RD']:
+        elif rstate in ['RH', 'RF', 'S', 'RD', 'ST']:
             jobStatus = 'SUSPENDED'
-        elif rstate == ['BF', 'CA', 'DL', 'F', 'NF', 'OOM', 'PR', 'TO', 'RQ', 'RV', 'SE', 'ST']:
+        elif rstate in ['BF', 'CA', 'DL', 'F', 'NF', 'OOM', 'PR', 'TO', 'RV', 'SE']:
             jobStatus = 'COMPLETED'
-            #TODO refine for all possible error states
-            exitStatus = 1
+            if exitStatus is None:
+                # the queue does not know the exit code of failed jobs
+                exitStatus = '1'
 
         if addStatus and jobStatus == 'COMPLETED':
-            jobStatus += ' ' + exitStatus
+            jobStatus += ' ' + (exitStatus or '0')
         return jobStatus
 
     def killJob(self, idsOnCluster):
@@ -866,19 +3113,508 @@ class SlurmSiteCluster(SiteCluster):
             return 1
         return 0
 
-    def getNodeCount(self):
-        cmd = ["sinfo", "-N", "-o", "%N", "--noheader"]
-        output = subprocess.check_output(cmd, universal_newlines=True)
-        nodes = set(output.splitlines())
-        return len(nodes)
+    ALLOCATION_VARIABLES = ('SLURM_JOB_NODELIST', 'SLURM_TASKS_PER_NODE')
+
+    def readAllocation(self):
+        try:
+            # installed next to sitecluster.py
+            import hostlist
+        except ImportError:  # pragma: no cover
+            hostlist = None
+        if hostlist:
+            hosts = list(hostlist.expand(os.environ['SLURM_JOB_NODELIST']))
+        else:
+            cmd = ['scontrol', 'show', 'hostnames', os.environ['SLURM_JOB_NODELIST']]
+            hosts = subprocess.check_output(cmd, universal_newlines=True).split()
+        # task counts per node as 2(x3),1
+        counts = []
+        for item in os.environ.get('SLURM_TASKS_PER_NODE', '').split(','):
+            match = re.match(r'^(\d+)(?:\(x(\d+)\))?$', item)
+            if match:
+                counts.extend([int(match.group(1))] * int(match.group(2) or 1))
+        if len(counts) != len(hosts):
+            counts = [1] * len(hosts)
+        return list(zip(hosts, counts))
+
+    def getLaunchCommand(self, num, cmdargs):
+        return ['srun', '-N1', '-n1', '-w', self.getNodeHost(num)] + cmdargs
+
+    def getSlurmVersion(self):
+        '''
+        Returns the version of srun as a tuple of numbers, as (17, 11, 8). SITE_CLUSTER_SLURM_VERSION
+        overrides the detection through srun --version.
+        '''
+        version = os.environ.get('SITE_CLUSTER_SLURM_VERSION')
+        if not version:
+            features = StateFile('SlurmSiteCluster-features.json')
+            version = features.read().get('version')
+            if version is None:
+                try:
+                    # "slurm 17.11.8"
+                    version = subprocess.check_output(['srun', '--version'], universal_newlines=True).split()[-1]
+                except (CalledProcessError, OSError, IndexError):
+                    version = '0'
+                features.update(lambda data: data.update({'version': version}))
+        return tuple(int(x) for x in re.findall(r'\d+', version)[:3])
+
+    def getAgentLaunchCommand(self, num, cmdargs):
+        # the agent step shares the whole node with the other steps of the allocation
+        if self.getSlurmVersion() >= (20, 11):
+            sharing = ['--overlap', '--whole', '--cpu-bind=none']
+        else:
+            # steps share the cpus of the allocation before 20.11, --mem=0 keeps the memory of the node for them
+            sharing = ['--mem=0', '--oversubscribe', '--cpu_bind=none']
+        return ['srun', '-N1', '-n1', '-w', self.getNodeHost(num)] + sharing + cmdargs
 
     def startNode(self, num, cmdargs):
-        # TODO check if this is correct way to do this
-        subprocess.check_call(['srun', '-N1', str(int(num))] + cmdargs)
+        subprocess.check_call(self.getLaunchCommand(num, cmdargs))
+
+
+def iterJsonMembers(stream, key, chunkSize=65536):
+    '''
+    Yields the (name, value) members of the object stored under key in the top level
+    JSON object read from stream, decoding one member at a time. Raises ValueError
+    if the stream does not contain a JSON object.
+    '''
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    # depth 0 are the members of the top level object, depth 1 the members under key
+    depth = 0
+    expect = 'open'
+    name = None
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos < len(buf):
+            c = buf[pos]
+            if expect == 'open':
+                if c != '{':
+                    raise ValueError('expected a JSON object at {}'.format(pos))
+                pos += 1
+                expect = 'name'
+                continue
+            if expect == 'name' and c == '}':
+                return
+            if expect == 'name' and c == ',':
+                pos += 1
+                continue
+            if expect == 'colon':
+                if c != ':':
+                    raise ValueError('expected a colon at {}'.format(pos))
+                pos += 1
+                expect = 'value'
+                continue
+            if expect == 'value' and depth == 0 and name == key:
+                depth = 1
+                expect = 'open'
+                continue
+            try:
+                decoded, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            # a number at the end of the buffer may continue in the next chunk
+            if end is not None and (end < len(buf) or eof):
+                pos = end
+                if expect == 'name':
+                    name = decoded
+                    expect = 'colon'
+                else:
+                    if depth == 1:
+                        yield name, decoded
+                    expect = 'name'
+                    # drop the decoded part to keep memory flat
+                    buf = buf[pos:]
+                    pos = 0
+                continue
+        if eof:
+            raise ValueError('truncated JSON object')
+        chunk = stream.read(chunkSize)
+        if not chunk:
+            eof = True
+        buf += chunk
+
+
+def memoryInMegabytes(memory):
+    '''
+    Converts a memory size with an optional K, M, G or T suffix to megabytes, megabytes being the default unit.
+    '''
+    reMatch = re.match(r'\s*([0-9.]+)\s*([KkMmGgTt]?)[Bb]?\s*$', str(memory))
+    if not reMatch:
+        raise ValueError('invalid memory size {}'.format(memory))
+    factor = {'K': 1.0 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}[reMatch.group(2).upper() or 'M']
+    return int(float(reMatch.group(1)) * factor + 0.5)
+
+
+class HTTPConnectionPool(object):
+    '''
+    Keep-alive HTTP connections to one server, shared by all threads of the process.
+    The url is either http[s]://host[:port] or unix:///path/to/socket.
+    '''
+    def __init__(self, url, size=8, timeout=60):
+        # only this backend needs http, the other commands start without importing it
+        try:
+            import http.client as httplib
+            from urllib.parse import urlparse
+        except ImportError:  # pragma: no cover
+            import httplib
+            from urlparse import urlparse
+        self.httplib = httplib
+        self.url = urlparse(url)
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.url.scheme == 'https':
+            return self.httplib.HTTPSConnection(self.url.netloc, timeout=self.timeout)
+        if self.url.scheme != 'unix':
+            return self.httplib.HTTPConnection(self.url.netloc, timeout=self.timeout)
+        conn = self.httplib.HTTPConnection('localhost', timeout=self.timeout)
+
+        def connect():
+            conn.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.sock.settimeout(self.timeout)
+            conn.sock.connect(self.url.path)
+        conn.connect = connect
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        '''
+        Returns the status and the body of the response.
+        '''
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        # a pooled connection may have been closed by the server meanwhile, retry once on a new one
+        for attempt in range(2):
+            if conn is None:
+                conn = self._connect()
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (self.httplib.HTTPException, socket.error):
+                conn.close()
+                conn = None
+                if attempt:
+                    raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        return (response.status, data)
+
+
+class SlurmRestSiteCluster(SlurmSiteCluster):
+    """Sitecluster talking to the slurmrestd JSON API instead of forking the Slurm commands
+
+    Configured through SLURM_RESTD_URL (http[s]://host:port or unix:///path), SLURM_JWT,
+    SLURM_RESTD_USER, SLURM_RESTD_API (API version) and SLURM_RESTD_POOL_SIZE.
+    """
+
+    def __init__(self, use_argv=True, ignore_user=True):
+        self.pool = HTTPConnectionPool(os.environ.get('SLURM_RESTD_URL', 'http://localhost:6820'),
+                                       size=int(os.environ.get('SLURM_RESTD_POOL_SIZE') or 8))
+        self.apiVersion = os.environ.get('SLURM_RESTD_API', 'v0.0.39')
+        SlurmSiteCluster.__init__(self, use_argv=use_argv, ignore_user=ignore_user)
+
+    def _call(self, method, path, payload=None, allowErrors=False):
+        headers = {'Accept': 'application/json'}
+        if 'SLURM_JWT' in os.environ:
+            headers['X-SLURM-USER-TOKEN'] = os.environ['SLURM_JWT']
+            headers['X-SLURM-USER-NAME'] = os.environ.get('SLURM_RESTD_USER') or os.environ.get('USER', '')
+        body = None
+        if payload is not None:
+            body = json.dumps(payload)
+            headers['Content-Type'] = 'application/json'
+        status, data = self.pool.request(method, path.format(version=self.apiVersion), body, headers)
+        try:
+            answer = json.loads(data.decode('utf-8')) if data else {}
+        except ValueError:
+            answer = {'errors': [{'error': data.decode('utf-8', 'replace')}]}
+        if (status >= 400 or answer.get('errors')) and not allowErrors:
+            raise RuntimeError('slurmrestd {} {} failed with status {}: {}'.format(
+                method, path.format(version=self.apiVersion), status, json.dumps(answer.get('errors', []))))
+        return answer
+
+    def getQueues(self):
+        return [partition['name'] for partition in self._call('GET', '/slurm/{version}/partitions').get('partitions', [])]
+
+    def getPackOptions(self, options, nodes):
+        # custom arguments like --exclusive do not apply to slurmrestd
+        options = SiteCluster.getPackOptions(self, options, nodes)
+        options.threads = None
+        return options
+
+    def submitJob(self, options, cmdargs):
+        #  sub job start within job
+        if hasattr(options, 'startnode') and options.startnode:
+            self.startNode(options.startnode, cmdargs)
+            return self.readJobId()
+
+        cwd = os.getcwd()
+        job = {
+            'name': options.jobname or (cmdargs[0] if cmdargs else 'sitecluster'),
+            'current_working_directory': cwd,
+            'standard_output': os.path.join(cwd, 'slurm-%j.out'),
+            # same as sbatch which exports the environment of the submitter
+            'environment': ['{}={}'.format(k, v) for k, v in os.environ.items()],
+        }
+        if options.queue:
+            job['partition'] = options.queue
+        if options.nodes:
+            job['minimum_nodes'] = options.nodes
+        if options.threads:
+            job['cpus_per_task'] = options.threads
+        if options.memory:
+            job['memory_per_node'] = self._restNumber(memoryInMegabytes(options.memory))
+        if options.email:
+            job['mail_user'] = options.email
+            # the events of sbatch --mail-type=ALL, flag lists since v0.0.39
+            job['mail_type'] = ['BEGIN', 'END', 'FAIL', 'REQUEUE', 'STAGE_OUT', 'INVALID_DEPENDENCY'] if self._apiVersionAtLeast(39) else 'ALL'
+        if options.after:
+            afterJobs = eval(options.after)
+            if afterJobs != []:
+                job['dependency'] = 'after:%s' % ":".join(afterJobs)
+        # job array of submit-batch
+        if getattr(options, 'array', None):
+            job['array'] = '1-%d' % options.array
+        for name in ['attime', 'endtime', 'customargs']:
+            if getattr(options, name, None):
+                print('WARNING: --{} is not supported by the slurmrestd backend and ignored'.format(name), file=sys.stderr)
+
+        script = '#!/bin/bash\nexec {}\n'.format(' '.join(quote(x) for x in cmdargs or ['true']))
+        answer = self._call('POST', '/slurm/{version}/job/submit', {'job': job, 'script': script})
+        return str(answer.get('job_id', ''))
+
+    def getJobStatuses(self, idsOnCluster, addStatus=False):
+        idsOnCluster = [str(x) for x in idsOnCluster]
+        # one listing of the controller answers all active jobs
+        states = {}
+        for job in self._call('GET', '/slurm/{version}/jobs').get('jobs', []):
+            states[self._restJobId(job)] = job
+
+        jobStatuses = []
+        for idOnCluster in idsOnCluster:
+            job = states.get(idOnCluster)
+            if job is None:
+                jobStatuses.append(None)
+                continue
+            state = self._restValue(job.get('job_state'))
+            exitStatus = self._slurmExitStatus(state, self._restExitCode(job.get('exit_code')))
+            jobStatuses.append(self._slurmJobStatus(SLURM_STATE_CODES.get(state, ''), addStatus, exitStatus))
+
+        # jobs purged from the controller are looked up in the accounting
+        purged = [x for x, y in zip(idsOnCluster, jobStatuses) if y is None]
+        accounting = self.getAccountingStatuses(purged) if purged else {}
+        for i, idOnCluster in enumerate(idsOnCluster):
+            if jobStatuses[i] is not None:
+                continue
+            if accounting.get(idOnCluster):
+                state, exitStatus = accounting[idOnCluster]
+                jobStatuses[i] = self._slurmJobStatus(SLURM_STATE_CODES.get(state, ''), addStatus, exitStatus)
+            elif idOnCluster in accounting:
+                # no accounting available, same as a job which left squeue
+                jobStatuses[i] = self._slurmJobStatus('', addStatus)
+            else:
+                jobStatuses[i] = 'UNKNOWNID'
+        return jobStatuses
+
+    def getActiveJobStates(self):
+        jobStatuses = {}
+        for job in self._call('GET', '/slurm/{version}/jobs').get('jobs', []):
+            jobStatus = self._slurmJobStatus(SLURM_STATE_CODES.get(self._restValue(job.get('job_state')), ''))
+            if jobStatus != 'COMPLETED':
+                jobStatuses[self._restJobId(job)] = jobStatus
+        return jobStatuses
+
+    def getAccountingStatuses(self, idsOnCluster):
+        acctCache = StateFile('SlurmSiteCluster-acct.json')
+        cached = acctCache.read()
+        accounting = dict((x, tuple(cached[x][:2])) for x in idsOnCluster if x in cached)
+        missing = [x for x in idsOnCluster if x not in accounting]
+        if not missing:
+            return accounting
+
+        # one query for all jobs, the step filter selects jobs and array tasks like sacct -j
+        answer = self._call('GET', '/slurmdb/{version}/jobs?step=' + ','.join(missing), allowErrors=True)
+        jobs = answer.get('jobs')
+        if jobs is None:
+            # slurmdbd is not configured
+            accounting.update((x, None) for x in missing)
+            return accounting
+        terminal = {}
+        for job in jobs:
+            idOnCluster = self._restAccountingJobId(job)
+            if idOnCluster not in missing:
+                continue
+            state = self._restValue(job.get('state', {}).get('current'))
+            exitStatus = self._slurmExitStatus(state, self._restExitCode(job.get('exit_code')))
+            accounting[idOnCluster] = (state, exitStatus)
+            if state in SLURM_TERMINAL_STATES:
+                terminal[idOnCluster] = [state, exitStatus, time.time()]
+        if terminal:
+            acctCache.merge(terminal)
+        return accounting
+
+    def killJob(self, idsOnCluster):
+        res = 0
+        for idOnCluster in idsOnCluster:
+            answer = self._call('DELETE', '/slurm/{version}/job/' + str(idOnCluster), allowErrors=True)
+            for error in answer.get('errors', []):
+                # same as scancel, finished jobs are not an error
+                if 'already' not in str(error.get('error', '')).lower():
+                    res = 1
+        return res
+
+    def _restValue(self, value):
+        # newer API versions report flags and states as lists and numbers as {"set": .., "number": ..}
+        if isinstance(value, list):
+            return value[0] if value else ''
+        if isinstance(value, dict):
+            return value.get('number', 0)
+        return value if value is not None else ''
+
+    def _apiVersionAtLeast(self, minor):
+        return int(re.sub(r'\D', '', self.apiVersion.rsplit('.', 1)[-1]) or 0) >= minor
+
+    def _restNumber(self, number):
+        # since v0.0.39 numbers which may be unset or infinite are sent as {"set", "infinite", "number"}
+        if self._apiVersionAtLeast(39):
+            return {'set': True, 'infinite': False, 'number': number}
+        return number
+
+    def _restAccountingJobId(self, job):
+        # array tasks of slurmdbd, task_id of other jobs is unset
+        array = job.get('array') or {}
+        taskId = array.get('task_id')
+        if self._restValue(array.get('job_id')) and taskId not in (None, '') and (not isinstance(taskId, dict) or taskId.get('set')):
+            return '{}_{}'.format(self._restValue(array['job_id']), self._restValue(taskId))
+        return str(self._restValue(job.get('job_id')))
+
+    def _restJobId(self, job):
+        if self._restValue(job.get('array_job_id')) and job.get('array_task_id') is not None:
+            return '{}_{}'.format(self._restValue(job['array_job_id']), self._restValue(job['array_task_id']))
+        return str(self._restValue(job.get('job_id')))
+
+    def _restExitCode(self, exitCode):
+        '''
+        Converts the exit code of the API versions to the "<code>:<signal>" notation of sacct.
+        '''
+        if isinstance(exitCode, dict):
+            sig = exitCode.get('signal', {})
+            sig = sig.get('id', sig.get('signal_id', 0)) if isinstance(sig, dict) else sig
+            return '{}:{}'.format(self._restValue(exitCode.get('return_code', 0)), self._restValue(sig) or 0)
+        return '{}:0'.format(exitCode or 0)
+
+
+def readProcStat(pid):
+    '''
+    Returns the (state, start time in clock ticks since boot) of a process from /proc,
+    or None if there is no such process.
+    '''
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            stat = f.read()
+    except (IOError, OSError):
+        return None
+    # the command name in parentheses may contain spaces
+    fields = stat[stat.rindex(')') + 2:].split()
+    return (fields[0], int(fields[19]))
+
+
+def parseCpuList(cpuList):
+    '''
+    Returns the cpu numbers of a kernel cpu list like 0-3,8-11.
+    '''
+    cpus = []
+    for part in cpuList.strip().split(','):
+        if part:
+            first, _, last = part.partition('-')
+            cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+class AffinityPlanner(object):
+    '''
+    Plans disjoint cpu sets for local jobs from the host topology in sysfs.
+
+    The topology is read below SITE_CLUSTER_SYSFS, /sys by default, so a fake tree
+    can stand in for the host. A job gets its cpus from a single NUMA node when one
+    has enough free cpus, choosing the node with the fewest free cpus that fits to
+    keep whole nodes available for larger jobs.
+    '''
+    def __init__(self, root=None):
+        self.root = root or os.environ.get('SITE_CLUSTER_SYSFS') or '/sys'
+
+    def readCpuList(self, path):
+        try:
+            with open(os.path.join(self.root, path)) as f:
+                return parseCpuList(f.read())
+        except (IOError, OSError):
+            return None
+
+    def getNodes(self):
+        '''
+        Returns the online cpus of each NUMA node, a single node with all online cpus without NUMA support.
+        '''
+        online = self.readCpuList('devices/system/cpu/online') or []
+        if self.root == '/sys' and hasattr(os, 'sched_getaffinity'):
+            # stay within the cpus this process may use, e.g. inside a cgroup
+            allowed = os.sched_getaffinity(0)
+            online = [x for x in online if x in allowed]
+        nodes = {}
+        nodeDirectory = os.path.join(self.root, 'devices/system/node')
+        names = os.listdir(nodeDirectory) if os.path.isdir(nodeDirectory) else []
+        for name in names:
+            if re.match(r'node\d+$', name):
+                cpus = [x for x in self.readCpuList(os.path.join('devices/system/node', name, 'cpulist')) or [] if x in online]
+                if cpus:
+                    nodes[int(name[4:])] = cpus
+        if not nodes and online:
+            nodes[0] = online
+        return nodes
+
+    def plan(self, threads, usedCpus=()):
+        '''
+        Returns a sorted list of threads free cpus, or None when not enough cpus are free.
+        '''
+        used = set(usedCpus)
+        free = dict((node, [x for x in cpus if x not in used]) for node, cpus in self.getNodes().items())
+        fitting = [node for node in free if len(free[node]) >= threads]
+        if fitting:
+            node = min(fitting, key=lambda x: (len(free[x]), x))
+            return free[node][:threads]
+        # spread over as few nodes as possible, largest free node first
+        cpus = []
+        for node in sorted(free, key=lambda x: (-len(free[x]), x)):
+            cpus.extend(free[node][:threads - len(cpus)])
+        if len(cpus) < threads:
+            return None
+        return sorted(cpus)
 
 
 class ProcessSiteCluster(SiteCluster):
-    """Sitecluster uses normal process execution on local host"""
+    """
+    Sitecluster uses normal process execution on local host.
+
+    Submitted jobs are queued in ProcessSiteCluster-queue.json and started once the cores
+    and memory requested through --threads and --memory are free and the jobs listed in
+    --after have ended. The host size is taken from SITE_CLUSTER_LOCAL_CORES and
+    SITE_CLUSTER_LOCAL_MEMORY or else detected. A scheduling pass runs on submit, on
+    status and whenever a job ends. Started jobs are pinned to the cpus planned by the
+    AffinityPlanner unless SITE_CLUSTER_LOCAL_AFFINITY is 0.
+    """
 
     def __init__(self, use_argv=True, ignore_user=True):
         SiteCluster.__init__(self, use_argv=use_argv, ignore_user=ignore_user)
@@ -887,58 +3623,316 @@ class ProcessSiteCluster(SiteCluster):
         """Return a dummy queue name: run_local_process"""
         return ["run_local_process"]
 
-    def submitJob(self, options, cmdargs):
-        """Submit implementated as standard process launch: returning pid of new process"""
-        dir=os.getcwd()
-        with tempfile.NamedTemporaryFile(dir=dir) as out, tempfile.NamedTemporaryFile(dir=dir) as err:
-            proc = subprocess.Popen(cmdargs, stdout=out, stderr=err, preexec_fn=os.setpgrp, close_fds=True)
-            stdout_f = "stdout.{}.txt".format(proc.pid)
-            os.link(out.name, stdout_f)
-            stderr_f = "stderr.{}.txt".format(proc.pid)
-            os.link(err.name, stderr_f)
-            os.chmod(stdout_f, os.stat(stdout_f).st_mode | stat.S_IRGRP | stat.S_IROTH )
-            os.chmod(stderr_f, os.stat(stderr_f).st_mode | stat.S_IRGRP | stat.S_IROTH )
-        return proc.pid
+    def jobsDirectory(self):
+        """Return the directory holding one record per job written by its supervisor"""
+        directory = os.path.join(cacheDirectory(), 'ProcessSiteCluster-jobs')
+        if not os.path.isdir(directory):
+            try:
+                os.mkdir(directory, 0o700)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        return directory
+
+    def jobRecord(self, idOnCluster):
+        return StateFile('{}.json'.format(idOnCluster), self.jobsDirectory())
+
+    def jobQueue(self):
+        return StateFile('ProcessSiteCluster-queue.json')
+
+    def getLocalResources(self):
+        """Return the number of cores and megabytes of memory jobs may use on this host"""
+        cores = os.environ.get('SITE_CLUSTER_LOCAL_CORES')
+        if cores:
+            cores = int(cores)
+        elif hasattr(os, 'sched_getaffinity'):
+            cores = len(os.sched_getaffinity(0))
+        else:
+            cores = os.sysconf('SC_NPROCESSORS_ONLN')
+        memory = os.environ.get('SITE_CLUSTER_LOCAL_MEMORY')
+        if memory:
+            memory = memoryInMegabytes(memory)
+        else:
+            memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+        return (cores, memory)
 
-    def getJobStatus(self, idOnCluster, addStatus=False):
-        """Return status of process exit state always 0 as we cannot know that for terminated process"""
-        cmd = ['ps', '--no-headers', '-o', 'pid,state', '--pid', str(idOnCluster) ]
+    def submitJob(self, options, cmdargs):
+        """Submit implementated as a queued process launch: returning the id of the new job"""
+        if not cmdargs:
+            raise ValueError('ERROR: no command to submit')
+        job = {
+            'cmdargs': cmdargs,
+            'cwd': os.getcwd(),
+            # the job runs with the environment of the submitter like qsub -V
+            'env': dict(os.environ),
+            'threads': options.threads or 1,
+            'memory': memoryInMegabytes(options.memory) if options.memory else 0,
+            'after': [],
+            'submit_time': time.time(),
+        }
+        if options.after:
+            afterJobs = eval(options.after)
+            if afterJobs != []:
+                job['after'] = [str(x) for x in afterJobs]
+
+        def enqueue(data):
+            # ids count up from the submit time in milliseconds, so an id is not issued again
+            # after the cache directory was cleaned and its counter lost
+            jobId = str(max(data.get('next', 0), int(time.time() * 1000)))
+            data['next'] = int(jobId) + 1
+            data.setdefault('pending', {})[jobId] = job
+            job['id'] = jobId
+        self.jobQueue().update(enqueue)
+        self.schedule()
+        self.pruneJobRecords()
+        return job['id']
+
+    # seconds a job taken from the queue by a scheduling pass may take until its record is written
+    START_TIMEOUT = 60
+
+    def hasEnded(self, jobId, job):
+        """Return whether the running job of the queue has ended, a job still being started by a scheduling pass has not"""
+        state = self.getSupervisedJobState(jobId)[0]
+        if state == 'UNKNOWNID' and time.time() - job.get('start_time', 0) < self.START_TIMEOUT:
+            return False
+        return state in ['COMPLETED', 'UNKNOWNID']
+
+    def schedule(self):
+        """
+        Starts the pending jobs which fit into the free cores and memory in submission order,
+        letting smaller jobs pass a job that does not fit yet. Returns the ids of the jobs still
+        pending, including the jobs other scheduling passes are starting.
+
+        A pass without pending or ended jobs only reads the queue. Otherwise the queue is updated
+        under its lock, rewritten only if it changed, and the jobs are started after releasing it.
+        """
+        queue = self.jobQueue()
+        data = queue.read()
+        running = data.get('running', {})
+        if not data.get('pending') and not [x for x in running if self.hasEnded(x, running[x])]:
+            return set(x for x in running if not os.path.exists(self.jobRecord(x).path))
+        launches = []
+        with queue.lock():
+            data = queue.read()
+            unchanged = json.dumps(data, sort_keys=True)
+            pending = data.setdefault('pending', {})
+            running = data.setdefault('running', {})
+            for jobId in list(running):
+                if self.hasEnded(jobId, running[jobId]):
+                    del running[jobId]
+            if pending:
+                cores, memory = self.getLocalResources()
+                usedCores = sum(job['threads'] for job in running.values())
+                usedMemory = sum(job['memory'] for job in running.values())
+                usedCpus = set(x for job in running.values() for x in job.get('cpus') or [])
+                planner = AffinityPlanner() if os.environ.get('SITE_CLUSTER_LOCAL_AFFINITY', '1') != '0' else None
+                for jobId in sorted(pending, key=int):
+                    job = pending[jobId]
+                    if [x for x in job['after'] if x in pending or x in running]:
+                        continue
+                    # a job larger than the host runs once it is alone
+                    if running and (usedCores + job['threads'] > cores or usedMemory + job['memory'] > memory):
+                        continue
+                    job['cpus'] = planner.plan(job['threads'], usedCpus) if planner else None
+                    launches.append((jobId, job))
+                    del pending[jobId]
+                    running[jobId] = {'threads': job['threads'], 'memory': job['memory'], 'cpus': job['cpus'], 'start_time': time.time()}
+                    usedCpus.update(job['cpus'] or [])
+                    usedCores += job['threads']
+                    usedMemory += job['memory']
+            if json.dumps(data, sort_keys=True) != unchanged:
+                queue.write(data)
+            starting = set(x for x in running if not os.path.exists(self.jobRecord(x).path))
+        for jobId, job in launches:
+            self.launchJob(jobId, job)
+        return set(pending) | (starting - set(x[0] for x in launches))
+
+    def launchJob(self, jobId, job):
+        """Starts the queued job with its output in stdout.<id>.txt and stderr.<id>.txt of its submit directory"""
+        if self.jobRecord(jobId).read():
+            # killed after the scheduling pass took it from the queue
+            return
+        outputs = []
+        for name in ['stdout', 'stderr']:
+            path = os.path.join(job['cwd'], '{}.{}.txt'.format(name, jobId))
+            outputs.append(open(path, 'wb'))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IRGRP | stat.S_IROTH)
         try:
-            # stderr=subprocess.STDOUT redirection is needed for getting the "Unknown Job Id" in err.output
-            output = [s for s in subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True).splitlines()]
-        except CalledProcessError as err:
-            # process is terminated already
-            output = err.output
-
-        reAnsw = r'\s*{}\s*([DRSTtWXZ])'.format(idOnCluster)
-        rstate = ''
-        for s in output:
-            reMatch = re.match(reAnsw, s)
-            if reMatch:
-                rstate = reMatch.group(1)
-                break
-        jobStatus = 'COMPLETED'
-        exitStatus = '0'
-        if rstate == '':
-            jobStatus = 'COMPLETED'
-        elif rstate in ['D', 'R', 'S'] :
-            jobStatus = 'RUNNING'
-        elif rstate in ['T', 't', 'Z']:
-            jobStatus = 'SUSPENDED'
-        elif rstate == ['X']:
-            jobStatus = 'COMPLETED'
-            exitStatus = 1
+            self.launchSupervised(jobId, job, outputs[0], outputs[1])
+        except OSError as e:
+            # report the failed start as a job which could not execute its command
+            outputs[1].write('{}\n'.format(e).encode('utf-8'))
+            self.jobRecord(jobId).write({'pid': None, 'start_time': time.time(), 'exit_code': 127, 'rusage': None})
+        finally:
+            for output in outputs:
+                output.close()
+
+    def launchSupervised(self, jobId, job, out, err):
+        """
+        Starts the job under a detached supervisor process which waits for it and records
+        its exit code and resource usage. Returns the pid of the started process.
+        """
+        # the supervisor is a new interpreter running the supervise command and not a fork,
+        # forking a process with threads like serve may leave its locks held in the child
+        env = dict((k, v) for k, v in os.environ.items() if not k.startswith('SITE_CLUSTER_USE_'))
+        env['SITE_CLUSTER_USE_SUBPROCESS'] = '1'
+        readFd, writeFd = os.pipe()
+        try:
+            try:
+                supervisor = subprocess.Popen(['/usr/bin/env', 'python3', os.path.abspath(__file__), 'supervise', str(jobId), str(writeFd)],
+                                              stdin=subprocess.PIPE, stdout=out, stderr=err, env=env,
+                                              pass_fds=[writeFd], start_new_session=True)
+            finally:
+                os.close(writeFd)
+            with supervisor.stdin:
+                supervisor.stdin.write(json.dumps({'job': job, 'jobs_directory': self.jobsDirectory()}).encode('utf-8'))
+        except Exception:
+            os.close(readFd)
+            raise
+        with os.fdopen(readFd) as f:
+            answer = f.read()
+        # the supervisor continues in a child of its own, reaped by init and never a zombie of this process
+        supervisor.wait()
+        if not answer.isdigit():
+            raise OSError('ERROR: failed to start {}: {}'.format(' '.join(job['cmdargs']), answer.strip() or 'supervisor failed'))
+        return int(answer)
+
+    def supervise(self):
+        '''
+        Runs the supervisor of a job started by launchSupervised: reads the job from stdin, starts it
+        with the stdout and stderr of the supervisor, writes its pid or the error to the descriptor
+        <fd>, waits for it and records its exit status.
+        '''
+        jobId, notifyFd = self.argv[2], int(self.argv[3])
+        spec = json.load(sys.stdin)
+        # this new interpreter has no threads yet, the fork is safe
+        if os.fork() != 0:
+            os._exit(0)
+        job = spec['job']
+        cpus = job.get('cpus')
+
+        def prepareJob():
+            os.setpgrp()
+            if cpus and hasattr(os, 'sched_setaffinity'):
+                try:
+                    os.sched_setaffinity(0, cpus)
+                except OSError:
+                    # the planned cpus went offline, run unpinned
+                    pass
+        try:
+            proc = subprocess.Popen(job['cmdargs'], stdout=sys.stdout.fileno(), stderr=sys.stderr.fileno(), cwd=job['cwd'],
+                                    env=job['env'], preexec_fn=prepareJob, close_fds=True)
+        except OSError as e:
+            os.write(notifyFd, str(e).encode('utf-8'))
+            sys.exit(1)
+        procStat = readProcStat(proc.pid)
+        record = StateFile('{}.json'.format(jobId), spec['jobs_directory'])
+        state = {'pid': proc.pid, 'start_time': time.time(), 'start_ticks': procStat[1] if procStat else None,
+                 'supervisor': os.getpid(), 'supervisor_ticks': readProcStat(os.getpid())[1],
+                 'cpus': cpus, 'exit_code': None, 'rusage': None}
+        record.write(state)
+        # detach from the streams of the submitting sitecluster so its caller sees them closed
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(devnull, fd)
+        os.write(notifyFd, str(proc.pid).encode('utf-8'))
+        os.close(notifyFd)
+
+        _, waitStatus, rusage = os.wait4(proc.pid, 0)
+        if os.WIFSIGNALED(waitStatus):
+            state['exit_code'] = 128 + os.WTERMSIG(waitStatus)
+        else:
+            state['exit_code'] = os.WEXITSTATUS(waitStatus)
+        state['end_time'] = time.time()
+        state['rusage'] = {'utime': rusage.ru_utime, 'stime': rusage.ru_stime, 'maxrss': rusage.ru_maxrss}
+        record.write(state)
+        # the freed cores may admit pending jobs
+        self.schedule()
+
+    def pruneJobRecords(self, maxAge=7 * 24 * 3600):
+        """Remove the records of jobs which ended more than maxAge seconds ago"""
+        expired = time.time() - maxAge
+        jobsDirectory = self.jobsDirectory()
+        for name in os.listdir(jobsDirectory):
+            path = os.path.join(jobsDirectory, name)
+            if name.endswith('.json') and os.path.getmtime(path) < expired:
+                job = StateFile(name, jobsDirectory).read()
+                if job.get('exit_code') is not None:
+                    os.unlink(path)
+
+    def isJobProcess(self, job, procStat):
+        """Return whether the running process procStat is the one recorded in job and not a reused pid"""
+        return procStat is not None and job.get('start_ticks') is not None and job['start_ticks'] == procStat[1]
+
+    def getSupervisedJobState(self, idOnCluster):
+        """Return the (state, exit status) of a started job from its record and /proc"""
+        job = self.jobRecord(idOnCluster).read()
+        exitStatus = job.get('exit_code')
+        if exitStatus is not None:
+            return ('COMPLETED', exitStatus)
+        if not job:
+            # never issued, pruned or its record removed, the id is no pid to look up
+            return ('UNKNOWNID', None)
+        procStat = readProcStat(job['pid'])
+        if self.isJobProcess(job, procStat):
+            # a zombie is about to be reaped by the supervisor
+            return ('SUSPENDED' if procStat[0] in ['T', 't'] else 'RUNNING', None)
+        if self.isJobProcess({'start_ticks': job.get('supervisor_ticks')}, readProcStat(job.get('supervisor'))):
+            # the supervisor is writing the exit status
+            return ('RUNNING', None)
+        # the supervisor died without recording the exit status
+        return ('COMPLETED', None)
 
-        if addStatus and jobStatus == 'COMPLETED':
-            jobStatus += ' ' + exitStatus
-        return jobStatus
+    def getJobStatus(self, idOnCluster, addStatus=False):
+        """Return status of a job"""
+        return self.getJobStatuses([idOnCluster], addStatus)[0]
+
+    def getJobStatuses(self, idsOnCluster, addStatus=False):
+        """Return status of all jobs in idsOnCluster from the queue, their records and /proc without spawning processes"""
+        pending = self.schedule()
+        jobStatuses = []
+        for idOnCluster in [str(x) for x in idsOnCluster]:
+            if idOnCluster in pending:
+                jobStatuses.append('PENDING')
+                continue
+            jobStatus, exitStatus = self.getSupervisedJobState(idOnCluster)
+            if addStatus and jobStatus == 'COMPLETED' and exitStatus is not None:
+                jobStatus += ' ' + str(exitStatus)
+            jobStatuses.append(jobStatus)
+        return jobStatuses
 
     def killJob(self, idsOnCluster):
-        """Kill processes in idsOnCluster list by sending SIGKILL to each of them"""
+        """Kill jobs in idsOnCluster list by dequeuing pending ones and sending SIGKILL to the process groups of running ones"""
+        idsOnCluster = [str(x) for x in idsOnCluster]
+        queue = self.jobQueue()
+        with queue.lock():
+            data = queue.read()
+            for id in [x for x in idsOnCluster if x in data.get('pending', {})]:
+                del data['pending'][id]
+                self.jobRecord(id).write({'pid': None, 'start_time': None, 'exit_code': 128 + signal.SIGKILL, 'rusage': None})
+            # jobs a scheduling pass is about to start are not started anymore
+            for id in [x for x in idsOnCluster if x in data.get('running', {}) and not os.path.exists(self.jobRecord(x).path)]:
+                self.jobRecord(id).write({'pid': None, 'start_time': None, 'exit_code': 128 + signal.SIGKILL, 'rusage': None})
+            queue.write(data)
         for id in idsOnCluster:
-            os.kill(int(id), signal.SIGKILL)
+            job = self.jobRecord(id).read()
+            if job.get('exit_code') is not None:
+                continue
+            if not job.get('pid') or not self.isJobProcess(job, readProcStat(job['pid'])):
+                # unknown id or the job ended already, its pid may belong to another process by now
+                continue
+            # the job leads its own process group, which takes its children along
+            os.killpg(job['pid'], signal.SIGKILL)
+        # jobs waiting for the killed ones may start now
+        self.schedule()
         return 0
 
+    def getPackSlots(self, threads):
+        return max(1, self.getLocalResources()[0] // threads)
+
+    def getPackTaskCommand(self, slot, threads, cmdargs):
+        return cmdargs
+
     def getNodeCount(self):
         """Node count returns 1 as we only have local machine"""
         return 1
@@ -950,17 +3944,28 @@ class ProcessSiteCluster(SiteCluster):
         return proc.pid
 
 
-if __name__ == '__main__':
+def main():
     if 'SITE_CLUSTER_USE_PBS' in os.environ:
         PBSSiteCluster(ignore_user=True)
     elif 'SITE_CLUSTER_USE_LSF' in os.environ:
         LSFSiteCluster()
     elif 'SITE_CLUSTER_USE_SGE' in os.environ:
         SunGridEngineSiteCluster()
+    elif 'SITE_CLUSTER_USE_SLURMREST' in os.environ:
+        SlurmRestSiteCluster()
     elif 'SITE_CLUSTER_USE_SLURM' in os.environ:
         SlurmSiteCluster()
     elif 'SITE_CLUSTER_USE_SUBPROCESS' in os.environ:
         ProcessSiteCluster()
     else:
-        print('ERROR: No sitecluster configuration enabled through a SITE_CLUSTER_USE_{PBS|LSF|SGE|SUBPROCESS} environment variable')
+        print('ERROR: No sitecluster configuration enabled through a SITE_CLUSTER_USE_{PBS|LSF|SGE|SLURM|SLURMREST|SUBPROCESS} environment variable')
         SiteCluster()
+
+
+if __name__ == '__main__':
+    # the sitecluster wrapper forwards through sitecluster_client.py, direct calls of sitecluster.py too
+    if 'SITE_CLUSTER_SOCKET' in os.environ and sys.argv[1:2] and sys.argv[1] in SERVE_COMMANDS:
+        returncode = runClient(os.environ['SITE_CLUSTER_SOCKET'], sys.argv[1:])
+        if returncode is not None:
+            sys.exit(returncode)
+    main()
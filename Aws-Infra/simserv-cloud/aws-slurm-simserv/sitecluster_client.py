@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# Copyright 1983-2020 Keysight Technologies
+'''
+Thin client of a sitecluster serve daemon.
+
+The sitecluster wrapper runs this script for every call. When SITE_CLUSTER_SOCKET is set the
+commands the daemon serves are forwarded over its socket with only the standard modules below
+imported. Every other command, and a daemon which is not reachable, runs sitecluster.py
+in-process, imported as a module so python loads its compiled code instead of compiling the
+script on every call.
+'''
+from __future__ import print_function
+import json
+import os
+import socket
+import sys
+
+# commands which do not depend on the caller's working directory or environment
+SERVE_COMMANDS = ('api', 'queues', 'status', 'kill', 'behavior', 'cachestats')
+
+
+def runClient(socketPath, argv):
+    '''
+    Runs the command argv through a sitecluster serve daemon and writes its output.
+    Returns the exit code of the command or None when the daemon is not reachable.
+    '''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socketPath)
+    except socket.error:
+        client.close()
+        return None
+    stdin = None
+    # status reads the job ids from stdin when none are given
+    if argv[:1] == ['status'] and [a for a in argv[1:] if a not in ('-e', '--add-exit-status')] in ([], ['-']):
+        if not sys.stdin.isatty():
+            stdin = sys.stdin.read()
+    try:
+        client.sendall((json.dumps({'argv': argv, 'stdin': stdin}) + '\n').encode('utf-8'))
+        response = json.loads(client.makefile('rb').readline().decode('utf-8'))
+    finally:
+        client.close()
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    return response['rc']
+
+
+if __name__ == '__main__':
+    if 'SITE_CLUSTER_SOCKET' in os.environ and sys.argv[1:2] and sys.argv[1] in SERVE_COMMANDS:
+        returncode = runClient(os.environ['SITE_CLUSTER_SOCKET'], sys.argv[1:])
+        if returncode is not None:
+            sys.exit(returncode)
+    # imported rather than run as a script, so python reuses its compiled module
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import sitecluster
+    sitecluster.main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Instance type planner of the AWS burst nodes.
+
+Usage: slurm-aws-planner.py {plan [--trace <file>] [--write] | simulate [<trace>] [options]}
+
+plan bin-packs the cpus and memory of the pending jobs, or of the jobs of a trace, onto a
+catalogue of instance types and prints the node definitions of the nodes include file with
+the address ranges of each subnet split among the chosen types. Each definition carries the
+CPUs, RealMemory and instance type feature of its type and a Weight of its price, so Slurm
+places a job on the cheapest type it fits. A share of every range stays with the fallback
+type for job shapes the plan did not see. --write replaces the include file, only while all
+burst nodes are powered down, and reconfigures slurmctld. The resume program launches the
+type of a node's definition.
+
+simulate replays a trace (see slurmsim) or a synthetic mix of job shapes on the fixed
+fallback type and on the planned types and prints the queue wait, node hours and cost of
+both as JSON lines.
+
+The catalogue is a JSON list of {"type", "cpus", "memory" (GiB), "price" (per hour)}, by
+default DEFAULT_CATALOGUE, SLURM_AWS_CATALOGUE or --catalogue names another one.
+'''
+import argparse
+import collections
+import json
+import math
+import os
+import sys
+import time
+
+import hostlist
+import slurmaws
+import slurmsim
+
+# on-demand Linux prices of eu-west-3 in USD per hour, edit or replace with --catalogue
+DEFAULT_CATALOGUE = [
+    {'type': 'c5.large', 'cpus': 2, 'memory': 4, 'price': 0.101},
+    {'type': 'c5.xlarge', 'cpus': 4, 'memory': 8, 'price': 0.202},
+    {'type': 'c5.2xlarge', 'cpus': 8, 'memory': 16, 'price': 0.404},
+    {'type': 'c5.4xlarge', 'cpus': 16, 'memory': 32, 'price': 0.808},
+    {'type': 'm5.large', 'cpus': 2, 'memory': 8, 'price': 0.112},
+    {'type': 'm5.xlarge', 'cpus': 4, 'memory': 16, 'price': 0.224},
+    {'type': 'm5.2xlarge', 'cpus': 8, 'memory': 32, 'price': 0.448},
+    {'type': 'r5.large', 'cpus': 2, 'memory': 16, 'price': 0.148},
+    {'type': 'r5.xlarge', 'cpus': 4, 'memory': 32, 'price': 0.296},
+    {'type': 'r5.2xlarge', 'cpus': 8, 'memory': 64, 'price': 0.592},
+    {'type': 'r5.4xlarge', 'cpus': 16, 'memory': 128, 'price': 1.184},
+]
+# the type of the burst nodes before planning
+FALLBACK_TYPE = slurmaws.NODE_GROUPS[0][2]
+# share of each address range kept for the fallback type
+FALLBACK_SHARE = 0.1
+# share of the memory of an instance slurmd reports, RealMemory must not exceed it
+USABLE_MEMORY = 0.9
+
+# synthetic jobs of the simulation: mostly small solver runs and a few memory heavy EM simulations, (cpus, MB)
+SHAPES = ((1, 1800), (1, 1800), (2, 3600), (4, 7200), (8, 14400), (2, 24000), (4, 48000))
+
+InstanceType = collections.namedtuple('InstanceType', 'name cpus memory price')
+
+
+def readCatalogue(path=None):
+    '''
+    Returns the InstanceTypes of the catalogue file, of DEFAULT_CATALOGUE without one, memory as RealMemory in MB.
+    '''
+    entries = DEFAULT_CATALOGUE
+    if path:
+        with open(path) as f:
+            entries = json.load(f)
+    return [InstanceType(x['type'], int(x['cpus']), int(x.get('realMemory') or x['memory'] * 1024 * USABLE_MEMORY), float(x['price']))
+            for x in entries]
+
+
+def weight(instanceType):
+    # Slurm allocates the nodes of the lowest weight first
+    return max(1, int(round(instanceType.price * 1000)))
+
+
+def fits(shape, instanceType):
+    return shape[0] <= instanceType.cpus and shape[1] <= instanceType.memory
+
+
+def pack(jobs, catalogue, fallback):
+    '''
+    Packs the jobs onto instances of the catalogue, returns ({type name: instances}, unplaced jobs).
+
+    First fit decreasing over the job shapes (cpus, memory): each new instance takes the type
+    which costs the least per packed demand when filled with the largest remaining jobs, of
+    equal costs the cheaper instance. The demand of a job is its cpus or its memory in cpus
+    of the fallback type, whichever is larger.
+    '''
+    memoryPerCpu = float(fallback.memory) / fallback.cpus
+
+    def demand(shape):
+        return max(shape[0], shape[1] / memoryPerCpu)
+
+    counts = collections.Counter((x.cpus, x.memory) for x in jobs)
+    shapes = sorted(counts, key=demand, reverse=True)
+    instances, unplaced = collections.Counter(), 0
+    while any(counts.values()):
+        largest = next(x for x in shapes if counts[x])
+        best = None
+        for instanceType in catalogue:
+            if not fits(largest, instanceType):
+                continue
+            taken, cpus, memory = {}, instanceType.cpus, instanceType.memory
+            for shape in shapes:
+                number = min(counts[shape], cpus // shape[0], memory // shape[1] if shape[1] else counts[shape])
+                if number:
+                    taken[shape] = number
+                    cpus -= number * shape[0]
+                    memory -= number * shape[1]
+            key = (instanceType.price / sum(demand(x) * y for x, y in taken.items()), instanceType.price)
+            if best is None or key < best[0]:
+                best = (key, instanceType, taken)
+        if best is None:
+            # no type of the catalogue takes the job
+            unplaced += counts[largest]
+            counts[largest] = 0
+            continue
+        instances[best[1].name] += 1
+        for shape, number in best[2].items():
+            counts[shape] -= number
+    return instances, unplaced
+
+
+def splitNodes(count, instances, catalogue, fallback):
+    '''
+    Splits count nodes among the types in proportion to the planned instances, keeping FALLBACK_SHARE
+    for the fallback type. Returns [(InstanceType, nodes)] in the order of the prices.
+    '''
+    total = float(sum(instances.values()))
+    reserved = int(math.ceil(count * FALLBACK_SHARE)) if total else count
+    shares = dict((x, (count - reserved) * instances[x] / total) for x in instances) if total else {}
+    numbers = dict((x, int(y)) for x, y in shares.items())
+    numbers[fallback.name] = numbers.get(fallback.name, 0) + reserved
+    # the nodes left by rounding down go to the largest remainders
+    for name in sorted(shares, key=lambda x: shares[x] - int(shares[x]), reverse=True)[:count - sum(numbers.values())]:
+        numbers[name] += 1
+    byName = dict((x.name, x) for x in catalogue)
+    return sorted(((byName[x], y) for x, y in numbers.items() if y), key=lambda x: (x[0].price, x[0].name))
+
+
+def nodeDefinitions(lines, instances, catalogue, fallback, comment):
+    '''
+    Returns the lines of the nodes include file with the node ranges of each burst node group and
+    availability zone split among the planned types. Other lines are kept.
+    '''
+    groups, order = collections.OrderedDict(), []
+    for line in lines:
+        words = dict(x.split('=', 1) for x in line.split() if '=' in x)
+        if line.startswith('# slurm-aws-planner'):
+            continue
+        try:
+            hosts = list(hostlist.expand(words['NodeName'])) if 'NodeName' in words and not line.lstrip().startswith('#') else []
+        except ValueError:
+            hosts = []
+        if len(hosts) < 2 or not all(slurmaws.nodeGroup(x) for x in hosts):
+            order.append(line)
+            continue
+        zones = [x for x in words.get('Feature', '').split(',') if x and '.' not in x]
+        rest = [x for x in line.split() if x.split('=', 1)[0] not in ('NodeName', 'CPUs', 'RealMemory', 'Feature', 'Weight')]
+        key = (slurmaws.nodeGroup(hosts[0])[0], ','.join(zones), ' '.join(rest))
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].extend(hosts)
+    output = [comment + '\n']
+    for item in order:
+        if not isinstance(item, tuple):
+            output.append(item)
+            continue
+        _, zones, rest = item
+        hosts, start = groups[item], 0
+        for instanceType, number in splitNodes(len(hosts), instances, catalogue, fallback):
+            features = ','.join(x for x in (zones, instanceType.name) if x)
+            output.append('NodeName={} CPUs={} RealMemory={} Feature={} Weight={}{}\n'.format(
+                hostlist.compress(hosts[start:start + number]), instanceType.cpus, instanceType.memory, features,
+                weight(instanceType), ' ' + rest if rest else ''))
+            start += number
+    return output
+
+
+def plan(options, catalogue, fallback):
+    jobs = slurmsim.readTrace(options.trace) if options.trace else slurmaws.queuedJobs()[0]
+    instances, unplaced = pack(jobs, catalogue, fallback)
+    comment = '# slurm-aws-planner.py {}: {} for {} jobs{}'.format(
+        time.strftime('%Y-%m-%d %H:%M'), ', '.join('{} {}'.format(y, x) for x, y in sorted(instances.items())) or 'nothing',
+        len(jobs), ', {} fit no type'.format(unplaced) if unplaced else '')
+    with open(options.conf) as f:
+        lines = f.readlines()
+    text = ''.join(nodeDefinitions(lines, instances, catalogue, fallback, comment))
+    if not options.write:
+        sys.stdout.write(text)
+        return 0
+    busy = [x.name for x in slurmaws.burstNodes({}, time.time()) if x.state != 'down']
+    if busy:
+        print('ERROR: burst nodes {} are not powered down'.format(hostlist.compress(busy)), file=sys.stderr)
+        return 1
+    slurmaws.replaceFile(options.conf, text)
+    slurmaws.scontrol('reconfigure')
+    slurmaws.log('Planner wrote the node definitions, {}'.format(comment.split(': ', 1)[1]))
+    return 0
+
+
+def simulate(options, catalogue, fallback):
+    if options.synthetic:
+        jobsPerHour, hours = (float(x) for x in options.synthetic.split(','))
+        shapes = [tuple(int(y) for y in x.split(':')) for x in options.shapes.split(',')] if options.shapes else SHAPES
+        jobs = slurmsim.syntheticTrace(jobsPerHour, hours, options.seed, shapes=shapes)
+    else:
+        jobs = slurmsim.readTrace(options.trace)
+    partitions = sorted(set(['all'] + [x.partition for x in jobs]))
+    instances, _ = pack(jobs, catalogue, fallback)
+    configurations = [('fixed-' + fallback.name, [(fallback, options.nodes)]),
+                      ('planned', splitNodes(options.nodes, instances, catalogue, fallback))]
+    for name, types in configurations:
+        nodes = []
+        for instanceType, number in types:
+            for _ in range(number):
+                nodes.append(slurmsim.Node('node{}'.format(len(nodes)), partitions, instanceType.cpus, instanceType.memory,
+                                           price=instanceType.price, weight=weight(instanceType)))
+        result = slurmsim.Simulation(nodes, options.suspend_time, options.boot).run(jobs)
+        result['policy'] = name
+        result['types'] = dict((x.name, y) for x, y in types)
+        print(json.dumps(result, sort_keys=True))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Instance type planner of the AWS burst nodes.')
+    parser.add_argument('--catalogue', default=os.environ.get('SLURM_AWS_CATALOGUE'), help='JSON catalogue of instance types')
+    parser.add_argument('--fallback', default=FALLBACK_TYPE, help='type for unseen job shapes (default %(default)s)')
+    commands = parser.add_subparsers(dest='command')
+    planParser = commands.add_parser('plan', help='print or write the node definitions of the planned types')
+    planParser.add_argument('--trace', help='plan for the jobs of a trace instead of the pending jobs')
+    planParser.add_argument('--conf', default=slurmaws.SLURM_NODES_CONF, help='nodes include file (default %(default)s)')
+    planParser.add_argument('--write', action='store_true', help='replace the nodes include file and reconfigure slurmctld')
+    simulateParser = commands.add_parser('simulate', help='compare the fixed and the planned types on a job trace')
+    simulateParser.add_argument('trace', nargs='?', help='JSON lines trace file')
+    simulateParser.add_argument('--synthetic', metavar='<jobs per hour>,<hours>', help='simulate a synthetic job mix instead of a trace')
+    simulateParser.add_argument('--shapes', metavar='<cpus>:<MB>,...', help='job shapes of the synthetic trace')
+    simulateParser.add_argument('--seed', type=int, default=0, help='seed of the synthetic trace')
+    simulateParser.add_argument('--nodes', type=int, default=735, help='number of burst nodes (default %(default)s)')
+    simulateParser.add_argument('--boot', type=int, default=slurmsim.BOOT_SECONDS, help='seconds a node boots (default %(default)s)')
+    simulateParser.add_argument('--suspend-time', type=int, default=60, help='SuspendTime of both configurations (default %(default)s)')
+    options = parser.parse_args()
+    if options.command not in ('plan', 'simulate'):
+        parser.print_usage(sys.stderr)
+        sys.exit(2)
+    if options.command == 'simulate' and not options.trace and not options.synthetic:
+        parser.error('simulate needs a trace or --synthetic')
+    try:
+        catalogue = readCatalogue(options.catalogue)
+        fallback = [x for x in catalogue if x.name == options.fallback]
+        if not fallback:
+            raise ValueError('the fallback type {} is not in the catalogue'.format(options.fallback))
+        sys.exit((plan if options.command == 'plan' else simulate)(options, catalogue, fallback[0]))
+    except (IOError, ValueError, KeyError) as e:
+        print('ERROR: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Slurm ResumeProgram of the AWS burst nodes.
+
+Usage: slurm-aws-resume.py <hostlist> | --report
+
+Starts the stopped instances the suspend program kept in the warm pools for the nodes and
+launches one instance per remaining node with the node's pinned private address, grouped by
+subnet and instance type. The calls run in parallel through one EC2 client, then the addresses
+of all resumed nodes are set with a single scontrol update. Nodes which failed to resume are
+set down. The launch latency of each node is appended to SLURM_RESUME_LOG.
+
+--report prints the warm pool hit rate and the launch and slurmd registration latencies of
+the resumes in SLURM_RESUME_LOG as JSON.
+'''
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+import hostlist
+import slurmaws
+import slurmsim
+
+# parallel RunInstances calls
+LAUNCH_CONCURRENCY = int(os.environ.get('SLURM_AWS_LAUNCH_CONCURRENCY', 32))
+
+USER_DATA = '''#!/bin/bash -xe
+sudo sed -i "s|enforcing|disabled|g" /etc/selinux/config
+sudo yum --nogpgcheck install wget curl epel-release nfs-utils -y
+sudo yum install -y yum-utils
+sudo yum install python2-pip -y
+sudo pip install awscli
+sudo yum -y install git
+cd /home/centos
+sudo git clone https://github.com/aws/efs-utils
+cd efs-utils
+sudo yum -y install make
+sudo yum -y install rpm-build
+sudo make rpm
+sudo yum -y install ./build/amazon-efs-utils*rpm
+sudo mkdir -p /opt/ads/
+# Mount EFS
+sudo mount -t efs {efs}:/ /opt/ads
+sudo mount -t efs {efs}:/ /project/code/simserv/data
+sudo sed -i '$a '{efs}':/ /opt/ads efs defaults,_netdev 0 0' /etc/fstab
+sudo sed -i '$a '{efs}':/ /project/code/simserv/data efs defaults,_netdev 0 0' /etc/fstab
+sudo mkdir -p /nfs
+sudo cp /home/centos/slurm-compute1.sh /home/centos/slurm-compute.sh
+chmod +x /home/centos/slurm-compute.sh
+sudo /home/centos/slurm-compute.sh {headnode}
+# restarts from the warm pool mount the head node NFS, which is not in fstab, and start slurmd
+sudo mkdir -p /var/lib/cloud/scripts/per-boot
+cat << 'HOOK' | sudo tee /var/lib/cloud/scripts/per-boot/slurm-warm-start.sh
+#!/bin/bash
+mountpoint -q /nfs || mount -t nfs {headnode}:/nfs /nfs
+systemctl restart slurmd
+HOOK
+sudo chmod +x /var/lib/cloud/scripts/per-boot/slurm-warm-start.sh
+'''
+
+
+def launch(host, subnet, instanceType, userData):
+    '''
+    Launches the instance of host and returns its instance id.
+    '''
+    reservation = slurmaws.client('ec2').run_instances(
+        ImageId=slurmaws.AWS_AMI, InstanceType=instanceType, KeyName=slurmaws.AWS_KEYNAME,
+        SecurityGroupIds=[slurmaws.AWS_SECURITY_GROUP], SubnetId=subnet, UserData=userData,
+        PrivateIpAddress=slurmaws.nodeAddress(host), MinCount=1, MaxCount=1,
+        BlockDeviceMappings=[{'DeviceName': '/dev/sda1', 'Ebs': {'DeleteOnTermination': True}}],
+        TagSpecifications=[{'ResourceType': 'instance',
+                            'Tags': [{'Key': 'Name', 'Value': '{}_slurm-compute-processor'.format(host)},
+                                     {'Key': slurmaws.NODE_TAG, 'Value': host}]}])
+    return reservation['Instances'][0]['InstanceId']
+
+
+def startWarm(instances):
+    '''
+    Starts the stopped instances {host: (instance id, state, instance type)} of the warm pools with one call.
+    Returns {host: error} of the instances which did not start.
+    '''
+    ec2 = slurmaws.client('ec2')
+    stopping = [x[0] for x in instances.values() if x[1] == 'stopping']
+    if stopping:
+        ec2.get_waiter('instance_stopped').wait(InstanceIds=stopping, WaiterConfig={'Delay': 5, 'MaxAttempts': 24})
+    ids = [x[0] for x in instances.values()]
+    try:
+        ec2.start_instances(InstanceIds=ids)
+        errors = {}
+    except (BotoCoreError, ClientError):
+        # one instance fails the whole call, start them one by one
+        errors = {}
+        for host, (instanceId, _, _) in instances.items():
+            try:
+                ec2.start_instances(InstanceIds=[instanceId])
+            except (BotoCoreError, ClientError) as e:
+                errors[host] = e
+    started = [instances[x][0] for x in instances if x not in errors]
+    if started:
+        ec2.delete_tags(Resources=started, Tags=[{'Key': slurmaws.POOL_TAG}])
+    if errors:
+        # the stopped instances hold the addresses of the nodes, the next resume launches them afresh
+        ec2.terminate_instances(InstanceIds=[instances[x][0] for x in errors])
+    return errors
+
+
+def resume(expression):
+    '''
+    Resumes the nodes of the hostlist expression, returns the number of nodes which failed.
+    '''
+    requested = time.time()
+    hosts = slurmaws.expandNodes(expression)
+    slurmaws.putMetric('BurstNodeRequestCount', len(hosts))
+    groups = {}
+    for host in hosts:
+        group = slurmaws.nodeGroup(host)
+        if group:
+            groups.setdefault(group, []).append(host)
+        else:
+            slurmaws.log('Resume skips {}, not a burst node'.format(host))
+    userData = USER_DATA.format(efs=slurmaws.EFS_ID, headnode=os.environ.get('SLURM_HEADNODE') or slurmaws.metadata('meta-data/local-ipv4'))
+
+    def timedLaunch(host, subnet, instanceType, terminated=None):
+        if terminated:
+            # the stopped instance of an old instance type holds the address until it is gone
+            terminated[0].result()
+            slurmaws.client('ec2').get_waiter('instance_terminated').wait(
+                InstanceIds=[terminated[1]], WaiterConfig={'Delay': 5, 'MaxAttempts': 24})
+        instanceId = launch(host, subnet, instanceType, userData)
+        return instanceId, time.time() - requested
+
+    def timedStartWarm(warm):
+        errors = startWarm(warm)
+        return errors, time.time() - requested
+
+    # the instances of nodes in a warm pool keep the node's address, they are started instead of launched
+    warm = slurmaws.findInstances([x for y in groups.values() for x in y], states=('stopping', 'stopped')) if groups else {}
+    # the planner changed the instance type of these nodes, they are launched afresh
+    stale = dict((x, warm.pop(x)[0]) for x in [x for x in warm if warm[x][2] != slurmaws.nodeGroup(x)[1]])
+    launched, failed = [], []
+    with ThreadPoolExecutor(max_workers=LAUNCH_CONCURRENCY) as executor:
+        # submitted first, it runs before the launches of the stale nodes wait for it
+        terminateFuture = executor.submit(slurmaws.client('ec2').terminate_instances, InstanceIds=sorted(stale.values())) if stale else None
+        warmFuture = executor.submit(timedStartWarm, warm) if warm else None
+        futures = [(host, group, executor.submit(timedLaunch, host, group[0], group[1],
+                                                 (terminateFuture, stale[host]) if host in stale else None))
+                   for group, groupHosts in sorted(groups.items()) for host in groupHosts if host not in warm]
+        results = []
+        if warmFuture:
+            try:
+                errors, latency = warmFuture.result()
+            except Exception as e:
+                # a failed resume sets the nodes down instead of failing the others
+                errors, latency = dict((x, e) for x in warm), 0
+            for host in warm:
+                results.append((host, slurmaws.nodeGroup(host), warm[host][0], latency, True, errors.get(host)))
+        for host, group, future in futures:
+            try:
+                instanceId, latency = future.result()
+                results.append((host, group, instanceId, latency, False, None))
+            except Exception as e:
+                results.append((host, group, None, 0, False, e))
+    with open(slurmaws.SLURM_RESUME_LOG, 'a') as f:
+        for host, group, instanceId, latency, isWarm, error in results:
+            if error:
+                slurmaws.log('Resume of {} in {} as {} failed: {}'.format(host, group[0], group[1], error))
+                failed.append(host)
+                continue
+            launched.append(host)
+            f.write(json.dumps({'node': host, 'instance': instanceId, 'subnet': group[0], 'type': group[1], 'warm': isWarm,
+                                'requested': requested, 'launch_seconds': round(latency, 3)}) + '\n')
+    if launched:
+        nodes = hostlist.compress(launched)
+        # the addresses are listed in the order of the expanded node names
+        addresses = ','.join(slurmaws.nodeAddress(x) for x in hostlist.expand(nodes))
+        if slurmaws.scontrol('update', 'nodename=' + nodes, 'nodeaddr=' + addresses, 'nodehostname=' + nodes):
+            # a controller which does not take address lists
+            for host in launched:
+                slurmaws.scontrol('update', 'nodename=' + host, 'nodeaddr=' + slurmaws.nodeAddress(host), 'nodehostname=' + host)
+    if failed:
+        slurmaws.scontrol('update', 'nodename=' + hostlist.compress(failed), 'state=down', 'reason=resume_failed')
+    slurmaws.log('Resumed {} nodes in {:.1f}s, {} from the warm pools, {} failed'.format(
+        len(launched), time.time() - requested, len([x for x in results if x[4] and not x[5]]), len(failed)))
+    return len(failed)
+
+
+def slurmdStartTimes(nodes):
+    '''
+    Returns {node: SlurmdStartTime as seconds since the epoch} of the nodes reported by scontrol.
+    '''
+    times = {}
+    cmd = [os.path.join(slurmaws.SLURM_ROOT, 'bin', 'scontrol'), 'show', 'node', '-o', hostlist.compress(nodes)]
+    try:
+        output = subprocess.check_output(cmd, universal_newlines=True)
+    except (OSError, subprocess.CalledProcessError):
+        return times
+    for line in output.splitlines():
+        fields = dict(x.split('=', 1) for x in line.split() if '=' in x)
+        try:
+            times[fields['NodeName']] = slurmaws.slurmTime(fields['SlurmdStartTime'])
+        except (KeyError, ValueError):
+            pass
+    return times
+
+
+def report():
+    '''
+    Returns the warm pool hit rate and the latencies of the resumes in SLURM_RESUME_LOG.
+
+    The slurmd registration latency is the SlurmdStartTime of a node after its latest resume request,
+    earlier resumes of the node cannot be matched anymore.
+    '''
+    records = []
+    with open(slurmaws.SLURM_RESUME_LOG) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    latest = {}
+    for record in records:
+        latest[record['node']] = record
+    registered = slurmdStartTimes(list(latest)) if latest else {}
+    stats = {}
+    for kind, isWarm in (('warm', True), ('cold', False)):
+        selected = [x for x in records if bool(x.get('warm')) == isWarm]
+        registrations = [registered[x['node']] - x['requested'] for x in latest.values()
+                         if bool(x.get('warm')) == isWarm and registered.get(x['node'], 0) >= x['requested']]
+        stats[kind] = {'resumes': len(selected), 'launch_seconds': slurmsim.percentiles([x['launch_seconds'] for x in selected]),
+                       'registration_seconds': slurmsim.percentiles(registrations)}
+    stats['hit_rate'] = round(float(stats['warm']['resumes']) / len(records), 3) if records else None
+    return stats
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__.strip().splitlines()[2], file=sys.stderr)
+        sys.exit(2)
+    if sys.argv[1] == '--report':
+        print(json.dumps(report(), sort_keys=True))
+        sys.exit(0)
+    slurmaws.log('Resume invoked {} {}'.format(sys.argv[0], sys.argv[1]))
+    sys.exit(1 if resume(sys.argv[1]) else 0)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Predictive scaling controller of the AWS burst nodes.
+
+Usage: slurm-aws-scaler.py {run | simulate [<trace>] [options] | trace <start> [<end>]}
+
+run samples the pending demand of squeue every SLURM_AWS_SCALER_INTERVAL seconds, powers
+up nodes ahead of the jobs expected to arrive while a node boots and powers down idle
+nodes after a window adapted to the arrivals of their partitions. slurm.conf keeps a
+longer SuspendTime as a backstop while the controller is not running.
+
+simulate replays a trace (see slurmsim) or a synthetic day cycle with reactive power
+saving at fixed suspend times and with the controller, and prints the queue wait and the
+node hours of each policy as JSON lines. trace writes the jobs sacct accounted from
+start to end as a trace.
+'''
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+import hostlist
+import slurmaws
+import slurmsim
+
+# seconds between two samples of squeue
+INTERVAL = int(os.environ.get('SLURM_AWS_SCALER_INTERVAL', 30))
+# seconds ahead the demand is forecast, the time a node takes to boot and register
+LEAD = int(os.environ.get('SLURM_AWS_SCALER_LEAD', slurmsim.BOOT_SECONDS))
+# bounds of the idle time before a node is powered down
+MIN_WINDOW = int(os.environ.get('SLURM_AWS_SCALER_MIN_WINDOW', 60))
+MAX_WINDOW = int(os.environ.get('SLURM_AWS_SCALER_MAX_WINDOW', 600))
+# seconds over which arrivals are averaged
+TIME_CONSTANT = int(os.environ.get('SLURM_AWS_SCALER_TIME_CONSTANT', 1800))
+# SuspendTime of slurm.conf, powers down what the controller keeps too long
+BACKSTOP_SUSPEND_TIME = 900
+
+
+class Controller(object):
+    '''
+    Forecasts the node demand of each partition and keeps the nodes to meet it.
+
+    The arrival rate and the cpus and memory per job of each partition are exponentially
+    weighted moving averages over timeConstant seconds. Pending jobs start on the up or booting
+    node of the lowest weight they fit, else power up the down node of the lowest weight they
+    fit, as Slurm chooses nodes of mixed instance types. The jobs expected to arrive within lead
+    seconds, of the average shape, take the free nodes that shape fits and then power up
+    nodes while they fill at least half of one.
+
+    An idle node is powered down after two mean gaps between the arrivals of its partitions,
+    long enough that the next job likely finds it up. When two gaps exceed maxWindow the node
+    is not worth keeping and goes after minWindow.
+    '''
+    interval = INTERVAL
+
+    def __init__(self, lead=LEAD, minWindow=MIN_WINDOW, maxWindow=MAX_WINDOW, timeConstant=TIME_CONSTANT):
+        self.lead = lead
+        self.minWindow = minWindow
+        self.maxWindow = maxWindow
+        self.timeConstant = timeConstant
+        # partition: [jobs per second, cpus per job, MB per job]
+        self.averages = {}
+        self.lastObserved = None
+
+    def observe(self, now, jobs):
+        '''
+        Updates the averages with the jobs submitted since the last observation.
+        '''
+        if self.lastObserved is None:
+            # jobs submitted before the first sample are no arrivals
+            self.lastObserved = now
+            return
+        if now <= self.lastObserved:
+            return
+        elapsed = now - self.lastObserved
+        arrivals = {}
+        for job in jobs:
+            if job.submit > self.lastObserved:
+                arrivals.setdefault(job.partition, []).append(job)
+        weight = 1 - math.exp(-elapsed / self.timeConstant)
+        for partition in set(self.averages) | set(arrivals):
+            arrived = arrivals.get(partition, [])
+            average = self.averages.setdefault(partition, [0.0, 0.0, 0.0])
+            average[0] += weight * (len(arrived) / elapsed - average[0])
+            if arrived:
+                # the first jobs of a partition set its shape
+                shapeWeight = max(weight, 1 - math.exp(-len(arrived) / 10.0)) if average[1] else 1.0
+                average[1] += shapeWeight * (sum(x.cpus for x in arrived) / float(len(arrived)) - average[1])
+                average[2] += shapeWeight * (sum(x.memory for x in arrived) / float(len(arrived)) - average[2])
+        self.lastObserved = now
+
+    def window(self, partitions):
+        '''
+        Returns the idle seconds before a node of the partitions is powered down.
+        '''
+        windows = [self.minWindow]
+        for partition in partitions:
+            rate = self.averages.get(partition, (0.0,))[0]
+            if rate > 0 and 2 / rate <= self.maxWindow:
+                windows.append(2 / rate)
+        return max(windows)
+
+    @staticmethod
+    def capacity(node, cpus, memory):
+        # the jobs of cpus and memory the free resources of the node take, memory counts if the node defines RealMemory
+        return min(node.freeCpus / float(cpus), node.freeMemory / float(memory) if memory and node.memory > 1 else float('inf'))
+
+    def plan(self, now, nodes, pending):
+        '''
+        Returns the nodes to power up and the nodes to power down.
+        '''
+        # the resources left on the up and booting nodes and the nodes to power up once the planned jobs run
+        free = dict((x.name, slurmsim.Node(x.name, x.partitions, x.cpus, x.memory, x.state, x.freeCpus, x.freeMemory, weight=x.weight))
+                    for x in nodes if x.state in ('up', 'booting'))
+        backlogs = {}
+        for job in pending:
+            backlogs.setdefault(job.partition, []).append(job)
+        powerUp, keep = [], set()
+
+        def nodeFor(members, job):
+            # the planned node of the lowest weight the job fits, else the down node of the lowest weight as Slurm chooses it
+            for member in members:
+                if member.name in free and free[member.name].fits(job):
+                    return free[member.name]
+            for member in members:
+                if member.state == 'down' and member.name not in free:
+                    node = slurmsim.Node(member.name, member.partitions, member.cpus, member.memory, 'booting', weight=member.weight)
+                    if node.fits(job):
+                        free[member.name] = node
+                        powerUp.append(member)
+                        return node
+            # larger than any node which is not busy, the job waits for running jobs
+            return None
+
+        for partition in sorted(set(backlogs) | set(self.averages)):
+            members = sorted((x for x in nodes if partition in x.partitions), key=lambda x: x.weight)
+            for job in backlogs.get(partition, []):
+                node = nodeFor(members, job)
+                if node is not None:
+                    node.freeCpus -= job.cpus
+                    node.freeMemory -= job.memory
+                    keep.add(node.name)
+            rate, cpus, memory = self.averages.get(partition, (0.0, 0.0, 0.0))
+            expected = rate * self.lead
+            if expected <= 0 or cpus <= 0:
+                continue
+            # the jobs expected to arrive take the free nodes their average shape fits, then nodes powered up
+            # while they fill at least half of one
+            shape = slurmsim.Job(None, partition, cpus, memory, now, 0)
+            for member in members:
+                node = free.get(member.name)
+                if expected > 0 and node is not None and node.fits(shape):
+                    expected -= self.capacity(node, cpus, memory)
+                    node.freeCpus, node.freeMemory = 0, 0
+                    keep.add(member.name)
+            for member in members:
+                if member.state != 'down' or member.name in free:
+                    continue
+                node = slurmsim.Node(member.name, member.partitions, member.cpus, member.memory, 'booting', weight=member.weight)
+                if not node.fits(shape):
+                    continue
+                if expected < self.capacity(node, cpus, memory) / 2:
+                    break
+                expected -= self.capacity(node, cpus, memory)
+                node.freeCpus, node.freeMemory = 0, 0
+                free[member.name] = node
+                powerUp.append(member)
+        powerDown = [x for x in nodes if x.state == 'up' and x.idle() and x.idleSince is not None and x.name not in keep
+                     and now - x.idleSince >= self.window(x.partitions)]
+        return powerUp, powerDown
+
+
+def run():
+    controller, idleSince = Controller(), {}
+    slurmaws.log('Scaler started, forecasting {}s ahead, idle windows of {}s to {}s'.format(
+        controller.lead, controller.minWindow, controller.maxWindow))
+    while True:
+        started = time.time()
+        try:
+            pending, running = slurmaws.queuedJobs()
+            nodes = slurmaws.burstNodes(idleSince, started)
+            controller.observe(started, pending + running)
+            powerUp, powerDown = controller.plan(started, nodes, pending)
+        except (OSError, subprocess.CalledProcessError) as e:
+            # slurmctld restarting, the next sample retries
+            slurmaws.log('Scaler sample failed: {}'.format(e))
+            powerUp, powerDown = [], []
+        if powerUp:
+            names = hostlist.compress(x.name for x in powerUp)
+            rates = ', '.join('{} {:.1f}'.format(x, y[0] * 3600) for x, y in sorted(controller.averages.items()))
+            slurmaws.log('Scaler powers up {} for {} pending jobs, arrivals per hour: {}'.format(names, len(pending), rates or 'none'))
+            slurmaws.scontrol('update', 'nodename=' + names, 'state=power_up')
+        if powerDown:
+            names = hostlist.compress(x.name for x in powerDown)
+            slurmaws.log('Scaler powers down idle {}'.format(names))
+            slurmaws.scontrol('update', 'nodename=' + names, 'state=power_down')
+            for node in powerDown:
+                idleSince.pop(node.name, None)
+        time.sleep(max(0, controller.interval - (time.time() - started)))
+
+
+def simulate(options):
+    if options.synthetic:
+        jobsPerHour, hours = (float(x) for x in options.synthetic.split(','))
+        shapes = [tuple(int(y) for y in x.split(':')) for x in options.shapes.split(',')] if options.shapes else slurmsim.SHAPES
+        jobs = slurmsim.syntheticTrace(jobsPerHour, hours, options.seed, shapes=shapes)
+    else:
+        jobs = slurmsim.readTrace(options.trace)
+    # every partition takes all nodes, as in slurm.conf
+    partitions = sorted(set(['all'] + [x.partition for x in jobs]))
+    if options.node_types:
+        # mixed instance types in node order as slurm-aws-planner.py writes them
+        types = [tuple(int(y) for y in x.split(':')) for x in options.node_types.split(',')]
+    else:
+        types = [(options.nodes, options.cpus, options.memory, 1)]
+    for policy in options.policies.split(','):
+        nodes = []
+        for number, cpus, memory, weight in types:
+            for _ in range(number):
+                nodes.append(slurmsim.Node('node{}'.format(len(nodes)), partitions, cpus, memory, weight=weight))
+        if policy == 'predictive':
+            simulation = slurmsim.Simulation(nodes, BACKSTOP_SUSPEND_TIME, options.boot, Controller(lead=options.boot))
+        elif policy.startswith('reactive-'):
+            simulation = slurmsim.Simulation(nodes, int(policy.split('-', 1)[1]), options.boot)
+        else:
+            raise ValueError('unknown policy {}'.format(policy))
+        result = simulation.run(jobs)
+        result['policy'] = policy
+        print(json.dumps(result, sort_keys=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Predictive scaling controller of the AWS burst nodes.')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('run', help='run the controller')
+    simulateParser = commands.add_parser('simulate', help='compare the policies on a job trace')
+    simulateParser.add_argument('trace', nargs='?', help='JSON lines trace file')
+    simulateParser.add_argument('--synthetic', metavar='<jobs per hour>,<hours>', help='simulate a synthetic day cycle instead of a trace')
+    simulateParser.add_argument('--seed', type=int, default=0, help='seed of the synthetic trace')
+    simulateParser.add_argument('--nodes', type=int, default=735, help='number of burst nodes (default %(default)s)')
+    simulateParser.add_argument('--cpus', type=int, default=8, help='cpus per node (default %(default)s)')
+    simulateParser.add_argument('--memory', type=int, default=15000, help='MB per node (default %(default)s)')
+    simulateParser.add_argument('--node-types', metavar='<nodes>:<cpus>:<MB>:<weight>,...',
+                                help='mixed node types instead of --nodes, --cpus and --memory')
+    simulateParser.add_argument('--shapes', metavar='<cpus>:<MB>,...', help='job shapes of the synthetic trace')
+    simulateParser.add_argument('--boot', type=int, default=slurmsim.BOOT_SECONDS, help='seconds a node boots (default %(default)s)')
+    simulateParser.add_argument('--policies', default='reactive-60,reactive-{},predictive'.format(BACKSTOP_SUSPEND_TIME),
+                                help='comma separated reactive-<SuspendTime> and predictive (default %(default)s)')
+    traceParser = commands.add_parser('trace', help='write the jobs of sacct as a trace')
+    traceParser.add_argument('start', help='start time as for sacct -S')
+    traceParser.add_argument('end', nargs='?', help='end time as for sacct -E')
+    options = parser.parse_args()
+    if options.command == 'run':
+        run()
+    elif options.command == 'simulate':
+        if not options.trace and not options.synthetic:
+            parser.error('simulate needs a trace or --synthetic')
+        try:
+            simulate(options)
+        except (IOError, ValueError, KeyError) as e:
+            print('ERROR: {}'.format(e), file=sys.stderr)
+            sys.exit(1)
+    elif options.command == 'trace':
+        jobs = slurmaws.accountedJobs(options.start, options.end)
+        # submit times relative to the first job
+        origin = jobs[0].submit if jobs else 0
+        slurmsim.writeTrace([x._replace(submit=x.submit - origin) for x in jobs], sys.stdout)
+    else:
+        parser.print_usage(sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Slurm SuspendProgram of the AWS burst nodes.
+
+Usage: slurm-aws-suspend.py <hostlist>
+
+Resolves the instances of all nodes with one filtered describe call. Instances are stopped
+into the warm pool of their subnet and instance type while the pool is below its size, the
+others are terminated in batches. Slurm powers up idle nodes in node order, so the first
+nodes of the suspend event go to the pools. The node definitions of the nodes are removed
+from the nodes include file in one atomic rewrite and slurmctld is reconfigured once, only
+when the file changed.
+'''
+import sys
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+import hostlist
+import slurmaws
+
+# instance ids per StopInstances and TerminateInstances call
+TERMINATE_BATCH = 500
+
+
+def removeNodeDefinitions(hosts):
+    '''
+    Drops the lines of the nodes include file defining a single node of hosts.
+    Returns True if the file changed.
+    '''
+    try:
+        with open(slurmaws.SLURM_NODES_CONF) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return False
+    kept = []
+    for line in lines:
+        words = dict(x.split('=', 1) for x in line.split() if '=' in x)
+        if not line.lstrip().startswith('#') and 'NodeName' in words:
+            try:
+                # ranges of nodes, as slurm-mgmtd.sh and the planner define them, stay
+                nodes = hostlist.HostList(words['NodeName'])
+                if len(nodes) == 1 and nodes[0] in hosts:
+                    continue
+            except ValueError:
+                pass
+        kept.append(line)
+    if len(kept) == len(lines):
+        return False
+    slurmaws.replaceFile(slurmaws.SLURM_NODES_CONF, ''.join(kept))
+    return True
+
+
+def suspend(expression):
+    '''
+    Suspends the nodes of the hostlist expression, returns the number of instances which failed to terminate.
+    '''
+    started = time.time()
+    hosts = [x for x in slurmaws.expandNodes(expression) if slurmaws.nodeGroup(x)]
+    slurmaws.putMetric('ShutdownNodeRequestCount', len(hosts))
+    ec2 = slurmaws.client('ec2') if hosts else None
+    # instances already stopped are members of a warm pool
+    instances = slurmaws.findInstances(hosts, states=('pending', 'running')) if hosts else {}
+    poolSizes = slurmaws.countPoolMembers() if instances else {}
+    pools, terminate = {}, []
+    order = dict((x, i) for i, x in enumerate(hosts))
+    for host in sorted(instances, key=order.get):
+        group = slurmaws.nodeGroup(host)
+        name = slurmaws.poolName(group)
+        if poolSizes.get(name, 0) < group[2]:
+            poolSizes[name] = poolSizes.get(name, 0) + 1
+            pools.setdefault(name, []).append(instances[host][0])
+        else:
+            terminate.append(instances[host][0])
+    stopped, failed = 0, 0
+    for name, ids in sorted(pools.items()):
+        try:
+            ec2.create_tags(Resources=ids, Tags=[{'Key': slurmaws.POOL_TAG, 'Value': name}])
+            ec2.stop_instances(InstanceIds=ids)
+            stopped += len(ids)
+        except (BotoCoreError, ClientError) as e:
+            slurmaws.log('Stopping {} instances into the warm pool {} failed: {}'.format(len(ids), name, e))
+            terminate.extend(ids)
+    for start in range(0, len(terminate), TERMINATE_BATCH):
+        try:
+            ec2.terminate_instances(InstanceIds=terminate[start:start + TERMINATE_BATCH])
+        except (BotoCoreError, ClientError) as e:
+            slurmaws.log('Terminating {} instances failed: {}'.format(len(terminate[start:start + TERMINATE_BATCH]), e))
+            failed += len(terminate[start:start + TERMINATE_BATCH])
+    if removeNodeDefinitions(set(hosts)):
+        slurmaws.scontrol('reconfigure')
+    slurmaws.log('Suspended {} nodes, stopped {} instances into the warm pools, terminated {} in {:.1f}s, {} failed'.format(
+        len(hosts), stopped, len(terminate) - failed, time.time() - started, failed))
+    return failed
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__.strip().splitlines()[2], file=sys.stderr)
+        sys.exit(2)
+    slurmaws.log('Suspend invoked {} {}'.format(sys.argv[0], sys.argv[1]))
+    sys.exit(1 if suspend(sys.argv[1]) else 0)
@@ -78,6 +78,7 @@ sudo -E mkdir -p /var/spool/slurm
 #echo "include *.conf" | sudo tee -a $SLURM_HOME/etc/slurm.conf.d/slurm_nodes.conf
 sudo cp /home/centos/slurm-aws* $SLURM_HOME/bin
 sudo chmod +x $SLURM_HOME/bin/slurm-aws*
+sudo cp /home/centos/hostlist.py /home/centos/slurmaws.py /home/centos/slurmsim.py $SLURM_HOME/bin
 #echo `/nfs/slurm/sbin/slurmd -C` | cut -d " " -f1,2,5,6,7 | sudo tee -a $SLURM_HOME/etc/slurm.conf.d/slurm_nodes.conf
 
 azs=$2
@@ -88,7 +89,7 @@ IFS=',' read -r -a ranges_arr <<< "$ranges"
 num_ranges=`printf '%s\n' "${ranges_arr[@]}" | wc -w`
 
 for ((i =0; i < $num_ranges; i++)); do
-   echo NodeName=@RANGE@ CPUs=8 Feature=@AZ@ State=Cloud | sudo tee -a $SLURM_HOME/etc/slurm.conf.d/slurm_nodes.conf
+   echo NodeName=@RANGE@ CPUs=8 RealMemory=14745 Feature=@AZ@ State=Cloud | sudo tee -a $SLURM_HOME/etc/slurm.conf.d/slurm_nodes.conf
    sudo -E sed -i "s|@RANGE@|${ranges_arr[i]}|g" $SLURM_HOME/etc/slurm.conf.d/slurm_nodes.conf
    sudo -E sed -i "s|@AZ@|${azs_arr[i]}|g" $SLURM_HOME/etc/slurm.conf.d/slurm_nodes.conf
 done
@@ -101,3 +102,22 @@ sudo -E sed -i "s|@EXC@|$IPADDR_N|g" $SLURM_HOME/etc/slurm.conf
 sudo systemctl enable slurmctld
 sudo systemctl start slurmctld
 
+# the predictive scaler powers nodes up and down ahead of slurmctld's SuspendTime
+cat << EOF | sudo tee /etc/systemd/system/slurm-aws-scaler.service
+[Unit]
+Description=Predictive scaling of the Slurm AWS burst nodes
+After=slurmctld.service
+
+[Service]
+Environment=SLURM_ROOT=$SLURM_HOME
+ExecStart=$SLURM_HOME/bin/slurm-aws-scaler.py run
+Restart=always
+RestartSec=30
+
+[Install]
+WantedBy=multi-user.target
+EOF
+sudo systemctl daemon-reload
+sudo systemctl enable slurm-aws-scaler
+sudo systemctl start slurm-aws-scaler
+
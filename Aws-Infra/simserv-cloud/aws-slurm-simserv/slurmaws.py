@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Settings and helpers shared by the Slurm power save programs of the AWS burst nodes.
+
+The @...@ placeholders are filled in by the head node deployment (templates/script.tpl).
+SLURM_AWS_ENDPOINT_URL points the AWS clients to another endpoint, e.g. a local EC2 API stub.
+'''
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # pragma: no cover
+    from urllib2 import urlopen
+
+import boto3
+from botocore.config import Config
+
+import hostlist
+import slurmsim
+
+SLURM_ROOT = os.environ.get('SLURM_ROOT', '/nfs/slurm')
+SLURM_POWER_LOG = os.environ.get('SLURM_POWER_LOG', '/var/log/power_save.log')
+# one JSON line per resumed node with its launch latency
+SLURM_RESUME_LOG = os.environ.get('SLURM_RESUME_LOG', '/var/log/power_save_resume.jsonl')
+SLURM_NODES_CONF = os.path.join(SLURM_ROOT, 'etc', 'slurm.conf.d', 'slurm_nodes.conf')
+
+AWS_AMI = '@BASEAMI@'
+AWS_KEYNAME = '@KEYNAME@'
+AWS_SECURITY_GROUP = 'sg-028bc1e61119b8194'
+EFS_ID = 'slurm_efs_id'
+
+# burst node name prefix, subnet, instance type, number of stopped instances kept for fast resumes
+NODE_GROUPS = (
+    ('ip-10-248-156-', '@PRIVATE1@', 'c5.2xlarge', 4),
+    ('ip-10-248-157-', '@PRIVATE2@', 'c5.2xlarge', 4),
+    ('ip-10-248-158-', '@PRIVATE3@', 'c5.2xlarge', 4),
+)
+
+# tags of the burst instances: the node an instance belongs to, the warm pool of a stopped instance
+NODE_TAG = 'slurm-node'
+POOL_TAG = 'slurm-warm-pool'
+
+# reasons of pending jobs which powering up nodes does not start
+BLOCKED_REASONS = ('Dependency', 'JobHeld', 'BeginTime', 'Partition', 'Assoc', 'QOS', 'Reservation')
+
+METADATA_URL = 'http://169.254.169.254/latest/'
+
+_clients = {}
+_clientsLock = threading.Lock()
+_nodeTypes = None
+_nodeTypesMtime = None
+
+
+def log(message):
+    with open(SLURM_POWER_LOG, 'a') as f:
+        f.write('{} {}\n'.format(time.strftime('%a %b %d %H:%M:%S %Z %Y'), message))
+
+
+def metadata(path):
+    return urlopen(METADATA_URL + path, timeout=5).read().decode('utf-8')
+
+
+def region():
+    if not os.environ.get('AWS_DEFAULT_REGION'):
+        os.environ['AWS_DEFAULT_REGION'] = json.loads(metadata('dynamic/instance-identity/document'))['region']
+    return os.environ['AWS_DEFAULT_REGION']
+
+
+def client(service):
+    '''
+    Client of the AWS service shared by all threads of the program, retrying throttled calls.
+    '''
+    with _clientsLock:
+        if service not in _clients:
+            _clients[service] = boto3.client(service, region_name=region(),
+                                             endpoint_url=os.environ.get('SLURM_AWS_ENDPOINT_URL') or None,
+                                             config=Config(retries={'max_attempts': 10, 'mode': 'adaptive'}))
+        return _clients[service]
+
+
+def expandNodes(expression):
+    return list(hostlist.expand(expression))
+
+
+def nodeAddress(host):
+    # ip-10-248-156-4 -> 10.248.156.4
+    return host[3:].replace('-', '.')
+
+
+def nodeGroup(host):
+    '''
+    Returns the (subnet, instance type, warm pool size) of the burst node host, None if it is not a burst node.
+    The instance type of the node definition overrides the one of the group, SLURM_AWS_WARM_POOL_SIZE the pool
+    size of all groups.
+    '''
+    for prefix, subnet, instanceType, poolSize in NODE_GROUPS:
+        if host.startswith(prefix):
+            return subnet, nodeType(host) or instanceType, int(os.environ.get('SLURM_AWS_WARM_POOL_SIZE', poolSize))
+    return None
+
+
+def nodeTypes():
+    '''
+    Returns [(HostList, instance type)] of the node definitions of the nodes include file naming an instance
+    type, like c5.2xlarge, among their features as slurm-aws-planner.py writes them. The definitions are read
+    again when the file changed, the scaler runs for longer than a plan.
+    '''
+    global _nodeTypes, _nodeTypesMtime
+    try:
+        mtime = os.stat(SLURM_NODES_CONF).st_mtime
+    except OSError:
+        mtime = None
+    if _nodeTypes is None or mtime != _nodeTypesMtime:
+        nodeTypes = []
+        try:
+            with open(SLURM_NODES_CONF) as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            lines = []
+        for line in lines:
+            words = dict(x.split('=', 1) for x in line.split() if '=' in x)
+            if line.lstrip().startswith('#') or 'NodeName' not in words:
+                continue
+            # availability zones have no dot
+            types = [x for x in words.get('Feature', '').split(',') if '.' in x]
+            if types:
+                try:
+                    nodeTypes.append((hostlist.HostList(words['NodeName']), types[0]))
+                except ValueError:
+                    pass
+        _nodeTypes, _nodeTypesMtime = nodeTypes, mtime
+    return _nodeTypes
+
+
+def nodeType(host):
+    for hosts, instanceType in nodeTypes():
+        if host in hosts:
+            return instanceType
+    return None
+
+
+def poolName(group):
+    return '{}/{}'.format(group[0], group[1])
+
+
+def findInstances(hosts, states=('pending', 'running', 'stopping', 'stopped')):
+    '''
+    Returns {host: (instance id, state, instance type)} of the instances of the burst nodes hosts, found by their private addresses.
+    '''
+    addresses = dict((nodeAddress(x), x) for x in hosts)
+    instances = {}
+    paginator = client('ec2').get_paginator('describe_instances')
+    # filters take up to 200 values
+    values = sorted(addresses)
+    for start in range(0, len(values), 200):
+        filters = [{'Name': 'private-ip-address', 'Values': values[start:start + 200]},
+                   {'Name': 'instance-state-name', 'Values': list(states)}]
+        for page in paginator.paginate(Filters=filters):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    if instance.get('PrivateIpAddress') in addresses:
+                        host = addresses[instance['PrivateIpAddress']]
+                        instances[host] = (instance['InstanceId'], instance['State']['Name'], instance['InstanceType'])
+    return instances
+
+
+def countPoolMembers():
+    '''
+    Returns {pool name: number of stopped instances} of the warm pools.
+    '''
+    counts = {}
+    filters = [{'Name': 'tag-key', 'Values': [POOL_TAG]}, {'Name': 'instance-state-name', 'Values': ['stopping', 'stopped']}]
+    for page in client('ec2').get_paginator('describe_instances').paginate(Filters=filters):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                pool = [x['Value'] for x in instance.get('Tags', []) if x['Key'] == POOL_TAG]
+                counts[pool[0]] = counts.get(pool[0], 0) + 1
+    return counts
+
+
+def replaceFile(path, text):
+    '''
+    Replaces the contents of path with text at once, readers see either the old or the new file.
+    '''
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        if os.path.exists(path):
+            os.chmod(tmpPath, os.stat(path).st_mode & 0o7777)
+        os.rename(tmpPath, path)
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+
+
+def scontrol(*args):
+    with open(SLURM_POWER_LOG, 'a') as output:
+        return subprocess.call([os.path.join(SLURM_ROOT, 'bin', 'scontrol')] + list(args), stdout=output, stderr=output)
+
+
+def slurmTime(text):
+    # 2020-06-01T10:00:00 in local time
+    return time.mktime(time.strptime(text, '%Y-%m-%dT%H:%M:%S'))
+
+
+def queuedJobs():
+    '''
+    Returns the pending and the started (configuring or running) jobs of squeue as slurmsim Jobs.
+    Jobs pending for reasons no node can remove are left out.
+    '''
+    output = subprocess.check_output([os.path.join(SLURM_ROOT, 'bin', 'squeue'), '-h', '-a', '-t', 'PD,CF,R',
+                                      '-o', '%i|%P|%C|%m|%V|%T|%r'], universal_newlines=True)
+    pending, started = [], []
+    for line in output.splitlines():
+        fields = line.split('|')
+        if len(fields) != 7:
+            continue
+        jobId, partition, cpus, memory, submit, state, reason = fields
+        try:
+            # a job submitted to several partitions runs in one of them, the first is as good a guess as any
+            job = slurmsim.Job(jobId, partition.split(',')[0], int(cpus), slurmsim.parseMemory(memory, int(cpus)), slurmTime(submit), None)
+        except ValueError:
+            continue
+        if state != 'PENDING':
+            started.append(job)
+        elif not reason.startswith(BLOCKED_REASONS):
+            pending.append(job)
+    return pending, started
+
+
+def accountedJobs(start, end=None):
+    '''
+    Returns the jobs which ran from start (a Slurm time) as slurmsim Jobs from the accounting of sacct.
+    '''
+    cmd = [os.path.join(SLURM_ROOT, 'bin', 'sacct'), '-a', '-X', '-P', '-n', '-S', start,
+           '-o', 'JobIDRaw,Partition,Submit,ReqCPUS,ReqMem,Elapsed']
+    if end:
+        cmd += ['-E', end]
+    jobs = []
+    for line in subprocess.check_output(cmd, universal_newlines=True).splitlines():
+        fields = line.split('|')
+        if len(fields) != 6:
+            continue
+        try:
+            cpus, runtime = int(fields[3]), slurmsim.parseDuration(fields[5])
+            job = slurmsim.Job(fields[0], fields[1].split(',')[0], cpus, slurmsim.parseMemory(fields[4], cpus), slurmTime(fields[2]), runtime)
+        except ValueError:
+            continue
+        # jobs cancelled while pending never ran
+        if runtime > 0:
+            jobs.append(job)
+    return sorted(jobs, key=lambda x: x.submit)
+
+
+def nodeState(state):
+    '''
+    Returns the slurmsim Node state of a Slurm node state like IDLE+CLOUD+POWER or IDLE~.
+    '''
+    words = state.split('+')
+    base, flags = words[0].rstrip('*'), set(words[1:])
+    if flags & {'POWER_DOWN', 'POWERING_DOWN', 'DRAIN', 'FAIL', 'MAINT'} or base.rstrip('~#%') in ('DOWN', 'DRAINED', 'DRAINING', 'FAIL', 'FAILING', 'FUTURE', 'UNKNOWN'):
+        return 'unavailable'
+    if flags & {'POWER_UP', 'POWERING_UP'} or base.endswith('#'):
+        return 'booting'
+    if flags & {'POWER', 'POWERED_DOWN'} or base.endswith('~'):
+        return 'down'
+    return 'up'
+
+
+def burstNodes(idleSince, now):
+    '''
+    Returns the burst nodes of scontrol as slurmsim Nodes. idleSince {node: time} keeps when
+    the up nodes were first seen idle, Slurm 17.11 does not report the last busy time.
+    '''
+    output = subprocess.check_output([os.path.join(SLURM_ROOT, 'bin', 'scontrol'), 'show', 'node', '-o'],
+                                     universal_newlines=True)
+    nodes = []
+    for line in output.splitlines():
+        fields = dict(x.split('=', 1) for x in line.split() if '=' in x)
+        if not nodeGroup(fields.get('NodeName', '')):
+            continue
+        try:
+            cpus, memory = int(fields['CPUTot']), int(fields['RealMemory'])
+            node = slurmsim.Node(fields['NodeName'], fields.get('Partitions', '').split(','), cpus, memory, nodeState(fields['State']),
+                                 cpus - int(fields.get('CPUAlloc', 0)), memory - int(fields.get('AllocMem', 0)),
+                                 weight=int(fields.get('Weight', 1)))
+        except (KeyError, ValueError):
+            continue
+        if node.state == 'up' and node.idle():
+            node.idleSince = idleSince.setdefault(node.name, now)
+        else:
+            idleSince.pop(node.name, None)
+        nodes.append(node)
+    return nodes
+
+
+def putMetric(name, value):
+    try:
+        client('cloudwatch').put_metric_data(Namespace='SLURM', MetricData=[{'MetricName': name, 'Value': value}])
+    except Exception as e:
+        # metrics never fail a power save action
+        log('put-metric-data {} failed: {}'.format(name, e))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# Copyright 1983-2020 Keysight Technologies
+'''
+Job traces and a simulation of Slurm's power saving on the AWS burst nodes.
+
+A trace is a JSON lines file with one job per line: submit (seconds), partition, cpus,
+memory (MB) and runtime (seconds). Simulation replays a trace on cloud nodes which boot
+when a job needs them and are terminated after an idle time, optionally steered by a
+controller, and reports the queue wait of the jobs against the node hours and the cost paid.
+'''
+import collections
+import heapq
+import json
+import math
+import random
+import re
+
+# seconds from the power up of a node until slurmd registered
+BOOT_SECONDS = 240
+
+Job = collections.namedtuple('Job', 'id partition cpus memory submit runtime')
+
+
+def parseMemory(text, cpus=1):
+    '''
+    Returns the MB of a Slurm memory size like 2000, 2000M, 4G, 2000Mc (per cpu) or 4Gn (per node).
+    '''
+    match = re.match(r'^([\d.]+)([KMGT]?)([cn]?)$', text.strip())
+    if not match:
+        return 0
+    size = float(match.group(1)) * {'K': 1.0 / 1024, '': 1, 'M': 1, 'G': 1024, 'T': 1024 * 1024}[match.group(2)]
+    return int(size * cpus if match.group(3) == 'c' else size)
+
+
+def parseDuration(text):
+    '''
+    Returns the seconds of a Slurm duration [days-]hours:minutes:seconds.
+    '''
+    days, _, clock = text.strip().rpartition('-')
+    seconds = 0
+    for part in clock.split(':'):
+        seconds = seconds * 60 + float(part)
+    return int(days or 0) * 86400 + seconds
+
+
+def readTrace(path):
+    '''
+    Returns the jobs of the trace file in submit order.
+    '''
+    jobs = []
+    with open(path) as f:
+        for number, line in enumerate(f):
+            if line.strip():
+                record = json.loads(line)
+                jobs.append(Job(record.get('id', number), record.get('partition', 'all'), int(record.get('cpus', 1)),
+                                int(record.get('memory', 0)), float(record['submit']), float(record['runtime'])))
+    return sorted(jobs, key=lambda x: x.submit)
+
+
+def writeTrace(jobs, f):
+    for job in jobs:
+        f.write(json.dumps(job._asdict(), sort_keys=True) + '\n')
+
+
+# (cpus, MB) of the synthetic jobs
+SHAPES = ((1, 1800), (2, 3600), (4, 7200), (8, 14400))
+
+
+def syntheticTrace(jobsPerHour, hours, seed=0, partition='all', shapes=SHAPES):
+    '''
+    Returns Poisson arrivals following a day cycle around the mean rate, the quietest hour at
+    a fifth of the busiest. Jobs take one of the shapes and an exponential runtime of 20
+    minutes mean.
+    '''
+    generator = random.Random(seed)
+    peak = jobsPerHour * 1.67 / 3600.0
+    jobs, now = [], 0.0
+    while True:
+        # thinning of a Poisson process at the peak rate
+        now += generator.expovariate(peak)
+        if now >= hours * 3600:
+            return jobs
+        if generator.random() * peak <= peak * (1 + 0.67 * math.sin(2 * math.pi * now / 86400)) / 1.67:
+            cpus, memory = generator.choice(shapes)
+            jobs.append(Job(len(jobs), partition, cpus, memory, round(now, 1), round(generator.expovariate(1 / 1200.0), 1)))
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {'count': len(values), 'mean': round(sum(values) / len(values), 1), 'median': round(values[len(values) // 2], 1),
+            'p90': round(values[int(len(values) * 0.9)], 1), 'max': round(values[-1], 1)}
+
+
+class Node(object):
+    '''
+    A burst node as the controller sees it. state is down (powered down), booting, up or
+    unavailable (powering down, down or drained), idleSince the time an up node ran its last job.
+    price is per hour, Slurm chooses the nodes of lower weight first.
+    '''
+    def __init__(self, name, partitions, cpus, memory, state='down', freeCpus=None, freeMemory=None, idleSince=None, price=1.0, weight=1):
+        self.name = name
+        self.partitions = partitions
+        self.cpus = cpus
+        self.memory = memory
+        self.state = state
+        self.freeCpus = cpus if freeCpus is None else freeCpus
+        self.freeMemory = memory if freeMemory is None else freeMemory
+        self.idleSince = idleSince
+        self.price = price
+        self.weight = weight
+
+    def fits(self, job):
+        return job.cpus <= self.freeCpus and job.memory <= self.freeMemory
+
+    def idle(self):
+        return self.freeCpus == self.cpus and self.freeMemory == self.memory
+
+
+class Simulation(object):
+    '''
+    Replays jobs on the nodes the way slurmctld with power saving does: a job starts on the
+    up node of the lowest weight it fits, else waits on a booting node or powers up a powered
+    down node, again of the lowest weight, and idle nodes are powered down after suspendTime. A controller is called every
+    controller.interval seconds with observe(now, arrived jobs) and plan(now, nodes, pending
+    jobs), returning the nodes to power up and down.
+    '''
+    def __init__(self, nodes, suspendTime=60, boot=BOOT_SECONDS, controller=None):
+        self.nodes = nodes
+        self.suspendTime = suspendTime
+        self.boot = boot
+        self.controller = controller
+
+    def run(self, jobs):
+        nodes = self.nodes
+        placeable = [x for x in jobs if any(x.partition in y.partitions and x.cpus <= y.cpus and x.memory <= y.memory for y in nodes)]
+        pending, waits, events = [], [], []
+        readyAt, poweredAt = {}, {}
+        nodeSeconds, cost = 0.0, 0.0
+        arrivals = collections.deque(placeable)
+        now = placeable[0].submit if placeable else 0.0
+        nextPlan = now
+        # jobs arrived since the last controller call
+        observed = []
+
+        def powerUp(node, now):
+            node.state = 'booting'
+            readyAt[node.name] = now + self.boot
+            poweredAt[node.name] = now
+            heapq.heappush(events, (now + self.boot, 'ready', node.name))
+
+        def powerDown(node, now):
+            nonlocal nodeSeconds, cost
+            node.state = 'down'
+            node.idleSince = None
+            seconds = now - poweredAt.pop(node.name)
+            nodeSeconds += seconds
+            cost += seconds * node.price / 3600
+
+        def start(job, node, now):
+            node.freeCpus -= job.cpus
+            node.freeMemory -= job.memory
+            node.idleSince = None
+            begin = max(now, readyAt.get(node.name, now)) if node.state == 'booting' else now
+            waits.append(begin - job.submit)
+            heapq.heappush(events, (begin + job.runtime, 'end', (node.name, job.cpus, job.memory)))
+
+        byName = dict((x.name, x) for x in nodes)
+        # slurmctld avoids powering up nodes
+        order = {'up': 0, 'booting': 1, 'down': 2}
+        while arrivals or pending or events or any(x.state != 'down' for x in nodes):
+            arrived = []
+            while arrivals and arrivals[0].submit <= now:
+                arrived.append(arrivals.popleft())
+            pending.extend(arrived)
+            observed.extend(arrived)
+            while events and events[0][0] <= now:
+                _, kind, data = heapq.heappop(events)
+                if kind == 'ready':
+                    node = byName[data]
+                    if node.state == 'booting':
+                        node.state = 'up'
+                        node.idleSince = now if node.idle() else None
+                else:
+                    node = byName[data[0]]
+                    node.freeCpus += data[1]
+                    node.freeMemory += data[2]
+                    if node.idle():
+                        node.idleSince = now
+            waiting = []
+            for job in pending:
+                candidates = [x for x in nodes if job.partition in x.partitions and x.state in order and x.fits(job)]
+                node = min(candidates, key=lambda x: (order[x.state], x.weight)) if candidates else None
+                if node is None:
+                    waiting.append(job)
+                    continue
+                if node.state == 'down':
+                    powerUp(node, now)
+                start(job, node, now)
+            pending = waiting
+            if self.controller and now >= nextPlan:
+                self.controller.observe(now, observed)
+                observed = []
+                up, down = self.controller.plan(now, nodes, pending)
+                for node in up:
+                    if node.state == 'down':
+                        powerUp(node, now)
+                for node in down:
+                    if node.state == 'up' and node.idle():
+                        powerDown(node, now)
+                nextPlan = now + self.controller.interval
+            for node in nodes:
+                if node.state == 'up' and node.idleSince is not None and now - node.idleSince >= self.suspendTime:
+                    powerDown(node, now)
+            # the next arrival, job end, boot, controller call or idle timeout
+            candidates = [x.idleSince + self.suspendTime for x in nodes if x.state == 'up' and x.idleSince is not None]
+            if arrivals:
+                candidates.append(arrivals[0].submit)
+            if events:
+                candidates.append(events[0][0])
+            if self.controller and (arrivals or pending or events or any(x.state != 'down' for x in nodes)):
+                candidates.append(nextPlan)
+            if not candidates:
+                break
+            now = max(min(candidates), now + 1e-6)
+        return {'jobs': len(placeable), 'unplaceable': len(jobs) - len(placeable), 'wait_seconds': percentiles(waits),
+                'node_hours': round(nodeSeconds / 3600, 1), 'cost': round(cost, 2)}
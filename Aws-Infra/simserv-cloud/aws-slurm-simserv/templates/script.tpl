@@ -32,7 +32,10 @@ libXau libXmu libGLU \
 postgresql-libs \
 postgresql-devel
 sudo mv /tmp/.env /project/code/simserv
-sudo mv /tmp/sitecluster /tmp/sitecluster.py /project/code/simserv/sitecluster/bin/
+sudo mv /tmp/sitecluster /tmp/sitecluster.py /tmp/sitecluster_client.py /project/code/simserv/sitecluster/bin/
+sudo cp /home/centos/hostlist.py /project/code/simserv/sitecluster/bin/
+# compiled once here, the bin directory is not writable for the users calling sitecluster
+sudo python3 -m compileall -q /project/code/simserv/sitecluster/bin
 sudo mv /tmp/.env /project/code/simserv
 ########################################################privateIpAssign################################
 prvIp=`hostname -i`
@@ -55,6 +58,7 @@ sudo yum update -y
 sudo yum --nogpgcheck install wget curl epel-release nano nfs-utils -y
 sudo yum --nogpgcheck install python2-pip -y
 sudo pip install awscli
+sudo python3 -m pip install boto3
 sudo pip install https://s3.amazonaws.com/cloudformation-examples/aws-cfn-bootstrap-latest.tar.gz
 sudo chmod +x /bin/cfn-*
 sudo mkdir -p /nfs
@@ -68,12 +72,24 @@ sudo sed -i "s|@BASEAMI@|ami-0cb72d2e599cffbf9|g" /home/centos/slurm-aws-startup
 sudo sed -i "s|@PRIVATE1@|subnet-07fd3a799b83fa30c|g" /home/centos/slurm-aws-startup.sh
 sudo sed -i "s|@PRIVATE2@|subnet-0e8aeba843c58e698|g" /home/centos/slurm-aws-startup.sh
 sudo sed -i "s|@PRIVATE3@|subnet-0fb818c58048da2c3|g" /home/centos/slurm-aws-startup.sh
+sudo sed -i "s|@KEYNAME@|Slurm-key-2020|g" /home/centos/slurmaws.py
+sudo sed -i "s|@BASEAMI@|ami-0cb72d2e599cffbf9|g" /home/centos/slurmaws.py
+sudo sed -i "s|@PRIVATE1@|subnet-07fd3a799b83fa30c|g" /home/centos/slurmaws.py
+sudo sed -i "s|@PRIVATE2@|subnet-0e8aeba843c58e698|g" /home/centos/slurmaws.py
+sudo sed -i "s|@PRIVATE3@|subnet-0fb818c58048da2c3|g" /home/centos/slurmaws.py
 chmod +x /home/centos/slurm-mgmtd.sh
 sudo sed -i -e 's/\r$//' /home/centos/slurm-aws-startup.sh
 sudo sed -i -e 's/\r$//' /home/centos/slurm-aws-shutdown.sh
+sudo sed -i -e 's/\r$//' /home/centos/slurm-aws-resume.py
+sudo sed -i -e 's/\r$//' /home/centos/slurm-aws-suspend.py
+sudo sed -i -e 's/\r$//' /home/centos/slurmaws.py
+sudo sed -i -e 's/\r$//' /home/centos/slurm-aws-scaler.py
+sudo sed -i -e 's/\r$//' /home/centos/slurm-aws-planner.py
+sudo sed -i -e 's/\r$//' /home/centos/slurmsim.py
 sudo sed -i -e 's/\r$//' /home/centos/slurm-mgmtd.sh
 sudo sed -i -e 's/\r$//' /home/centos/slurm-compute1.sh
 sudo sed -i  "s/slurm_efs_id/fs-e7c64756/g" /home/centos/slurm-aws-startup.sh
+sudo sed -i  "s/slurm_efs_id/fs-e7c64756/g" /home/centos/slurmaws.py
 sudo /home/centos/slurm-mgmtd.sh 17.11.8 eu-west-3a,eu-west-3b,eu-west-3c ip-10-248-156-[6-250],ip-10-248-157-[6-250],ip-10-248-158-[6-250]
 
 sudo mv /home/centos/slurm-17.11.8.tar.bz2 /tmp/
@@ -81,6 +97,9 @@ sudo mv /home/centos/slurm.conf /tmp/
 sudo mv /home/centos/gres.conf /tmp/
 sudo mv /home/centos/slurm-aws-startup.sh /tmp/
 sudo mv /home/centos/slurm-aws-shutdown.sh /tmp/
+sudo mv /home/centos/slurm-aws-resume.py /home/centos/slurm-aws-suspend.py /home/centos/slurmaws.py /tmp/
+sudo mv /home/centos/slurm-aws-scaler.py /home/centos/slurm-aws-planner.py /home/centos/slurmsim.py /tmp/
+sudo mv /home/centos/hostlist.py /tmp/
 sudo mv /home/centos/slurm-mgmtd.sh /tmp/
 sudo mv /home/centos/slurm-17.11.8 /tmp/
 sudo mv /home/centos/*.pem /root/
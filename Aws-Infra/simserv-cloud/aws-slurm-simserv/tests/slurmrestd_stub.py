@@ -0,0 +1,198 @@
+'''
+Local stand-in for slurmrestd v0.0.39 with the endpoints SlurmRestSiteCluster uses.
+
+Jobs are kept in memory: submitted jobs are RUNNING until finish() moves them to the
+accounting, as slurmctld purges finished jobs. Submissions are checked against the v0.0.39
+job description the way slurmrestd parses it, requests and connections are counted.
+'''
+import json
+import os
+import re
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+VERSION = 'v0.0.39'
+
+# fields of the v0.0.39 job description taking a {"set", "infinite", "number"} struct
+NUMBER_FIELDS = ('memory_per_node', 'memory_per_cpu', 'time_limit', 'time_minimum')
+# fields taking flag lists
+FLAG_FIELDS = {'mail_type': ('BEGIN', 'END', 'FAIL', 'REQUEUE', 'TIME=100%', 'TIME=90%', 'TIME=80%', 'TIME=50%',
+                             'STAGE_OUT', 'ARRAY_TASKS', 'INVALID_DEPENDENCY')}
+INTEGER_FIELDS = ('minimum_nodes', 'cpus_per_task')
+
+
+def number(value, isSet=True):
+    return {'set': isSet, 'infinite': False, 'number': value}
+
+
+def exitCode(code, sig=0):
+    return {'status': 'SUCCESS' if not code and not sig else 'ERROR', 'return_code': number(code),
+            'signal': {'id': number(sig, bool(sig)), 'name': ''}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        if self.connection.family != socket.AF_UNIX:
+            # the headers and the body are written separately
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def answer(self, status, document):
+        body = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, method):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        with stub.lock:
+            stub.requests.append((method, url.path))
+        if stub.token and self.headers.get('X-SLURM-USER-TOKEN') != stub.token:
+            return self.answer(401, {'errors': [{'error': 'authentication failed'}]})
+        payload = None
+        if method == 'POST':
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        prefix = '/slurm/{}/'.format(VERSION)
+        if method == 'GET' and url.path == prefix + 'partitions':
+            return self.answer(200, {'partitions': [{'name': x} for x in stub.partitions], 'errors': []})
+        if method == 'POST' and url.path == prefix + 'job/submit':
+            errors = stub.validate(payload.get('job', {}))
+            if errors:
+                return self.answer(400, {'errors': [{'error': x} for x in errors]})
+            return self.answer(200, {'job_id': stub.submit(payload), 'step_id': 'batch', 'errors': []})
+        if method == 'GET' and url.path == prefix + 'jobs':
+            with stub.lock:
+                jobs = [stub.controllerJob(x) for x in stub.active.values()]
+            return self.answer(200, {'jobs': jobs, 'errors': []})
+        match = re.match(re.escape(prefix) + r'job/(\d+)$', url.path)
+        if method == 'DELETE' and match:
+            if not stub.cancel(int(match.group(1))):
+                return self.answer(200, {'errors': [{'error': 'Job has already finished'}]})
+            return self.answer(200, {'errors': []})
+        if method == 'GET' and url.path == '/slurmdb/{}/jobs'.format(VERSION):
+            if not stub.accountingEnabled:
+                return self.answer(500, {'errors': [{'error': 'Unable to connect to database'}]})
+            steps = ','.join(parse_qs(url.query).get('step', [])).split(',')
+            with stub.lock:
+                jobs = [stub.accountingJob(x) for x in stub.finished.values() if str(x['job_id']) in steps]
+            return self.answer(200, {'jobs': jobs, 'errors': []})
+        self.answer(404, {'errors': [{'error': 'Unable find requested URL'}]})
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+
+class _TCPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = socketserver.UnixStreamServer.get_request(self)
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('local', 0)
+
+
+class SlurmRestStub(object):
+    def __init__(self, socketPath=None, token=None, partitions=('all',)):
+        self.token = token
+        self.partitions = list(partitions)
+        self.accountingEnabled = True
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = 0
+        self.submitted = []
+        self.active = {}
+        self.finished = {}
+        self.nextJobId = 100
+        if socketPath:
+            self.server = _UnixServer(socketPath, _Handler)
+            self.url = 'unix://' + socketPath
+        else:
+            self.server = _TCPServer(('127.0.0.1', 0), _Handler)
+            self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.server.stub = self
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.url.startswith('unix://') and os.path.exists(self.url[7:]):
+            os.unlink(self.url[7:])
+
+    def validate(self, job):
+        errors = []
+        for field in NUMBER_FIELDS:
+            value = job.get(field)
+            if value is not None and not (isinstance(value, dict) and isinstance(value.get('number'), int) and 'set' in value):
+                errors.append('{} must be a number struct in {}, got {}'.format(field, VERSION, json.dumps(value)))
+        for field, flags in FLAG_FIELDS.items():
+            value = job.get(field)
+            if value is not None and not (isinstance(value, list) and all(x in flags for x in value)):
+                errors.append('{} must be a list of {} in {}, got {}'.format(field, ','.join(flags), VERSION, json.dumps(value)))
+        for field in INTEGER_FIELDS:
+            if field in job and not isinstance(job[field], int):
+                errors.append('{} must be an integer, got {}'.format(field, json.dumps(job[field])))
+        if not isinstance(job.get('environment', []), list):
+            errors.append('environment must be a list of NAME=value')
+        if not job.get('current_working_directory'):
+            errors.append('current_working_directory is required')
+        return errors
+
+    def submit(self, payload):
+        with self.lock:
+            jobId = self.nextJobId
+            self.nextJobId += 1
+            self.submitted.append(payload)
+            self.active[jobId] = {'job_id': jobId, 'state': 'RUNNING', 'exit': (0, 0)}
+        return jobId
+
+    def cancel(self, jobId):
+        with self.lock:
+            if jobId not in self.active:
+                return False
+            self.active[jobId]['state'] = 'CANCELLED'
+        return True
+
+    def finish(self, jobId, state='COMPLETED', code=0, sig=0, purge=True):
+        with self.lock:
+            job = self.active.pop(jobId) if purge else self.active[jobId]
+            job.update(state=state, exit=(code, sig))
+            self.finished[jobId] = job
+
+    def controllerJob(self, job):
+        return {'job_id': job['job_id'], 'job_state': [job['state']], 'exit_code': exitCode(*job['exit']),
+                'array_job_id': number(0), 'array_task_id': number(0, False)}
+
+    def accountingJob(self, job):
+        return {'job_id': job['job_id'], 'state': {'current': job['state'], 'reason': 'None'}, 'exit_code': exitCode(*job['exit']),
+                'array': {'job_id': 0, 'task_id': number(0, False)}}
+
+    def count(self, method, path):
+        return len([x for x in self.requests if x == (method, path)])
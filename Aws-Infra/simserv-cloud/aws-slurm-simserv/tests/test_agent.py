@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+# runs the command after the options on this host, rejecting the step sharing options of Slurm 20.11 as 17.11 does
+SRUN = '''#!/bin/sh
+if [ "$1" = "--version" ]; then echo "slurm ${SRUN_VERSION}"; exit 0; fi
+echo "$*" >> "$SITE_CLUSTER_CACHE_DIR/srun.log"
+case "$SRUN_VERSION $*" in
+17.*--overlap*) echo "srun: unrecognized option '--overlap'" >&2; exit 1;;
+esac
+case "$*" in
+*" agent "*) if [ -n "$SRUN_NO_AGENT" ]; then exit 1; fi;;
+esac
+while [ $# -gt 0 ]; do
+  case "$1" in
+  -w) shift 2;;
+  -*) shift;;
+  *) break;;
+  esac
+done
+exec "$@"
+'''
+
+
+class NodeAgentServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = sitecluster._NodeAgentServer('secret')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def request(self, request):
+        connection = socket.create_connection(('localhost', self.server.server_address[1]))
+        try:
+            connection.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            messages = []
+            # the agent keeps the connection open after the exit status, as the client closes it
+            for line in connection.makefile('rb'):
+                messages.append(json.loads(line.decode('utf-8')))
+                if 'exit' in messages[-1] or 'error' in messages[-1]:
+                    return messages
+            return messages
+        finally:
+            connection.close()
+
+    def testCommand(self):
+        messages = self.request({'token': 'secret', 'cmdargs': ['sh', '-c', 'echo $$; echo oops >&2; exit 3'], 'cwd': '/'})
+        output = b''.join(sitecluster.base64.b64decode(x['data']) for x in messages if x.get('fd') == 1)
+        self.assertEqual(str(messages[0]['pid']).encode('ascii') + b'\n', output)
+        self.assertEqual(b'oops\n', b''.join(sitecluster.base64.b64decode(x['data']) for x in messages if x.get('fd') == 2))
+        self.assertEqual({'exit': 3}, messages[-1])
+
+    def testInvalidToken(self):
+        self.assertEqual([{'error': 'invalid token'}], self.request({'token': 'guess', 'cmdargs': ['true']}))
+
+    def testCommandNotFound(self):
+        messages = self.request({'token': 'secret', 'cmdargs': ['/nonexistent/command']})
+        self.assertEqual(127, messages[-1]['exit'])
+
+
+class StartNodeAgentTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.env = dict(os.environ, SITE_CLUSTER_USE_SLURM='1', SITE_CLUSTER_CACHE_DIR=self.directory,
+                        PATH=self.directory + os.pathsep + os.environ['PATH'], SRUN_VERSION='17.11.8',
+                        SLURM_JOB_ID='77', SLURM_JOB_NODELIST='localhost', SLURM_TASKS_PER_NODE='2',
+                        TMPDIR=self.directory, SITE_CLUSTER_AGENT_TIMEOUT='10')
+        for name in [x for x in self.env if x.startswith('SITE_CLUSTER_USE_') and x != 'SITE_CLUSTER_USE_SLURM']:
+            del self.env[name]
+        for name in ['SITE_CLUSTER_SOCKET', 'SITE_CLUSTER_AGENT', 'SITE_CLUSTER_SLURM_VERSION', 'PBS_JOBID', 'LSB_JOBID', 'JOB_ID']:
+            self.env.pop(name, None)
+        with open(os.path.join(self.directory, 'srun'), 'w') as f:
+            f.write(SRUN)
+        os.chmod(os.path.join(self.directory, 'srun'), 0o755)
+
+    def tearDown(self):
+        # the agents keep running after startnode returned
+        for pid in [x for x in os.listdir('/proc') if x.isdigit()]:
+            try:
+                with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+                    cmdline = f.read().split(b'\0')
+            except (IOError, OSError):
+                continue
+            if b'agent' in cmdline and any(x.startswith(self.directory.encode('utf-8')) for x in cmdline):
+                try:
+                    os.kill(int(pid), signal.SIGTERM)
+                except OSError:
+                    pass
+        shutil.rmtree(self.directory)
+
+    def startnode(self, *args, **env):
+        proc = subprocess.Popen([sys.executable, os.path.join(DIRECTORY, 'sitecluster.py'), 'startnode'] + list(args), cwd=self.directory,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=dict(self.env, **env), universal_newlines=True)
+        stdout, stderr = proc.communicate(timeout=60)
+        return proc.returncode, stdout, stderr
+
+    def launches(self):
+        with open(os.path.join(self.directory, 'srun.log')) as f:
+            return f.read().splitlines()
+
+    def agentState(self):
+        return sitecluster.StateFile('agent-77-localhost.json', self.directory).read()
+
+    def testLaterCommandsGoThroughTheAgent(self):
+        self.assertEqual((0, 'first\n', ''), self.startnode('1', 'echo', 'first'))
+        self.assertIn('port', self.agentState())
+        self.assertEqual((3, 'second\n'), self.startnode('0', 'sh', '-c', 'echo second; exit 3')[:2])
+        # the launcher only started the agent
+        launches = self.launches()
+        self.assertEqual(1, len(launches))
+        self.assertIn('-w localhost --mem=0 --oversubscribe --cpu_bind=none /usr/bin/env python3', launches[0])
+        self.assertIn(' agent --token-file ', launches[0])
+
+    def testStepSharingOptionsOfNewSlurm(self):
+        self.assertEqual(0, self.startnode('0', 'true', SRUN_VERSION='20.11.9')[0])
+        self.assertIn('-w localhost --overlap --whole --cpu-bind=none /usr/bin/env python3', self.launches()[0])
+
+    def testPidOfTheCommand(self):
+        pidFile = os.path.join(self.directory, 'pid')
+        returncode, stdout, _ = self.startnode('0', 'sh', '-c', 'echo $$', SITE_CLUSTER_PID_FILE=pidFile)
+        self.assertEqual(0, returncode)
+        with open(pidFile) as f:
+            self.assertEqual(stdout, f.read())
+
+    def testLauncherWithoutAgent(self):
+        self.assertEqual((0, 'first\n'), self.startnode('0', 'echo', 'first', SRUN_NO_AGENT='1')[:2])
+        self.assertIn('failed', self.agentState())
+        self.assertEqual((4, 'second\n'), self.startnode('0', 'sh', '-c', 'echo second; exit 4')[:2])
+        # one failed agent start, then every command goes through the launcher
+        self.assertEqual([False, True, True], [' agent ' not in x for x in self.launches()])
+
+    def testAgentDisabled(self):
+        self.assertEqual((0, 'first\n'), self.startnode('0', 'echo', 'first', SITE_CLUSTER_AGENT='0')[:2])
+        self.assertEqual(1, len(self.launches()))
+        self.assertEqual({}, self.agentState())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import random
+import subprocess
+import sys
+import unittest
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import hostlist  # noqa: E402
+
+
+class ExpandTest(unittest.TestCase):
+    def testRanges(self):
+        self.assertEqual(['ip-10-248-156-4', 'ip-10-248-156-5', 'ip-10-248-156-12', 'ip-10-248-157-1', 'ip-10-248-157-2'],
+                         list(hostlist.expand('ip-10-248-156-[4-5,12],ip-10-248-157-[1-2]')))
+
+    def testPaddedAndNestedGroups(self):
+        self.assertEqual(['n008', 'n009', 'n010'], list(hostlist.expand('n[008-010]')))
+        self.assertEqual(['r1n1', 'r1n2', 'r2n1', 'r2n2', 'login'], list(hostlist.expand('r[1-2]n[1-2], login')))
+
+    def testInvalid(self):
+        for expression in ['n[1-', 'n1]', 'n[3-1]', 'n[a]', 'n[1,,2]']:
+            self.assertRaises(ValueError, hostlist.HostList, expression)
+
+    def testLengthMembershipAndIndexing(self):
+        hosts = hostlist.HostList('ip-10-248-156-[4-9,12],ip-10-248-157-[1-200],n[08-10]')
+        expanded = list(hosts)
+        self.assertEqual(len(expanded), len(hosts))
+        for index in [0, 5, 6, 7, 206, 207, 209, -1, -3]:
+            self.assertEqual(expanded[index], hosts[index])
+        self.assertEqual(expanded[3:40:7], hosts[3:40:7])
+        self.assertEqual(expanded[-5:], hosts[-5:])
+        self.assertRaises(IndexError, hosts.__getitem__, len(expanded))
+        self.assertRaises(IndexError, hosts.__getitem__, -len(expanded) - 1)
+        for host in expanded:
+            self.assertIn(host, hosts)
+        for host in ['ip-10-248-156-10', 'ip-10-248-157-0', 'ip-10-248-157-201', 'n8', 'n011', 'ip-10-248-156-04']:
+            self.assertNotIn(host, hosts)
+
+    def testLargeRangesAreNotMaterialised(self):
+        hosts = hostlist.HostList('r[1-1000]n[1-100000]')
+        self.assertEqual(100000000, len(hosts))
+        self.assertEqual('r500n100000', hosts[49999999])
+        self.assertIn('r1000n99999', hosts)
+        self.assertEqual('r1n1', next(hostlist.expand('r[1-1000]n[1-100000]')))
+
+
+class CompressTest(unittest.TestCase):
+    def testCompress(self):
+        self.assertEqual('ip-10-248-156-[4-6,12],ip-10-248-157-1',
+                         hostlist.compress(['ip-10-248-156-4', 'ip-10-248-156-5', 'ip-10-248-156-6', 'ip-10-248-156-12', 'ip-10-248-157-1']))
+        self.assertEqual('n[008-010]', hostlist.compress(['n008', 'n009', 'n010']))
+        self.assertEqual('login,n[1-2]', hostlist.compress(['login', 'n1', 'n2']))
+        self.assertEqual('', hostlist.compress([]))
+
+    def testOrderIsKept(self):
+        self.assertEqual('n[3,1-2]', hostlist.compress(['n3', 'n1', 'n2']))
+
+    def testRoundTrips(self):
+        generator = random.Random(20)
+        for _ in range(200):
+            hosts = []
+            for _ in range(generator.randint(1, 40)):
+                prefix = generator.choice(['ip-10-248-156-', 'ip-10-248-157-', 'n', 'r1n', 'gpu'])
+                number = generator.randint(0, 120)
+                width = generator.choice([0, 0, 3])
+                hosts.append(prefix + '%0*d' % (width, number) + generator.choice(['', '', '-ib']))
+            if generator.random() < 0.5:
+                hosts.sort()
+            expression = hostlist.compress(hosts)
+            self.assertEqual(hosts, list(hostlist.expand(expression)), expression)
+            self.assertEqual(expression, hostlist.compress(hostlist.expand(expression)))
+
+    def testExpressionRoundTrips(self):
+        for expression in ['ip-10-248-156-[4-9,12],ip-10-248-157-[1-200]', 'n[001-100]', 'a1,b[2-3]-ib,c']:
+            self.assertEqual(expression, hostlist.compress(hostlist.expand(expression)))
+
+    def testLargeRoundTrip(self):
+        expression = 'ip-10-248-156-[1-100000]'
+        self.assertEqual(expression, hostlist.compress(hostlist.expand(expression)))
+
+
+class CommandTest(unittest.TestCase):
+    def command(self, *args, **kwargs):
+        return subprocess.check_output([sys.executable, os.path.join(DIRECTORY, 'hostlist.py')] + list(args),
+                                       universal_newlines=True, **kwargs)
+
+    def testCommands(self):
+        self.assertEqual('n1\nn2\nn3\n', self.command('expand', 'n[1-3]'))
+        self.assertEqual('n[1-3]\n', self.command('compress', 'n1', 'n2', 'n3'))
+        self.assertEqual('7\n', self.command('count', 'n[1-3]', 'm[1-4]'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+
+class ListingCluster(sitecluster.SiteCluster):
+    '''
+    Lists the jobs of self.active, jobs which left the queue completed.
+    '''
+    def __init__(self):
+        sitecluster.SiteCluster.__init__(self, use_argv=False)
+        self.active = {}
+        self.listings = 0
+        self.queried = []
+
+    def getActiveJobStates(self):
+        self.listings += 1
+        return dict(self.active)
+
+    def getJobStatuses(self, idsOnCluster, addStatus=False):
+        self.queried.append(list(idsOnCluster))
+        return ['COMPLETED 0' for _ in idsOnCluster]
+
+
+class JobStateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ.update(SITE_CLUSTER_CACHE_DIR=self.directory, SITE_CLUSTER_CACHE_TTL='60', SITE_CLUSTER_CACHE_MAX_STALE='30')
+        self.cluster = ListingCluster()
+        self.cluster.active = {'1': 'RUNNING', '2': 'PENDING'}
+        self.cache = sitecluster.JobStateCache(self.cluster, 60)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def age(self, seconds):
+        table = self.cache.table.read()
+        table['time'] = time.time() - seconds
+        self.cache.table.write(table)
+
+    def loggedCalls(self):
+        with open(self.cache.statsLog) as f:
+            return len(f.readlines())
+
+    def cachestats(self):
+        output = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['sitecluster', 'cachestats']), contextlib.redirect_stdout(output):
+            self.cluster.cachestats()
+        return json.loads(output.getvalue())
+
+    def testWithinTTL(self):
+        self.assertEqual(['RUNNING', 'COMPLETED 0'], self.cluster.lookupJobStatuses(['1', '3']))
+        self.cluster.active = {}
+        self.assertEqual(['RUNNING', 'PENDING'], self.cluster.lookupJobStatuses(['1', '2.headnode']))
+        self.assertEqual(1, self.cluster.listings)
+        # only the jobs missing from the table go to the backend
+        self.assertEqual([['3']], self.cluster.queried)
+        self.assertEqual({'hits': 3, 'misses': 1, 'refreshes': 1, 'stale': 0, 'ttl': 60.0}, self.cachestats())
+
+    def testStaleTableIsServedWhileRefreshing(self):
+        self.cache.getJobStatuses(['1'])
+        self.age(70)
+        self.cluster.active = {'1': 'COMPLETING'}
+        with mock.patch.object(self.cache, 'refreshInBackground') as refreshInBackground:
+            self.assertEqual(['RUNNING'], self.cache.getJobStatuses(['1']))
+        # this caller refreshes, holding the lock, without waiting for the scheduler
+        lockFile = refreshInBackground.call_args[0][0]
+        self.assertIsNone(self.cache.table.lock(blocking=False))
+        # the others keep reading the stale table meanwhile
+        self.assertEqual(['RUNNING'], self.cache.getJobStatuses(['1']))
+        self.assertEqual(1, refreshInBackground.call_count)
+        with lockFile:
+            self.cache._refresh()
+        self.assertEqual(['COMPLETING'], self.cache.getJobStatuses(['1']))
+        self.assertEqual(2, self.cluster.listings)
+        self.assertEqual({'hits': 4, 'misses': 0, 'refreshes': 2, 'stale': 2, 'ttl': 60.0}, self.cachestats())
+
+    def testBackgroundRefresh(self):
+        self.cache.getJobStatuses(['1'])
+        self.age(70)
+        self.cluster.active = {'1': 'COMPLETING'}
+        self.assertEqual(['RUNNING'], self.cache.getJobStatuses(['1']))
+        # a child process writes the refreshed table
+        deadline = time.time() + 10
+        while self.cache.table.read()['jobs'] != {'1': 'COMPLETING'} and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(['COMPLETING'], self.cache.getJobStatuses(['1']))
+
+    def testTooOldToBeServed(self):
+        self.cache.getJobStatuses(['1'])
+        self.age(100)
+        self.cluster.active = {'1': 'COMPLETING'}
+        with mock.patch.object(self.cache, 'refreshInBackground') as refreshInBackground:
+            self.assertEqual(['COMPLETING'], self.cache.getJobStatuses(['1']))
+        self.assertFalse(refreshInBackground.called)
+
+    def testCountersAreFoldedByTheRefresh(self):
+        for _ in range(3):
+            self.cache.getJobStatuses(['1', '2'])
+        self.assertEqual(3, self.loggedCalls())
+        self.age(100)
+        self.cache.getJobStatuses(['3'])
+        # the refresh took the counters of the log before this call appended its own
+        self.assertEqual({'hits': 6, 'misses': 0, 'refreshes': 1, 'stale': 0}, self.cache.stats.read())
+        self.assertEqual(1, self.loggedCalls())
+        self.assertEqual({'hits': 6, 'misses': 1, 'refreshes': 2, 'stale': 0, 'ttl': 60.0}, self.cachestats())
+
+    def testWithoutTTL(self):
+        del os.environ['SITE_CLUSTER_CACHE_TTL']
+        self.assertEqual(['COMPLETED 0'], self.cluster.lookupJobStatuses(['1']))
+        self.assertEqual(0, self.cluster.listings)
+        self.assertEqual({'hits': 0, 'misses': 0, 'refreshes': 0, 'stale': 0, 'ttl': 0.0}, self.cachestats())
+
+
+if __name__ == '__main__':
+    unittest.main()
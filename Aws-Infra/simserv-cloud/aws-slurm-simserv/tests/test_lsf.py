@@ -0,0 +1,165 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+# recorded from LSF 10.1, bjobs exits with 255 when one of the jobs is not found
+BJOBS_JSON = '''{
+  "COMMAND":"bjobs",
+  "JOBS":7,
+  "RECORDS":[
+    {"JOBID":"201","JOBINDEX":"0","STAT":"RUN","EXIT_CODE":""},
+    {"JOBID":"202","JOBINDEX":"0","STAT":"DONE","EXIT_CODE":""},
+    {"JOBID":"203","JOBINDEX":"0","STAT":"EXIT","EXIT_CODE":"3"},
+    {"JOBID":"204","JOBINDEX":"0","STAT":"EXIT","EXIT_CODE":""},
+    {"JOBID":"205","JOBINDEX":"2","STAT":"PEND","EXIT_CODE":""},
+    {"JOBID":"208","JOBINDEX":"0","STAT":"USUSP","EXIT_CODE":""},
+    {"ERROR":"Job <206> is not found"}
+  ]
+}
+'''
+
+# LSF before 10.1
+BJOBS_TEXT = '''JOBID   USER    STAT  QUEUE      FROM_HOST   EXEC_HOST   JOB_NAME   SUBMIT_TIME
+201     user    RUN   normal     head        node1       sim        Oct 18 10:00
+202     user    DONE  normal     head        node1       sim        Oct 18 10:00
+205     user    PEND  normal     head                    arr[2]     Oct 18 10:00
+Job <206> is not found
+'''
+
+BHIST = {
+    '204': '''Job <204>, User <user>, Project <default>, Command <sim>
+Sun Oct 18 10:00:00: Submitted from host <head>, to Queue <normal>;
+Sun Oct 18 10:00:05: Dispatched 1 Task(s) on Host(s) <node1>;
+Sun Oct 18 10:01:00: Exited with exit code 137. The CPU time used is 1.0 seconds;
+''',
+    '207': '''Job <207>, User <user>, Project <default>, Command <sim>
+Sun Oct 18 10:00:00: Submitted from host <head>, to Queue <normal>;
+Sun Oct 18 10:01:00: Done successfully. The CPU time used is 1.0 seconds;
+''',
+}
+
+
+class LSFStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['SITE_CLUSTER_CACHE_DIR'] = self.directory
+        os.environ['PATH'] = self.directory + os.pathsep + os.environ['PATH']
+        self.fixture('bjobs.json', BJOBS_JSON)
+        self.fixture('bjobs.txt', BJOBS_TEXT)
+        for jobId, text in BHIST.items():
+            self.fixture('bhist.{}'.format(jobId), text)
+        self.command('bhist', '''#!/bin/sh
+echo "$*" >> "$SITE_CLUSTER_CACHE_DIR/bhist.log"
+cat "$SITE_CLUSTER_CACHE_DIR/bhist.$2" 2>/dev/null && exit 0
+echo "No matching job found"
+exit 255
+''')
+        self.cluster = sitecluster.LSFSiteCluster(use_argv=False)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def fixture(self, name, text):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(text)
+
+    def command(self, name, script):
+        self.fixture(name, script)
+        os.chmod(os.path.join(self.directory, name), 0o755)
+
+    def bjobs(self, json=True):
+        # the JSON output or, as before LSF 10.1, an error on -json and the text table
+        answer = 'cat "$SITE_CLUSTER_CACHE_DIR/bjobs.json"' if json else 'echo "bjobs: illegal option -- json"'
+        self.command('bjobs', '''#!/bin/sh
+echo "$*" >> "$SITE_CLUSTER_CACHE_DIR/bjobs.log"
+case "$*" in
+*-json*) {};;
+*) cat "$SITE_CLUSTER_CACHE_DIR/bjobs.txt";;
+esac
+exit 255
+'''.format(answer))
+
+    def calls(self, name):
+        path = os.path.join(self.directory, name + '.log')
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [x.split() for x in f.read().splitlines()]
+
+    def testBatchedStatus(self):
+        self.bjobs()
+        self.assertEqual(['RUNNING', 'COMPLETED 0', 'COMPLETED 3', 'COMPLETED 137', 'PENDING', 'UNKNOWNID', 'COMPLETED 0', 'SUSPENDED'],
+                         self.cluster.getJobStatuses(['201', '202', '203', '204', '205[2]', '206', '207', '208'], addStatus=True))
+        # one bjobs call for all jobs, bhist only for the jobs bjobs has no exit code of
+        self.assertEqual(1, len(self.calls('bjobs')))
+        self.assertEqual(['-la', '204'], self.calls('bhist')[0])
+        self.assertEqual(['204', '206', '207'], sorted(x[1] for x in self.calls('bhist')))
+
+    def testTerminalResultsAreCached(self):
+        self.bjobs()
+        jobIds = ['201', '202', '203', '204', '206', '207']
+        first = self.cluster.getJobStatuses(jobIds, addStatus=True)
+        self.assertEqual(first, self.cluster.getJobStatuses(jobIds, addStatus=True))
+        # only the running and the unknown job are asked for again, no finished job goes through bhist twice
+        self.assertEqual(['-json', '201', '206'], self.calls('bjobs')[1][-3:])
+        self.assertEqual(['204', '206', '207', '206'], [x[1] for x in self.calls('bhist')])
+        self.assertEqual(['COMPLETED', 'COMPLETED'], sitecluster.LSFSiteCluster(use_argv=False).getJobStatuses(['203', '207']))
+        self.assertEqual(2, len(self.calls('bjobs')))
+
+    def testUnknownJobsAreNotCached(self):
+        self.bjobs()
+        self.assertEqual(['UNKNOWNID'], self.cluster.getJobStatuses(['206'], addStatus=True))
+        # bhist knows the job once its record reached the event log
+        self.fixture('bhist.206', BHIST['204'].replace('<204>', '<206>'))
+        self.assertEqual(['COMPLETED 137'], self.cluster.getJobStatuses(['206'], addStatus=True))
+        self.assertEqual(['COMPLETED 137'], self.cluster.getJobStatuses(['206'], addStatus=True))
+        self.assertEqual(2, len(self.calls('bhist')))
+
+    def testTextFallback(self):
+        self.bjobs(json=False)
+        self.assertEqual(['RUNNING', 'COMPLETED 0', 'PENDING', 'UNKNOWNID'],
+                         self.cluster.getJobStatuses(['201', '202', '205[2]', '206'], addStatus=True))
+        self.assertEqual(['-a', '201', '202', '205[2]', '206'], self.calls('bjobs')[1])
+        self.assertEqual(['206'], [x[1] for x in self.calls('bhist')])
+
+
+class LSFJobIdTest(unittest.TestCase):
+    def setUp(self):
+        self.environ = dict(os.environ)
+        self.cluster = sitecluster.LSFSiteCluster(use_argv=False)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def testReadJobId(self):
+        os.environ.pop('PBS_JOBID', None)
+        os.environ.update(LSB_JOBID='301', LSB_JOBINDEX='0')
+        self.assertEqual('301', self.cluster.readJobId())
+        os.environ['LSB_JOBINDEX'] = '4'
+        self.assertEqual('301_4', self.cluster.readJobId())
+        self.assertEqual('301[4]', self.cluster.nativeJobId(self.cluster.readJobId()))
+
+    def testStartnodeReturnsTheRunningJob(self):
+        os.environ.pop('PBS_JOBID', None)
+        os.environ.pop('LSB_JOBINDEX', None)
+        os.environ['LSB_JOBID'] = '302'
+        with mock.patch.object(self.cluster, 'startNode') as startNode:
+            self.assertEqual('302', self.cluster.submitJob(argparse.Namespace(startnode=2), ['true']))
+        startNode.assert_called_once_with(2, ['true'])
+
+
+if __name__ == '__main__':
+    unittest.main()
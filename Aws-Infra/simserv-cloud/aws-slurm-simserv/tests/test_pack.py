@@ -0,0 +1,140 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+
+class LocalPackCluster(sitecluster.SiteCluster):
+    '''
+    Runs the tasks of a pack on two local slots, the allocations have the states of self.states.
+    '''
+    def __init__(self):
+        sitecluster.SiteCluster.__init__(self, use_argv=False)
+        self.states = {}
+        self.killed = []
+
+    def getPackSlots(self, threads):
+        return 2
+
+    def getPackTaskCommand(self, slot, threads, cmdargs):
+        return cmdargs
+
+    def getJobStatus(self, idOnCluster, addStatus=False):
+        return self.states.get(idOnCluster, 'UNKNOWNID')
+
+    def killJob(self, idsOnCluster):
+        self.killed += idsOnCluster
+        return 0
+
+
+class PackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['SITE_CLUSTER_CACHE_DIR'] = self.directory
+        self.cluster = LocalPackCluster()
+        self.pack = sitecluster.Pack.make(self.directory)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+
+class PackTest(PackTestCase):
+    def runPack(self, **kwargs):
+        runner = threading.Thread(target=self.pack.run, args=(self.cluster, 0.01), kwargs=kwargs)
+        runner.start()
+        return runner
+
+    def waitFor(self, task, state):
+        deadline = time.time() + 10
+        while self.pack.taskState(task).read().get('state') != state and time.time() < deadline:
+            time.sleep(0.01)
+
+    def testTasksComplete(self):
+        self.assertEqual(1, self.pack.addTask(['sh', '-c', 'echo one'], self.directory))
+        self.assertEqual(2, self.pack.addTask(['sh', '-c', 'exit 3'], self.directory))
+        self.assertEqual(3, self.pack.addTask(['/nonexistent/command'], self.directory))
+        self.pack.seal()
+        self.runPack().join(10)
+        self.assertEqual(['COMPLETED 0', 'COMPLETED 3', 'COMPLETED 127'], [self.pack.getTaskStatus(x, 'RUNNING') for x in [1, 2, 3]])
+        with open(self.pack.path('stdout.1.txt')) as f:
+            self.assertEqual('one\n', f.read())
+        # the pack is closed once all tasks ended
+        self.assertIsNone(self.pack.addTask(['true'], self.directory))
+
+    def testCancel(self):
+        self.pack.addTask(['sleep', '30'], self.directory)
+        self.pack.addTask(['sleep', '30'], self.directory)
+        self.pack.addTask(['true'], self.directory)
+        self.pack.cancelTask(3)
+        self.pack.seal()
+        runner = self.runPack(killDelay=0.5)
+        self.waitFor(1, 'RUNNING')
+        self.waitFor(2, 'RUNNING')
+        self.assertEqual('RUNNING', self.pack.getTaskStatus(1, 'RUNNING'))
+        self.pack.cancelTask(1)
+        self.pack.cancelTask(2)
+        runner.join(10)
+        self.assertFalse(runner.is_alive())
+        # SIGTERM ends sleep, a cancelled task which never started counts as killed
+        self.assertEqual(['COMPLETED 143', 'COMPLETED 143', 'COMPLETED 137'], [self.pack.getTaskStatus(x, 'RUNNING') for x in [1, 2, 3]])
+
+    def testAllocationEnded(self):
+        for _ in range(4):
+            self.pack.addTask(['true'], self.directory)
+        self.pack.taskState(1).write({'state': 'COMPLETED', 'exit': 0})
+        self.pack.taskState(2).write({'state': 'RUNNING', 'slot': 0})
+        self.pack.cancelTask(4)
+        self.assertEqual(['RUNNING', 'PENDING'], [self.pack.getTaskStatus(x, 'RUNNING') for x in [2, 3]])
+        self.assertEqual('PENDING', self.pack.getTaskStatus(3, 'PENDING'))
+        # killed with the allocation while running, never started, cancelled before it started
+        self.assertEqual(['COMPLETED 0', 'COMPLETED 137', 'COMPLETED 1', 'COMPLETED 137'],
+                         [self.pack.getTaskStatus(x, 'COMPLETED') for x in [1, 2, 3, 4]])
+        self.assertEqual(['COMPLETED 137', 'COMPLETED 1'], [self.pack.getTaskStatus(x, 'UNKNOWNID') for x in [2, 3]])
+        self.assertEqual('UNKNOWNID', self.pack.getTaskStatus(5, 'COMPLETED'))
+
+
+class PackCommandTest(PackTestCase):
+    def setUp(self):
+        PackTestCase.setUp(self)
+        for _ in range(3):
+            self.pack.addTask(['true'], self.directory)
+        sitecluster.Pack.register('5', self.pack.directory)
+        self.cluster.states = {'5': 'RUNNING', '6': 'COMPLETED 0'}
+
+    def testStatus(self):
+        self.pack.taskState(1).write({'state': 'COMPLETED', 'exit': 2})
+        self.pack.taskState(2).write({'state': 'RUNNING', 'slot': 1})
+        self.assertEqual(['COMPLETED 2', 'RUNNING', 'PENDING', 'UNKNOWNID', 'UNKNOWNID', 'UNKNOWNID', 'COMPLETED 0', 'RUNNING'],
+                         self.cluster.lookupJobStatuses(['5+1', '5+2', '5+3', '5+4', '7+1', '5+x', '6', '5'], True))
+        self.assertEqual(['COMPLETED', 'RUNNING'], self.cluster.lookupJobStatuses(['5+1', '5+2']))
+        self.cluster.states['5'] = 'COMPLETED 0'
+        self.assertEqual(['COMPLETED 137', 'COMPLETED 1'], self.cluster.lookupJobStatuses(['5+2', '5+3'], True))
+
+    def testKill(self):
+        output = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['sitecluster', 'kill', '5+2', '6', '7+1']), contextlib.redirect_stdout(output):
+            self.cluster.kill()
+        self.assertEqual('0\n', output.getvalue())
+        self.assertTrue(os.path.exists(self.pack.path('cancel', '2')))
+        self.assertEqual(['2'], os.listdir(self.pack.path('cancel')))
+        # only the jobs which are not tasks go to the scheduler
+        self.assertEqual(['6'], self.cluster.killed)
+        self.assertEqual('COMPLETED 137', self.pack.getTaskStatus(2, 'RUNNING'))
+
+
+if __name__ == '__main__':
+    unittest.main()
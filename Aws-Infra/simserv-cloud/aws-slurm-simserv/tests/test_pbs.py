@@ -0,0 +1,235 @@
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+QSUB = '''#!/bin/sh
+echo "$@" >> "$SITE_CLUSTER_CACHE_DIR/qsub.log"
+echo "123[].headnode"
+'''
+
+# recorded from PBS Pro 19.1, finished jobs are listed through -x
+QSTAT_JSON = '''{
+    "timestamp":1603015200,
+    "pbs_version":"19.1.3",
+    "pbs_server":"headnode",
+    "Jobs":{
+        "101.headnode":{
+            "Job_Name":"sim",
+            "Job_Owner":"user@headnode",
+            "job_state":"R",
+            "queue":"workq",
+            "Resource_List":{
+                "ncpus":4,
+                "mem":"4gb"
+            }
+        },
+        "102.headnode":{
+            "Job_Name":"sim",
+            "job_state":"F",
+            "Exit_status":3
+        },
+        "103.headnode":{
+            "Job_Name":"sim",
+            "job_state":"Q"
+        },
+        "104[2].headnode":{
+            "Job_Name":"sim",
+            "job_state":"H"
+        }
+    }
+}
+'''
+
+QSTAT_TEXT = '''Job Id: 101.headnode
+    Job_Name = sim
+    job_state = R
+    queue = workq
+
+Job Id: 102.headnode
+    Job_Name = sim
+    job_state = C
+    exit_status = 3
+
+'''
+
+QSTAT_VERSION = {
+    'torque': 'Version: 6.1.2\n',
+    'pro': 'pbs_version = 19.1.3\n',
+}
+
+
+class PBSTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        os.environ['SITE_CLUSTER_CACHE_DIR'] = self.directory
+        os.environ['PATH'] = self.directory + os.pathsep + os.environ['PATH']
+        os.environ.pop('SITE_CLUSTER_PBS_FLAVOUR', None)
+        self.cluster = sitecluster.PBSSiteCluster(use_argv=False)
+        self.cluster.ignore_user = True
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def command(self, name, script):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+
+    def options(self, *args):
+        return self.cluster.submitParser().parse_args(list(args))
+
+
+class PBSArrayTest(PBSTestCase):
+    def submitArray(self, flavour):
+        self.command('qsub', QSUB)
+        self.command('qstat', '#!/bin/sh\nprintf "{}"\n'.format(QSTAT_VERSION[flavour]))
+        group = [argparse.Namespace(**vars(self.options('--', 'sim', str(x)))) for x in range(3)]
+        for options in group:
+            options.cmdargs = options.cmdargs[1:]
+        arrayId = self.cluster.submitArray(group)
+        with open(os.path.join(self.directory, 'qsub.log')) as f:
+            return arrayId, f.read().split()
+
+    def testTorqueArray(self):
+        arrayId, argv = self.submitArray('torque')
+        self.assertEqual('123.headnode', arrayId)
+        self.assertEqual('1-3', argv[argv.index('-t') + 1])
+        self.assertNotIn('-J', argv)
+        with open(argv[-1]) as f:
+            self.assertIn('case "$PBS_ARRAYID" in', f.read())
+
+    def testProArray(self):
+        arrayId, argv = self.submitArray('pro')
+        self.assertEqual('1-3', argv[argv.index('-J') + 1])
+        with open(argv[-1]) as f:
+            self.assertIn('case "$PBS_ARRAY_INDEX" in', f.read())
+
+    def testFlavourIsDetectedOnce(self):
+        self.command('qstat', '#!/bin/sh\necho x >> "$SITE_CLUSTER_CACHE_DIR/qstat.log"\nprintf "{}"\n'.format(QSTAT_VERSION['pro']))
+        self.assertEqual('pro', self.cluster.getFlavour())
+        self.assertEqual('pro', self.cluster.getFlavour())
+        with open(os.path.join(self.directory, 'qstat.log')) as f:
+            self.assertEqual(1, len(f.readlines()))
+
+    def testTaskIds(self):
+        os.environ['SITE_CLUSTER_PBS_FLAVOUR'] = 'torque'
+        self.assertEqual('123[2].headnode', self.cluster.nativeJobId('123.headnode_2'))
+
+    def testReadJobId(self):
+        os.environ['SITE_CLUSTER_PBS_FLAVOUR'] = 'torque'
+        os.environ['PBS_JOBID'] = '123[7].headnode'
+        self.assertEqual('123.headnode_7', self.cluster.readJobId())
+        self.assertEqual('123[7].headnode', self.cluster.nativeJobId(self.cluster.readJobId()))
+        os.environ['PBS_JOBID'] = '124.headnode'
+        self.assertEqual('124.headnode', self.cluster.readJobId())
+
+
+class JsonMembersTest(unittest.TestCase):
+    def members(self, text, chunkSize=65536):
+        return list(sitecluster.iterJsonMembers(io.StringIO(text), 'Jobs', chunkSize))
+
+    def testMembersOfKey(self):
+        expected = sorted(json.loads(QSTAT_JSON)['Jobs'].items())
+        self.assertEqual(expected, sorted(self.members(QSTAT_JSON)))
+        # tokens and numbers split across chunks
+        for chunkSize in (1, 2, 3, 7):
+            self.assertEqual(expected, sorted(self.members(QSTAT_JSON, chunkSize)))
+
+    def testNoMembers(self):
+        self.assertEqual([], self.members('{}'))
+        self.assertEqual([], self.members('{"pbs_version":"19.1.3"}'))
+        self.assertEqual([('1', {'n': 12345})], self.members('{"a":[1,{"Jobs":2}],"Jobs":{"1":{"n":12345}},"b":2}', 3))
+
+    def testNoObject(self):
+        self.assertRaises(ValueError, self.members, '')
+        self.assertRaises(ValueError, self.members, 'qstat: invalid option -- F')
+        self.assertRaises(ValueError, self.members, '{"Jobs":{"1":')
+
+    def testManyJobs(self):
+        text = json.dumps({'Jobs': dict(('{}.headnode'.format(x), {'job_state': 'F', 'Exit_status': x % 7}) for x in range(10000))})
+        members = sitecluster.iterJsonMembers(io.StringIO(text), 'Jobs', 4096)
+        self.assertEqual(('0.headnode', {'job_state': 'F', 'Exit_status': 0}), next(members))
+        self.assertEqual(9999, len(list(members)))
+
+
+class PBSStatusTest(PBSTestCase):
+    def qstat(self, json=True):
+        # -F json or, as PBS servers without it, a usage error and the text listing
+        self.fixture('qstat.json', QSTAT_JSON)
+        self.fixture('qstat.txt', QSTAT_TEXT)
+        answer = 'cat "$SITE_CLUSTER_CACHE_DIR/qstat.json"' if json else 'echo "qstat: invalid option -- \'F\'" >&2; echo "usage: qstat [-f]" >&2; exit 2'
+        self.command('qstat', '''#!/bin/sh
+echo "$*" >> "$SITE_CLUSTER_CACHE_DIR/qstat.log"
+case "$*" in
+*"-F json"*) {};;
+*) cat "$SITE_CLUSTER_CACHE_DIR/qstat.txt";;
+esac
+status=0
+for id in "$@"; do
+    case "$id" in 9*) echo "qstat: Unknown Job Id $id" >&2; status=153;; esac
+done
+exit $status
+'''.format(answer))
+
+    def fixture(self, name, text):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(text)
+
+    def calls(self):
+        with open(os.path.join(self.directory, 'qstat.log')) as f:
+            return f.read().splitlines()
+
+    def testJsonStatus(self):
+        self.qstat()
+        self.assertEqual(['RUNNING', 'COMPLETED 3', 'PENDING', 'SUSPENDED', 'UNKNOWNID'],
+                         self.cluster.getJobStatuses(['101.headnode', '102', '103.headnode', '104[2].headnode', '999.headnode'], addStatus=True))
+        self.assertEqual(['-f -F json -x 101.headnode 102 103.headnode 104[2].headnode 999.headnode'], self.calls())
+
+    def testUnlistedJobsAreUnknown(self):
+        self.qstat()
+        # a job missing from the listing without an error and another form of the server name
+        self.assertEqual(['UNKNOWNID', 'COMPLETED 3', 'RUNNING'],
+                         self.cluster.getJobStatuses(['105.headnode', '102.headnode.example.com', '101.other'], addStatus=True))
+
+    def testAllJobsUnknown(self):
+        self.qstat()
+        self.command('qstat', '''#!/bin/sh
+echo "$*" >> "$SITE_CLUSTER_CACHE_DIR/qstat.log"
+for id in "$@"; do
+    case "$id" in 9*) echo "qstat: Unknown Job Id $id" >&2;; esac
+done
+exit 153
+''')
+        self.assertEqual(['UNKNOWNID', 'UNKNOWNID'], self.cluster.getJobStatuses(['998.headnode', '999'], addStatus=True))
+        # no second qstat in text mode and JSON is still used
+        self.assertEqual(['-f -F json -x 998.headnode 999'], self.calls())
+        self.cluster.getJobStatuses(['999'])
+        self.assertEqual('-f -F json -x 999', self.calls()[-1])
+
+    def testTextFallback(self):
+        self.qstat(json=False)
+        self.assertEqual(['RUNNING', 'COMPLETED 3', 'UNKNOWNID'], self.cluster.getJobStatuses(['101', '102.headnode', '999'], addStatus=True))
+        self.assertEqual(['RUNNING'], self.cluster.getJobStatuses(['101']))
+        # the server without -F json is remembered
+        self.assertEqual(['-f -F json -x 101 102.headnode 999', '-f 101 102.headnode 999', '-f 101'], self.calls())
+
+
+if __name__ == '__main__':
+    unittest.main()
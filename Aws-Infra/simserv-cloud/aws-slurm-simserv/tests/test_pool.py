@@ -0,0 +1,150 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+# records whether the pools are locked while the allocation is submitted
+SBATCH = '''#!/bin/sh
+if flock -n "$SITE_CLUSTER_CACHE_DIR/pools.json.lock" true; then lock=free; else lock=held; fi
+echo "$lock" >> "$SITE_CLUSTER_CACHE_DIR/sbatch.log"
+sleep "${SBATCH_DELAY:-0}"
+if [ -n "$SBATCH_FAIL" ]; then echo "sbatch: error: invalid partition" >&2; exit 1; fi
+echo "Submitted batch job $(wc -l < "$SITE_CLUSTER_CACHE_DIR/sbatch.log")"
+'''
+
+
+class AllocationPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['SITE_CLUSTER_CACHE_DIR'] = self.directory
+        os.environ['PATH'] = self.directory + os.pathsep + os.environ['PATH']
+        with open(os.path.join(self.directory, 'sbatch'), 'w') as f:
+            f.write(SBATCH)
+        os.chmod(os.path.join(self.directory, 'sbatch'), 0o755)
+        self.cluster = sitecluster.SlurmSiteCluster(use_argv=False)
+        self.pool = sitecluster.AllocationPool(self.cluster, 'warm')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def start(self, size=1):
+        options = vars(self.cluster.submitParser().parse_args([]))
+        self.pool.start({'nodes': 1, 'size': size, 'idle': 60, 'options': options, 'directory': self.directory})
+
+    def submissions(self):
+        with open(os.path.join(self.directory, 'sbatch.log')) as f:
+            return f.read().split()
+
+    def members(self):
+        return sitecluster.StateFile('pools.json').read().get('warm', {}).get('members', [])
+
+    def testStartTwiceFails(self):
+        self.start()
+        self.assertRaises(KeyError, self.start, 2)
+        self.assertEqual(['free'], self.submissions())
+        self.assertEqual(1, len(self.members()))
+
+    def testFailedStartForgetsThePool(self):
+        os.environ['SBATCH_FAIL'] = '1'
+        self.assertRaises(subprocess.CalledProcessError, self.start)
+        self.assertEqual([], self.members())
+        del os.environ['SBATCH_FAIL']
+        self.start()
+        self.assertEqual('2+1', self.pool.submit(['true'], self.directory))
+
+    def testGrowsWithoutHoldingTheLock(self):
+        self.start(size=2)
+        # the first member runs a task on its only slot
+        pack = sitecluster.Pack(self.members()[0][1])
+        pack.settings.update(lambda data: data.update(started=time.time(), heartbeat=time.time(), slots=1, tasks=1))
+        self.assertEqual('1+2', self.pool.submit(['true'], self.directory))
+        self.assertEqual(['free', 'free'], self.submissions())
+        self.assertEqual(['1', '2'], [x['id'] for x in self.pool.getStatus()['members']])
+        status = self.pool.getStatus()
+        self.assertEqual((0, 1), (status['hits'], status['misses']))
+
+    def testSubmitWaitsForTheAllocationOfAReservedMember(self):
+        os.environ['SBATCH_DELAY'] = '1'
+        starter = threading.Thread(target=self.start)
+        starter.start()
+        while not self.members():
+            time.sleep(0.02)
+        # the reserved member takes the job and its id is known once the allocation is submitted
+        self.assertEqual([None], [x[0] for x in self.members()])
+        self.assertEqual('1+1', self.pool.submit(['true'], self.directory))
+        starter.join()
+
+    def testFailedGrowthIsReported(self):
+        self.start(size=2)
+        pack = sitecluster.Pack(self.members()[0][1])
+        pack.settings.update(lambda data: data.update(started=time.time(), heartbeat=time.time(), slots=1, tasks=1))
+        os.environ['SBATCH_FAIL'] = '1'
+        self.assertRaises(subprocess.CalledProcessError, self.pool.submit, ['true'], self.directory)
+        # the failed member is dropped, the next job grows the pool again
+        del os.environ['SBATCH_FAIL']
+        self.assertEqual('1+3', self.pool.submit(['true'], self.directory))
+        self.assertEqual(['1', '3'], [x['id'] for x in self.pool.getStatus()['members']])
+
+
+class PoolCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.env = dict(os.environ, SITE_CLUSTER_USE_SLURM='1', SITE_CLUSTER_CACHE_DIR=self.directory,
+                        PATH=self.directory + os.pathsep + os.environ['PATH'])
+        for name in [x for x in self.env if x.startswith('SITE_CLUSTER_USE_') and x != 'SITE_CLUSTER_USE_SLURM']:
+            del self.env[name]
+        self.env.pop('SITE_CLUSTER_SOCKET', None)
+        with open(os.path.join(self.directory, 'sbatch'), 'w') as f:
+            f.write(SBATCH)
+        os.chmod(os.path.join(self.directory, 'sbatch'), 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def command(self, *args, **kwargs):
+        proc = subprocess.Popen([sys.executable, os.path.join(DIRECTORY, 'sitecluster.py')] + list(args), cwd=self.directory,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env, universal_newlines=True)
+        stdout, stderr = proc.communicate(kwargs.get('input'), timeout=60)
+        return proc.returncode, stdout, stderr
+
+    def testSubmitOptionsAreRejected(self):
+        self.assertEqual(0, self.command('pool', 'start', 'warm')[0])
+        returncode, stdout, stderr = self.command('submit', '--pool', 'warm', '--queue', 'long', '--threads', '4', '--', 'true')
+        self.assertEqual(2, returncode)
+        self.assertIn('--queue, --threads cannot be used with --pool', stderr)
+        self.assertEqual((0, '1+1\n'), self.command('submit', '--pool', 'warm', '--', 'true')[:2])
+
+    def testUnknownPool(self):
+        returncode, _, stderr = self.command('submit', '--pool', 'cold', '--', 'true')
+        self.assertEqual(1, returncode)
+        self.assertIn('no pool named cold', stderr)
+
+    def testStartExistingPool(self):
+        self.assertEqual(0, self.command('pool', 'start', 'warm')[0])
+        returncode, _, stderr = self.command('pool', 'start', 'warm', '--size', '4')
+        self.assertEqual(1, returncode)
+        self.assertIn('pool warm exists already', stderr)
+        status = json.loads(self.command('pool', 'status', 'warm')[1])
+        self.assertEqual(1, status['size'])
+
+    def testPoolInSubmitBatch(self):
+        returncode, _, stderr = self.command('submit-batch', input='{"cmdargs": ["true"], "pool": "warm"}\n')
+        self.assertEqual(2, returncode)
+        self.assertIn('line 1: pool is not supported by submit-batch', stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+
+def fakeSysfs(root, online, nodes):
+    """Writes the cpu and NUMA node lists of a host below root"""
+    os.makedirs(os.path.join(root, 'devices', 'system', 'cpu'))
+    with open(os.path.join(root, 'devices', 'system', 'cpu', 'online'), 'w') as f:
+        f.write(online + '\n')
+    for node, cpuList in nodes.items():
+        os.makedirs(os.path.join(root, 'devices', 'system', 'node', 'node{}'.format(node)))
+        with open(os.path.join(root, 'devices', 'system', 'node', 'node{}'.format(node), 'cpulist'), 'w') as f:
+            f.write(cpuList + '\n')
+
+
+class AffinityPlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def planner(self, online, nodes):
+        fakeSysfs(self.directory, online, nodes)
+        return sitecluster.AffinityPlanner(self.directory)
+
+    def testParseCpuList(self):
+        self.assertEqual([0, 1, 2, 3, 8, 10, 11], sitecluster.parseCpuList('0-3,8,10-11\n'))
+        self.assertEqual([], sitecluster.parseCpuList(''))
+
+    def testNodes(self):
+        # cpu 5 is offline, node 2 has no cpus
+        planner = self.planner('0-4,6-7', {0: '0-3', 1: '4-7', 2: ''})
+        self.assertEqual({0: [0, 1, 2, 3], 1: [4, 6, 7]}, planner.getNodes())
+
+    def testWithoutNuma(self):
+        planner = self.planner('0-3', {})
+        self.assertEqual({0: [0, 1, 2, 3]}, planner.getNodes())
+        self.assertEqual([0, 1], planner.plan(2))
+
+    def testJobsGetDisjointCpusOfOneNode(self):
+        planner = self.planner('0-15', {0: '0-7', 1: '8-15'})
+        used = set()
+        for threads, expected in [(4, [0, 1, 2, 3]), (6, [8, 9, 10, 11, 12, 13]), (4, [4, 5, 6, 7]), (2, [14, 15])]:
+            cpus = planner.plan(threads, used)
+            self.assertEqual(expected, cpus)
+            self.assertFalse(used & set(cpus))
+            used.update(cpus)
+        self.assertIsNone(planner.plan(1, used))
+
+    def testFullestNodeThatFits(self):
+        planner = self.planner('0-15', {0: '0-7', 1: '8-15'})
+        # node 1 has 3 free cpus, enough for a 2 thread job, node 0 stays whole
+        self.assertEqual([13, 14], planner.plan(2, range(8, 13)))
+
+    def testJobLargerThanANode(self):
+        planner = self.planner('0-11', {0: '0-3', 1: '4-7', 2: '8-11'})
+        self.assertEqual([0, 1, 2, 3, 4, 5], planner.plan(6))
+        # the largest free node first
+        self.assertEqual([0, 1, 6, 7, 8, 9, 10, 11], planner.plan(8, [2, 3, 4, 5]))
+        self.assertIsNone(planner.plan(13))
+
+
+class ProcessSiteClusterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        os.environ['SITE_CLUSTER_CACHE_DIR'] = self.directory
+        os.environ['SITE_CLUSTER_LOCAL_CORES'] = '2'
+        os.environ['SITE_CLUSTER_LOCAL_AFFINITY'] = '0'
+        self.cluster = sitecluster.ProcessSiteCluster(use_argv=False)
+
+    def tearDown(self):
+        # the supervisors write the queue once their job ended
+        deadline = time.time() + 10
+        for name in os.listdir(self.cluster.jobsDirectory()):
+            record = self.cluster.jobRecord(name[:-len('.json')]).read()
+            while time.time() < deadline and (sitecluster.readProcStat(record.get('supervisor')) or ['Z'])[0] != 'Z':
+                time.sleep(0.02)
+        os.chdir(self.cwd)
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def submit(self, *args):
+        options = self.cluster.submitParser().parse_args(list(args))
+        return self.cluster.submitJob(options, options.cmdargs[1:])
+
+    def wait(self, jobIds, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            statuses = self.cluster.getJobStatuses(jobIds, addStatus=True)
+            if all(x.startswith('COMPLETED') for x in statuses):
+                return statuses
+            time.sleep(0.05)
+        self.fail('jobs did not end: {}'.format(statuses))
+
+    def testExitStatusAndOutput(self):
+        jobId = self.submit('--', 'sh', '-c', 'echo out; echo err >&2; exit 3')
+        self.assertEqual(['COMPLETED 3'], self.wait([jobId]))
+        with open('stdout.{}.txt'.format(jobId)) as f:
+            self.assertEqual('out\n', f.read())
+        with open('stderr.{}.txt'.format(jobId)) as f:
+            self.assertEqual('err\n', f.read())
+
+    def testSupervisorIsNoFork(self):
+        # submitting from a threaded process like serve
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            jobId = self.submit('--', 'sleep', '0.2')
+        finally:
+            stop.set()
+            thread.join()
+        record = self.cluster.jobRecord(jobId).read()
+        with open('/proc/{}/cmdline'.format(record['supervisor']), 'rb') as f:
+            self.assertIn(b'supervise', f.read().split(b'\0'))
+        self.assertEqual(['COMPLETED 0'], self.wait([jobId]))
+
+    def testQueuedJobStartsWhenCoresFree(self):
+        first = self.submit('--threads', '2', '--', 'sleep', '0.3')
+        second = self.submit('--threads', '2', '--', 'true')
+        self.assertEqual(['RUNNING', 'PENDING'], self.cluster.getJobStatuses([first, second]))
+        # the second job starts once the first ended
+        self.assertEqual(['COMPLETED 0', 'COMPLETED 0'], self.wait([first, second]))
+
+    @unittest.skipUnless(hasattr(os, 'sched_getaffinity') and 0 in os.sched_getaffinity(0), 'cpu 0 is not available')
+    def testPinnedToPlannedCpus(self):
+        os.environ['SITE_CLUSTER_LOCAL_AFFINITY'] = '1'
+        os.environ['SITE_CLUSTER_SYSFS'] = os.path.join(self.directory, 'sys')
+        fakeSysfs(os.environ['SITE_CLUSTER_SYSFS'], '0,4096', {0: '0', 1: '4096'})
+        first = self.submit('--', 'sleep', '1')
+        # no such cpu on this host, the job runs unpinned
+        second = self.submit('--', 'true')
+        self.assertEqual([0], self.cluster.jobRecord(first).read()['cpus'])
+        self.assertEqual([4096], self.cluster.jobRecord(second).read()['cpus'])
+        with open('/proc/{}/status'.format(self.cluster.jobRecord(first).read()['pid'])) as f:
+            self.assertIn('Cpus_allowed_list:\t0\n', f.read())
+        self.assertEqual(['COMPLETED 0'], self.wait([second]))
+        self.cluster.killJob([first])
+        self.assertEqual(['COMPLETED 137'], self.wait([first]))
+
+    def testKillTakesTheChildrenAlong(self):
+        jobId = self.submit('--', 'sh', '-c', 'sleep 30 & echo $! > child; wait')
+        deadline = time.time() + 10
+        while not os.path.exists('child') or not os.path.getsize('child'):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.02)
+        with open('child') as f:
+            child = int(f.read())
+        self.cluster.killJob([jobId])
+        self.assertEqual(['COMPLETED 137'], self.wait([jobId]))
+        # the orphaned sleep is gone or a zombie waiting for init
+        while time.time() < deadline and (sitecluster.readProcStat(child) or ['Z'])[0] != 'Z':
+            time.sleep(0.02)
+        self.assertEqual('Z', (sitecluster.readProcStat(child) or ['Z'])[0])
+
+    def testIdsAreNotReusedAfterCleaning(self):
+        first = self.submit('--', 'true')
+        self.wait([first])
+        # the cache directory was cleaned, the ids still grow
+        os.unlink(os.path.join(self.directory, 'ProcessSiteCluster-queue.json'))
+        second = self.submit('--', 'true')
+        self.assertGreater(int(second), int(first))
+        self.assertEqual(['COMPLETED 0', 'COMPLETED 0'], self.wait([first, second]))
+
+    def testJobsStartOutsideTheQueueLock(self):
+        lockPath = self.cluster.jobQueue().path + '.lock'
+        locked = []
+        launchJob = self.cluster.launchJob
+
+        def checkedLaunch(jobId, job):
+            with open(lockPath, 'a') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    locked.append(jobId)
+            launchJob(jobId, job)
+        with mock.patch.object(self.cluster, 'launchJob', side_effect=checkedLaunch):
+            first = self.submit('--threads', '2', '--', 'sleep', '0.3')
+            second = self.submit('--threads', '2', '--', 'true')
+            self.assertEqual(['COMPLETED 0', 'COMPLETED 0'], self.wait([first, second]))
+        self.assertEqual([], locked)
+
+    def testStatusLeavesAnUnchangedQueue(self):
+        jobId = self.submit('--', 'sleep', '1')
+        before = os.stat(self.cluster.jobQueue().path)
+        self.assertEqual(['RUNNING', 'RUNNING'], self.cluster.getJobStatuses([jobId, jobId]))
+        after = os.stat(self.cluster.jobQueue().path)
+        self.assertEqual((before.st_ino, before.st_mtime), (after.st_ino, after.st_mtime))
+        self.cluster.killJob([jobId])
+        self.assertEqual(['COMPLETED 137'], self.wait([jobId]))
+
+    def testFailedStart(self):
+        jobId = self.submit('--', os.path.join(self.directory, 'missing'))
+        self.assertEqual(['COMPLETED 127'], self.cluster.getJobStatuses([jobId], addStatus=True))
+        with open('stderr.{}.txt'.format(jobId)) as f:
+            self.assertIn('missing', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
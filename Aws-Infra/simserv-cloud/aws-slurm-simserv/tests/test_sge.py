@@ -0,0 +1,128 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+QSTAT = '''#!/bin/sh
+cat << 'EOF'
+job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID
+-----------------------------------------------------------------------------------------------------------------
+    101 0.55500 sim        user         r     10/18/2026 10:00:00 all.q@node1                        1
+    102 0.55500 sim        user         qw    10/18/2026 10:00:00                                    1 1-3:1
+EOF
+'''
+
+
+def accountingRecord(jobNumber, exitStatus, failed=0, endTime=1600000000, taskNumber=0):
+    fields = ['0'] * 45
+    fields[:6] = ['all.q', 'node1', 'users', 'user', 'sim', str(jobNumber)]
+    fields[10], fields[11], fields[12], fields[35] = str(endTime), str(failed), str(exitStatus), str(taskNumber)
+    return ':'.join(fields) + '\n'
+
+
+class SGETestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['SITE_CLUSTER_CACHE_DIR'] = self.directory
+        os.environ['PATH'] = self.directory + os.pathsep + os.environ['PATH']
+        self.accountingPath = os.path.join(self.directory, 'accounting')
+        os.environ['SITE_CLUSTER_SGE_ACCOUNTING'] = self.accountingPath
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def command(self, name, script):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+
+    def append(self, *records):
+        with open(self.accountingPath, 'a') as f:
+            f.write(''.join(records))
+
+
+class SGEAccountingIndexTest(SGETestCase):
+    def testLookup(self):
+        self.append('# Version: 8.1.9\n', accountingRecord(1, 0), accountingRecord(2, 3, failed=100, endTime=1600000100))
+        index = sitecluster.SGEAccountingIndex()
+        self.assertEqual({'1': ('0', '0', '1600000000'), '2': ('3', '100', '1600000100')}, index.lookup(['1', '2', '3']))
+        self.assertEqual({'1': '0', '3': 'UNKNOWNID'}, index.getExitStatuses(['1', '3']))
+
+    def testArrayTasks(self):
+        self.append(accountingRecord(5, 0, taskNumber=1), accountingRecord(5, 2, taskNumber=2))
+        self.assertEqual({'5.1': '0', '5.2': '2', '5': '2'}, sitecluster.SGEAccountingIndex().getExitStatuses(['5.1', '5.2', '5']))
+
+    def testArrayHasTheWorstTask(self):
+        self.append(accountingRecord(6, 2, taskNumber=1), accountingRecord(6, 0, taskNumber=2), accountingRecord(6, 1, taskNumber=3))
+        index = sitecluster.SGEAccountingIndex()
+        self.assertEqual({'6': '2', '6.3': '1'}, index.getExitStatuses(['6', '6.3']))
+        # a task SGE failed is worse than any exit status, in a later update as well
+        self.append(accountingRecord(6, 0, failed=100, endTime=1600000200, taskNumber=4), accountingRecord(6, 5, taskNumber=5))
+        self.assertEqual({'6': ('0', '100', '1600000200')}, index.lookup(['6']))
+
+    def testIncrementalUpdate(self):
+        self.append(accountingRecord(1, 0))
+        index = sitecluster.SGEAccountingIndex()
+        self.assertEqual({'1': '0', '2': 'UNKNOWNID'}, index.getExitStatuses(['1', '2']))
+        # a record still being written is left for the next update
+        record = accountingRecord(2, 4)
+        self.append(record[:20])
+        self.assertEqual({'2': 'UNKNOWNID'}, index.getExitStatuses(['2']))
+        self.append(record[20:])
+        self.assertEqual({'2': '4'}, index.getExitStatuses(['2']))
+        db = index._connect()
+        try:
+            self.assertEqual(os.path.getsize(self.accountingPath), db.execute('SELECT offset FROM position').fetchone()[0])
+        finally:
+            db.close()
+
+    def testOnlyNewRecordsAreRead(self):
+        self.append(accountingRecord(1, 0))
+        index = sitecluster.SGEAccountingIndex()
+        index.getExitStatuses(['1'])
+        # records before the offset are not read again
+        with open(self.accountingPath, 'r+') as f:
+            f.write(accountingRecord(1, 9))
+        self.append(accountingRecord(2, 0))
+        self.assertEqual({'1': '0', '2': '0'}, index.getExitStatuses(['1', '2']))
+
+    def testRotation(self):
+        self.append(accountingRecord(1, 0), accountingRecord(2, 0))
+        index = sitecluster.SGEAccountingIndex()
+        index.getExitStatuses(['1'])
+        os.rename(self.accountingPath, self.accountingPath + '.0')
+        self.append(accountingRecord(3, 1))
+        # the rotated file is read from its start, the records of the old file are kept
+        self.assertEqual({'1': '0', '3': '1'}, index.getExitStatuses(['1', '3']))
+
+
+class SunGridEngineStatusTest(SGETestCase):
+    def setUp(self):
+        SGETestCase.setUp(self)
+        self.command('qstat', QSTAT)
+        self.cluster = sitecluster.SunGridEngineSiteCluster(use_argv=False)
+
+    def testStatusesFromQstatAndAccounting(self):
+        self.append(accountingRecord(99, 0), accountingRecord(100, 2))
+        # no qacct on the PATH, the index answers for the finished jobs
+        self.assertEqual(['RUNNING', 'PENDING', 'PENDING', 'COMPLETED 0', 'COMPLETED 2', 'UNKNOWNID'],
+                         self.cluster.getJobStatuses(['101', '102', '102.3', '99', '100', '98'], addStatus=True))
+        self.assertEqual(['COMPLETED'], self.cluster.getJobStatuses(['100']))
+
+    def testQacctWithoutAccountingFile(self):
+        self.command('qacct', '#!/bin/sh\nif [ "$2" = 99 ]; then echo "exit_status  7"; else echo "error: job id $2 not found"; exit 1; fi\n')
+        self.assertEqual(['COMPLETED 7', 'UNKNOWNID'], self.cluster.getJobStatuses(['99', '98'], addStatus=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
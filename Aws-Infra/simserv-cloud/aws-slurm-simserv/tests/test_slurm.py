@@ -0,0 +1,263 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import select
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+# squeue -o '%i %t' of Slurm 20.11 lists completing and recently completed jobs as well
+SQUEUE = '''#!/bin/sh
+echo "$*" >> "$SITE_CLUSTER_CACHE_DIR/squeue.log"
+cat "$SITE_CLUSTER_CACHE_DIR/squeue.txt"
+'''
+
+SACCT = '''#!/bin/sh
+echo "$*" >> "$SITE_CLUSTER_CACHE_DIR/sacct.log"
+cat "$SITE_CLUSTER_CACHE_DIR/sacct.txt"
+'''
+
+
+class SlurmTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['SITE_CLUSTER_CACHE_DIR'] = self.directory
+        os.environ['PATH'] = self.directory + os.pathsep + os.environ['PATH']
+        os.environ.pop('SITE_CLUSTER_CACHE_TTL', None)
+        self.command('squeue', SQUEUE)
+        self.command('sacct', SACCT)
+        self.fixture('squeue.txt', '')
+        self.fixture('sacct.txt', '')
+        self.cluster = sitecluster.SlurmSiteCluster(use_argv=False)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def command(self, name, script):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+
+    def fixture(self, name, text):
+        # replaced as a whole, the fake commands may read it at any time
+        with open(os.path.join(self.directory, name + '.tmp'), 'w') as f:
+            f.write(text)
+        os.rename(os.path.join(self.directory, name + '.tmp'), os.path.join(self.directory, name))
+
+    def calls(self, name):
+        path = os.path.join(self.directory, name + '.log')
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [x.split() for x in f.read().splitlines()]
+
+    def status(self, *args, **kwargs):
+        output = io.StringIO()
+        stdin = io.StringIO(kwargs.get('stdin', ''))
+        with mock.patch.object(sys, 'argv', ['sitecluster', 'status'] + list(args)), mock.patch.object(sys, 'stdin', stdin), \
+                contextlib.redirect_stdout(output):
+            self.cluster.status()
+        return output.getvalue().splitlines()
+
+
+class SlurmStatusTest(SlurmTestCase):
+    def setUp(self):
+        SlurmTestCase.setUp(self)
+        self.fixture('squeue.txt', '     11 R\n     12 PD\n     15 CD\n  16_2 S\n')
+        self.fixture('sacct.txt', '14|COMPLETED|0:0\n15|FAILED|2:0\n')
+
+    def testOneQueryForAllJobs(self):
+        self.assertEqual(['RUNNING', 'UNKNOWNID', 'PENDING', 'COMPLETED 2', 'COMPLETED 0', 'SUSPENDED'],
+                         self.status('-e', '11', '13', '12', '15', '14', '16_2'))
+        squeue = self.calls('squeue')
+        self.assertEqual(1, len(squeue))
+        self.assertEqual('11,13,12,15,14,16_2', squeue[0][squeue[0].index('-j') + 1])
+        # only the jobs which left the queue are looked up in the accounting, in one call
+        sacct = self.calls('sacct')
+        self.assertEqual(1, len(sacct))
+        self.assertEqual('13,15,14', sacct[0][sacct[0].index('-j') + 1])
+
+    def testIdsFromStdin(self):
+        jobIds = [str(x) for x in range(1000, 1500)] + ['12', '11']
+        self.assertEqual(['UNKNOWNID'] * 500 + ['PENDING', 'RUNNING'], self.status(stdin='\n'.join(jobIds) + '\n'))
+        self.assertEqual(['UNKNOWNID', 'COMPLETED'], self.status('-', stdin='13 14'))
+        self.assertEqual(2, len(self.calls('squeue')))
+
+    def testAllJobsLeftTheQueue(self):
+        self.command('squeue', '''#!/bin/sh
+echo "$*" >> "$SITE_CLUSTER_CACHE_DIR/squeue.log"
+echo "slurm_load_jobs error: Invalid job id specified"
+exit 1
+''')
+        self.assertEqual(['COMPLETED 0', 'UNKNOWNID'], self.status('-e', '14', '13'))
+        # the terminal state is cached, the next status does not ask the scheduler at all
+        self.assertEqual(['COMPLETED 0'], self.status('-e', '14'))
+        self.assertEqual(1, len(self.calls('squeue')))
+        self.assertEqual(1, len(self.calls('sacct')))
+
+
+# sacct --allocations of Slurm 20.11 for jobs which left the queue
+SACCT_RECORDS = '''21|COMPLETED|0:0
+22|FAILED|3:0
+23|CANCELLED by 1000|0:9
+24|CANCELLED by 1000|0:0
+25|TIMEOUT|0:15
+26|OUT_OF_MEMORY|0:125
+27|RUNNING|0:0
+28_3|NODE_FAIL|0:0
+'''
+
+
+class SlurmAccountingTest(SlurmTestCase):
+    def setUp(self):
+        SlurmTestCase.setUp(self)
+        self.fixture('sacct.txt', SACCT_RECORDS)
+
+    def testExitStatus(self):
+        jobIds = ['21', '22', '23', '24', '25', '26', '27', '28_3', '29']
+        self.assertEqual({'21': ('COMPLETED', '0'), '22': ('FAILED', '3'), '23': ('CANCELLED', '137'), '24': ('CANCELLED', '1'),
+                          '25': ('TIMEOUT', '143'), '26': ('OUT_OF_MEMORY', '253'), '27': ('RUNNING', '0'), '28_3': ('NODE_FAIL', '1')},
+                         self.cluster.getAccountingStatuses(jobIds))
+        # an exit code wins over the signal, a failed job without either exits with 1
+        self.assertEqual('5', self.cluster._slurmExitStatus('FAILED', '5:9'))
+        self.assertEqual('1', self.cluster._slurmExitStatus('FAILED', ''))
+        self.assertEqual(['COMPLETED 0', 'COMPLETED 3', 'COMPLETED 137', 'COMPLETED 1', 'RUNNING', 'COMPLETED 1', 'UNKNOWNID'],
+                         self.cluster.getJobStatuses(['21', '22', '23', '24', '27', '28_3', '29'], True))
+
+    def testTerminalStatesAreCached(self):
+        self.cluster.getAccountingStatuses(['21', '22', '27'])
+        self.fixture('sacct.txt', '27|COMPLETED|0:0\n')
+        self.assertEqual({'21': ('COMPLETED', '0'), '22': ('FAILED', '3'), '27': ('COMPLETED', '0')},
+                         self.cluster.getAccountingStatuses(['21', '22', '27']))
+        # the running job is asked for again, the finished ones are neither looked up in sacct nor in squeue
+        self.assertEqual(['21,22,27', '27'], [x[x.index('-j') + 1] for x in self.calls('sacct')])
+        self.assertEqual(['COMPLETED 0', 'COMPLETED 3', 'COMPLETED 0'], self.cluster.getJobStatuses(['21', '22', '27'], True))
+        self.assertEqual([], self.calls('squeue'))
+        self.assertEqual(2, len(self.calls('sacct')))
+
+    def testAccountingDisabled(self):
+        self.command('sacct', '''#!/bin/sh
+echo "$*" >> "$SITE_CLUSTER_CACHE_DIR/sacct.log"
+echo "sacct: error: Slurm accounting storage is disabled" >&2
+exit 1
+''')
+        self.fixture('squeue.txt', '31 CD\n32 F\n33 R\n')
+        self.assertEqual({'31': None, '32': None}, self.cluster.getAccountingStatuses(['31', '32']))
+        # the state of the queue is all there is
+        self.assertEqual(['COMPLETED 0', 'COMPLETED 1', 'RUNNING'], self.cluster.getJobStatuses(['31', '32', '33'], True))
+        self.assertEqual({}, sitecluster.StateFile('SlurmSiteCluster-acct.json').read())
+
+
+class SlurmWatchTest(SlurmTestCase):
+    def setUp(self):
+        SlurmTestCase.setUp(self)
+        self.env = dict(os.environ, SITE_CLUSTER_USE_SLURM='1')
+        for name in [x for x in self.env if x.startswith('SITE_CLUSTER_USE_') and x != 'SITE_CLUSTER_USE_SLURM']:
+            del self.env[name]
+        self.env.pop('SITE_CLUSTER_SOCKET', None)
+        self.proc = None
+
+    def tearDown(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        if self.proc:
+            self.proc.stdout.close()
+            if self.proc.stdin:
+                self.proc.stdin.close()
+        SlurmTestCase.tearDown(self)
+
+    def watch(self, *args, **kwargs):
+        self.proc = subprocess.Popen([sys.executable, os.path.join(DIRECTORY, 'sitecluster.py'), 'watch', '--interval', '0.05'] + list(args),
+                                     stdin=kwargs.get('stdin', subprocess.DEVNULL), stdout=subprocess.PIPE, env=self.env,
+                                     universal_newlines=True)
+
+    def event(self):
+        ready, _, _ = select.select([self.proc.stdout], [], [], 20)
+        self.assertTrue(ready, 'no event within 20 seconds')
+        line = self.proc.stdout.readline()
+        self.assertTrue(line, 'watch ended')
+        event = json.loads(line)
+        self.assertLessEqual(abs(event.pop('ts') - time.time()), 20)
+        return event
+
+    def testTransitions(self):
+        self.fixture('squeue.txt', '11 PD\n')
+        self.watch('11')
+        self.assertEqual({'job': '11', 'state': 'PENDING', 'exit': None}, self.event())
+        # every state is reported once, however many polls it lasts
+        time.sleep(0.5)
+        self.fixture('squeue.txt', '11 R\n')
+        self.assertEqual({'job': '11', 'state': 'RUNNING', 'exit': None}, self.event())
+        self.fixture('sacct.txt', '11|CANCELLED by 1000|0:15\n')
+        self.fixture('squeue.txt', '11 CA\n')
+        self.assertEqual({'job': '11', 'state': 'COMPLETED', 'exit': 143}, self.event())
+        # all jobs ended and stdin is closed
+        self.assertEqual(0, self.proc.wait(20))
+        self.assertEqual('', self.proc.stdout.read())
+        self.assertGreater(len(self.calls('squeue')), 4)
+
+    def testJobsFromStdin(self):
+        self.fixture('squeue.txt', '12 R\n')
+        self.watch(stdin=subprocess.PIPE)
+        self.proc.stdin.write('12\n')
+        self.proc.stdin.flush()
+        self.assertEqual({'job': '12', 'state': 'RUNNING', 'exit': None}, self.event())
+        self.proc.stdin.write('13 12\n')
+        self.proc.stdin.flush()
+        self.assertEqual({'job': '13', 'state': 'UNKNOWNID', 'exit': None}, self.event())
+        self.proc.stdin.close()
+        # job 12 is still running after stdin closed
+        time.sleep(0.5)
+        self.assertIsNone(self.proc.poll())
+        self.fixture('squeue.txt', '')
+        self.fixture('sacct.txt', '12|COMPLETED|0:0\n')
+        self.assertEqual({'job': '12', 'state': 'COMPLETED', 'exit': 0}, self.event())
+        self.assertEqual(0, self.proc.wait(20))
+        # both jobs are polled together
+        self.assertIn(['--noheader', '--array', '--states=all', '-j', '12,13', '-o', '%i', '%t'], self.calls('squeue'))
+
+    def testStdinClosedWithoutJobs(self):
+        self.watch()
+        self.assertEqual(0, self.proc.wait(20))
+        self.assertEqual('', self.proc.stdout.read())
+        self.assertEqual([], self.calls('squeue'))
+
+
+class SlurmJobIdTest(SlurmTestCase):
+    def setUp(self):
+        SlurmTestCase.setUp(self)
+        for name in ['PBS_JOBID', 'SLURM_ARRAY_JOB_ID', 'SLURM_ARRAY_TASK_ID']:
+            os.environ.pop(name, None)
+        os.environ['SLURM_JOB_ID'] = '41'
+
+    def testReadJobId(self):
+        self.assertEqual('41', self.cluster.readJobId())
+        # an array task has a job id of its own, sitecluster knows it by the array's
+        os.environ.update(SLURM_JOB_ID='45', SLURM_ARRAY_JOB_ID='42', SLURM_ARRAY_TASK_ID='3')
+        self.assertEqual('42_3', self.cluster.readJobId())
+
+    def testStartnodeReturnsTheRunningJob(self):
+        with mock.patch.object(self.cluster, 'startNode') as startNode:
+            self.assertEqual('41', self.cluster.submitJob(argparse.Namespace(startnode=1), ['true']))
+        startNode.assert_called_once_with(1, ['true'])
+        self.assertEqual([], self.calls('sbatch'))
+
+
+if __name__ == '__main__':
+    unittest.main()
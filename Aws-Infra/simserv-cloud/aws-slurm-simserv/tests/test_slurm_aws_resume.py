@@ -0,0 +1,259 @@
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+try:
+    import boto3
+    from moto import mock_aws
+    from moto.ec2.models.instances import Instance
+    from moto.ec2.responses.instances import InstanceResponse
+except ImportError:
+    raise unittest.SkipTest('boto3 and moto are not installed')
+
+import slurmaws  # noqa: E402
+
+spec = importlib.util.spec_from_file_location('resume', os.path.join(DIRECTORY, 'slurm-aws-resume.py'))
+resume = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(resume)
+
+# records its calls, fails updates with address lists when SCONTROL_NO_LISTS is set
+SCONTROL = '''#!/bin/bash
+echo "$*" >> "$(dirname "$0")/scontrol.calls"
+if [ -n "$SCONTROL_NO_LISTS" ] && [ "$1" = update ] && [[ "$3" == *,* ]]; then
+    exit 1
+fi
+'''
+
+_validateBlockDeviceMapping = InstanceResponse._validate_block_device_mapping
+_parseBlockDeviceMapping = InstanceResponse._parse_block_device_mapping
+_terminate = Instance.terminate
+
+
+# EC2 takes the root device of the AMI without a size or snapshot, moto needs one of them
+def validateBlockDeviceMapping(mapping):
+    if mapping.get('DeviceName') != '/dev/sda1':
+        _validateBlockDeviceMapping(mapping)
+
+
+def parseBlockDeviceMapping(response):
+    mappings = _parseBlockDeviceMapping(response)
+    for mapping in mappings:
+        if mapping['DeviceName'] == '/dev/sda1' and not mapping['Ebs']['SnapshotId']:
+            mapping['Ebs']['VolumeSize'] = mapping['Ebs']['VolumeSize'] or 8
+    return mappings
+
+
+# EC2 releases the address of a terminated instance, moto only once the instance is deleted
+def terminate(instance):
+    subnet = instance.ec2_backend.get_subnet(instance.subnet_id)
+    state = _terminate(instance)
+    for address in instance._private_ips:
+        subnet.del_subnet_ip(address)
+    return state
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ.update({'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                           'AWS_DEFAULT_REGION': 'eu-west-3', 'SLURM_HEADNODE': '10.248.156.5'})
+        os.environ.pop('SLURM_AWS_ENDPOINT_URL', None)
+        os.makedirs(os.path.join(self.directory, 'bin'))
+        os.makedirs(os.path.join(self.directory, 'etc', 'slurm.conf.d'))
+        with open(os.path.join(self.directory, 'bin', 'scontrol'), 'w') as f:
+            f.write(SCONTROL)
+        os.chmod(os.path.join(self.directory, 'bin', 'scontrol'), 0o755)
+
+        self.mock = mock_aws()
+        self.mock.start()
+        self.ec2 = boto3.client('ec2', region_name='eu-west-3')
+        vpc = self.ec2.create_vpc(CidrBlock='10.248.0.0/16')['Vpc']['VpcId']
+        subnets = [self.ec2.create_subnet(VpcId=vpc, CidrBlock='10.248.{}.0/24'.format(x))['Subnet']['SubnetId'] for x in (156, 157)]
+        group = self.ec2.create_security_group(GroupName='slurm', Description='slurm', VpcId=vpc)['GroupId']
+        self.patches = [mock.patch.multiple(slurmaws, SLURM_ROOT=self.directory, AWS_AMI='ami-12345678', AWS_KEYNAME='key',
+                                            AWS_SECURITY_GROUP=group, _clients={}, _nodeTypes=None, _nodeTypesMtime=None,
+                                            SLURM_POWER_LOG=os.path.join(self.directory, 'power_save.log'),
+                                            SLURM_RESUME_LOG=os.path.join(self.directory, 'resume.jsonl'),
+                                            SLURM_NODES_CONF=os.path.join(self.directory, 'etc', 'slurm.conf.d', 'slurm_nodes.conf'),
+                                            NODE_GROUPS=(('ip-10-248-156-', subnets[0], 'c5.2xlarge', 4),
+                                                         ('ip-10-248-157-', subnets[1], 'c5.2xlarge', 4),
+                                                         # the subnet of the group is gone
+                                                         ('ip-10-248-158-', 'subnet-00000000', 'c5.2xlarge', 4))),
+                        mock.patch.object(InstanceResponse, '_validate_block_device_mapping', staticmethod(validateBlockDeviceMapping)),
+                        mock.patch.object(InstanceResponse, '_parse_block_device_mapping', parseBlockDeviceMapping),
+                        mock.patch.object(Instance, 'terminate', terminate)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.mock.stop()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def scontrolCalls(self):
+        path = os.path.join(self.directory, 'bin', 'scontrol.calls')
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [x.split() for x in f.read().splitlines()]
+
+    def resumeRecords(self):
+        with open(slurmaws.SLURM_RESUME_LOG) as f:
+            return [json.loads(x) for x in f]
+
+    def instances(self, states=('pending', 'running')):
+        filters = [{'Name': 'instance-state-name', 'Values': list(states)}]
+        return dict((x['PrivateIpAddress'], x) for y in self.ec2.describe_instances(Filters=filters)['Reservations']
+                    for x in y['Instances'])
+
+    def testColdLaunch(self):
+        self.assertEqual(0, resume.resume('ip-10-248-156-[4-6],ip-10-248-157-4'))
+        instances = self.instances()
+        self.assertEqual(['10.248.156.4', '10.248.156.5', '10.248.156.6', '10.248.157.4'], sorted(instances))
+        tags = dict((x['Key'], x['Value']) for x in instances['10.248.157.4']['Tags'])
+        self.assertEqual('ip-10-248-157-4', tags[slurmaws.NODE_TAG])
+        self.assertEqual('c5.2xlarge', instances['10.248.157.4']['InstanceType'])
+        records = self.resumeRecords()
+        self.assertEqual(4, len(records))
+        self.assertFalse([x for x in records if x['warm']])
+
+    def testAddressListUpdate(self):
+        resume.resume('ip-10-248-156-[4-6],ip-10-248-157-4')
+        # one update sets the addresses of all nodes in the order of the expanded names
+        calls = self.scontrolCalls()
+        self.assertEqual(1, len(calls))
+        command, nodename, nodeaddr, nodehostname = calls[0]
+        nodes = list(resume.hostlist.expand(nodename.split('=', 1)[1]))
+        self.assertEqual(['ip-10-248-156-4', 'ip-10-248-156-5', 'ip-10-248-156-6', 'ip-10-248-157-4'], sorted(nodes))
+        self.assertEqual('nodeaddr=' + ','.join(slurmaws.nodeAddress(x) for x in nodes), nodeaddr)
+        self.assertEqual(['update', nodename.replace('nodename=', 'nodehostname=')], [command, nodehostname])
+
+    def testUpdatePerNodeWithoutAddressLists(self):
+        os.environ['SCONTROL_NO_LISTS'] = '1'
+        self.assertEqual(0, resume.resume('ip-10-248-156-[4-5]'))
+        self.assertEqual([['update', 'nodename=ip-10-248-156-[4-5]', 'nodeaddr=10.248.156.4,10.248.156.5', 'nodehostname=ip-10-248-156-[4-5]'],
+                          ['update', 'nodename=ip-10-248-156-4', 'nodeaddr=10.248.156.4', 'nodehostname=ip-10-248-156-4'],
+                          ['update', 'nodename=ip-10-248-156-5', 'nodeaddr=10.248.156.5', 'nodehostname=ip-10-248-156-5']],
+                         self.scontrolCalls())
+
+    def testLaunchFailureSetsNodesDown(self):
+        self.assertEqual(2, resume.resume('ip-10-248-156-4,ip-10-248-158-[4-5]'))
+        self.assertEqual(['10.248.156.4'], sorted(self.instances()))
+        calls = self.scontrolCalls()
+        self.assertIn(['update', 'nodename=ip-10-248-156-4', 'nodeaddr=10.248.156.4', 'nodehostname=ip-10-248-156-4'], calls)
+        self.assertIn(['update', 'nodename=ip-10-248-158-[4-5]', 'state=down', 'reason=resume_failed'], calls)
+        self.assertEqual(['ip-10-248-156-4'], [x['node'] for x in self.resumeRecords()])
+
+    def warmInstance(self, host, instanceType='c5.2xlarge'):
+        reservation = self.ec2.run_instances(ImageId=slurmaws.AWS_AMI, InstanceType=instanceType, MinCount=1, MaxCount=1,
+                                             SubnetId=slurmaws.nodeGroup(host)[0], PrivateIpAddress=slurmaws.nodeAddress(host),
+                                             TagSpecifications=[{'ResourceType': 'instance', 'Tags': [
+                                                 {'Key': slurmaws.NODE_TAG, 'Value': host},
+                                                 {'Key': slurmaws.POOL_TAG, 'Value': 'pool'}]}])
+        instanceId = reservation['Instances'][0]['InstanceId']
+        self.ec2.stop_instances(InstanceIds=[instanceId])
+        return instanceId
+
+    def testWarmStart(self):
+        instanceId = self.warmInstance('ip-10-248-156-4')
+        self.assertEqual(0, resume.resume('ip-10-248-156-[4-5]'))
+        instances = self.instances()
+        # the stopped instance is started instead of launching another one
+        self.assertEqual(instanceId, instances['10.248.156.4']['InstanceId'])
+        self.assertNotIn(slurmaws.POOL_TAG, [x['Key'] for x in instances['10.248.156.4'].get('Tags', [])])
+        self.assertEqual({'ip-10-248-156-4': True, 'ip-10-248-156-5': False},
+                         dict((x['node'], x['warm']) for x in self.resumeRecords()))
+
+    def testStaleWarmInstanceIsReplaced(self):
+        with open(slurmaws.SLURM_NODES_CONF, 'w') as f:
+            f.write('NodeName=ip-10-248-156-4 CPUs=16 Feature=eu-west-3a,c5.4xlarge State=CLOUD\n')
+        stale = self.warmInstance('ip-10-248-156-4')
+        warm = self.warmInstance('ip-10-248-156-5')
+        self.assertEqual(0, resume.resume('ip-10-248-156-[4-5]'))
+        self.assertEqual('terminated', self.ec2.describe_instances(InstanceIds=[stale])['Reservations'][0]['Instances'][0]['State']['Name'])
+        instances = self.instances()
+        self.assertEqual('c5.4xlarge', instances['10.248.156.4']['InstanceType'])
+        self.assertEqual(warm, instances['10.248.156.5']['InstanceId'])
+        self.assertEqual({'ip-10-248-156-4': False, 'ip-10-248-156-5': True},
+                         dict((x['node'], x['warm']) for x in self.resumeRecords()))
+
+
+# scontrol show node -o of the nodes which registered
+SHOW_NODE = '''#!/bin/sh
+echo "$*" >> "$(dirname "$0")/scontrol.calls"
+cat "$(dirname "$0")/nodes.txt"
+'''
+
+
+class ReportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'bin'))
+        with open(os.path.join(self.directory, 'bin', 'scontrol'), 'w') as f:
+            f.write(SHOW_NODE)
+        os.chmod(os.path.join(self.directory, 'bin', 'scontrol'), 0o755)
+        self.patch = mock.patch.multiple(slurmaws, SLURM_ROOT=self.directory, SLURM_RESUME_LOG=os.path.join(self.directory, 'resume.jsonl'))
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.directory)
+
+    def record(self, node, warm, requested, launchSeconds):
+        with open(slurmaws.SLURM_RESUME_LOG, 'a') as f:
+            f.write(json.dumps({'node': node, 'instance': 'i-' + node, 'subnet': 'subnet-1', 'type': 'c5.2xlarge', 'warm': warm,
+                                'requested': requested, 'launch_seconds': launchSeconds}) + '\n')
+
+    def registered(self, nodes):
+        with open(os.path.join(self.directory, 'bin', 'nodes.txt'), 'w') as f:
+            for node, started in sorted(nodes.items()):
+                f.write('NodeName={} Arch=x86_64 CoresPerSocket=8 SlurmdStartTime={} State=IDLE\n'.format(
+                    node, time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started))))
+
+    def testHitRateAndLatencies(self):
+        requested = float(int(time.time()) - 3600)
+        # an earlier resume of a node counts for the hit rate and the launches but not for the registration
+        self.record('ip-10-248-156-4', True, requested - 1000, 4.0)
+        self.record('ip-10-248-156-4', True, requested, 6.0)
+        self.record('ip-10-248-156-5', False, requested, 40.0)
+        self.record('ip-10-248-156-6', False, requested, 50.0)
+        with open(slurmaws.SLURM_RESUME_LOG, 'a') as f:
+            f.write('{"node": "ip-10-248-1\n')
+        # ip-10-248-156-6 has not registered since its resume
+        self.registered({'ip-10-248-156-4': requested + 20, 'ip-10-248-156-5': requested + 90, 'ip-10-248-156-6': requested - 500})
+        stats = resume.report()
+        self.assertEqual(0.5, stats['hit_rate'])
+        self.assertEqual(2, stats['warm']['resumes'])
+        self.assertEqual({'count': 2, 'mean': 5.0, 'median': 6.0, 'p90': 6.0, 'max': 6.0}, stats['warm']['launch_seconds'])
+        self.assertEqual({'count': 1, 'mean': 20.0, 'median': 20.0, 'p90': 20.0, 'max': 20.0}, stats['warm']['registration_seconds'])
+        self.assertEqual(2, stats['cold']['resumes'])
+        self.assertEqual(50.0, stats['cold']['launch_seconds']['max'])
+        self.assertEqual({'count': 1, 'mean': 90.0, 'median': 90.0, 'p90': 90.0, 'max': 90.0}, stats['cold']['registration_seconds'])
+        with open(os.path.join(self.directory, 'bin', 'scontrol.calls')) as f:
+            self.assertEqual('show node -o ip-10-248-156-[4-6]\n', f.read())
+
+    def testWithoutScontrol(self):
+        os.unlink(os.path.join(self.directory, 'bin', 'scontrol'))
+        self.record('ip-10-248-156-4', False, time.time(), 30.0)
+        stats = resume.report()
+        self.assertEqual(0.0, stats['hit_rate'])
+        self.assertIsNone(stats['warm']['launch_seconds'])
+        self.assertIsNone(stats['cold']['registration_seconds'])
+        self.assertEqual(1, stats['cold']['launch_seconds']['count'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+try:
+    import boto3  # noqa: F401 slurmaws needs it
+except ImportError:
+    raise unittest.SkipTest('boto3 is not installed')
+
+import slurmsim
+
+spec = importlib.util.spec_from_file_location('scaler', os.path.join(DIRECTORY, 'slurm-aws-scaler.py'))
+scaler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(scaler)
+
+
+def mixedNodes():
+    # c5.large nodes first in node order, as a planned include file may list them
+    return ([slurmsim.Node('small{}'.format(x), ['all'], 2, 3600, weight=85) for x in range(5)] +
+            [slurmsim.Node('large{}'.format(x), ['all'], 16, 120000, weight=384) for x in range(3)])
+
+
+class ObserveTest(unittest.TestCase):
+    def testFirstSampleHasNoArrivals(self):
+        controller = scaler.Controller()
+        controller.observe(100, [slurmsim.Job(1, 'all', 4, 7200, 50, 100)])
+        self.assertEqual({}, controller.averages)
+        self.assertEqual(100, controller.lastObserved)
+
+    def testArrivalRate(self):
+        controller = scaler.Controller(timeConstant=1800)
+        controller.observe(0, [])
+        # the job submitted before the last sample arrived already
+        jobs = [slurmsim.Job(x, 'all', 4, 7200, 30, 100) for x in range(3)] + [slurmsim.Job(3, 'all', 4, 7200, -10, 100)]
+        controller.observe(60, jobs)
+        weight = 1 - math.exp(-60 / 1800.0)
+        self.assertAlmostEqual(weight * 3 / 60.0, controller.averages['all'][0])
+        # the first jobs set the shape
+        self.assertEqual([4, 7200], controller.averages['all'][1:])
+        # no arrivals decay the rate, the shape stays
+        controller.observe(120, jobs)
+        self.assertAlmostEqual(weight * 3 / 60.0 * (1 - weight), controller.averages['all'][0])
+        self.assertEqual([4, 7200], controller.averages['all'][1:])
+        # a sample out of order changes nothing
+        controller.observe(90, [slurmsim.Job(4, 'all', 4, 7200, 100, 100)])
+        self.assertEqual(120, controller.lastObserved)
+        self.assertAlmostEqual(weight * 3 / 60.0 * (1 - weight), controller.averages['all'][0])
+
+    def testShapeFollowsTheJobs(self):
+        controller = scaler.Controller(timeConstant=1800)
+        controller.observe(0, [])
+        controller.observe(30, [slurmsim.Job(1, 'all', 2, 1000, 10, 100)])
+        controller.observe(60, [slurmsim.Job(x, 'all', 8, 11000, 40, 100) for x in range(2, 7)])
+        # five jobs weigh more than the 30 seconds since the last sample
+        shapeWeight = 1 - math.exp(-0.5)
+        self.assertAlmostEqual(2 + shapeWeight * 6, controller.averages['all'][1])
+        self.assertAlmostEqual(1000 + shapeWeight * 10000, controller.averages['all'][2])
+
+    def testPartitionsApart(self):
+        controller = scaler.Controller()
+        controller.observe(0, [])
+        controller.observe(60, [slurmsim.Job(1, 'short', 1, 1000, 10, 100), slurmsim.Job(2, 'long', 16, 60000, 10, 100)])
+        self.assertEqual([1, 1000], controller.averages['short'][1:])
+        self.assertEqual([16, 60000], controller.averages['long'][1:])
+        self.assertEqual(controller.averages['short'][0], controller.averages['long'][0])
+
+
+class WindowTest(unittest.TestCase):
+    def setUp(self):
+        self.controller = scaler.Controller(minWindow=60, maxWindow=600)
+
+    def testWithoutArrivals(self):
+        self.assertEqual(60, self.controller.window(['all']))
+        self.controller.averages['all'] = [0.0, 4, 7200]
+        self.assertEqual(60, self.controller.window(['all']))
+
+    def testTwoGaps(self):
+        self.controller.averages['all'] = [1 / 120.0, 4, 7200]
+        self.assertAlmostEqual(240, self.controller.window(['all']))
+        # frequent arrivals keep the node at least minWindow
+        self.controller.averages['all'] = [1.0, 4, 7200]
+        self.assertEqual(60, self.controller.window(['all']))
+
+    def testRareArrivalsGoAfterMinWindow(self):
+        self.controller.averages['all'] = [1 / 301.0, 4, 7200]
+        self.assertEqual(60, self.controller.window(['all']))
+        self.controller.averages['all'] = [1 / 300.0, 4, 7200]
+        self.assertAlmostEqual(600, self.controller.window(['all']))
+
+    def testLongestOfThePartitions(self):
+        self.controller.averages.update(short=[1 / 60.0, 1, 1000], long=[1 / 200.0, 16, 60000], rare=[1 / 3600.0, 1, 1000])
+        self.assertAlmostEqual(400, self.controller.window(['short', 'long', 'rare']))
+        self.assertAlmostEqual(120, self.controller.window(['short', 'rare']))
+
+
+class StopLoop(Exception):
+    pass
+
+
+class RunTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.patch = mock.patch.multiple(scaler.slurmaws, SLURM_POWER_LOG=os.path.join(self.directory, 'power_save.log'),
+                                         scontrol=mock.DEFAULT, queuedJobs=mock.DEFAULT, burstNodes=mock.DEFAULT)
+        self.mocks = self.patch.start()
+        self.mocks['scontrol'].return_value = 0
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.directory)
+
+    def loop(self, samples):
+        # each sleep ends a sample, the last one stops the loop
+        sleep = mock.Mock(side_effect=[None] * (samples - 1) + [StopLoop()])
+        with mock.patch.object(scaler.time, 'sleep', sleep):
+            self.assertRaises(StopLoop, scaler.run)
+        return sleep
+
+    def log(self):
+        with open(scaler.slurmaws.SLURM_POWER_LOG) as f:
+            return f.read()
+
+    def testPowerUpForPendingJobs(self):
+        self.mocks['queuedJobs'].return_value = ([slurmsim.Job(1, 'all', 4, 48000, 0, 100)], [])
+        self.mocks['burstNodes'].side_effect = lambda idleSince, now: mixedNodes()
+        sleep = self.loop(1)
+        self.assertEqual([mock.call('update', 'nodename=large0', 'state=power_up')], self.mocks['scontrol'].call_args_list)
+        self.assertLessEqual(sleep.call_args[0][0], scaler.Controller.interval)
+        self.assertIn('Scaler powers up large0 for 1 pending jobs', self.log())
+
+    def testPowerDownIdleNodes(self):
+        seen = []
+
+        def burstNodes(idleSince, now):
+            nodes = mixedNodes()
+            for node in nodes[:2]:
+                node.state, node.idleSince = 'up', idleSince.setdefault(node.name, now - 3600)
+            seen.append(idleSince)
+            return nodes
+        self.mocks['queuedJobs'].return_value = ([], [])
+        self.mocks['burstNodes'].side_effect = burstNodes
+        self.loop(1)
+        self.assertEqual([mock.call('update', 'nodename=small[0-1]', 'state=power_down')], self.mocks['scontrol'].call_args_list)
+        # the nodes powered down are idle afresh once they are up again
+        self.assertEqual({}, seen[0])
+
+    def testFailedSampleIsRetried(self):
+        self.mocks['queuedJobs'].side_effect = [subprocess.CalledProcessError(1, 'squeue'), ([slurmsim.Job(1, 'all', 4, 48000, 0, 100)], [])]
+        self.mocks['burstNodes'].side_effect = lambda idleSince, now: mixedNodes()
+        self.loop(2)
+        self.assertIn('Scaler sample failed', self.log())
+        self.assertEqual([mock.call('update', 'nodename=large0', 'state=power_up')], self.mocks['scontrol'].call_args_list)
+
+
+class ControllerTest(unittest.TestCase):
+    def testPendingJobPowersUpOnlyANodeItFits(self):
+        job = slurmsim.Job(1, 'all', 4, 48000, 0, 100)
+        powerUp, powerDown = scaler.Controller().plan(0, mixedNodes(), [job])
+        self.assertEqual(['large0'], [x.name for x in powerUp])
+        self.assertEqual([], powerDown)
+
+    def testLowestWeightFirst(self):
+        nodes = mixedNodes()[::-1]
+        jobs = [slurmsim.Job(x, 'all', 1, 1800, 0, 100) for x in range(3)]
+        powerUp, _ = scaler.Controller().plan(0, nodes, jobs)
+        # two 1 cpu jobs fill a c5.large
+        self.assertEqual(['small4', 'small3'], [x.name for x in powerUp])
+
+    def testJobsStartOnFreeNodes(self):
+        nodes = mixedNodes()
+        nodes[5].state = 'up'
+        jobs = [slurmsim.Job(x, 'all', 4, 7200, 0, 100) for x in range(4)]
+        powerUp, _ = scaler.Controller().plan(0, nodes, jobs)
+        self.assertEqual([], powerUp)
+
+    def testUnfitJobPowersUpNothing(self):
+        job = slurmsim.Job(1, 'all', 32, 1000, 0, 100)
+        self.assertEqual(([], []), scaler.Controller().plan(0, mixedNodes(), [job]))
+
+    def testExpectedArrivalsSkipNodesTheyDoNotFit(self):
+        controller = scaler.Controller(lead=240)
+        controller.averages['all'] = [4 / 240.0, 4, 30000]
+        powerUp, _ = controller.plan(0, mixedNodes(), [])
+        self.assertEqual(['large0'], [x.name for x in powerUp])
+
+    def testIdleNodePoweredDownAfterWindow(self):
+        nodes = mixedNodes()
+        nodes[0].state, nodes[0].idleSince = 'up', 0
+        controller = scaler.Controller(minWindow=60)
+        self.assertEqual([], controller.plan(30, nodes, [])[1])
+        self.assertEqual(['small0'], [x.name for x in controller.plan(60, nodes, [])[1]])
+
+
+class SimulationTest(unittest.TestCase):
+    def testMixedTypes(self):
+        jobs = slurmsim.syntheticTrace(20, 24, shapes=((1, 1800), (4, 7200), (4, 48000)))
+        results = {}
+        for name, controller, suspendTime in [('reactive', None, scaler.BACKSTOP_SUSPEND_TIME),
+                                              ('predictive', scaler.Controller(), scaler.BACKSTOP_SUSPEND_TIME)]:
+            nodes = ([slurmsim.Node('small{}'.format(x), ['all'], 2, 3600, weight=85) for x in range(8)] +
+                     [slurmsim.Node('medium{}'.format(x), ['all'], 8, 15000, weight=340) for x in range(8)] +
+                     [slurmsim.Node('large{}'.format(x), ['all'], 16, 120000, weight=1000) for x in range(8)])
+            results[name] = slurmsim.Simulation(nodes, suspendTime, controller=controller).run(jobs)
+        self.assertEqual(0, results['predictive']['unplaceable'])
+        self.assertLessEqual(results['predictive']['node_hours'], results['reactive']['node_hours'])
+        self.assertLessEqual(results['predictive']['wait_seconds']['mean'], results['reactive']['wait_seconds']['mean'] * 1.5)
+
+
+
+class SimulateCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def main(self, *args):
+        output = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['slurm-aws-scaler.py'] + list(args)), contextlib.redirect_stdout(output):
+            scaler.main()
+        return [json.loads(x) for x in output.getvalue().splitlines()]
+
+    def testSyntheticTrace(self):
+        results = self.main('simulate', '--synthetic', '10,4', '--nodes', '8', '--policies', 'reactive-60,predictive')
+        self.assertEqual(['reactive-60', 'predictive'], [x['policy'] for x in results])
+        self.assertEqual(results[0]['jobs'], results[1]['jobs'])
+
+    def testTraceFile(self):
+        path = os.path.join(self.directory, 'trace.jsonl')
+        jobs = slurmsim.syntheticTrace(10, 2, shapes=((1, 1800), (4, 7200)))
+        with open(path, 'w') as f:
+            slurmsim.writeTrace(jobs, f)
+        results = self.main('simulate', path, '--node-types', '4:2:3600:85,2:16:120000:384', '--policies', 'predictive')
+        self.assertEqual(1, len(results))
+        self.assertEqual(len(jobs), results[0]['jobs'])
+        self.assertEqual(0, results[0]['unplaceable'])
+
+    def testUnknownPolicy(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit) as raised:
+            self.main('simulate', '--synthetic', '10,1', '--policies', 'eager')
+        self.assertEqual(1, raised.exception.code)
+        self.assertIn('unknown policy eager', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+    from moto import mock_aws
+except ImportError:
+    raise unittest.SkipTest('boto3 and moto are not installed')
+
+import slurmaws  # noqa: E402
+
+spec = importlib.util.spec_from_file_location('suspend', os.path.join(DIRECTORY, 'slurm-aws-suspend.py'))
+suspend = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(suspend)
+spec = importlib.util.spec_from_file_location('resume', os.path.join(DIRECTORY, 'slurm-aws-resume.py'))
+resume = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(resume)
+
+# records its calls
+SCONTROL = '''#!/bin/sh
+echo "$*" >> "$(dirname "$0")/scontrol.calls"
+'''
+
+NODES_CONF = '''# burst nodes
+NodeName=ip-10-248-156-4 CPUs=8 Feature=eu-west-3a,c5.2xlarge State=CLOUD
+NodeName=ip-10-248-156-5 CPUs=8 Feature=eu-west-3a,c5.2xlarge State=CLOUD
+NodeName=ip-10-248-157-[4-9] CPUs=8 Feature=eu-west-3b,c5.2xlarge State=CLOUD
+'''
+
+
+class SuspendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ.update({'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing', 'AWS_DEFAULT_REGION': 'eu-west-3'})
+        os.environ.pop('SLURM_AWS_ENDPOINT_URL', None)
+        os.environ.pop('SLURM_AWS_WARM_POOL_SIZE', None)
+        os.makedirs(os.path.join(self.directory, 'bin'))
+        os.makedirs(os.path.join(self.directory, 'etc', 'slurm.conf.d'))
+        with open(os.path.join(self.directory, 'bin', 'scontrol'), 'w') as f:
+            f.write(SCONTROL)
+        os.chmod(os.path.join(self.directory, 'bin', 'scontrol'), 0o755)
+
+        self.mock = mock_aws()
+        self.mock.start()
+        self.ec2 = boto3.client('ec2', region_name='eu-west-3')
+        vpc = self.ec2.create_vpc(CidrBlock='10.248.0.0/16')['Vpc']['VpcId']
+        self.subnets = [self.ec2.create_subnet(VpcId=vpc, CidrBlock='10.248.{}.0/24'.format(x))['Subnet']['SubnetId'] for x in (156, 157)]
+        self.patches = [mock.patch.multiple(slurmaws, SLURM_ROOT=self.directory, AWS_AMI='ami-12345678', _clients={},
+                                            _nodeTypes=None, _nodeTypesMtime=None,
+                                            SLURM_POWER_LOG=os.path.join(self.directory, 'power_save.log'),
+                                            SLURM_NODES_CONF=os.path.join(self.directory, 'etc', 'slurm.conf.d', 'slurm_nodes.conf'),
+                                            NODE_GROUPS=self.nodeGroups())]
+        for patch in self.patches:
+            patch.start()
+        # the EC2 calls of the suspend program
+        self.requests = []
+        slurmaws.client('ec2').meta.events.register('before-parameter-build.ec2', self.recordRequest)
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.mock.stop()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def nodeGroups(self):
+        return (('ip-10-248-156-', self.subnets[0], 'c5.2xlarge', 0),
+                ('ip-10-248-157-', self.subnets[1], 'c5.2xlarge', 0))
+
+    def recordRequest(self, model, params, **kwargs):
+        self.requests.append((model.name, params))
+
+    def requestNames(self):
+        return [x[0] for x in self.requests]
+
+    def scontrolCalls(self):
+        path = os.path.join(self.directory, 'bin', 'scontrol.calls')
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [x.split() for x in f.read().splitlines()]
+
+    def launch(self, host, stopped=False):
+        reservation = self.ec2.run_instances(ImageId=slurmaws.AWS_AMI, InstanceType='c5.2xlarge', MinCount=1, MaxCount=1,
+                                             SubnetId=slurmaws.nodeGroup(host)[0], PrivateIpAddress=slurmaws.nodeAddress(host),
+                                             TagSpecifications=[{'ResourceType': 'instance', 'Tags': [{'Key': slurmaws.NODE_TAG, 'Value': host}]}])
+        instanceId = reservation['Instances'][0]['InstanceId']
+        if stopped:
+            self.ec2.create_tags(Resources=[instanceId], Tags=[{'Key': slurmaws.POOL_TAG, 'Value': slurmaws.poolName(slurmaws.nodeGroup(host))}])
+            self.ec2.stop_instances(InstanceIds=[instanceId])
+        return instanceId
+
+    def states(self, instanceIds):
+        instances = [x for y in self.ec2.describe_instances(InstanceIds=instanceIds)['Reservations'] for x in y['Instances']]
+        return dict((x['InstanceId'], x['State']['Name']) for x in instances)
+
+    def tags(self, instanceId):
+        instance = self.ec2.describe_instances(InstanceIds=[instanceId])['Reservations'][0]['Instances'][0]
+        return dict((x['Key'], x['Value']) for x in instance.get('Tags', []))
+
+
+class SuspendTest(SuspendTestCase):
+    def testBatchedTerminate(self):
+        instanceIds = [self.launch('ip-10-248-156-{}'.format(x)) for x in range(4, 9)]
+        with mock.patch.object(suspend, 'TERMINATE_BATCH', 2):
+            self.assertEqual(0, suspend.suspend('ip-10-248-156-[4-8],headnode'))
+        self.assertEqual(set(['terminated']), set(self.states(instanceIds).values()))
+        self.assertEqual(3, self.requestNames().count('TerminateInstances'))
+        self.assertEqual([2, 2, 1], [len(x[1]['InstanceIds']) for x in self.requests if x[0] == 'TerminateInstances'])
+        # the instances are found by their addresses, never by a scan of all instances of the account
+        describes = [x[1] for x in self.requests if x[0] == 'DescribeInstances']
+        self.assertTrue(describes)
+        self.assertTrue(all(x.get('Filters') for x in describes))
+        addresses = [x for x in describes[0]['Filters'] if x['Name'] == 'private-ip-address'][0]['Values']
+        self.assertEqual(['10.248.156.{}'.format(x) for x in range(4, 9)], addresses)
+
+    def testOtherInstancesAreKept(self):
+        kept = self.launch('ip-10-248-157-4')
+        stopped = self.launch('ip-10-248-156-5', stopped=True)
+        suspended = self.launch('ip-10-248-156-4')
+        self.assertEqual(0, suspend.suspend('ip-10-248-156-[4-5]'))
+        # a stopped instance of a warm pool is left in it
+        self.assertEqual({kept: 'running', stopped: 'stopped', suspended: 'terminated'}, self.states([kept, stopped, suspended]))
+
+    def testNodeDefinitionsRemovedWithOneReconfigure(self):
+        with open(slurmaws.SLURM_NODES_CONF, 'w') as f:
+            f.write(NODES_CONF)
+        for host in ['ip-10-248-156-4', 'ip-10-248-156-5', 'ip-10-248-157-4']:
+            self.launch(host)
+        self.assertEqual(0, suspend.suspend('ip-10-248-156-[4-5],ip-10-248-157-4'))
+        with open(slurmaws.SLURM_NODES_CONF) as f:
+            # ranges of nodes stay defined
+            self.assertEqual('# burst nodes\nNodeName=ip-10-248-157-[4-9] CPUs=8 Feature=eu-west-3b,c5.2xlarge State=CLOUD\n', f.read())
+        self.assertEqual([['reconfigure']], self.scontrolCalls())
+        # nothing left to remove, slurmctld is not reconfigured again
+        self.assertEqual(0, suspend.suspend('ip-10-248-156-[4-5]'))
+        self.assertEqual([['reconfigure']], self.scontrolCalls())
+
+    def testFailedTerminateIsCounted(self):
+        self.launch('ip-10-248-156-4')
+        self.launch('ip-10-248-156-5')
+        error = ClientError({'Error': {'Code': 'RequestLimitExceeded', 'Message': 'Request limit exceeded.'}}, 'TerminateInstances')
+        with mock.patch.object(slurmaws.client('ec2'), 'terminate_instances', side_effect=error):
+            self.assertEqual(2, suspend.suspend('ip-10-248-156-[4-5]'))
+        with open(slurmaws.SLURM_POWER_LOG) as f:
+            self.assertIn('Terminating 2 instances failed', f.read())
+
+    def testNoBurstNodes(self):
+        self.assertEqual(0, suspend.suspend('headnode,login[1-2]'))
+        self.assertEqual([], [x for x in self.requestNames() if x != 'PutMetricData'])
+        self.assertEqual([], self.scontrolCalls())
+
+
+class WarmPoolTest(SuspendTestCase):
+    def nodeGroups(self):
+        return (('ip-10-248-156-', self.subnets[0], 'c5.2xlarge', 2),
+                ('ip-10-248-157-', self.subnets[1], 'c5.2xlarge', 1))
+
+    def testFirstNodesAreStopped(self):
+        instanceIds = dict((x, self.launch('ip-10-248-156-{}'.format(x))) for x in range(4, 8))
+        instanceIds.update((x + 10, self.launch('ip-10-248-157-{}'.format(x))) for x in range(4, 6))
+        self.assertEqual(0, suspend.suspend('ip-10-248-157-[4-5],ip-10-248-156-[4-7]'))
+        # each pool takes the nodes first in node order up to its size
+        states = self.states(list(instanceIds.values()))
+        self.assertEqual(['stopped', 'stopped', 'terminated', 'terminated', 'stopped', 'terminated'],
+                         [states[instanceIds[x]] for x in [4, 5, 6, 7, 14, 15]])
+        self.assertEqual(slurmaws.poolName(slurmaws.nodeGroup('ip-10-248-156-4')), self.tags(instanceIds[4])[slurmaws.POOL_TAG])
+        self.assertEqual(slurmaws.poolName(slurmaws.nodeGroup('ip-10-248-157-4')), self.tags(instanceIds[14])[slurmaws.POOL_TAG])
+        self.assertNotIn(slurmaws.POOL_TAG, self.tags(instanceIds[6]))
+        self.assertEqual(2, self.requestNames().count('StopInstances'))
+        self.assertEqual(1, self.requestNames().count('TerminateInstances'))
+
+    def testMembersCountTowardsTheSize(self):
+        member = self.launch('ip-10-248-156-9', stopped=True)
+        stopped = self.launch('ip-10-248-156-4')
+        terminated = self.launch('ip-10-248-156-5')
+        self.assertEqual(0, suspend.suspend('ip-10-248-156-[4-5]'))
+        self.assertEqual({member: 'stopped', stopped: 'stopped', terminated: 'terminated'}, self.states([member, stopped, terminated]))
+        # a full pool takes no more instances
+        third = self.launch('ip-10-248-156-6')
+        self.assertEqual(0, suspend.suspend('ip-10-248-156-6'))
+        self.assertEqual({third: 'terminated'}, self.states([third]))
+
+    def testSizeFromTheEnvironment(self):
+        os.environ['SLURM_AWS_WARM_POOL_SIZE'] = '0'
+        instanceId = self.launch('ip-10-248-156-4')
+        self.assertEqual(0, suspend.suspend('ip-10-248-156-4'))
+        self.assertEqual({instanceId: 'terminated'}, self.states([instanceId]))
+        self.assertNotIn('StopInstances', self.requestNames())
+
+    def testFailedStopTerminates(self):
+        instanceId = self.launch('ip-10-248-156-4')
+        error = ClientError({'Error': {'Code': 'IncorrectInstanceState', 'Message': 'The instance is not in a state from which it can be stopped.'}},
+                            'StopInstances')
+        with mock.patch.object(slurmaws.client('ec2'), 'stop_instances', side_effect=error):
+            self.assertEqual(0, suspend.suspend('ip-10-248-156-4'))
+        self.assertEqual({instanceId: 'terminated'}, self.states([instanceId]))
+
+    def testResumeStartsTheStoppedInstance(self):
+        instanceId = self.launch('ip-10-248-156-4')
+        suspend.suspend('ip-10-248-156-4')
+        os.environ['SLURM_HEADNODE'] = '10.248.0.10'
+        with mock.patch.multiple(slurmaws, SLURM_RESUME_LOG=os.path.join(self.directory, 'resume.jsonl'), AWS_KEYNAME='key',
+                                 AWS_SECURITY_GROUP='sg-12345678'):
+            self.assertEqual(0, resume.resume('ip-10-248-156-4'))
+        self.assertEqual({instanceId: 'running'}, self.states([instanceId]))
+        self.assertNotIn(slurmaws.POOL_TAG, self.tags(instanceId))
+        self.assertEqual(1, self.requestNames().count('StartInstances'))
+        self.assertNotIn('RunInstances', self.requestNames())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+try:
+    import boto3  # noqa: F401 slurmaws needs it
+except ImportError:
+    raise unittest.SkipTest('boto3 is not installed')
+
+import slurmaws  # noqa: E402
+
+
+class NodeTypesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'slurm_nodes.conf')
+        self.patch = mock.patch.multiple(slurmaws, SLURM_NODES_CONF=self.path, _nodeTypes=None, _nodeTypesMtime=None)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.directory)
+
+    def write(self, text, mtime):
+        with open(self.path, 'w') as f:
+            f.write(text)
+        os.utime(self.path, (mtime, mtime))
+
+    def testTypesOfNodeDefinitions(self):
+        self.write('# planned\n'
+                   'NodeName=ip-10-248-156-[4-7] CPUs=8 Feature=eu-west-3a,c5.2xlarge State=CLOUD\n'
+                   'NodeName=ip-10-248-157-[4-5] CPUs=2 Feature=eu-west-3b State=CLOUD\n', 1000)
+        self.assertEqual('c5.2xlarge', slurmaws.nodeType('ip-10-248-156-5'))
+        self.assertIsNone(slurmaws.nodeType('ip-10-248-157-4'))
+
+    def testReloadWhenTheFileChanges(self):
+        self.write('NodeName=ip-10-248-156-[4-7] Feature=c5.2xlarge\n', 1000)
+        self.assertEqual('c5.2xlarge', slurmaws.nodeType('ip-10-248-156-4'))
+        self.write('NodeName=ip-10-248-156-[4-7] Feature=c5.4xlarge\n', 2000)
+        self.assertEqual('c5.4xlarge', slurmaws.nodeType('ip-10-248-156-4'))
+        os.unlink(self.path)
+        self.assertIsNone(slurmaws.nodeType('ip-10-248-156-4'))
+
+    def testNoReloadOfAnUnchangedFile(self):
+        self.write('NodeName=ip-10-248-156-[4-7] Feature=c5.2xlarge\n', 1000)
+        types = slurmaws.nodeTypes()
+        self.assertIs(types, slurmaws.nodeTypes())
+
+
+if __name__ == '__main__':
+    unittest.main()
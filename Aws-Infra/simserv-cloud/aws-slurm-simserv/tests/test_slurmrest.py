@@ -0,0 +1,109 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import sitecluster  # noqa: E402
+from slurmrestd_stub import SlurmRestStub  # noqa: E402
+
+
+class SlurmRestSiteClusterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['SITE_CLUSTER_CACHE_DIR'] = self.directory
+        os.environ['SLURM_JWT'] = 'token'
+        os.environ.pop('SLURM_RESTD_API', None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def cluster(self, stub):
+        os.environ['SLURM_RESTD_URL'] = stub.url
+        return sitecluster.SlurmRestSiteCluster(use_argv=False)
+
+    def submit(self, cluster, *args):
+        options = cluster.submitParser().parse_args(list(args) + ['--', 'true'])
+        return cluster.submitJob(options, options.cmdargs[1:])
+
+    def testQueues(self):
+        with SlurmRestStub(token='token', partitions=['all', 'large']) as stub:
+            self.assertEqual(['all', 'large'], self.cluster(stub).getQueues())
+
+    def testSubmitPayloadOfVersion39(self):
+        with SlurmRestStub(token='token') as stub:
+            cluster = self.cluster(stub)
+            jobId = self.submit(cluster, '--memory', '4G', '--threads', '4', '--nodes', '1', '--email', 'user@host', '--jobname', 'sim')
+            self.assertEqual('100', jobId)
+            job = stub.submitted[0]['job']
+            self.assertEqual({'set': True, 'infinite': False, 'number': 4096}, job['memory_per_node'])
+            self.assertEqual(4, job['cpus_per_task'])
+            self.assertEqual('sim', job['name'])
+            self.assertIn('END', job['mail_type'])
+            self.assertTrue(stub.submitted[0]['script'].endswith('exec true\n'))
+
+    def testSubmitPayloadOfOlderVersion(self):
+        os.environ['SLURM_RESTD_API'] = 'v0.0.38'
+        cluster = sitecluster.SlurmRestSiteCluster(use_argv=False)
+        self.assertEqual(4096, cluster._restNumber(4096))
+
+    def testStatusOfActiveAndPurgedJobs(self):
+        with SlurmRestStub(token='token') as stub:
+            cluster = self.cluster(stub)
+            jobIds = [self.submit(cluster) for _ in range(4)]
+            stub.finish(int(jobIds[1]))
+            stub.finish(int(jobIds[2]), 'FAILED', code=3)
+            stub.finish(int(jobIds[3]), 'CANCELLED', sig=9)
+            self.assertEqual(['RUNNING', 'COMPLETED 0', 'COMPLETED 3', 'COMPLETED 137', 'UNKNOWNID'],
+                             cluster.getJobStatuses(jobIds + ['999'], addStatus=True))
+            # the purged jobs are looked up in one accounting query
+            self.assertEqual(1, stub.count('GET', '/slurmdb/v0.0.39/jobs'))
+            # and their terminal states are cached
+            cluster.getJobStatuses(jobIds[1:], addStatus=True)
+            self.assertEqual(1, stub.count('GET', '/slurmdb/v0.0.39/jobs'))
+
+    def testStatusWithoutAccounting(self):
+        with SlurmRestStub(token='token') as stub:
+            stub.accountingEnabled = False
+            cluster = self.cluster(stub)
+            jobId = self.submit(cluster)
+            stub.finish(int(jobId))
+            self.assertEqual(['COMPLETED 0'], cluster.getJobStatuses([jobId], addStatus=True))
+
+    def testKill(self):
+        with SlurmRestStub(token='token') as stub:
+            cluster = self.cluster(stub)
+            jobId = self.submit(cluster)
+            self.assertEqual(0, cluster.killJob([jobId]))
+            self.assertEqual(['COMPLETED 1'], cluster.getJobStatuses([jobId], addStatus=True))
+            stub.finish(int(jobId), 'CANCELLED')
+            # same as scancel, killing a finished job is no error
+            self.assertEqual(0, cluster.killJob([jobId]))
+
+    def testKeepAliveConnection(self):
+        with SlurmRestStub(token='token') as stub:
+            cluster = self.cluster(stub)
+            for _ in range(20):
+                cluster.getJobStatuses([self.submit(cluster)])
+            self.assertEqual(1, stub.connections)
+
+    def testUnixSocket(self):
+        with SlurmRestStub(os.path.join(self.directory, 'slurmrestd.socket'), token='token') as stub:
+            cluster = self.cluster(stub)
+            self.assertEqual(['RUNNING'], cluster.getJobStatuses([self.submit(cluster)]))
+            self.assertEqual(1, stub.connections)
+
+    def testRejectedSubmission(self):
+        with SlurmRestStub(token='other') as stub:
+            self.assertRaises(RuntimeError, self.submit, self.cluster(stub))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# records the node and the range of the forwarded startnode, then runs it there
+PBSDSH = '''#!/bin/sh
+echo "$2 $8" >> "$SITE_CLUSTER_CACHE_DIR/pbsdsh.log"
+shift 2
+exec "$@"
+'''
+
+
+class StartNodesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.env = dict(os.environ, SITE_CLUSTER_USE_PBS='1', SITE_CLUSTER_PBS_FLAVOUR='torque',
+                        SITE_CLUSTER_CACHE_DIR=self.directory, PBS_NODEFILE=os.path.join(self.directory, 'nodes'),
+                        PATH=self.directory + os.pathsep + os.environ['PATH'])
+        for name in [x for x in self.env if x.startswith('SITE_CLUSTER_USE_') and x != 'SITE_CLUSTER_USE_PBS']:
+            del self.env[name]
+        self.env.pop('SITE_CLUSTER_NODE', None)
+        self.env.pop('SITE_CLUSTER_SOCKET', None)
+        with open(os.path.join(self.directory, 'pbsdsh'), 'w') as f:
+            f.write(PBSDSH)
+        os.chmod(os.path.join(self.directory, 'pbsdsh'), 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def startnode(self, nodes, *args):
+        with open(self.env['PBS_NODEFILE'], 'w') as f:
+            f.write(''.join('node{}\n'.format(x) for x in range(nodes)))
+        proc = subprocess.Popen([sys.executable, os.path.join(DIRECTORY, 'sitecluster.py'), 'startnode'] + list(args),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env, universal_newlines=True)
+        stdout, stderr = proc.communicate(timeout=60)
+        return proc.returncode, stdout.splitlines(), stderr
+
+    def launches(self):
+        with open(os.path.join(self.directory, 'pbsdsh.log')) as f:
+            return [x.split() for x in f.read().splitlines()]
+
+    def testAllNodes(self):
+        returncode, lines, _ = self.startnode(10, '--all', '--fanout', '3', '--', 'sh', '-c', 'echo node $SITE_CLUSTER_NODE')
+        self.assertEqual(0, returncode)
+        self.assertEqual(sorted('{}: node {}'.format(x, x) for x in range(10)), sorted(lines))
+        launches = self.launches()
+        # every node is launched once, as the first node of a subrange of its parent
+        self.assertEqual([str(x) for x in range(10)], sorted([x[0] for x in launches], key=int))
+        self.assertEqual(['0-3', '1-1', '2-2', '3-3', '4-6', '5-5', '6-6', '7-9', '8-8', '9-9'], sorted(x[1] for x in launches))
+
+    def testRange(self):
+        returncode, lines, _ = self.startnode(10, '--range', '2-5', '--fanout', '8', '--', 'sh', '-c', 'echo $SITE_CLUSTER_NODE')
+        self.assertEqual(0, returncode)
+        self.assertEqual(['2: 2', '3: 3', '4: 4', '5: 5'], sorted(lines))
+
+    def testFirstFailureStopsTheOthers(self):
+        started = time.time()
+        returncode, _, stderr = self.startnode(8, '--all', '--fanout', '2', '--', 'sh', '-c',
+                                               'if [ $SITE_CLUSTER_NODE = 5 ]; then exit 3; fi; sleep 30')
+        self.assertEqual(3, returncode)
+        self.assertIn('node 5 failed with exit status 3', stderr)
+        self.assertLess(time.time() - started, 20)
+
+    def testInvalidRange(self):
+        returncode, _, stderr = self.startnode(4, '--range', '3-1', '--', 'true')
+        self.assertEqual(2, returncode)
+        self.assertIn('invalid node range 3-1', stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import unittest
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+
+class TokenBucketTest(unittest.TestCase):
+    def testSlowDownFloor(self):
+        bucket = sitecluster.TokenBucket(16)
+        for _ in range(10):
+            bucket.slowDown()
+        self.assertEqual(1, bucket.rate)
+
+    def testSpeedUp(self):
+        bucket = sitecluster.TokenBucket(16)
+        bucket.slowDown()
+        bucket.speedUp()
+        self.assertEqual(9, bucket.rate)
+        for _ in range(10):
+            bucket.speedUp()
+        self.assertEqual(16, bucket.rate)
+
+
+class SubmissionEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.environ = dict(os.environ)
+        os.environ['SITE_CLUSTER_SUBMIT_RATE'] = '1000'
+        sitecluster._submitBuckets.clear()
+        sitecluster.random.seed(0)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        sitecluster._submitBuckets.clear()
+
+    def testBusyAnswersAreRetried(self):
+        answers = ['Socket timed out on send/recv operation', None]
+
+        def submission():
+            answer = answers.pop(0)
+            if answer:
+                raise subprocess.CalledProcessError(1, ['sbatch'], output=answer)
+            return '42'
+        os.environ['SITE_CLUSTER_SUBMIT_RETRIES'] = '1'
+        engine = sitecluster.SubmissionEngine(sitecluster.SiteCluster(use_argv=False))
+        self.assertEqual('42', engine.submit(submission))
+
+    def testOtherFailuresAreReported(self):
+        def submission():
+            raise subprocess.CalledProcessError(1, ['sbatch'], output='invalid partition')
+        results = []
+        sitecluster.SubmissionEngine(sitecluster.SiteCluster(use_argv=False)).run(
+            [submission, lambda: '7'], lambda index, result, error: results.append((index, result, error is not None)))
+        self.assertEqual([(0, None, True), (1, '7', False)], sorted(results))
+
+
+if __name__ == '__main__':
+    unittest.main()
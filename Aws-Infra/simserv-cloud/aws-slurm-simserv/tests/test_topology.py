@@ -0,0 +1,127 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORY)
+
+import sitecluster  # noqa: E402
+
+
+class AllocationTopologyTest(unittest.TestCase):
+    def testHostOfSlot(self):
+        topology = sitecluster.AllocationTopology(['a', 'b', 'c', 'd'], [2, 0, 3, 1])
+        self.assertEqual(6, len(topology))
+        self.assertEqual(['a', 'a', 'c', 'c', 'c', 'd'], [topology.host(x) for x in range(6)])
+        self.assertRaises(IndexError, topology.host, 6)
+        self.assertRaises(IndexError, topology.host, -1)
+
+    def testLargeAllocation(self):
+        # one entry per host, not per slot
+        topology = sitecluster.AllocationTopology(['node{}'.format(x) for x in range(1000)], [10 ** 6] * 1000)
+        self.assertEqual(10 ** 9, len(topology))
+        self.assertEqual('node999', topology.host(10 ** 9 - 1))
+        self.assertEqual('node1', topology.host(10 ** 6))
+        self.assertEqual(1000, len(topology.ends))
+
+    def testEmpty(self):
+        topology = sitecluster.AllocationTopology([], [])
+        self.assertEqual(0, len(topology))
+        self.assertRaises(IndexError, topology.host, 0)
+
+
+class ReadAllocationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        for name in [x for x in os.environ if x.startswith(('SLURM_', 'PBS_', 'LSB_', 'PE_'))] + ['JOB_ID']:
+            os.environ.pop(name, None)
+        os.environ.update(SITE_CLUSTER_CACHE_DIR=self.directory, TMPDIR=self.directory)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+
+class SlurmAllocationTest(ReadAllocationTestCase):
+    def setUp(self):
+        ReadAllocationTestCase.setUp(self)
+        os.environ.update(SLURM_JOB_ID='77', SLURM_JOB_NODELIST='node[1-3],gpu7', SLURM_TASKS_PER_NODE='2(x3),1')
+        self.cluster = sitecluster.SlurmSiteCluster(use_argv=False)
+
+    def testTasksPerNode(self):
+        self.assertEqual([('node1', 2), ('node2', 2), ('node3', 2), ('gpu7', 1)], self.cluster.readAllocation())
+        self.assertEqual(7, self.cluster.getNodeCount())
+        self.assertEqual(['node1', 'node2', 'node3', 'gpu7'], [self.cluster.getNodeHost(x) for x in [1, 2, 5, 6]])
+
+    def testCountsNotMatchingTheHosts(self):
+        os.environ['SLURM_TASKS_PER_NODE'] = '4(x2)'
+        self.assertEqual([('node1', 1), ('node2', 1), ('node3', 1), ('gpu7', 1)], self.cluster.readAllocation())
+
+    def testHostsCommand(self):
+        output = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['sitecluster', 'hosts']), contextlib.redirect_stdout(output):
+            self.cluster.hosts()
+        self.assertEqual('node1 2\nnode2 2\nnode3 2\ngpu7 1\n', output.getvalue())
+
+    def testTableIsCachedForTheJob(self):
+        self.assertEqual(7, self.cluster.getNodeCount())
+        with mock.patch.object(sitecluster.SlurmSiteCluster, 'readAllocation', side_effect=AssertionError):
+            self.assertEqual(7, sitecluster.SlurmSiteCluster(use_argv=False).getNodeCount())
+        # the table is read again when the allocation changed
+        os.environ['SLURM_TASKS_PER_NODE'] = '1(x4)'
+        self.assertEqual(4, sitecluster.SlurmSiteCluster(use_argv=False).getNodeCount())
+
+
+class SGEAllocationTest(ReadAllocationTestCase):
+    def testHostFile(self):
+        # the variable names the file, its lines are <host> <slots> <queue> <processor range>
+        os.environ.update(JOB_ID='12', PE_HOSTFILE=self.write('pe_hostfile', 'node1 4 all.q@node1 UNDEFINED\nnode2 2 all.q@node2 UNDEFINED\n\n'))
+        cluster = sitecluster.SunGridEngineSiteCluster(use_argv=False)
+        self.assertEqual([('node1', 4), ('node2', 2)], cluster.readAllocation())
+        self.assertEqual(6, cluster.getNodeCount())
+        self.assertEqual('node2', cluster.getNodeHost(4))
+
+    def testOutsideOfParallelEnvironment(self):
+        self.assertEqual([], sitecluster.SunGridEngineSiteCluster(use_argv=False).readAllocation())
+
+
+class LSFAllocationTest(ReadAllocationTestCase):
+    def testHostSlotPairs(self):
+        os.environ.update(LSB_JOBID='5', LSB_MCPU_HOSTS='node1 4 node2 2', LSB_HOSTS='node1 node1 node1 node1 node2 node2')
+        cluster = sitecluster.LSFSiteCluster(use_argv=False)
+        self.assertEqual([('node1', 4), ('node2', 2)], cluster.readAllocation())
+        self.assertEqual(6, cluster.getNodeCount())
+
+    def testHostList(self):
+        os.environ.update(LSB_JOBID='5', LSB_HOSTS='node1 node1 node2')
+        cluster = sitecluster.LSFSiteCluster(use_argv=False)
+        self.assertEqual(3, cluster.getNodeCount())
+        # consecutive entries of a host are merged
+        self.assertEqual((['node1', 'node2'], [2, 1]), (cluster.getTopology().hosts, cluster.getTopology().counts))
+
+
+class PBSAllocationTest(ReadAllocationTestCase):
+    def testNodeFileLines(self):
+        # one line per node index of pbsdsh, PBS_NUM_NODES counts hosts instead
+        os.environ.update(PBS_JOBID='9.headnode', PBS_NUM_NODES='2',
+                          PBS_NODEFILE=self.write('nodes', 'node1\nnode1\nnode1\nnode2\nnode2\n'))
+        cluster = sitecluster.PBSSiteCluster(use_argv=False)
+        self.assertEqual(5, cluster.getNodeCount())
+        self.assertEqual(['node1', 'node1', 'node1', 'node2', 'node2'], [cluster.getNodeHost(x) for x in range(5)])
+
+
+if __name__ == '__main__':
+    unittest.main()